@@ -1,8 +1,17 @@
-from neurorobotics import utils
-from neurorobotics import simulations
-from neurorobotics import reward
-from neurorobotics import constants
-from neurorobotics import evaluate
-from neurorobotics import oscillator
-from neurorobotics import train
-from neurorobotics import tests
+"""Subpackages are imported on first access, e.g. `neurorobotics.utils`, so
+importing one module, as the workers of vectorized environments do, does not
+import the whole package.
+"""
+import importlib
+
+_SUBMODULES = ['utils', 'simulations', 'reward', 'constants', 'evaluate', 'oscillator', 'train', 'tests']
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('{}.{}'.format(__name__, name))
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + _SUBMODULES)
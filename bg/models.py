@@ -1,17 +1,74 @@
 import numpy as np
 import torch
-import torchvision as tv
 from neurorobotics.constants import params
+from neurorobotics.utils.optional import lazy_import
 import stable_baselines3 as sb3
 import gym
 from typing import NamedTuple, Any, Dict, List, Optional, Tuple, Type, Union
 from collections import OrderedDict
+tv = lazy_import('torchvision', 'torchvision')
 
 def check_for_nan(inp, name):
     if torch.isnan(inp).any():
         print('nan in {}'.format(name))
 
 
+@torch.jit.script
+def _basal_ganglia_dynamics(
+    J_D1: torch.Tensor,
+    J_D2: torch.Tensor,
+    K_D1: torch.Tensor,
+    K_D2: torch.Tensor,
+    lamd1: torch.Tensor,
+    lamd2: torch.Tensor,
+    w_d1gpi: torch.Tensor,
+    w_stngpi: torch.Tensor,
+    glat: torch.Tensor,
+    slat: torch.Tensor,
+    wsg: torch.Tensor,
+    wgs: torch.Tensor,
+    hx: torch.Tensor,
+    w_ih: torch.Tensor,
+    w_hh: torch.Tensor,
+    b_ih: Optional[torch.Tensor],
+    b_hh: Optional[torch.Tensor],
+    FF_steps: int,
+    stn_gpe_iter: int,
+    eta_gpe: float,
+    eta_stn: float,
+    eta_gpi: float
+) -> torch.Tensor:
+    # Striatum, STN-GPe and GPi iterations of `BasalGanglia`, returning the thalamus state.
+    # The first iterations start from zero states and are peeled off.
+    V_D1 = torch.zeros_like(J_D1)
+    V_D2 = torch.zeros_like(J_D2)
+    if FF_steps > 0:
+        V_D1 = torch.sigmoid(lamd1 * J_D1)
+        V_D2 = torch.sigmoid(lamd2 * J_D2)
+    for _ in range(FF_steps - 1):
+        V_D1 = torch.sigmoid(lamd1 * (J_D1 * (1 - V_D1) + (1 - K_D1) * V_D1))
+        V_D2 = torch.sigmoid(lamd2 * (J_D2 * (1 - V_D2) + (1 - K_D2) * V_D2))
+    V_GPi_DP = torch.nn.functional.linear(V_D1, w_d1gpi)
+    if stn_gpe_iter > 0:
+        xgpe = eta_gpe * -V_D2
+        xstn = eta_stn * (wgs * xgpe)
+        vstn = torch.tanh(lamd2 * xstn)
+        V_GPi = eta_gpi * (-V_GPi_DP + 2 * (lamd2 * torch.nn.functional.linear(vstn, w_stngpi)))
+        hx = torch.rnn_tanh_cell(-V_GPi, hx, w_ih, w_hh, b_ih, b_hh)
+        for _ in range(stn_gpe_iter - 1):
+            xgpe = xgpe + eta_gpe * (
+                -xgpe + wsg * vstn + torch.nn.functional.linear(xgpe, glat) - V_D2
+            )
+            xstn = xstn + eta_stn * (
+                -xstn + wgs * xgpe + torch.nn.functional.linear(vstn, slat)
+            )
+            vstn = torch.tanh(lamd2 * xstn)
+            V_GPi_IP = lamd2 * torch.nn.functional.linear(vstn, w_stngpi)
+            V_GPi = V_GPi + eta_gpi * (-V_GPi - V_GPi_DP + 2 * V_GPi_IP)
+            hx = torch.rnn_tanh_cell(-V_GPi, hx, w_ih, w_hh, b_ih, b_hh)
+    return hx
+
+
 class BasalGanglia(torch.nn.Module):
     def __init__(self,
                  num_out=2,
@@ -59,13 +116,17 @@ class BasalGanglia(torch.nn.Module):
         self.wsg = torch.nn.Parameter(torch.Tensor(np.array([[2.0]])))
         self.wgs = torch.nn.Parameter(torch.Tensor(np.array([[-2.0]])))
         self.epsilon_glat = torch.nn.Parameter(torch.Tensor(np.array([[.05]])))
-        self.weights_glat = torch.ones(
+        # Lateral connection masks, not saved with the parameters
+        self.register_buffer('weights_glat', torch.ones(
+            (self.num_gpe, self.num_gpe)
+        ) - torch.eye(self.num_gpe), persistent=False)
+        self.register_buffer('ones_glat', torch.ones(
             (self.num_gpe, self.num_gpe)
-        ) - torch.eye(self.num_gpe)
+        ), persistent=False)
         self.epsilon_slat = torch.nn.Parameter(torch.Tensor(np.array([[.05]])))
-        self.weights_slat = torch.ones(
+        self.register_buffer('weights_slat', torch.ones(
             (self.num_stn, self.num_stn)
-        ) - torch.eye(self.num_stn)
+        ) - torch.eye(self.num_stn), persistent=False)
         self.fc_d1gpi = torch.nn.Linear(
             self.FF_Dim_in, self.num_gpi, bias=False)
         self.fc_stngpi = torch.nn.Linear(
@@ -84,11 +145,12 @@ class BasalGanglia(torch.nn.Module):
     def forward(self, inputs):
         stimulus_t, stimulus_t_1 = inputs
         batch_size = stimulus_t.shape[0]
-        v_t = self.vf(stimulus_t)
-        v_t_1 = self.vf(stimulus_t_1)
+        # Both value function inputs in one batch
+        v_t, v_t_1 = torch.split(
+            self.vf(torch.cat([stimulus_t, stimulus_t_1], 0)),
+            [batch_size, stimulus_t_1.shape[0]]
+        )
         deltavf = v_t - v_t_1
-        V_D1 = torch.zeros((batch_size, self.FF_Dim_in)).to(stimulus_t.device)
-        V_D2 = torch.zeros((batch_size, self.FF_Dim_in)).to(stimulus_t.device)
         lamd1 = 1 / (1 + torch.exp(-self.log_a1.exp()
                      * (deltavf - self.thetad1)))
         lamd2 = 1 / (1 + torch.exp(self.log_a2.exp()
@@ -99,44 +161,20 @@ class BasalGanglia(torch.nn.Module):
         K_D1 = self.fc_kd1(stimulus_t)
         K_D2 = self.fc_kd2(stimulus_t)
 
-        for FFiter in range(self.FF_steps):
-            V_D1 = J_D1 * (1 - V_D1) + (1 - K_D1) * V_D1
-            V_D2 = J_D2 * (1 - V_D2) + (1 - K_D2) * V_D2
-            V_D1 = torch.sigmoid(lamd1 * V_D1)
-            V_D2 = torch.sigmoid(lamd2 * V_D2)
-        V_GPi_DP = self.fc_d1gpi(V_D1)
-        V_GPi = torch.zeros((batch_size, self.num_gpi)).to(stimulus_t.device)
-        xgpe = torch.zeros((batch_size, self.num_gpe)).to(stimulus_t.device)
-        xstn = torch.zeros((batch_size, self.num_stn)).to(stimulus_t.device)
-        vstn = torch.tanh(lamd2 * xstn)
-        hx = torch.rand((batch_size, self.num_gpi)).to(stimulus_t.device)
-        for it in range(self.stn_gpe_iter):
-            dxgpe = self.eta_gpe * (
-                -xgpe + self.wsg * vstn +
-                torch.nn.functional.linear(
-                    xgpe,
-                    self.epsilon_glat * self.weights_glat.to(stimulus_t.device) +
-                    torch.ones((
-                        self.num_gpe, self.num_gpe
-                    )).to(stimulus_t.device)
-                ) - V_D2
-            )
-            xgpe = xgpe + dxgpe
-            dxstn = self.eta_stn * (
-                -xstn + self.wgs * xgpe +
-                torch.nn.functional.linear(
-                    vstn,
-                    self.epsilon_slat * self.weights_slat.to(stimulus_t.device)
-                )
-            )
-            xstn = xstn + dxstn
-            vstn = torch.tanh(lamd2 * xstn)
-            V_GPi_IP = lamd2 * self.fc_stngpi(vstn)
-            dvgpi = self.eta_gpi * (-V_GPi - V_GPi_DP + 2 * V_GPi_IP)
-            V_GPi = V_GPi + dvgpi
-            Ith = -V_GPi
-            hx = self.thalamus(Ith, hx)
-            out = self.linear(hx)
+        # Effective lateral connections, constant over the iterations
+        glat = self.epsilon_glat * self.weights_glat + self.ones_glat
+        slat = self.epsilon_slat * self.weights_slat
+        hx = torch.rand((batch_size, self.num_gpi), device=stimulus_t.device)
+        hx = _basal_ganglia_dynamics(
+            J_D1, J_D2, K_D1, K_D2, lamd1, lamd2,
+            self.fc_d1gpi.weight, self.fc_stngpi.weight,
+            glat, slat, self.wsg, self.wgs, hx,
+            self.thalamus.weight_ih, self.thalamus.weight_hh,
+            self.thalamus.bias_ih, self.thalamus.bias_hh,
+            self.FF_steps, self.stn_gpe_iter,
+            self.eta_gpe, self.eta_stn, self.eta_gpi
+        )
+        out = self.linear(hx)
         return out, v_t
 
 
@@ -1,4 +1,3 @@
-import torch
 import numpy as np
 import os
 
@@ -40,16 +39,30 @@ params = {
     'imitation_steps'             : int(2e4),
     'render_freq'                 : int(4e4),
     'save_freq'                   : int(4e4),
+    'keep_checkpoints'            : None,
+    'checkpoint_replay_buffer'    : False,
     'eval_freq'                   : int(2e4),
+    'eval_threads'                : 0,
     'buffer_size'                 : int(3e4),
+    'prioritized_replay'          : False,
+    'per_alpha'                   : 0.6,
+    'per_beta'                    : 0.4,
+    'prefetch_batches'            : 0,
+    'return_steps'                : 0,
+    'return_lambda'               : 1.0,
     'max_episode_size'            : int(5e2),
     'max_seq_len'                 : 5,
     'seq_sample_freq'             : 5,
     'burn_in_seq_len'             : 5,
     'total_timesteps'             : int(1e6),
+    'n_actors'                    : 0,
+    'utd_ratio'                   : 1.0,
+    'weight_sync_freq'            : 100,
+    'actor_chunk_size'            : 64,
     'history_steps'               : 10,
     'net_arch'                    : [200, 150],
     'n_critics'                   : 3,
+    'ensemble_critic'             : False,
     'ds'                          : 0.01,
     'motor_cortex'                : [256, 128],
     'snc'                         : [256, 1],
@@ -77,10 +90,11 @@ params = {
     'policy_delay'                : 5,
     'seed'                        : 281,
     'target_speed'                : 8.0,
+    # Scheduler classes are dotted paths, importing the constants does not import torch
     'lr_schedule_preprocesing'    : [
                                         {
                                             'name' : 'ExponentialLRSchedule',
-                                            'class' : torch.optim.lr_scheduler.ExponentialLR,
+                                            'class' : 'torch.optim.lr_scheduler.ExponentialLR',
                                             'kwargs' : {
                                                 'gamma' : 0.99,
                                                 'last_epoch' : - 1,
@@ -88,7 +102,7 @@ params = {
                                             }
                                         }, {
                                             'name' : 'ReduceLROnPlateauSchedule',
-                                            'class' : torch.optim.lr_scheduler.ReduceLROnPlateau,
+                                            'class' : 'torch.optim.lr_scheduler.ReduceLROnPlateau',
                                             'kwargs' : {
                                                 'mode' : 'min',
                                                 'factor' : 0.5,
@@ -0,0 +1,407 @@
+"""Sharded on disk datasets of environment observations for encoder pretraining.
+
+`generate_dataset` steps environments in worker processes and writes the
+selected observation keys, e.g. `scale_1`, `scale_2` and `depth`, and
+optionally the colour detection labels of `Environment.detect_color`, into
+shards of `shard_size` frames. A dataset directory holds one sub directory per
+shard and an `index.json` listing the shards, their sizes and the shape and
+data type of every key. Shards are written as `.npy` files, memory mapped
+when read, or as one zlib compressed `.npz` file decompressed once per pass.
+Detection labels are stored as the concatenated `boxes` and `classes` of all
+frames with the `label_offsets` of each frame. `ShardedDataset` streams the
+shards to the workers of a `torch.utils.data.DataLoader`.
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import functools
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import gym
+import stable_baselines3 as sb3
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+COMPRESSIONS = ['none', 'zlib']
+LABEL_KEYS = ['boxes', 'classes', 'label_offsets']
+
+Labels = Tuple[Sequence[Sequence[float]], Sequence[int]]
+
+
+def detect_colors(env: gym.Env, obs: Dict[str, np.ndarray], key: str = 'frame_t') -> Labels:
+    """Detection labels of the frame `obs[key]` of shape `(height, width, 3)` with `Environment.detect_color`."""
+    return env.unwrapped.detect_color(obs[key], False)
+
+
+def _write_shard(
+    directory: str,
+    frames: Dict[str, List[np.ndarray]],
+    labels: Optional[Tuple[List[Any], List[int], List[int]]],
+    compression: str
+) -> int:
+    arrays = {key: np.stack(values) for key, values in frames.items()}
+    if labels is not None:
+        boxes, classes, counts = labels
+        arrays['boxes'] = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        arrays['classes'] = np.asarray(classes, dtype=np.int64)
+        arrays['label_offsets'] = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    os.makedirs(directory)
+    if compression == 'zlib':
+        np.savez_compressed(os.path.join(directory, 'shard.npz'), **arrays)
+    else:
+        for key, array in arrays.items():
+            np.save(os.path.join(directory, '{}.npy'.format(key)), array)
+    return len(next(iter(arrays.values())))
+
+
+def _generate_worker(
+    rank: int,
+    env_fn: Callable[[], gym.Env],
+    path: str,
+    episodes: int,
+    keys: List[str],
+    label_fn: Optional[Callable[[gym.Env, Dict[str, np.ndarray]], Labels]],
+    action_key: Optional[str],
+    shard_size: int,
+    compression: str,
+    seed: Optional[int],
+    results: Any
+) -> None:
+    torch.set_num_threads(1)
+    if seed is not None:
+        np.random.seed(seed + rank)
+        torch.manual_seed(seed + rank)
+    env = env_fn()
+    if seed is not None:
+        env.seed(seed + rank)
+        env.action_space.seed(seed + rank)
+    # Channel last images are stored channel first, as `VecTransposeImage` passes them to the encoders
+    transpose = [
+        key for key in keys
+        if sb3.common.preprocessing.is_image_space(env.observation_space[key], check_channels=True)
+        and not sb3.common.preprocessing.is_image_space_channels_first(env.observation_space[key])
+    ]
+
+    frames = {key: [] for key in keys}
+    labels = ([], [], []) if label_fn is not None else None
+    n_shards = 0
+
+    def flush():
+        nonlocal frames, labels, n_shards
+        name = 'shard_{:03d}_{:05d}'.format(rank, n_shards)
+        size = _write_shard(os.path.join(path, name), frames, labels, compression)
+        results.put({'name': name, 'size': size, 'worker': rank})
+        frames = {key: [] for key in keys}
+        labels = ([], [], []) if label_fn is not None else None
+        n_shards += 1
+
+    for episode in range(episodes):
+        obs = env.reset()
+        done = False
+        while not done:
+            action = obs[action_key] if action_key is not None else env.action_space.sample()
+            obs, reward, done, info = env.step(action)
+            for key in keys:
+                frames[key].append(np.transpose(obs[key], (2, 0, 1)) if key in transpose else np.asarray(obs[key]))
+            if label_fn is not None:
+                boxes, classes = label_fn(env, obs)
+                labels[0].extend(boxes)
+                labels[1].extend(classes)
+                labels[2].append(len(classes))
+            if len(frames[keys[0]]) >= shard_size:
+                flush()
+    if len(frames[keys[0]]) > 0:
+        flush()
+    env.close()
+    results.put(None)
+
+
+def generate_dataset(
+    path: str,
+    env_fn: Callable[[], gym.Env],
+    keys: Sequence[str],
+    episodes: int,
+    n_workers: int = 1,
+    label_fn: Optional[Callable[[gym.Env, Dict[str, np.ndarray]], Labels]] = None,
+    action_key: Optional[str] = 'sampled_action',
+    shard_size: int = 1000,
+    compression: str = 'zlib',
+    seed: Optional[int] = None
+) -> Dict[str, Any]:
+    """Writes the observations of `episodes` episodes to a sharded dataset under `path`, replacing it.
+
+    Workers are started with `spawn`, so environments holding OpenGL or
+    MuJoCo state are never forked. Each worker writes its own shards.
+    Channel last image observations are stored channel first.
+
+    :param path: directory of the dataset
+    :type path: str
+    :param env_fn: picklable function creating an environment with dict observations
+    :type env_fn: Callable[[], gym.Env]
+    :param keys: observation keys to store
+    :type keys: Sequence[str]
+    :param episodes: number of episodes, split between the workers
+    :type episodes: int
+    :param n_workers: number of worker processes
+    :type n_workers: int
+    :param label_fn: picklable function returning the boxes and classes of an observation, e.g. `detect_colors`
+    :type label_fn: Optional[Callable[[gym.Env, Dict[str, np.ndarray]], Labels]]
+    :param action_key: observation key of the action to take, random actions if `None`
+    :type action_key: Optional[str]
+    :param shard_size: max number of frames per shard
+    :type shard_size: int
+    :param compression: one of `COMPRESSIONS`, shards are memory mapped without compression
+    :type compression: str
+    :param seed: seed of the first worker, the others get the following seeds
+    :type seed: Optional[int]
+    :returns: the index written to `index.json`
+    :rtype: Dict[str, Any]
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError('Expected compression in {}, got {}'.format(COMPRESSIONS, compression))
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    keys = list(keys)
+    n_workers = max(min(n_workers, episodes), 1)
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(
+            target=_generate_worker,
+            args=(
+                rank, env_fn, path, episodes // n_workers + int(rank < episodes % n_workers), keys,
+                label_fn, action_key, shard_size, compression, seed, results
+            ),
+            daemon=True
+        ) for rank in range(n_workers)
+    ]
+    for process in processes:
+        process.start()
+    shards = []
+    running = n_workers
+    try:
+        while running > 0:
+            try:
+                shard = results.get(timeout=10)
+            except Exception:
+                if not any(process.is_alive() for process in processes):
+                    raise RuntimeError('Dataset generation workers exited unexpectedly')
+                continue
+            if shard is None:
+                running -= 1
+            else:
+                shards.append(shard)
+    finally:
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+    if not shards:
+        raise ValueError('No frames were written to {}, got {} episodes'.format(path, episodes))
+    shards = sorted(shards, key=lambda shard: shard['name'])
+    arrays = ShardedDataset._load(path, shards[0]['name'], compression)
+    index = {
+        'keys': {key: {'shape': list(arrays[key].shape[1:]), 'dtype': arrays[key].dtype.str} for key in keys},
+        'labels': label_fn is not None,
+        'compression': compression,
+        'size': int(sum(shard['size'] for shard in shards)),
+        'shards': shards
+    }
+    with open(os.path.join(path, 'index.json'), 'w') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+class ShardedDataset(torch.utils.data.IterableDataset):
+    """Streams the frames of a dataset written by `generate_dataset`.
+
+    The shards are split between the workers of the `DataLoader`, each
+    worker reading one shard at a time. With `batch_size` the dataset yields
+    batches gathered from one shard at a time, to be used with
+    `DataLoader(dataset, batch_size=None)`. Otherwise it yields frames to be
+    batched with `collate`. Samples are dicts of tensors of the selected keys,
+    and with `labels` the `boxes` and `classes` of each frame, as lists for
+    batches.
+
+    :param path: directory of the dataset
+    :type path: str
+    :param keys: keys to read, all by default
+    :type keys: Optional[Sequence[str]]
+    :param labels: whether to read the detection labels
+    :type labels: bool
+    :param batch_size: number of frames per yielded batch, frames are yielded one by one if `None`
+    :type batch_size: Optional[int]
+    :param shuffle: whether to shuffle the shards and the frames of each shard
+    :type shuffle: bool
+    :param seed: seed of the shuffling, combined with the epoch set with `set_epoch`
+    :type seed: int
+    """
+    def __init__(
+        self,
+        path: str,
+        keys: Optional[Sequence[str]] = None,
+        labels: bool = False,
+        batch_size: Optional[int] = None,
+        shuffle: bool = True,
+        seed: int = 0
+    ):
+        super(ShardedDataset, self).__init__()
+        self.path = path
+        with open(os.path.join(path, 'index.json'), 'r') as f:
+            self.index = json.load(f)
+        self.keys = list(keys) if keys is not None else list(self.index['keys'].keys())
+        if labels and not self.index['labels']:
+            raise ValueError('Dataset {} has no detection labels'.format(path))
+        self.labels = labels
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self) -> int:
+        if self.batch_size is None:
+            return self.index['size']
+        return sum(-(-shard['size'] // self.batch_size) for shard in self.index['shards'])
+
+    def set_epoch(self, epoch: int) -> None:
+        """Changes the shuffling of the following passes, call it before creating the iterator of each epoch."""
+        self.epoch = epoch
+
+    @staticmethod
+    def _load(path: str, name: str, compression: str) -> Dict[str, np.ndarray]:
+        if compression == 'zlib':
+            with np.load(os.path.join(path, name, 'shard.npz')) as shard:
+                return {key: shard[key] for key in shard.files}
+        directory = os.path.join(path, name)
+        return {
+            filename[:-len('.npy')]: np.load(os.path.join(directory, filename), mmap_mode='r')
+            for filename in os.listdir(directory) if filename.endswith('.npy')
+        }
+
+    def _sample(self, arrays: Dict[str, np.ndarray], inds: np.ndarray, batch: bool) -> Dict[str, Any]:
+        sample = {key: torch.from_numpy(np.ascontiguousarray(arrays[key][inds])) for key in self.keys}
+        if not batch:
+            sample = {key: value[0] for key, value in sample.items()}
+        if self.labels:
+            offsets = arrays['label_offsets']
+            boxes = [torch.from_numpy(np.array(arrays['boxes'][offsets[i]:offsets[i + 1]])) for i in inds]
+            classes = [torch.from_numpy(np.array(arrays['classes'][offsets[i]:offsets[i + 1]])) for i in inds]
+            sample['boxes'] = boxes if batch else boxes[0]
+            sample['classes'] = classes if batch else classes[0]
+        return sample
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        shards = list(self.index['shards'])
+        rng = np.random.default_rng([self.seed, self.epoch])
+        if self.shuffle:
+            shards = [shards[i] for i in rng.permutation(len(shards))]
+        worker = torch.utils.data.get_worker_info()
+        if worker is not None:
+            shards = shards[worker.id::worker.num_workers]
+            rng = np.random.default_rng([self.seed, self.epoch, worker.id + 1])
+        for shard in shards:
+            arrays = self._load(self.path, shard['name'], self.index['compression'])
+            order = rng.permutation(shard['size']) if self.shuffle else np.arange(shard['size'])
+            if self.batch_size is None:
+                for i in order:
+                    yield self._sample(arrays, np.array([i]), False)
+            else:
+                for start in range(0, len(order), self.batch_size):
+                    # Sorted rows read memory mapped shards sequentially
+                    yield self._sample(arrays, np.sort(order[start:start + self.batch_size]), True)
+
+
+def collate(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Batches frames of a `ShardedDataset`, keeping the detection labels of each frame in lists."""
+    batch = {}
+    for key in samples[0].keys():
+        if key in ['boxes', 'classes']:
+            batch[key] = [sample[key] for sample in samples]
+        else:
+            batch[key] = torch.stack([sample[key] for sample in samples])
+    return batch
+
+
+def make_simple_room_env(max_episode_size: int) -> gym.Env:
+    """`SimpleRoomEnv` in the simple room maze, as used for dataset generation from the command line."""
+    from neurorobotics.simulations.maze_env import SimpleRoomEnv
+    from neurorobotics.simulations.maze_task import create_simple_room_maze
+    from neurorobotics.simulations.point import PointEnv
+    from neurorobotics.constants import params
+    return SimpleRoomEnv(
+        model_cls=PointEnv,
+        maze_task_generator=create_simple_room_maze,
+        max_episode_size=max_episode_size,
+        n_steps=params['history_steps'],
+        frame_skip=params['frame_skip']
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate a sharded dataset of `SimpleRoomEnv` observations for encoder pretraining.'
+    )
+    parser.add_argument(
+        '--datapath',
+        type=str,
+        help='Path to folder to store generated data in. Ensure folder contains no important data.'
+    )
+    parser.add_argument(
+        '--keys',
+        type=str,
+        nargs='+',
+        default=['frame_t'],
+        help='Observation keys to store.'
+    )
+    parser.add_argument(
+        '--num_episodes',
+        type=int,
+        help='Number of episodes to generate data for.'
+    )
+    parser.add_argument(
+        '--num_workers',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of environment processes.'
+    )
+    parser.add_argument(
+        '--max_episode_size',
+        type=int,
+        help='Maximum number of steps in an episode.'
+    )
+    parser.add_argument(
+        '--shard_size',
+        type=int,
+        default=1000,
+        help='Maximum number of frames per shard.'
+    )
+    parser.add_argument(
+        '--compression',
+        type=str,
+        default='zlib',
+        choices=COMPRESSIONS,
+        help='Compression of the shards, uncompressed shards are memory mapped.'
+    )
+    parser.add_argument(
+        '--labels',
+        action='store_true',
+        help='Store the colour detection labels of the first key.'
+    )
+    args = parser.parse_args()
+
+    start = time.time()
+    index = generate_dataset(
+        path=args.datapath,
+        env_fn=functools.partial(make_simple_room_env, args.max_episode_size),
+        keys=args.keys,
+        episodes=args.num_episodes,
+        n_workers=args.num_workers,
+        label_fn=functools.partial(detect_colors, key=args.keys[0]) if args.labels else None,
+        shard_size=args.shard_size,
+        compression=args.compression
+    )
+    print('Wrote {} frames in {} shards in {:.1f}s'.format(index['size'], len(index['shards']), time.time() - start))
@@ -5,11 +5,12 @@ from neurorobotics.simulations.point import PointEnv
 from neurorobotics.simulations.maze_task import CustomGoalReward4Rooms, \
     GoalRewardNoObstacle, GoalRewardSimple
 import stable_baselines3 as sb3
-from neurorobotics.utils.td3 import NStepReplayBuffer, \
+from neurorobotics.utils.td3 import MultiModalFeaturesExtractorV2, TD3SS
+from neurorobotics.utils.nstep import NStepReplayBuffer, \
     NStepDictReplayBuffer, TD3Lambda, \
-    NStepLambdaDictReplayBuffer, NStepLambdaReplayBuffer, \
-    MultiModalFeaturesExtractorV2, \
-    TD3SS
+    NStepLambdaDictReplayBuffer, NStepLambdaReplayBuffer
+from neurorobotics.utils.prefetch import prefetched
+from neurorobotics.utils.ensemble import EnsembleTD3Policy
 from neurorobotics.utils.rtd3_utils import RTD3, RecurrentTD3Policy, EpisodicReplayBuffer, \
     EpisodicDictReplayBuffer
 from neurorobotics.constants import params
@@ -114,6 +115,9 @@ class Explore:
                 replay_buffer_class = NStepDictReplayBuffer
 
         policy_class = 'MlpPolicy'
+        if params['ensemble_critic']:
+            # All Q-networks are evaluated with batched matmuls
+            policy_class = EnsembleTD3Policy
         policy_kwargs = { 
             'features_extractor_class' : MultiModalFeaturesExtractorV2,
             'net_arch' : [150, 300, 150],
@@ -121,6 +125,10 @@ class Explore:
         }
         if model_type == 'standard':
             model = sb3.TD3
+            if n_steps > 0:
+                # n-step samples carry their own discount
+                model = TD3Lambda
+                kwargs['n_steps'] = n_steps
         elif model_type == 'self-supervised':
             model = TD3SS
         elif model_type == 'lambda':
@@ -160,6 +168,10 @@ class Explore:
             kwargs['lmbda'] = lmbda
             kwargs['n_steps'] = n_steps
 
+        if params.get('prefetch_batches', 0) > 0:
+            model = prefetched(model)
+            kwargs['prefetch_batches'] = params['prefetch_batches']
+
         print('Model: {}'.format(model))
         print('Policy: {}'.format(policy_class))
         print('Replay Buffer: {}'.format(replay_buffer_class))
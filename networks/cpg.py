@@ -3,11 +3,12 @@
 import torch
 import numpy as np
 import os
-import matplotlib.pyplot as plt
+from neurorobotics.utils.optional import lazy_import
 import argparse
 import shutil
-from tqdm import tqdm
 from neurorobotics.constants import params
+plt = lazy_import('matplotlib.pyplot', 'plotting')
+tqdm = lazy_import('tqdm', 'progress')
 
 
 def get_pattern(thresholds, dx = 0.001):
@@ -205,7 +206,7 @@ def pre_configure_network():
     Z_mod = hopf_mod(num_osc, omega.copy(), mu.copy(), z.copy(), C, params['degree'], N, dt)
     T = np.arange(N, dtype = np.float32) * dt
     print('Plotting Output.')
-    for i in tqdm(range(num_osc)):
+    for i in tqdm.tqdm(range(num_osc)):
         num_steps = int(2 * np.pi / (2 * omega[i] * dt * params['alpha']))
         fig, axes = plt.subplots(2,2, figsize = (12,12))
         axes[0][0].plot(
@@ -276,7 +277,7 @@ def pre_configure_network():
     fig, axes = plt.subplots(2,2, figsize = (10,10))
     num_osc = 4
     color = ['r', 'b', 'g', 'y']
-    for i in tqdm(range(num_osc)):
+    for i in tqdm.tqdm(range(num_osc)):
         num_steps = int(2 * np.pi / (2 * omega[i] * dt * params['alpha']))
         axes[0][0].plot(T[:num_steps], Z_mod[:num_steps, i], color = color[i], linestyle = '--')
         axes[0][0].set_xlabel('time (s)')
@@ -324,12 +325,12 @@ class ModifiedHopfCPGTorch(torch.nn.Module):
         x, y = torch.split(Z, self.num_osc, -1)
         r = torch.sqrt(torch.square(x) + torch.square(y))
         beta = self._get_beta(omega, C, degree)
-        phi = torch.arctan(y / (x + 1e-7))
+        phi = torch.atan2(y, (x + 1e-7))
         mean = torch.abs(1 / (2 * beta * (1 - beta)))
         amplitude = (1 - 2 * beta) / (2 * beta * (1 - beta))
         w = torch.abs(omega) * (mean + amplitude * self._get_omega_choice(phi) * self.alpha)
-        phi += dt * w
-        r += self.lmbd * dt * (mu - self.beta * torch.square(r)) * r
+        phi = phi + dt * w
+        r = r + self.lmbd * dt * (mu - self.cbeta * torch.square(r)) * r
         x = r * torch.cos(phi)
         y = r * torch.sin(phi)
         z = torch.cat([x, y], -1)
@@ -340,6 +341,103 @@ class ModifiedHopfCPGTorch(torch.nn.Module):
 
     def _get_beta(self, x, C, degree):
         x = torch.abs(x)
-        X = torch.stack([x ** p for p in range(degree, -1, -1)], 1)
-        beta = torch.stack([torch.sum(C * X[:, :, i]) for i in range(X.shape[-1])], -1)
+        X = torch.stack([x ** p for p in range(degree, -1, -1)], -1)
+        beta = torch.sum(C.reshape(-1) * X, -1)
         return beta
+
+
+class ModifiedHopfCPGRollout(torch.nn.Module):
+    """PyTorch Model that unrolls the modified hopf oscillator over many steps
+    for a batch of oscillator sets in a single differentiable call.
+
+    The beta polynomial and the frequency terms are evaluated for the whole
+    rollout before the integration loop, which then only advances the polar
+    state. The module is compatible with `torch.jit.script`, refer to
+    `compile_rollout`.
+
+    :param num_osc: Number of Oscillators in the CPG
+    :type num_osc: int
+    :param C: Coefficients of the beta polynomial, highest power first
+    :type C: np.ndarray
+    :param dt: sampling period
+    :type dt: float
+    :param truncate: Number of steps after which the state is detached from the graph for truncated BPTT, `0` keeps the whole rollout in the graph
+    :type truncate: int
+    """
+    def __init__(self, num_osc, C, dt=0.001, truncate=0):
+        super(ModifiedHopfCPGRollout, self).__init__()
+        self.num_osc = num_osc
+        self.dt = float(dt)
+        self.truncate = int(truncate)
+        self.alpha = float(params['alpha'])
+        self.lmbd = float(params['lambda'])
+        self.cbeta = float(params['beta'])
+        self.register_buffer('C', torch.as_tensor(np.asarray(C), dtype=torch.float32).reshape(-1))
+
+    def forward(self, Z, omega, mu, steps: int = 1):
+        """Feedforward method for the rollout.
+
+        :param Z: Initial State of the oscillators, shape `(B, 2 * num_osc)`
+        :type Z: torch.Tensor
+        :param omega: Frequencies, shape `(B, num_osc)` held for `steps` steps or `(T, B, num_osc)`
+        :type omega: torch.Tensor
+        :param mu: Amplitudes, shape `(B, num_osc)` held for `steps` steps or `(T, B, num_osc)`
+        :type mu: torch.Tensor
+        :param steps: number of steps to unroll for if `omega` and `mu` are not sequences
+        :type steps: int
+        :returns: States of the oscillators after every step, shape `(T, B, 2 * num_osc)`
+        :rtype: torch.Tensor
+        """
+        assert Z.size(-1) // 2 == self.num_osc
+        if omega.dim() == 3:
+            steps = omega.size(0)
+        else:
+            omega = omega.unsqueeze(0).expand(steps, omega.size(0), omega.size(1))
+        if mu.dim() == 2:
+            mu = mu.unsqueeze(0).expand(steps, mu.size(0), mu.size(1))
+        beta = self._get_beta(omega)
+        mean = torch.abs(1 / (2 * beta * (1 - beta)))
+        amplitude = self.alpha * (1 - 2 * beta) / (2 * beta * (1 - beta))
+        omega = torch.abs(omega)
+        x, y = torch.split(Z, self.num_osc, -1)
+        r = torch.sqrt(torch.square(x) + torch.square(y))
+        phi = torch.atan2(y, (x + 1e-7))
+        out = []
+        for t in range(steps):
+            w = omega[t] * (mean[t] + amplitude[t] * torch.tanh(1e3 * phi))
+            phi = torch.remainder(phi + self.dt * w + np.pi, 2 * np.pi) - np.pi
+            r = r + self.lmbd * self.dt * (mu[t] - self.cbeta * torch.square(r)) * r
+            out.append(torch.cat([r * torch.cos(phi), r * torch.sin(phi)], -1))
+            if self.truncate > 0 and (t + 1) % self.truncate == 0:
+                r = r.detach()
+                phi = phi.detach()
+        return torch.stack(out, 0)
+
+    def _get_beta(self, x):
+        x = torch.abs(x)
+        beta = torch.zeros_like(x) + self.C[0]
+        for i in range(1, self.C.size(0)):
+            beta = beta * x + self.C[i]
+        return beta
+
+
+def compile_rollout(rollout, backend = 'script'):
+    """Captures the graph of a `ModifiedHopfCPGRollout`.
+
+    :param rollout: rollout module to capture
+    :type rollout: ModifiedHopfCPGRollout
+    :param backend: `script` for TorchScript or `compile` for `torch.compile`
+    :type backend: str
+    :returns: captured module with the same call signature
+    :rtype: torch.nn.Module
+    """
+    if backend == 'script':
+        return torch.jit.script(rollout)
+    elif backend == 'compile':
+        if not hasattr(torch, 'compile'):
+            raise ValueError('`torch.compile` is not available in torch {}'.format(torch.__version__))
+        return torch.compile(rollout)
+    else:
+        raise ValueError(
+            'Expected one of `script` or `compile`, got {}'.format(backend)
+        )
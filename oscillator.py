@@ -1,11 +1,12 @@
 import numpy as np
 import os
-import matplotlib.pyplot as plt
+from neurorobotics.utils.optional import lazy_import
 from neurorobotics.constants import params
 import argparse
 import shutil
-from tqdm import tqdm
 from neurorobotics.utils.cpg_utils import test_cpg_entrainment
+plt = lazy_import('matplotlib.pyplot', 'plotting')
+tqdm = lazy_import('tqdm', 'progress')
 
 def hopf_simple_step(omega, mu, z, dt = 0.001):
     x, y = np.split(z, 2, -1)
@@ -104,7 +105,6 @@ def hopf_mod_step(omega, mu, z, C, degree, dt = 0.001):
     phi = np.arctan2(y, x)
     mean = np.abs(1 / (2 * beta * (1 - beta)))
     amplitude = (1 - 2 * beta) / (2 * beta * (1 - beta))
-    print(omega.shape, mean.shape, amplitude.shape, phi.shape)
     w = np.abs(omega) * (mean + amplitude * _get_omega_choice(phi)) * params['alpha']
     phi += dt * w 
     r += params['lambda'] * dt * (mu - params['beta'] * r ** 2) * r 
@@ -214,39 +214,167 @@ def Q(t, P, phase, X0_0, v, lmbda, omega, C, degree, dt):
     dzsfdt = (zsf2 - zsf1) / (2 * dt)
     return np.sqrt(P/np.linalg.norm(dzsfdt) ** 2) * dzsfdt
 
-def cpg_step_v2(omega, mu, r, z, z_ref, y, theta, t, phase, C, degree = 15, dt = 0.001):
-    q = Q(t, params['power'], phase, dt)
+class PhaseResponse:
+    """Phase response of the modified hopf oscillator, precomputed once for a
+    given `omega`, `mu` and beta polynomial.
+
+    The radial and angular dynamics of `hopf_mod_step` are decoupled, the
+    limit cycle is the circle of radius `sqrt(mu / beta)` and the isochrons are
+    radial lines. The asymptotic phase therefore follows from integrating
+    `1 / w(phi)` once over the cycle. The limit cycle, the phase sensitivity
+    function (gradient of the asymptotic phase, `ZSF`), its derivative and the
+    Floquet multipliers are tabulated over a uniform grid of asymptotic phase,
+    so that the per step feedback in `cpg_step_v2` is a table lookup with
+    linear interpolation.
+
+    :param omega: frequency of each oscillator
+    :type omega: np.ndarray
+    :param mu: amplitude of each oscillator
+    :type mu: np.ndarray
+    :param C: coefficients of the beta polynomial
+    :type C: np.ndarray
+    :param degree: degree of the beta polynomial
+    :type degree: int
+    :param num_points: number of points in the phase tables
+    :type num_points: int
+    """
+    def __init__(self, omega, mu, C, degree, num_points = 2048):
+        omega = np.abs(np.atleast_1d(omega)).astype(np.float64)
+        mu = np.broadcast_to(np.atleast_1d(mu), omega.shape).astype(np.float64)
+        self.units_osc = omega.shape[-1]
+        self.num_points = num_points
+        beta = _get_beta(omega, C, degree).astype(np.float64)
+        mean = np.abs(1 / (2 * beta * (1 - beta)))
+        amplitude = (1 - 2 * beta) / (2 * beta * (1 - beta))
+        # `_get_omega_choice` switches over a width of 1e-3 radians.
+        steps = max(int(2 * np.pi / 1e-4), 4 * num_points)
+        phi = np.linspace(0, 2 * np.pi, steps + 1)[:, np.newaxis]
+        wrapped = np.arctan2(np.sin(phi), np.cos(phi))
+        w = omega * (mean + amplitude * _get_omega_choice(wrapped)) * params['alpha']
+        t = np.concatenate([
+            np.zeros((1, self.units_osc)),
+            np.cumsum(np.diff(phi, axis = 0) * (1 / w[1:] + 1 / w[:-1]) / 2, 0)
+        ], 0)
+        self.period = t[-1]
+        self.frequency = 2 * np.pi / self.period
+        self.radius = np.sqrt(mu / params['beta'])
+        theta = 2 * np.pi * t / self.period
+        self.theta = np.linspace(0, 2 * np.pi, num_points, endpoint = False)
+        cycle_phi = np.stack([
+            np.interp(self.theta, theta[:, i], phi[:, 0]) for i in range(self.units_osc)
+        ], -1)
+        self._asymptotic_phase = np.stack([
+            np.interp(self.theta, phi[:, 0], theta[:, i]) for i in range(self.units_osc)
+        ], -1)
+        cycle_w = omega * (
+            mean + amplitude * _get_omega_choice(np.arctan2(np.sin(cycle_phi), np.cos(cycle_phi)))
+        ) * params['alpha']
+        self.limit_cycle = np.concatenate([
+            self.radius * np.cos(cycle_phi),
+            self.radius * np.sin(cycle_phi)
+        ], -1)
+        scale = self.frequency / (cycle_w * self.radius)
+        self.zsf = np.concatenate([
+            -scale * np.sin(cycle_phi),
+            scale * np.cos(cycle_phi)
+        ], -1)
+        dtheta = 2 * np.pi / num_points
+        self.dzsf = (np.roll(self.zsf, -1, 0) - np.roll(self.zsf, 1, 0)) / (2 * dtheta)
+        x, y = np.split(self.dzsf, 2, -1)
+        norm = np.sqrt(np.square(x) + np.square(y))
+        self._q = self.dzsf / np.concatenate([norm, norm], -1)
+        self.floquet_exponents = np.stack([
+            np.zeros(self.units_osc),
+            -2 * params['lambda'] * mu
+        ], 0)
+        self.floquet_multipliers = np.exp(self.floquet_exponents * self.period)
+        # Columns of the tables with one and two columns per oscillator
+        self._columns = {
+            width: (np.arange(width) % self.units_osc, np.arange(width))
+            for width in [self.units_osc, 2 * self.units_osc]
+        }
+
+    def _lookup(self, table, theta):
+        pos = np.mod(theta, 2 * np.pi) * (self.num_points / (2 * np.pi))
+        pos = np.broadcast_to(pos, (self.units_osc,))
+        i0 = pos.astype(np.int64)
+        frac = pos - i0
+        i0 %= self.num_points
+        i1 = (i0 + 1) % self.num_points
+        osc, cols = self._columns[table.shape[-1]]
+        frac = frac[osc]
+        return (1 - frac) * table[i0[osc], cols] + frac * table[i1[osc], cols]
+
+    def phase(self, z):
+        """Asymptotic phase of the state `z` of the oscillators."""
+        x, y = np.split(z, 2, -1)
+        phi = np.mod(np.arctan2(y, x), 2 * np.pi)
+        return self._lookup(self._asymptotic_phase, phi)
+
+    def state(self, theta):
+        """Point on the limit cycle at asymptotic phase `theta`."""
+        return self._lookup(self.limit_cycle, theta)
+
+    def ZSF(self, theta):
+        """Phase sensitivity function at asymptotic phase `theta`."""
+        return self._lookup(self.zsf, theta)
+
+    def Q(self, theta, P):
+        """Feedback of power `P` along the derivative of the phase sensitivity function."""
+        return np.sqrt(P) * self._lookup(self._q, theta)
+
+
+_phase_response_cache = {}
+
+def get_phase_response(omega, mu, C, degree, num_points = 2048):
+    """Returns the `PhaseResponse` for the given parameters, computing it on first use.
+
+    Building the key costs about as much as a step, get the tables once
+    before a loop of `cpg_step_v2` and pass them as `prc`.
+    """
+    omega = np.abs(np.atleast_1d(omega))
+    key = (
+        tuple(omega.tolist()),
+        tuple(np.broadcast_to(np.atleast_1d(mu), omega.shape).tolist()),
+        np.asarray(C).tobytes(),
+        degree,
+        num_points,
+        params['alpha'],
+        params['lambda'],
+        params['beta']
+    )
+    if key not in _phase_response_cache:
+        _phase_response_cache[key] = PhaseResponse(omega, mu, C, degree, num_points)
+    return _phase_response_cache[key]
+
+def cpg_step_v2(omega, mu, z, t, phase, C, degree = 15, dt = 0.001, prc = None):
+    if prc is None:
+        prc = get_phase_response(omega, mu, C, degree)
+    q = prc.Q(prc.frequency * t + phase, params['power'])
     z, w = hopf_mod_step(omega, mu, z, C, degree, dt)
-    z += q - params['alpha'] * y
-    return z, w, r, t, y
+    z = z + dt * q
+    return z, w, q
 
 def cpg_v2(omega, mu, phase, C, degree, N, dt = 0.001):
     Q = []
     Z = []
     W = []
-    Y = []
-    r = 1.02 - mu
-    R = [r]
-    T = [np.array([0.0], dtype = np.float32)]
+    T = []
     t = np.zeros(mu.shape, dtype = np.float32)
-    theta = np.zeros(mu.shape)
-    z = np.array([1.02, 0], dtype = np.float32)
-    z2 = np.array([
-        1.2 * np.cos(phase),
-        1.2 * np.sin(phase)
-    ], dtype = np.float32)
+    z = np.concatenate([
+        np.sqrt(mu / params['beta']) * np.cos(phase),
+        np.sqrt(mu / params['beta']) * np.sin(phase)
+    ], -1)
+    prc = get_phase_response(omega, mu, C, degree)
     for i in range(N):
-        z, w, r, theta, y, q = cpg_step_v2(omega, mu, r, z, z_ref, y, theta, t, phase, C, degree, dt)
+        z, w, q = cpg_step_v2(omega, mu, z, t, phase, C, degree, dt, prc)
         t += dt
         Z.append(z.copy())
         W.append(w.copy())
-        R.append(r.copy())
         T.append(t.copy())
-        Y.append(y.copy())
         Q.append(q.copy())
     return np.stack(Z, 0), np.stack(W, 0), \
-        np.stack(R, 0), np.stack(T, 0), \
-        np.stack(Y, 0), np.stack(Q, 0)
+        np.stack(T, 0), np.stack(Q, 0)
 
 
 def feedback():
@@ -269,7 +397,7 @@ def feedback():
     z_d2 = z1.copy() 
     z2 = z1.copy()
     C = _get_polynomial_coef(params['degree'], params['thresholds'], dt * 50)
-    for i in tqdm(range(N)):
+    for i in tqdm.tqdm(range(N)):
         z1, w, z_d1 = cpg_step(omega, mu, z_d1, z1, phase, C, params['degree'], dt)
         z2, w, z_d2 = cpg_step(omega, mu, z_d2, z2, phase, C, params['degree'], dt)
         z_r1, w = hopf_mod_step(omega, mu, z_r1, C, params['degree'], dt)
@@ -389,7 +517,7 @@ if __name__ == '__main__':
     os.mkdir(os.path.join(plot_path, 'hopf'))
     T = np.arange(N, dtype = np.float32) * dt
     print('Plotting Output.')
-    for i in tqdm(range(num_osc)):
+    for i in tqdm.tqdm(range(num_osc)):
         num_steps = int(2 * np.pi / (2 * omega[i] * dt * params['alpha']))
         fig, axes = plt.subplots(2,2, figsize = (12,12))
         axes[0][0].plot(
@@ -461,7 +589,7 @@ if __name__ == '__main__':
     num_osc = 4
     color = ['r', 'b', 'g', 'y']
     label = ['Phase {:2f}'.format(i) for i in [0.0, 0.25, 0.5, 0.75]]
-    for i in tqdm(range(num_osc)):
+    for i in tqdm.tqdm(range(num_osc)):
         num_steps = int(2 * np.pi / (2 * omega[i] * dt * params['alpha']))
         axes[0][0].plot(T[:num_steps], Z_mod[:num_steps, i], color = color[i], linestyle = '--')
         axes[0][0].set_xlabel('time (s)')
@@ -0,0 +1,245 @@
+"""Batched support plane, ZMP and fitness evaluation over whole trajectories.
+
+The functions and classes in this module take `(T, 3)` arrays of positions,
+forces and velocities along with a `(T,)` vector of time and compute the same
+quantities as `SupportPlane`, `ZMP`, `FitnessFunction` and `FitnessFunctionV2`
+for every time step in a few vectorised operations.
+"""
+import numpy as np
+
+
+def _dot(a, b):
+    return np.sum(a * b, -1)
+
+
+def _norm(a):
+    return np.linalg.norm(a, axis=-1)
+
+
+def _normal(AB, U, V):
+    """Batched `SupportPlane.get_n11` and friends.
+
+    Unit normal to `AB` and `U`, falling back to `V` when `AB` and `U` are
+    parallel, oriented along positive x.
+    """
+    cross = np.cross(AB, U)
+    norm = _norm(cross)
+    fallback = norm == 0
+    cross = np.where(fallback[:, np.newaxis], np.cross(AB, V), cross)
+    norm = np.where(fallback, _norm(cross), norm)
+    flag = norm == 0
+    n = cross / np.where(flag, 1e-8, norm)[:, np.newaxis]
+    return np.where(n[:, :1] < 0, -n, n), flag
+
+
+def _mean_normal(n1, n2):
+    n = n1 + n2
+    norm = _norm(n)
+    flag = norm == 0
+    return n / np.where(flag, 1.0, norm)[:, np.newaxis], flag
+
+
+def support_planes(t, Tb, A, B, AL, BL, AF, BF, guard=True):
+    """Batched `SupportPlane.__call__`.
+
+    :param t: time of each step, shape `(T,)`
+    :type t: np.ndarray
+    :param Tb: gait period, scalar or shape `(T,)`
+    :type Tb: Union[float, np.ndarray]
+    :param guard: replace zero norms of `xs` and `zs` by one as in `support_plane_v2`
+    :type guard: bool
+    :returns: support plane axes `xs`, `ys`, `zs` as rows, shape `(T, 3, 3)` and the degenerate flag of each step
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    t = np.asarray(t, dtype=np.float64)
+    Tb = np.broadcast_to(np.asarray(Tb, dtype=np.float64), t.shape)
+    Tb = np.where(Tb == 0, 1e-8, Tb)
+    AB = B - A
+    AAf, BBf = AF - A, BF - B
+    AAl, BBl = AL - A, BL - B
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n11, f11 = _normal(AB, AAf, BBf)
+        n12, f12 = _normal(AB, BBf, AAf)
+        n21, f21 = _normal(AB, AAl, BBl)
+        n22, f22 = _normal(AB, BBl, AAl)
+        n1, f1 = _mean_normal(n11, n12)
+        n2, f2 = _mean_normal(n21, n22)
+        mu = (-t / Tb + 1)[:, np.newaxis]
+        xs = mu * n1 + (1 - mu) * n2
+        norm = _norm(xs)
+        if guard:
+            norm = np.where(norm == 0, 1.0, norm)
+        xs = xs / norm[:, np.newaxis]
+        norm = _norm(AB)
+        if guard:
+            norm = np.where(norm == 0, 1.0, norm)
+        zs = AB / norm[:, np.newaxis]
+        ys = np.cross(zs, xs)
+        plane = np.stack([
+            xs / _norm(xs)[:, np.newaxis],
+            ys / _norm(ys)[:, np.newaxis],
+            zs / _norm(zs)[:, np.newaxis]
+        ], 1)
+    return plane, f11 | f12 | f21 | f22 | f1 | f2
+
+
+def zmp(plane, com, force, torque, v_real, v_exp, eta, g=np.array([0.0, 0.0, -9.8])):
+    """Batched `ZMP.__call__` of `reward.zmp`."""
+    com_s = np.einsum('tij,tj->ti', plane, com)
+    force_s = np.einsum('tij,tj->ti', plane, force)
+    torque_s = np.einsum('tij,tj->ti', plane, torque)
+    g_s = np.einsum('tij,j->ti', plane, g)
+    zmp_s = np.zeros_like(com_s)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        zmp_s[:, 1] = com_s[:, 1] - (
+            com_s[:, 0] * (force_s[:, 1] + g_s[:, 1]) + torque_s[:, 2]
+        ) / (force_s[:, 0] + g_s[:, 0])
+        zmp_s[:, 2] = com_s[:, 2] - (
+            com_s[:, 0] * (force_s[:, 2] + g_s[:, 2]) - torque_s[:, 1]
+        ) / (force_s[:, 0] + g_s[:, 0])
+    out = zmp_s + eta * (v_real - v_exp)
+    out[:, 0] = 0
+    return np.einsum('tji,tj->ti', plane, out)
+
+
+def zmp_v2(plane, com, acc, v_real, v_exp, eta, g=np.array([0.0, 0.0, -9.8])):
+    """Batched `ZMP.__call__` of `reward.zmp_v2`."""
+    com_s = np.einsum('tij,tj->ti', plane, com)
+    acc_s = np.einsum('tij,tj->ti', plane, acc)
+    g_s = np.einsum('tij,j->ti', plane, g)
+    zmp_s = np.zeros_like(com_s)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        zmp_s[:, 1] = com_s[:, 1] - (
+            com_s[:, 0] * (acc_s[:, 1] + g_s[:, 1])
+        ) / (acc_s[:, 0] + g_s[:, 0])
+        zmp_s[:, 2] = com_s[:, 2] - (
+            com_s[:, 0] * (acc_s[:, 2] + g_s[:, 2])
+        ) / (acc_s[:, 0] + g_s[:, 0])
+    out = zmp_s + eta * (
+        np.einsum('tij,tj->ti', plane, v_real) - np.einsum('tij,tj->ti', plane, v_exp)
+    )
+    out[:, 0] = 0
+    return np.einsum('tji,tj->ti', plane, out)
+
+
+def _edge_distance(P, edge, zmp, guard):
+    """Distance of `zmp` from the line through `P` along `edge`."""
+    norm = _norm(edge)
+    if guard:
+        norm = np.where(norm == 0.0, 1.0, norm)
+    return _norm(np.cross(P - zmp, edge) / norm[:, np.newaxis])
+
+
+def _min(a, b):
+    """Elementwise builtin `min`, which keeps `a` when either is NaN."""
+    return np.where(b < a, b, a)
+
+
+class TrajectoryFitnessFunction:
+    """Batched `FitnessFunction` over a trajectory.
+
+    `build` takes `(T,)` time and `(T, 3)` foot positions instead of the per
+    step dictionaries, every reward returns one value per time step.
+
+    :param params: dictionary of robot parameters with `L` and `W`
+    :type params: Dict[str, Any]
+    """
+    guard = False
+
+    def __init__(self, params):
+        self.params = params
+        self.g = np.array([0.0, 0.0, -9.8])
+
+    def build(self, t, Tb, A, B, AL, BL, AF, BF):
+        self.t = np.asarray(t, dtype=np.float64)
+        self.Tb = np.broadcast_to(np.asarray(Tb, dtype=np.float64), self.t.shape)
+        self.A = A
+        self.AL = AL
+        self.AF = AF
+        self.B = B
+        self.BL = BL
+        self.BF = BF
+        self.AB = B - A
+        self.AlBl = BL - AL
+        self.plane, self.flag = support_planes(t, Tb, A, B, AL, BL, AF, BF, self.guard)
+
+    def zmp(self, com, force, torque, v_real, v_exp, eta):
+        return zmp(self.plane, com, force, torque, v_real, v_exp, eta, self.g)
+
+    def _stability(self, zmp, com):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dc = np.abs(np.cross(self.A - zmp, self.AB) / _norm(self.AB)[:, np.newaxis])
+            dl = np.abs(np.cross(self.BL - zmp, self.AlBl) / _norm(self.AlBl)[:, np.newaxis])
+            middle = (0.25 * self.Tb < self.t) & (self.t < self.Tb * 0.75)
+            wc = np.where(middle, 2 * self.t / self.Tb - 1.5, 0.0)
+            wl = 1
+            d_spt = wc[:, np.newaxis] * dc + wl * dl
+            d11 = _edge_distance(self.A, self.A - self.BL, zmp, self.guard)
+            d12 = _edge_distance(self.AL, self.AL - self.B, zmp, self.guard)
+            d21 = _edge_distance(self.A, self.A - self.AL, zmp, self.guard)
+            d22 = _edge_distance(self.B, self.BL - self.B, zmp, self.guard)
+            d_edge = _min(d11, d12) + _min(d21, d22)
+            u = zmp - com
+            xs = self.plane[:, 0]
+            cosT = _dot(u, xs) / (_norm(u) * _norm(xs))
+            sinT = np.sqrt(1 - cosT * cosT)
+        L, W = self.params['L'], self.params['W']
+        d1 = np.where(np.isnan(d_edge), -1.0, d_edge)
+        d2 = ((L + W) / 8) * sinT
+        d2 = np.where(np.isnan(d2), 1.0, d2)
+        d3 = np.sum(((L + W) * 0.9 / (W * 4)) * d_spt, -1)
+        d3 = np.where(np.isnan(d3), 1.0, d3)
+        return d1, d2, d3, d1 - d2 - d3
+
+    def stability_reward(self, com, force, torque, v_real, v_exp, eta, mass=None, g=None):
+        return self._stability(self.zmp(com, force, torque, v_real, v_exp, eta), com)
+
+    def COT(self, joint_torque, joint_vel, v_real, mass, g, dt):
+        p_e = np.sum(np.abs(joint_torque * joint_vel), -1)
+        return -1 * p_e * dt
+
+    def motion_reward(self, pos, last_pos, desired_motion):
+        return _dot(pos - last_pos, desired_motion[..., :3])
+
+    def motion_reward_v2(self, pos, last_pos, v_real, desired_motion):
+        motion = np.sum(np.square(pos - last_pos - desired_motion[..., :3]), -1) + \
+            np.sum(np.square(v_real - desired_motion[..., 3:]), -1)
+        return -np.sqrt(motion)
+
+    def motion_reward_v3(self, pos, last_pos, v_real, desired_motion):
+        delta = pos - last_pos
+        norm = _norm(delta)
+        norm = np.where(norm != 0, norm, 1.0)
+        motion = _dot(delta / norm[..., np.newaxis], desired_motion[..., :3])
+        # `FitnessFunction.motion_reward_v3` overwrites the velocity norm with
+        # the norm of the desired velocity and never normalises the latter.
+        norm_1 = _norm(desired_motion[..., 3:])
+        norm_1 = np.where(norm_1 != 0, norm_1, np.where(_norm(v_real) != 0, _norm(v_real), 1.0))
+        motion += _dot(v_real / norm_1[..., np.newaxis], desired_motion[..., 3:])
+        return motion
+
+
+class TrajectoryFitnessFunctionV2(TrajectoryFitnessFunction):
+    """Batched `FitnessFunctionV2` over a trajectory.
+
+    :param params: dictionary of robot parameters with `L` and `W`
+    :type params: Dict[str, Any]
+    """
+    guard = True
+
+    def build(self, t, Tb, A, B, AL, BL, AF, BF):
+        # `FitnessFunctionV2.build` nudges coincident feet apart before
+        # building the support plane.
+        BL = np.where(np.all(BL - AL == 0, -1, keepdims=True), BL + 1e-8, BL)
+        BF = np.where(np.all(BF - AF == 0, -1, keepdims=True), BF + 1e-8, BF)
+        degenerate = np.all(B - A == 0, -1, keepdims=True)
+        B = np.where(degenerate, B + 1e-8, B)
+        super(TrajectoryFitnessFunctionV2, self).build(t, Tb, A, B, AL, BL, AF, BF)
+        self.AlBl = np.where(np.all(self.AlBl == 0, -1, keepdims=True), 1e-8, self.AlBl)
+        self.AB = np.where(degenerate, 1e-8, self.AB)
+
+    def zmp(self, com, acc, v_real, v_exp, eta):
+        return zmp_v2(self.plane, com, acc, v_real, v_exp, eta, self.g)
+
+    def stability_reward(self, com, acc, v_real, v_exp, eta):
+        return self._stability(self.zmp(com, acc, v_real, v_exp, eta), com)
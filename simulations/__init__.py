@@ -9,7 +9,6 @@ A maze environment using mujoco that supports custom tasks and robots.
 import gym
 from neurorobotics.simulations.maze_task import TaskRegistry
 from neurorobotics.simulations.point import PointEnv
-from neurorobotics.simulations.quadruped import Quadruped
 
 for maze_id in TaskRegistry.keys():
     for i, task_gen in enumerate(TaskRegistry.tasks(maze_id)):
@@ -31,3 +30,11 @@ for maze_id in TaskRegistry.keys():
         )
 
 __version__ = "2.0"
+
+
+def __getattr__(name):
+    # `Quadruped` imports the CPG networks and torch, only when used
+    if name == 'Quadruped':
+        from neurorobotics.simulations.quadruped import Quadruped
+        return Quadruped
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -0,0 +1,273 @@
+"""
+Collision queries for the maze environments.
+
+`WallDistanceField` answers the proximity and blind tests of
+`Environment.check_position` from distances to the walls precomputed over the
+maze grid, `ContactFilter` finds contacts between the agent and obstacles among the
+active MuJoCo contacts with boolean geom id lookups and `WallSegments`
+intersects the moves of many agents with all walls at once, as
+`maze_env_utils.CollisionDetector.detect` does for one agent.
+"""
+
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+
+class WallDistanceField:
+    """Signed distances from the cell centres to the nearest occupied cell along the axes.
+
+    The distance towards direction `k` of cell `(row, col)` is measured in
+    cells from the centre of the cell to the face of the first occupied cell
+    in that direction, cells outside the maze are occupied. A position inside
+    a cell collides with, and is blind towards, the occupied neighbour in a
+    direction when its offset from the centre of the cell in that direction
+    is larger than `collision` or `blind`. As offsets are at most half a cell
+    only adjacent occupied cells are reached, so the thresholds are
+    precomputed per cell and direction.
+
+    :param occupied: boolean grid of the cells that are not empty
+    :type occupied: np.ndarray
+    :param offsets: `(row, col)` directions, the order of the blind flags
+    :type offsets: List[Tuple[int, int]]
+    :param collision: offset towards an adjacent occupied cell from which a position collides
+    :type collision: float
+    :param blind: offset towards an adjacent occupied cell from which a position is blind
+    :type blind: float
+    """
+    def __init__(
+        self,
+        occupied: np.ndarray,
+        offsets: List[Tuple[int, int]],
+        collision: float = 0.325,
+        blind: float = 0.35,
+    ) -> None:
+        h, w = occupied.shape
+        self.shape = (h, w)
+        self.offsets = list(offsets)
+        self.directions = np.array(self.offsets, dtype=np.float64)
+        self.distances = np.stack([self._axis_distances(occupied, dr, dc) for dr, dc in self.offsets])
+        # Offsets of the positions of each cell colliding and blind towards each direction
+        self.collision_thresholds = self.distances - 0.5 + collision
+        self.blind_thresholds = self.distances - 0.5 + blind
+        for array in [self.directions, self.distances, self.collision_thresholds, self.blind_thresholds]:
+            array.setflags(write=False)
+        # Per cell lists for the scalar queries of `check`
+        self._thresholds = np.stack(
+            [self.collision_thresholds, self.blind_thresholds], -1
+        ).transpose(1, 2, 0, 3).tolist()
+
+    @staticmethod
+    def _axis_distances(occupied: np.ndarray, dr: int, dc: int) -> np.ndarray:
+        # Scans from the side of the maze the direction points to.
+        h, w = occupied.shape
+        distances = np.full((h + 2, w + 2), 0.5)
+        padded = np.ones((h + 2, w + 2), dtype=bool)
+        padded[1:-1, 1:-1] = occupied
+        rows = range(h, 0, -1) if dr > 0 else range(1, h + 1)
+        cols = range(w, 0, -1) if dc > 0 else range(1, w + 1)
+        if dr != 0:
+            for i in rows:
+                distances[i] = np.where(padded[i + dr], 0.5, distances[i + dr] + 1.0)
+        else:
+            for j in cols:
+                distances[:, j] = np.where(padded[:, j + dc], 0.5, distances[:, j + dc] + 1.0)
+        return distances[1:-1, 1:-1]
+
+    def inbound(self, row: int, col: int) -> bool:
+        """Whether the cell is inside the border of the maze, as required by `check`."""
+        return 0 < row < self.shape[0] - 1 and 0 < col < self.shape[1] - 1
+
+    def check(self, row: int, row_frac: float, col: int, col_frac: float) -> Tuple[bool, List[bool], bool]:
+        """Collision, blind directions and whether the position is outside the border of the maze.
+
+        :param row: row of the cell of the position
+        :type row: int
+        :param row_frac: fraction of the cell along the rows, `0.5` at the centre
+        :type row_frac: float
+        :param col: column of the cell of the position
+        :type col: int
+        :param col_frac: fraction of the cell along the columns, `0.5` at the centre
+        :type col_frac: float
+        :return: collision, blind flags in the order of `offsets` and outbound
+        :rtype: Tuple[bool, List[bool], bool]
+        """
+        blind = [False] * len(self.offsets)
+        if not self.inbound(row, col):
+            return False, blind, True
+        collision = False
+        r, c = np.array([row_frac - 0.5, col_frac - 0.5], dtype=np.float32).tolist()
+        for i, ((dr, dc), (collision_threshold, blind_threshold)) in enumerate(
+                zip(self.offsets, self._thresholds[row][col])):
+            offset = dr * r + dc * c
+            if offset > collision_threshold:
+                collision = True
+            if offset > blind_threshold:
+                blind[i] = True
+        return collision, blind, False
+
+    def query(
+        self,
+        rows: np.ndarray,
+        row_fracs: np.ndarray,
+        cols: np.ndarray,
+        col_fracs: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """`check` for many positions at once.
+
+        :param rows: rows of the cells of the positions, of shape `(n,)`
+        :type rows: np.ndarray
+        :param row_fracs: fractions of the cells along the rows
+        :type row_fracs: np.ndarray
+        :param cols: columns of the cells of the positions
+        :type cols: np.ndarray
+        :param col_fracs: fractions of the cells along the columns
+        :type col_fracs: np.ndarray
+        :return: collisions of shape `(n,)`, blind flags of shape `(n, len(offsets))` and outbound of shape `(n,)`
+        :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
+        """
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        h, w = self.shape
+        outbound = (rows <= 0) | (cols <= 0) | (rows >= h - 1) | (cols >= w - 1)
+        rows, cols = np.clip(rows, 0, h - 1), np.clip(cols, 0, w - 1)
+        offsets = self._offsets(row_fracs, col_fracs)
+        collision = (offsets > self.collision_thresholds[:, rows, cols].T).any(-1) & ~outbound
+        blind = (offsets > self.blind_thresholds[:, rows, cols].T) & ~outbound[:, None]
+        return collision, blind, outbound
+
+    def clearance(
+        self,
+        rows: np.ndarray,
+        row_fracs: np.ndarray,
+        cols: np.ndarray,
+        col_fracs: np.ndarray,
+    ) -> np.ndarray:
+        """Signed distances in cells from the positions to the nearest wall face along the axes,
+        negative past the face. Takes the arguments of `query` for cells inside the maze."""
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        return (self.distances[:, rows, cols].T - self._offsets(row_fracs, col_fracs)).min(-1)
+
+    def _offsets(self, row_fracs: np.ndarray, col_fracs: np.ndarray) -> np.ndarray:
+        # Offsets from the cell centres towards each direction, in single precision as `check`.
+        rpos = np.stack([np.asarray(row_fracs) - 0.5, np.asarray(col_fracs) - 0.5], -1).astype(np.float32)
+        return rpos.astype(np.float64) @ self.directions.T
+
+
+class ContactFilter:
+    """Finds contacts between agent and obstacle geoms.
+
+    :param ngeom: number of geoms of the model
+    :type ngeom: int
+    :param obstacle_ids: ids of the geoms of the obstacles
+    :type obstacle_ids: Sequence[int]
+    :param agent_ids: ids of the geoms of the agent
+    :type agent_ids: Sequence[int]
+    """
+    def __init__(self, ngeom: int, obstacle_ids: Sequence[int], agent_ids: Sequence[int]) -> None:
+        self.obstacles = np.zeros(ngeom, dtype=bool)
+        self.obstacles[list(obstacle_ids)] = True
+        self.agent = np.zeros(ngeom, dtype=bool)
+        self.agent[list(agent_ids)] = True
+        # Contacts with the world body are not collisions
+        self.obstacles[0] = self.agent[0] = False
+        self._obstacles, self._agent = self.obstacles.tolist(), self.agent.tolist()
+
+    @staticmethod
+    def contact_geoms(data) -> Tuple[np.ndarray, np.ndarray]:
+        """Geom ids of the active contacts `data.contact[:data.ncon]`."""
+        ncon = data.ncon
+        contacts = data.contact
+        if hasattr(contacts, 'geom1'):
+            return np.asarray(contacts.geom1[:ncon]), np.asarray(contacts.geom2[:ncon])
+        geom1 = np.fromiter((contact.geom1 for contact in contacts[:ncon]), dtype=np.int64, count=ncon)
+        geom2 = np.fromiter((contact.geom2 for contact in contacts[:ncon]), dtype=np.int64, count=ncon)
+        return geom1, geom2
+
+    def collisions(self, geom1: np.ndarray, geom2: np.ndarray) -> np.ndarray:
+        """Whether each contact between `geom1` and `geom2` is between the agent and an obstacle."""
+        return (self.obstacles[geom1] & self.agent[geom2]) | (self.obstacles[geom2] & self.agent[geom1])
+
+    def in_collision(self, data) -> bool:
+        """Whether any active contact of `data` is between the agent and an obstacle."""
+        contacts = data.contact
+        if hasattr(contacts, 'geom1'):
+            return bool(self.collisions(*self.contact_geoms(data)).any())
+        # Contacts of `mujoco_py` are structs, indexing lists is faster than gathering their ids
+        obstacles, agent = self._obstacles, self._agent
+        for contact in contacts[:data.ncon]:
+            geom1, geom2 = contact.geom1, contact.geom2
+            if (obstacles[geom1] and agent[geom2]) or (obstacles[geom2] and agent[geom1]):
+                return True
+        return False
+
+
+class WallSegments:
+    """Wall segments intersected with the moves of many agents at once.
+
+    :param p1: first end points of the walls, of shape `(n, 2)`
+    :type p1: np.ndarray
+    :param p2: second end points of the walls, of shape `(n, 2)`
+    :type p2: np.ndarray
+    """
+    def __init__(self, p1: np.ndarray, p2: np.ndarray) -> None:
+        self.p1 = np.asarray(p1, dtype=np.float64).reshape(-1, 2)
+        self.p2 = np.asarray(p2, dtype=np.float64).reshape(-1, 2)
+        self.v = self.p2 - self.p1
+        self.norm2 = np.hypot(self.v[:, 0], self.v[:, 1]) ** 2
+
+    def __len__(self) -> int:
+        return len(self.p1)
+
+    def intersect(
+        self,
+        starts: np.ndarray,
+        ends: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Nearest intersections of the moves from `starts` to `ends` with the walls.
+
+        As `maze_env_utils.Line`, segments touching at an end point intersect
+        and the nearest intersection is the first wall on ties. Moves of
+        length zero and moves along a wall do not intersect.
+
+        :param starts: start points of the moves, of shape `(m, 2)`
+        :type starts: np.ndarray
+        :param ends: end points of the moves, of shape `(m, 2)`
+        :type ends: np.ndarray
+        :return: whether each move hits a wall, index of the wall, intersection point and reflection of
+            the end point on the wall, of shapes `(m,)`, `(m,)`, `(m, 2)` and `(m, 2)`
+        :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+        """
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+        m = len(starts)
+        move = ends - starts
+        moved = np.hypot(move[:, 0], move[:, 1]) > 1e-8
+        if len(self) == 0:
+            return np.zeros(m, dtype=bool), np.full(m, -1), np.full((m, 2), np.nan), np.full((m, 2), np.nan)
+        # Moves along the first axis, walls along the second
+        p1, p2, v = self.p1[None], self.p2[None], self.v[None]
+        s, e, mv = starts[:, None], ends[:, None], move[:, None]
+        # Sides of the wall the move ends are on and sides of the move the wall ends are on
+        wall_sides = _cross(v, s - p1) * _cross(v, e - p1)
+        move_sides = _cross(mv, p1 - s) * _cross(mv, p2 - s)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = _cross(v, p2 - s) / _cross(v, mv)
+        # Moves along a wall have no single intersection
+        hits = (wall_sides <= 0.0) & (move_sides <= 0.0) & moved[:, None] & np.isfinite(scale)
+        points = s + scale[..., None] * mv
+        distances = np.where(hits, np.hypot(*np.moveaxis(points - s, -1, 0)), np.inf)
+        index = distances.argmin(-1)
+        hit = hits[np.arange(m), index]
+        point = points[np.arange(m), index]
+        # Reflection of the end point on the line of the nearest wall
+        w1, wv, wn = self.p1[index], self.v[index], self.norm2[index]
+        projection = w1 + wv * (((ends - w1) * wv).sum(-1) / wn)[:, None]
+        reflection = ends + 2.0 * (projection - ends)
+        index = np.where(hit, index, -1)
+        point[~hit] = np.nan
+        reflection[~hit] = np.nan
+        return hit, index, point, reflection
+
+
+def _cross(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
@@ -19,7 +19,7 @@ from typing import Any, List, Optional, Tuple, Type
 import gym
 import numpy as np
 import networkx as nx
-from neurorobotics.simulations import maze_env_utils, maze_task
+from neurorobotics.simulations import collision, maze_env_utils, maze_task
 from neurorobotics.simulations.agent_model import AgentModel
 from neurorobotics.utils.env_utils import convert_observation_to_space, \
     calc_spline_course, TargetCourse, proportional_control, \
@@ -245,6 +245,7 @@ class MazeEnv(gym.Env):
                 self.obstacles_ids.append(self.model._geom_name2id[name])
             elif name != 'floor':
                 self.agent_ids.append(self.model._geom_name2id[name])
+        self._contact_filter = collision.ContactFilter(self.model.ngeom, self.obstacles_ids, self.agent_ids)
         self._set_action_space()
         self.last_wrapped_obs = self.wrapped_env._get_obs().copy()
         action = self.action_space.sample()
@@ -584,18 +585,7 @@ class MazeEnv(gym.Env):
         ]
 
     def _is_in_collision(self):
-        for contact in self.data.contact:
-            geom1 = contact.geom1
-            geom2 = contact.geom2
-            if geom1 != 0 and geom2 != 0:
-                if geom1 in self.obstacles_ids:
-                    if geom2 in self.agent_ids:
-                        return True
-                if geom2 in self.obstacles_ids:
-                    if geom1 in self.agent_ids:
-                        return True
-            else:
-                return False
+        return self._contact_filter.in_collision(self.data)
 
     def check_position(self, pos):
         (row, row_frac), (col, col_frac) = self._xy_to_rowcol_v2(pos[0], pos[1])
@@ -20,7 +20,7 @@ from typing import Any, List, Optional, Tuple, Type, Callable, Union, Dict
 import gym
 import numpy as np
 import networkx as nx
-from neurorobotics.simulations import maze_env_utils, maze_task
+from neurorobotics.simulations import collision, maze_env_utils, maze_task, rewards, task_bank
 from neurorobotics.simulations.agent_model import AgentModel
 from neurorobotics.utils.env_utils import calc_spline_course, TargetCourse, State, pure_pursuit_steer_control
 import random
@@ -29,8 +29,9 @@ from neurorobotics.constants import params, image_width, image_height
 import math
 import cv2
 import colorsys
-import open3d as o3d
 from neurorobotics.utils.point_cloud import rotMatList2NPRotMat
+from neurorobotics.utils.telemetry import TelemetryRecorder
+from neurorobotics.utils import optional
 
 # Directory that contains mujoco xml files.
 MODEL_DIR = os.path.join(os.getcwd(), 'neurorobotics/assets', 'xml')
@@ -167,6 +168,13 @@ class Environment(gym.Env):
     :type image_shape: Tuple[int, int] = (600, 480),
     :param mode:
     :type mode: Optional[int]= None,
+    :param track_lst: keys of the per step telemetry to record in `telemetry`, `None` disables recording
+    :type track_lst: Optional[List[str]] = None,
+    :param reward_components: components of the reward, `None` uses `rewards.SIMPLE_ROOM_COMPONENTS`
+    :type reward_components: Optional[List[rewards.RewardComponent]] = None,
+    :param task_bank: pre-generated tasks drawn on reset instead of calling `maze_task_generator`,
+        with the generator of each environment once seeded with `seed`
+    :type task_bank: Optional[task_bank.TaskBank] = None,
     """
     def __init__(
         self,
@@ -185,12 +193,18 @@ class Environment(gym.Env):
         camera_zoom: Optional[float] = None,
         image_shape: Tuple[int, int] = (600, 480),
         mode=None,
+        track_lst: Optional[List[str]] = None,
+        reward_components: Optional[List[rewards.RewardComponent]] = None,
+        task_bank: Optional[task_bank.TaskBank] = None,
         **kwargs,
     ) -> None:
         """INITIALIZE.
         """
         self.frame_skip = frame_skip
         self.mode = mode
+        self.telemetry = None
+        if track_lst is not None:
+            self.telemetry = TelemetryRecorder(track_lst)
         self.collision_count = 0
         self.n_steps = n_steps
         self.kwargs = kwargs
@@ -204,6 +218,11 @@ class Environment(gym.Env):
         self._maze_height = maze_height
         self._maze_size_scaling = maze_size_scaling
         self._inner_reward_scaling = inner_reward_scaling
+        self._reward_components = reward_components
+        self._task_bank = task_bank
+        self._task_entry = None
+        # Draws of the tasks of `task_bank`, the sequence of `TaskBank.replay` until seeded
+        self._task_rng: Optional[np.random.Generator] = None
         
         # Observe other objectives
         self._restitution_coef = restitution_coef
@@ -218,19 +237,39 @@ class Environment(gym.Env):
         # Let's create MuJoCo XML
         self.set_env()
  
+    def seed(self, seed: Optional[int] = None) -> List[int]:
+        """Seeds the environment and the sequence of tasks drawn from `task_bank`.
+
+        Vectorized environments seed each copy with its own seed, so copies
+        sharing a task bank, or pickled with it, draw different tasks.
+        """
+        self._task_rng = np.random.default_rng(seed)
+        return super().seed(seed)
+
     def _set_structure(self) -> None:
-        """Sample Maze Configuration from `maze_task_generator`.
+        """Sample Maze Configuration from `maze_task_generator`, or draw it with its plan from `task_bank`.
         """
-        self._task, self._maze_structure, self._open_position_indices, self._agent_pos = self._maze_task_generator(self._maze_size_scaling)
+        if self._task_bank is None:
+            self._task_entry = None
+            self._set_task(self._maze_task_generator(self._maze_size_scaling))
+        else:
+            self._task_entry = self._task_bank.draw(self._task_rng)
+            self._set_task(self._task_entry.sample)
+
+    def _set_task(self, sample: Tuple[Any, ...]) -> None:
+        """Sets the maze configuration `sample` returned by `maze_task_generator`.
+        """
+        self._task, self._maze_structure, self._open_position_indices, self._agent_pos = sample
         # print("Agent Position: ", self._agent_pos)
+        self._maze = maze_env_utils.compile_maze(self._maze_structure)
         torso_x, torso_y = self._find_robot()
         self._init_torso_x = torso_x
         self._init_torso_y = torso_y
         # center_x = (len(self._maze_structure) // 2) * self._maze_size_scaling
         # center_y = (len(self._maze_structure) // 2) * self._maze_size_scaling
-        self.elevated = any(maze_env_utils.MazeCell.CHASM in row for row in self._maze_structure)
+        self.elevated = bool(self._maze.chasms.any())
         # Are there any movable blocks?
-        self.blocks = any(any(r.can_move() for r in row) for row in self._maze_structure)
+        self.blocks = bool(self._maze.movable.any())
 
     def _xy_to_rowcol(self, x, y):
         """
@@ -437,8 +476,6 @@ class Environment(gym.Env):
             np.expand_dims(np.arange(image_width), 0),
             image_height, 0
         ).reshape(-1)
-        self.pcd = o3d.geometry.PointCloud()
-        self.vec = o3d.utility.Vector3dVector()
         self.cam_pos = self.model.body_pos[self.cam_body_id] + np.array([0, 0, 0.5])
         mat = rotMatList2NPRotMat(self.sim.model.cam_mat0[index])
         rot_mat = np.asarray([[1, 0, 0], [0, -1, 0], [0, 0, -1]])
@@ -453,8 +490,19 @@ class Environment(gym.Env):
 
     def __consolidate_and_startup(self) -> None:
         self.target_speed = 2.25
+        self.reward_function = rewards.RewardFunction(
+            self._reward_components,
+            inner_reward_scaling=self._inner_reward_scaling,
+            target_speed=self.target_speed
+        )
+        self.reward_keys = self.reward_function.names
+        self._reward_state = self.reward_function.state()
         # print("Position before update: ", self.wrapped_env.data.qpos)
-        self._init_pos, self._init_ori = self._set_init(self._agent_pos)
+        if self._task_entry is None:
+            self._init_pos, self._init_ori = self._set_init(self._agent_pos)
+        else:
+            self._init_pos, self._init_ori = self._task_entry.init_pos, self._task_entry.init_ori
+            self._start_pos, self._start_ori = self._task_entry.start_pos, self._task_entry.start_ori
         self.wrapped_env.set_xy(self._init_pos)
         self.wrapped_env.set_ori(self._init_ori)
         # print("Position after update: ", self.wrapped_env.data.qpos)
@@ -469,6 +517,7 @@ class Environment(gym.Env):
                 self.obstacles_ids.append(self.model._geom_name2id[name])
             elif name != 'floor':
                 self.agent_ids.append(self.model._geom_name2id[name])
+        self._contact_filter = collision.ContactFilter(self.model.ngeom, self.obstacles_ids, self.agent_ids)
         self._set_action_space()
         self.last_wrapped_obs = self.wrapped_env._get_obs().copy()
         action = self.action_space.sample()
@@ -546,7 +595,7 @@ class Environment(gym.Env):
         for neighbor in neighbors:
             r, c = neighbor
             if self._check_structure_index_validity(r, c):
-                if not self._maze_structure[r][c].is_block():
+                if not self._maze.blocks[r, c]:
                     eligible.append([r, c])
         return eligible
 
@@ -606,7 +655,7 @@ class Environment(gym.Env):
         for neighbor in neighbors:
             r, c = neighbor
             if self._check_structure_index_validity(r, c):
-                if self._maze_structure[r][c].is_block():
+                if self._maze.blocks[r, c]:
                     x, y = self._rowcol_to_xy(row, col)
                     _x, _y = self._rowcol_to_xy(r, c)
                     angle = np.arctan2(_y - y, _x - x)
@@ -640,11 +689,8 @@ class Environment(gym.Env):
         goal = self._task.objects[self._task.goal_index].pos[:2] - self.wrapped_env.get_xy()
         self.goals = [goal.copy() for _ in range(self.n_steps)]
         self.positions = [np.zeros_like(self.data.qpos) for _ in range(self.n_steps)]
-        self._create_maze_graph()
-        self.sampled_path = self._sample_path()
+        self._plan_path(self.wrapped_env.get_xy())
         self._current_cell = copy.deepcopy(self.sampled_path[0])
-        self._find_all_waypoints()
-        self._find_cubic_spline_path()
         self.state = State(
             x=self.wrapped_env.sim.data.qpos[0],
             y=self.wrapped_env.sim.data.qpos[1],
@@ -669,6 +715,24 @@ class Environment(gym.Env):
         ob = self._get_obs()
         self._set_observation_space(ob)
 
+    def _plan_path(self, robot_xy: np.ndarray) -> None:
+        """Plans the shortest path from `robot_xy` to the goal and its spline course, or restores
+        the plan of the task drawn from `task_bank`.
+
+        :param robot_xy: Position of the agent.
+        :type robot_xy: np.ndarray
+        """
+        self._create_maze_graph()
+        if self._task_entry is None:
+            self.sampled_path = self._sample_path(robot_xy)
+            self._find_all_waypoints()
+            self._find_cubic_spline_path()
+        else:
+            self.sampled_path = list(self._task_entry.path)
+            self.wx, self.wy = list(self._task_entry.wx), list(self._task_entry.wy)
+            self.final = [self.wx[-1], self.wy[-1]]
+            self.cx, self.cy, self.cyaw, self.ck, self.s = [list(values) for values in self._task_entry.course]
+
     def _find_all_waypoints(self):
         self.wx = []
         self.wy = []
@@ -681,9 +745,9 @@ class Environment(gym.Env):
                 d_r = n_row - row
                 d_c = n_col - col
                 if abs(d_r) > 0 and abs(d_c) > 0:
-                    if self._maze_structure[row + d_r][col].is_block():
+                    if self._maze.blocks[row + d_r, col]:
                         cells.append([row, col + d_c])
-                    elif self._maze_structure[row][col + d_c].is_block():
+                    elif self._maze.blocks[row, col + d_c]:
                         cells.append([row + d_r, col])
 
         for row, col in cells:
@@ -708,14 +772,18 @@ class Environment(gym.Env):
         self.target_course = TargetCourse(self.cx, self.cy)
         self.target_ind, _ = self.target_course.search_target_index(self.state)
 
-    def _sample_path(self):
+    def _sample_path(self, robot_xy: Optional[np.ndarray] = None):
         """Computes the shortest path from the agent position to the target position using graph
         theoretic approach.
 
+        :param robot_xy: Position of the agent, the position in the simulation by default.
+        :type robot_xy: Optional[np.ndarray]
         :return: Shortest Path from the agent to the target.
         :rtype: List[int]
         """
-        robot_x, robot_y = self.wrapped_env.get_xy()
+        if robot_xy is None:
+            robot_xy = self.wrapped_env.get_xy()
+        robot_x, robot_y = robot_xy
         row, col = self._xy_to_rowcol(robot_x, robot_y)
         source = self._structure_to_graph_index(row, col)
         goal_pos = self._task.objects[self._task.goal_index].pos[:2]
@@ -777,95 +845,29 @@ class Environment(gym.Env):
         return self.sampled_action
 
     def _graph_to_structure_index(self, index):
-        row = int(index / len(self._maze_structure))
-        col = index % len(self._maze_structure[0])
+        row = int(index / self._maze.shape[0])
+        col = index % self._maze.shape[1]
         return row, col
 
     def _structure_to_graph_index(self, row, col):
-        return row * len(self._maze_structure[0]) + col
+        return row * self._maze.shape[1] + col
 
     def _check_structure_index_validity(self, i, j):
-        valid = [True, True]
-        if i < 0:
-            valid[0] = False
-        elif i >= len(self._maze_structure):
-            valid[0] = False
-        if j < 0:
-            valid[1] = False
-        elif j >= len(self._maze_structure[0]):
-            valid[1] = False
-        return valid[0] and valid[1]
-
-    def _add_edges_to_maze_graph(self, node):
-        neighbors = [
-            (node['row'] - 1, node['col']),
-            (node['row'], node['col'] - 1),
-            (node['row'] + 1, node['col']),
-            (node['row'], node['col'] + 1),
-            (node['row'] + 1, node['col'] + 1),
-            (node['row'] + 1, node['col'] - 1),
-            (node['row'] - 1, node['col'] + 1),
-            (node['row'] - 1, node['col'] - 1)
-        ]
-        for neighbor in neighbors:
-            if self._check_structure_index_validity(
-                neighbor[0],
-                neighbor[1]
-            ):
-                if not self._maze_graph.nodes[
-                    self._structure_to_graph_index(
-                        neighbor[0],
-                        neighbor[1]
-                    )
-                ]['struct'].is_wall_or_chasm():
-                    self._maze_graph.add_edge(
-                        node['index'],
-                        self._maze_graph.nodes[self._structure_to_graph_index(
-                            neighbor[0],
-                            neighbor[1]
-                        )]['index']
-                    )
+        return self._maze.contains(i, j)
 
     def _create_maze_graph(self):
-        num_row = len(self._maze_structure)
-        num_col = len(self._maze_structure[0])
-        num_vertices = num_row * num_col
-        self._maze_graph = nx.DiGraph()
-        self._maze_graph.add_nodes_from(np.arange(
-            0, num_vertices
-        ))
-        for i in range(num_row):
-            for j in range(num_col):
-                self._maze_graph.nodes[
-                    self._structure_to_graph_index(i, j)
-                ]['struct'] = self._maze_structure[i][j]
-                self._maze_graph.nodes[
-                    self._structure_to_graph_index(i, j)
-                ]['row'] = i
-                self._maze_graph.nodes[
-                    self._structure_to_graph_index(i, j)
-                ]['col'] = j
-                self._maze_graph.nodes[
-                    self._structure_to_graph_index(i, j)
-                ]['index'] = self._structure_to_graph_index(i, j)
-
-        for i in range(num_row):
-            for j in range(num_col):
-                self._add_edges_to_maze_graph(self._maze_graph.nodes[
-                    self._structure_to_graph_index(i, j)
-                ])
+        # Shared by all environments with the same maze, only read by `_sample_path`
+        self._maze_graph = self._maze.graph()
 
     def get_ori(self) -> float:
         return self.wrapped_env.get_ori()
 
     def _xy_limits(self) -> Tuple[float, float, float, float]:
         xmin, ymin, xmax, ymax = 100, 100, -100, -100
-        structure = self._maze_structure
-        for i, j in it.product(range(len(structure)), range(len(structure[0]))):
-            if structure[i][j].is_block():
-                continue
-            xmin, xmax = min(xmin, j), max(xmax, j)
-            ymin, ymax = min(ymin, i), max(ymax, i)
+        rows, cols = np.nonzero(~self._maze.blocks)
+        if len(rows) > 0:
+            xmin, xmax = min(xmin, cols.min()), max(xmax, cols.max())
+            ymin, ymax = min(ymin, rows.min()), max(ymax, rows.max())
 
         x0 = (len(self._maze_structure) // 2) * self._maze_size_scaling
         y0 = (len(self._maze_structure) // 2) * self._maze_size_scaling
@@ -1514,21 +1516,11 @@ class Environment(gym.Env):
             viewer.move_camera(const.MOUSE_ZOOM, 0, self._camera_zoom)
  
     def _find_robot(self) -> Tuple[float, float]:
-        structure = self._maze_structure
-        size_scaling = self._maze_size_scaling
-        for i, j in it.product(range(len(structure)), range(len(structure[0]))):
-            if structure[i][j].is_robot():
-                return j * size_scaling, i * size_scaling
-        raise ValueError("No robot in maze specification.")
+        return self._maze.find_robot(self._maze_size_scaling)
 
     def _find_all_robots(self) -> List[Tuple[float, float]]:
-        structure = self._maze_structure
         size_scaling = self._maze_size_scaling
-        coords = []
-        for i, j in it.product(range(len(structure)), range(len(structure[0]))):
-            if structure[i][j].is_robot():
-                coords.append((j * size_scaling, i * size_scaling))
-        return coords
+        return [(j * size_scaling, i * size_scaling) for i, j in self._maze.robot_cells]
 
     def _objball_positions(self):
         return [
@@ -1536,59 +1528,16 @@ class Environment(gym.Env):
         ]
 
     def _is_in_collision(self):
-        for contact in self.data.contact:
-            geom1 = contact.geom1
-            geom2 = contact.geom2
-            if geom1 != 0 and geom2 != 0:
-                if geom1 in self.obstacles_ids:
-                    if geom2 in self.agent_ids:
-                        return True
-                if geom2 in self.obstacles_ids:
-                    if geom1 in self.agent_ids:
-                        return True
-            else:
-                return False
+        return self._contact_filter.in_collision(self.data)
 
     def check_position(self, pos):
         (row, row_frac), (col, col_frac) = self._xy_to_rowcol_v2(pos[0], pos[1])
-        blind = [False, False, False, False]
-        collision = False
-        outbound = False
-        neighbors = [
-            (row, col + 1),
-            (row, col - 1),
-            (row + 1, col),
-            (row - 1, col),
-        ]
-        row_frac -= 0.5
-        col_frac -= 0.5
-        rpos = np.array([row_frac, col_frac], dtype=np.float32)
-        if row > 0 and col > 0 and row < len(self._maze_structure) - 1 and col < len(self._maze_structure[0]) - 1:
-            for i, (nrow, ncol) in enumerate(neighbors):
-                if not self._maze_structure[nrow][ncol].is_empty():
-                    rdir = (nrow - row)
-                    cdir = (ncol - col)
-                    direction = np.array([rdir, cdir], dtype=np.float32)
-                    distance = np.dot(rpos, direction)
-                    if distance > 0.325:
-                        collision = True
-                    if distance > 0.35:
-                        blind[i] = True
-        else:
-            outbound = True
-        return collision, blind, outbound
-
-    def conditional_blind(self, obs, yaw, b):
-        penalty = 0.0
-        for direction in b:
-            if direction:
-                penalty += -0.005 * self._inner_reward_scaling
-        if self._is_in_collision():
-            penalty += -0.99 * self._inner_reward_scaling
-            self.collision_count += 1
-            if 'frame_t' in obs.keys():
-                obs['frame_t'] = np.zeros_like(obs['frame_t'])
-        return obs, penalty
+        return self._maze.distance_field().check(row, row_frac, col, col_frac)
+
+    def _blank_frame(self, obs):
+        if 'frame_t' in obs.keys():
+            obs['frame_t'] = np.zeros_like(obs['frame_t'])
+        return obs
 
     def _get_current_cell(self):
         robot_x, robot_y = self.wrapped_env.get_xy()
@@ -1613,7 +1562,8 @@ class Environment(gym.Env):
         elif mode == "human" and self._websock_port is not None:
             if self._mj_offscreen_viewer is None:
                 from mujoco_py import MjRenderContextOffscreen as MjRCO
-                from mujoco_maze.websock_viewer import start_server
+                optional.require('websocket_viewer')
+                from neurorobotics.simulations.websock_viewer import start_server
 
                 self._mj_offscreen_viewer = MjRCO(self.wrapped_env.sim)
                 self._maybe_move_camera(self._mj_offscreen_viewer)
@@ -1628,18 +1578,7 @@ class Environment(gym.Env):
     def get_top_view(self):
         block_size = self.top_view_size
 
-        img = np.zeros(
-            (int(block_size * len(self._maze_structure)), int(block_size * len(self._maze_structure[0])), 3),
-            dtype=np.uint8
-        )
-
-        for i in range(len(self._maze_structure)):
-            for j in range(len(self._maze_structure[0])):
-                if self._maze_structure[i][j].is_wall_or_chasm():
-                    img[
-                        int(block_size * i): int(block_size * (i + 1)),
-                        int(block_size * j): int(block_size * (j + 1))
-                    ] = 128
+        img = self._maze.top_view(block_size).copy()
 
         def xy_to_imgrowcol(x, y):
             (row, row_frac), (col, col_frac) = self._xy_to_rowcol_v2(x, y)
@@ -1996,6 +1935,8 @@ class SimpleRoomEnv(Environment):
         self.goals = [goal.copy() for i in range(self.n_steps)]
         self.positions = [np.zeros_like(self.data.qpos) for _ in range(self.n_steps)]
         obs = self._get_obs()
+        if self.telemetry is not None:
+            self.telemetry.reset()
         return obs
 
     def step(self, action: np.ndarray) -> Tuple[np.ndarray, float, bool, dict]:
@@ -2010,7 +1951,9 @@ class SimpleRoomEnv(Environment):
         info = {}
         self.actions.pop(0)
         self.actions.append(action.copy()[1:])
-        _, inner_reward, _, info = self.wrapped_env.step(action)
+        _, wrapped_reward, _, info = self.wrapped_env.step(action)
+        state = self._reward_state
+        state[rewards.STATE['wrapped_reward']] = wrapped_reward
 
         # Observation and Parameter Gathering
         x, y = self.wrapped_env.get_xy()
@@ -2018,71 +1961,64 @@ class SimpleRoomEnv(Environment):
         v = np.linalg.norm(self.data.qvel[:2])
         self.state.set(x, y, v, yaw)
         next_pos = self.wrapped_env.get_xy()
-        collision_penalty = 0.0
         next_obs = self._get_obs()
         last_coverage = self.get_coverage(self.maps[0])
         coverage = self.get_coverage(self.maps[-1])
-        coverage_reward = (coverage - last_coverage) * 0.05
+        state[rewards.STATE['coverage_gain']] = coverage - last_coverage
 
-        # Computing the reward in "https://ieeexplore.ieee.org/document/8398461"
+        # State of the reward in "https://ieeexplore.ieee.org/document/8398461"
         goal = self._task.objects[self._task.goal_index].pos[:2] - self.wrapped_env.get_xy()
         self.goals.pop(0)
         self.goals.append(goal)
         self.positions.pop(0)
         self.positions.append(self.data.qpos.copy())
-        theta_t = self.check_angle(np.arctan2(goal[1], goal[0]) - self.get_ori())
-        qvel = self.wrapped_env.data.qvel.copy()
-        vyaw = qvel[self.wrapped_env.ORI_IND]
-        vmax = self.target_speed
-        if 'inframe' in next_obs.keys():
-            if bool(next_obs['inframe'][0]):
-                inner_reward = (v / vmax) * np.cos(theta_t) * (1 - (np.abs(vyaw) / params['max_vyaw'])) * 0.005
-                inner_reward = self._inner_reward_scaling * inner_reward
-
-        # Task Reward Computation
-        outer_reward = 0
-        outer_reward = self._task.reward(next_obs) * 0.005
+        state[rewards.STATE['heading_error']] = self.check_angle(np.arctan2(goal[1], goal[0]) - self.get_ori())
+        state[rewards.STATE['speed']] = v
+        state[rewards.STATE['yaw_rate']] = self.wrapped_env.data.qvel[self.wrapped_env.ORI_IND]
+        state[rewards.STATE['inframe']] = 'inframe' in next_obs.keys() and bool(next_obs['inframe'][0])
+
+        # Task State
+        state[rewards.STATE['task_reward']] = self._task.reward(next_obs)
         done = self._task.termination(next_obs)
+        state[rewards.STATE['success']] = done
         info["position"] = self.wrapped_env.get_xy()
+        info['is_success'] = done
 
-        # Collision Penalty Computation
+        # Collision State
         index = self._get_current_cell()
         self._current_cell = index
         almost_collision, blind, outbound = self.check_position(next_pos)
-        if almost_collision:
-            collision_penalty += -0.005 * self._inner_reward_scaling
-        next_obs, penalty = self.conditional_blind(next_obs, yaw, blind)
-        collision_penalty += penalty
-
-        # Reward and Info Declaration
-        if done:
-            outer_reward += 1.0
-            info['is_success'] = True
-        else:
-            info['is_success'] = False
+        contact = self._is_in_collision()
+        state[rewards.STATE['almost_collision']] = almost_collision
+        state[rewards.STATE['blind']] = sum(blind)
+        state[rewards.STATE['contact']] = contact
+        state[rewards.STATE['outbound']] = outbound
+        if contact:
+            self.collision_count += 1
+            next_obs = self._blank_frame(next_obs)
         if outbound:
-            collision_penalty += -0.05 * self._inner_reward_scaling
-            #next_obs['window'] = np.zeros_like(next_obs['window'])
-            if 'frame_t' in next_obs.keys():
-                next_obs['frame_t'] = np.zeros_like(next_obs['frame_t'])
+            next_obs = self._blank_frame(next_obs)
             done = True
         if self.t > self.max_episode_size:
             done = True
-        
-        if collision_penalty < -0.05:
-            done = True
 
-        reward = inner_reward + outer_reward + collision_penalty + coverage_reward
+        # Reward and Info Declaration
+        components = self.reward_function.compute(state)
+        collision_index = self.reward_function.index.get('collision_penalty')
+        if collision_index is not None and components[collision_index] < -0.05:
+            done = True
+        reward = float(self.reward_function.total(components))
         self.reward = reward
-        info['reward_keys'] = [
-                'inner_reward',
-                'outer_reward',
-                'collision_penalty',
-                'coverage_reward']
-        info['inner_reward'] = inner_reward
-        info['outer_reward'] = outer_reward
-        info['collision_penalty'] = collision_penalty
-        info['coverage_reward'] = coverage_reward
+        info['reward_keys'] = self.reward_keys
+        info['reward_components'] = components
+        if self.telemetry is not None:
+            self.telemetry.record_step(
+                qpos=self.data.qpos,
+                qvel=self.data.qvel,
+                action=action,
+                reward=reward,
+                reward_components=components
+            )
         return next_obs, reward, done, info
 
 
@@ -2201,7 +2137,7 @@ class LocalPlannerEnv(SimpleRoomEnv):
         for neighbor in neighbors:
             r, c = neighbor
             if self._check_structure_index_validity(r, c):
-                if self._maze_structure[r][c].is_block():
+                if self._maze.blocks[r, c]:
                     x, y = self._rowcol_to_xy(row, col)
                     _x, _y = self._rowcol_to_xy(r, c)
                     angle = np.arctan2(_y - y, _x - x)
@@ -2223,19 +2159,11 @@ class LocalPlannerEnv(SimpleRoomEnv):
         self._start_ori = ori
         return pos, ori
     
-    def _set_structure(self) -> None:
-        """Sample Maze Configuration from `maze_task_generator`.
+    def _set_task(self, sample: Tuple[Any, ...]) -> None:
+        """Sets the maze configuration `sample` returned by `maze_task_generator`, with the agent orientation.
         """
-        self._task, self._maze_structure, self._open_position_indices, self._agent_pos, self._agent_ori = self._maze_task_generator(self._maze_size_scaling)
-        # print("Agent Position: ", self._agent_pos)
-        torso_x, torso_y = self._find_robot()
-        self._init_torso_x = torso_x
-        self._init_torso_y = torso_y
-        # center_x = (len(self._maze_structure) // 2) * self._maze_size_scaling
-        # center_y = (len(self._maze_structure) // 2) * self._maze_size_scaling
-        self.elevated = any(maze_env_utils.MazeCell.CHASM in row for row in self._maze_structure)
-        # Are there any movable blocks?
-        self.blocks = any(any(r.can_move() for r in row) for row in self._maze_structure)
+        super()._set_task(sample[:4])
+        self._agent_ori = sample[4]
 
     def _set_action_space(self):
         """Sets the action space for this maze environment.
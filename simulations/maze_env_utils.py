@@ -12,6 +12,8 @@ from typing import Any, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 
+from neurorobotics.simulations.collision import WallDistanceField, WallSegments
+
 Self = Any
 Point = complex
 
@@ -81,6 +83,153 @@ class MazeCell(Enum):
         return self in [self.XY_HALF_BLOCK]
 
 
+def _isin(grid: np.ndarray, cells: List[MazeCell]) -> np.ndarray:
+    return np.isin(grid, [cell.value for cell in cells])
+
+
+class CompiledMaze:
+    """Immutable NumPy representation of a maze structure.
+
+    The cells are stored as `MazeCell` values in an integer grid, with one
+    boolean layer per `MazeCell` predicate evaluated once for all cells, so
+    that lookups in the environments index arrays instead of calling enum
+    methods. Neighbour masks hold for each cell whether the neighbour at each
+    offset is inside the maze and in a layer. Instances compare and hash by
+    their cells, use `compile_maze` to share one instance per structure. The
+    list of lists of `MazeCell` is derived with `structure`.
+
+    :param structure: List of lists describing the structure of the maze.
+    :type structure: List[List[MazeCell]]
+    """
+    # Offsets `(row, col)` of the neighbours checked by `Environment.check_position`
+    OFFSETS_4: List[Tuple[int, int]] = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+    # Offsets of the neighbours connected in the maze graph, in the order edges are added
+    OFFSETS_8: List[Tuple[int, int]] = [(-1, 0), (0, -1), (1, 0), (0, 1), (1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+    def __init__(self, structure: List[List[MazeCell]]) -> None:
+        grid = np.array([[cell.value for cell in row] for row in structure], dtype=np.int8)
+        assert grid.ndim == 2, 'All rows of the maze structure must have the same length'
+        self.grid = grid
+        self.shape = grid.shape
+        self.blocks = grid == MazeCell.BLOCK.value
+        self.chasms = grid == MazeCell.CHASM.value
+        self.walls = self.blocks | self.chasms
+        self.empty = _isin(grid, [MazeCell.ROBOT, MazeCell.EMPTY])
+        self.robot = grid == MazeCell.ROBOT.value
+        self.object_balls = grid == MazeCell.OBJECT_BALL.value
+        self.movable = _isin(grid, [
+            MazeCell.XY_BLOCK, MazeCell.XY_HALF_BLOCK, MazeCell.XZ_BLOCK,
+            MazeCell.YZ_BLOCK, MazeCell.XYZ_BLOCK, MazeCell.SPIN
+        ])
+        # Neighbours that are not empty, as checked for collisions, and neighbours that can be moved to
+        self.occupied_neighbours = self.neighbours(~self.empty, self.OFFSETS_4)
+        self.open_neighbours = self.neighbours(~self.walls, self.OFFSETS_8)
+        self.robot_cells = [(int(i), int(j)) for i, j in np.argwhere(self.robot)]
+        self.open_cells = [(int(i), int(j)) for i, j in np.argwhere(~self.walls)]
+        for array in [self.grid, self.blocks, self.chasms, self.walls, self.empty, self.robot,
+                      self.object_balls, self.movable, self.occupied_neighbours, self.open_neighbours]:
+            array.setflags(write=False)
+        self._key = (self.shape, grid.tobytes())
+        self._top_views = {}
+        self._graph = None
+        self._distance_field = None
+
+    def neighbours(self, layer: np.ndarray, offsets: List[Tuple[int, int]]) -> np.ndarray:
+        """Whether the neighbour of each cell at each offset is inside the maze and in `layer`.
+
+        :param layer: boolean layer of the shape of the maze
+        :type layer: np.ndarray
+        :param offsets: `(row, col)` offsets of the neighbours
+        :type offsets: List[Tuple[int, int]]
+        :return: masks of shape `(len(offsets), rows, cols)`
+        :rtype: np.ndarray
+        """
+        h, w = self.shape
+        padded = np.zeros((h + 2, w + 2), dtype=bool)
+        padded[1:-1, 1:-1] = layer
+        return np.stack([padded[1 + dr:1 + dr + h, 1 + dc:1 + dc + w] for dr, dc in offsets])
+
+    def __hash__(self) -> int:
+        return hash(self._key)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, CompiledMaze) and self._key == other._key
+
+    def __getitem__(self, index: Tuple[int, int]) -> MazeCell:
+        return MazeCell(int(self.grid[index]))
+
+    @property
+    def structure(self) -> List[List[MazeCell]]:
+        """List of lists of `MazeCell`, a new copy on every access."""
+        return [[MazeCell(value) for value in row] for row in self.grid.tolist()]
+
+    def contains(self, row: int, col: int) -> bool:
+        return 0 <= row < self.shape[0] and 0 <= col < self.shape[1]
+
+    def find_robot(self, size_scaling: float) -> Tuple[float, float]:
+        """Position of the first robot cell, as `maze_task.find_robot`."""
+        if len(self.robot_cells) == 0:
+            raise ValueError("No robot in maze specification.")
+        i, j = self.robot_cells[0]
+        return j * size_scaling, i * size_scaling
+
+    def open_edges(self) -> List[Tuple[int, int]]:
+        """Edges from all cells to their 8 neighbours that are not walls, with cells indexed by
+        `row * cols + col`, sorted by cell and then in the order of `OFFSETS_8`."""
+        cols = self.shape[1]
+        sources, k = np.nonzero(self.open_neighbours.reshape(len(self.OFFSETS_8), -1).T)
+        steps = np.array([dr * cols + dc for dr, dc in self.OFFSETS_8])
+        return list(zip(sources.tolist(), (sources + steps[k]).tolist()))
+
+    def graph(self) -> 'nx.DiGraph':
+        """Graph of `Environment._create_maze_graph`, built once and shared, it must not be modified.
+
+        Nodes are the cells indexed by `row * cols + col`, with attributes `struct`, `row`, `col` and `index`.
+        """
+        if self._graph is None:
+            import networkx as nx
+            rows, cols = self.shape
+            graph = nx.DiGraph()
+            graph.add_nodes_from(
+                (i * cols + j, {'struct': self[i, j], 'row': i, 'col': j, 'index': i * cols + j})
+                for i, j in it.product(range(rows), range(cols))
+            )
+            graph.add_edges_from(self.open_edges())
+            self._graph = graph
+        return self._graph
+
+    def distance_field(self) -> WallDistanceField:
+        """Distances to the cells that are not empty in the directions of `OFFSETS_4`, built once."""
+        if self._distance_field is None:
+            self._distance_field = WallDistanceField(~self.empty, self.OFFSETS_4)
+        return self._distance_field
+
+    def top_view(self, block_size: float) -> np.ndarray:
+        """Image with walls and chasms in grey, as drawn by `Environment.get_top_view`, cached per block size."""
+        if block_size not in self._top_views:
+            h, w = self.shape
+            # Cell of each pixel, with the block boundaries rounded as `int(block_size * i)`
+            rows = np.searchsorted([int(block_size * (i + 1)) for i in range(h)], np.arange(int(block_size * h)), 'right')
+            cols = np.searchsorted([int(block_size * (j + 1)) for j in range(w)], np.arange(int(block_size * w)), 'right')
+            img = np.where(self.walls[rows][:, cols, None], np.uint8(128), np.uint8(0)).repeat(3, -1)
+            img.setflags(write=False)
+            self._top_views[block_size] = img
+        return self._top_views[block_size]
+
+
+_COMPILED = {}
+
+
+def compile_maze(structure: Union[List[List[MazeCell]], CompiledMaze]) -> CompiledMaze:
+    """Compiles `structure` once, mazes with the same cells share one `CompiledMaze`."""
+    if isinstance(structure, CompiledMaze):
+        return structure
+    key = tuple(tuple(cell.value for cell in row) for row in structure)
+    if key not in _COMPILED:
+        _COMPILED[key] = CompiledMaze(structure)
+    return _COMPILED[key]
+
+
 class Line:
     def __init__(
         self,
@@ -150,31 +299,25 @@ class CollisionDetector:
 
     def __init__(
         self,
-        structure: list,
+        structure: Union[list, CompiledMaze],
         size_scaling: float,
         torso_x: float,
         torso_y: float,
         radius: float,
     ) -> None:
-        h, w = len(structure), len(structure[0])
+        maze = compile_maze(structure)
+        # Whether the neighbours at `NEIGHBORS`, given as `(dx, dy)`, are empty
+        empty = maze.neighbours(maze.empty, [(dy, dx) for dx, dy in self.NEIGHBORS])
         self.lines = []
 
-        def is_empty(i, j) -> bool:
-            if 0 <= i < h and 0 <= j < w:
-                return structure[i][j].is_empty()
-            else:
-                return False
-
-        for i, j in it.product(range(len(structure)), range(len(structure[0]))):
-            if not structure[i][j].is_block():
-                continue
+        for i, j in np.argwhere(maze.blocks).tolist():
             y_base = i * size_scaling - torso_y
             x_base = j * size_scaling - torso_x
             offset = size_scaling * 0.5 + radius
             min_y, max_y = y_base - offset, y_base + offset
             min_x, max_x = x_base - offset, x_base + offset
-            for dx, dy in self.NEIGHBORS:
-                if not is_empty(i + dy, j + dx):
+            for k, (dx, dy) in enumerate(self.NEIGHBORS):
+                if not empty[k, i, j]:
                     continue
                 self.lines.append(
                     Line(
@@ -182,6 +325,17 @@ class CollisionDetector:
                         (min_x if dx == -1 else max_x, min_y if dy == -1 else max_y),
                     )
                 )
+        self._walls = None
+
+    @property
+    def walls(self) -> WallSegments:
+        """`lines` as `WallSegments`, built on first use."""
+        if self._walls is None:
+            self._walls = WallSegments(
+                [(line.p1.real, line.p1.imag) for line in self.lines],
+                [(line.p2.real, line.p2.imag) for line in self.lines]
+            )
+        return self._walls
 
     def detect(self, old_pos: np.ndarray, new_pos: np.ndarray) -> Optional[Collision]:
         move = Line(old_pos, new_pos)
@@ -204,3 +358,22 @@ class CollisionDetector:
             if new_dist < dist:
                 col, dist = collision, new_dist
         return col
+
+    def detect_many(
+        self,
+        old_positions: np.ndarray,
+        new_positions: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """`detect` for the moves of many agents at once, intersecting all moves with all walls
+        in `walls`. Moves along a wall do not collide.
+
+        :param old_positions: positions before the moves, of shape `(n, 2)`
+        :type old_positions: np.ndarray
+        :param new_positions: positions after the moves, of shape `(n, 2)`
+        :type new_positions: np.ndarray
+        :return: whether each move collides, the collision points and `Collision.rest` of each move,
+            points and rests are `nan` for moves without collision
+        :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
+        """
+        hit, _, point, reflection = self.walls.intersect(old_positions, new_positions)
+        return hit, point, reflection - point
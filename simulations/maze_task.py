@@ -5,7 +5,7 @@ from abc import ABC, abstractmethod
 from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Type, Union
 import numpy as np
 from neurorobotics.utils.cv_utils import blob_detect
-from neurorobotics.simulations.maze_env_utils import MazeCell
+from neurorobotics.simulations.maze_env_utils import MazeCell, compile_maze
 import copy
 from neurorobotics.constants import params
 import colorsys
@@ -40,10 +40,7 @@ def get_hsv_ranges(rgb):
 
 
 def find_robot(structure, size_scaling):
-    for i, j in it.product(range(len(structure)), range(len(structure[0]))):
-        if structure[i][j].is_robot():
-            return j * size_scaling, i * size_scaling
-    raise ValueError("No robot in maze specification.")
+    return compile_maze(structure).find_robot(size_scaling)
 
 
 def check_target_object_distance(agent, target):
@@ -263,18 +260,13 @@ MAPS = {
 def create_simple_room_maze(
         maze_size_scaling: float = 4.0,
 ):
-    structure = MAPS['simple_room']
+    compiled = compile_maze(MAPS['simple_room'])
+    structure = compiled.structure
     num_objects = 2
-    torso_init = find_robot(structure, maze_size_scaling)
+    torso_init = compiled.find_robot(maze_size_scaling)
     objects = []
-    _open_position_indices = []
-    agent_pos = None
-    for i in range(len(structure)):
-        for j in range(len(structure[i])):
-            if not structure[i][j].is_wall_or_chasm():
-                _open_position_indices.append([i, j])
-            if structure[i][j].is_robot():
-                agent_pos = [i, j]
+    _open_position_indices = [list(cell) for cell in compiled.open_cells]
+    agent_pos = list(compiled.robot_cells[-1])
     # print(_open_position_indices)
 
     _eligible_position_indices = []
@@ -377,23 +369,70 @@ class SimpleRoom(Maze):
             reward_threshold: float
     ) -> None:
         super().__init__(structure, objects, goal_index, scale, reward_threshold)
+        self._object_arrays = None
+
+    def reset(
+            self,
+            structure: List[List[MazeCell]],
+            objects: List[MazeObject],
+            goal_index: int
+    ):
+        super().reset(structure, objects, goal_index)
+        self._object_arrays = None
+
+    def _objects_as_arrays(self) -> Tuple[np.ndarray, float, float, np.ndarray, np.ndarray]:
+        # Position, threshold and reward scale of the goal, positions and thresholds of the other objects
+        if self._object_arrays is None:
+            goal = self.objects[self.goal_index]
+            others = [obj for i, obj in enumerate(self.objects) if i != self.goal_index]
+            self._object_arrays = (
+                goal.pos[:2],
+                goal.threshold,
+                goal.reward_scale,
+                np.array([obj.pos[:2] for obj in others], dtype=goal.pos.dtype).reshape(-1, 2),
+                np.array([obj.threshold for obj in others], dtype=np.float64)
+            )
+        return self._object_arrays
+
+    def rewards(self, achieved_goals: np.ndarray, start_positions: np.ndarray, inframe: np.ndarray) -> np.ndarray:
+        """`reward` of many agents at once.
+
+        :param achieved_goals: positions of the agents, of shape `(n, 2)` or more columns
+        :type achieved_goals: np.ndarray
+        :param start_positions: start positions of the agents, of shape `(n, 2)`
+        :type start_positions: np.ndarray
+        :param inframe: whether the target is in the frame of each agent, of shape `(n,)`
+        :type inframe: np.ndarray
+        :return: rewards of shape `(n,)`
+        :rtype: np.ndarray
+        """
+        goal_pos, goal_threshold, goal_scale, positions, thresholds = self._objects_as_arrays()
+        # Distances in the precision of the positions, as `MazeObject.neighbor`
+        achieved_goals = np.asarray(achieved_goals)[:, :2]
+        distances = np.linalg.norm(achieved_goals - goal_pos, axis=-1)
+        start_distances = np.linalg.norm(np.asarray(start_positions)[:, :2] - goal_pos, axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            goal = 0.5 * goal_scale + (1 - distances / start_distances) + (distances <= 2.5 * goal_threshold) * goal_scale
+        rewards = np.where(np.asarray(inframe, dtype=bool), goal, 0.0)
+        neighbours = np.linalg.norm(achieved_goals[:, None] - positions, axis=-1) <= thresholds
+        return rewards - 0.1 * neighbours.sum(-1)
 
     def reward(self, observations: Union[np.ndarray, Dict[str, np.ndarray]]) -> float:
+        # `rewards` of a single agent, looping over the object arrays
+        goal_pos, goal_threshold, goal_scale, positions, thresholds = self._objects_as_arrays()
+        achieved_goal = observations['achieved_goal'][:2]
         reward = 0.0
-        for i, obj in enumerate(self.objects):
-            if i == self.goal_index:
-                if observations['inframe']:
-                    reward += 0.5 * obj.reward_scale + (
-                            1 - np.linalg.norm(
-                                    observations['achieved_goal'] - obj.pos
-                            ) / np.linalg.norm(
-                                    observations['start_pos'] - obj.pos))
-                    if np.linalg.norm(observations['achieved_goal'] - obj.pos) <= 2.5 * obj.threshold:
-                        reward += 1.0 * obj.reward_scale
-            else:
-                if obj.neighbor(observations['achieved_goal']):
-                    reward += -0.1
-        return reward
+        if np.asarray(observations['inframe']).reshape(-1)[0]:
+            # Norms as `np.linalg.norm` of vectors
+            offset = achieved_goal - goal_pos
+            distance = np.sqrt(offset.dot(offset))
+            offset = observations['start_pos'][:2] - goal_pos
+            reward = 0.5 * goal_scale + (1 - distance / np.sqrt(offset.dot(offset))) + (distance <= 2.5 * goal_threshold) * goal_scale
+        neighbours = 0
+        for position, threshold in zip(positions, thresholds):
+            offset = achieved_goal - position
+            neighbours += np.sqrt(offset.dot(offset)) <= threshold
+        return float(reward - 0.1 * neighbours)
 
     def termination(self, observations: Union[np.ndarray, Dict[str, np.ndarray]]) -> bool:
         if self.objects[self.goal_index].neighbor(observations['achieved_goal']):
@@ -404,18 +443,13 @@ class SimpleRoom(Maze):
 def create_local_planner_area(
         maze_size_scaling: float = 4.0,
 ):
-    structure = MAPS['local_planner']
+    compiled = compile_maze(MAPS['local_planner'])
+    structure = compiled.structure
     num_objects = 1
-    torso_init = find_robot(structure, maze_size_scaling)
+    torso_init = compiled.find_robot(maze_size_scaling)
     objects = []
-    _open_position_indices = []
-    agent_pos = None
-    for i in range(len(structure)):
-        for j in range(len(structure[i])):
-            if not structure[i][j].is_wall_or_chasm():
-                _open_position_indices.append([i, j])
-            if structure[i][j].is_robot():
-                agent_pos = [i, j]
+    _open_position_indices = [list(cell) for cell in compiled.open_cells]
+    agent_pos = list(compiled.robot_cells[-1])
     # print(_open_position_indices)
 
     _eligible_position_indices = []
@@ -0,0 +1,142 @@
+"""
+Utilities for the quadruped gait trajectories.
+
+The joint trajectories of `Quadruped._compute_joint_pos` are piecewise
+sinusoids whose shape over one normalised period only depends on the duty
+factor `beta`. The period `T`, the hip and knee amplitudes and the leg
+direction only scale the time and joint axes. `GaitTrajectory` tabulates the
+normalised shapes once per `beta` and evaluates any number of legs and robots
+with a single vectorised interpolation. For a single robot the NumPy call
+overhead on 4 legs outweighs the table, `Quadruped._get_joint_pos` keeps its
+scalar loop and the table serves batched queries.
+"""
+
+from typing import Dict, Tuple
+
+import numpy as np
+
+KNEE_OFFSET = 1.3089
+AMPLITUDE_SCALE = 1.0471
+
+
+class GaitTrajectory:
+    """Tabulated hip and knee trajectories over one normalised period.
+
+    :param beta: duty factor of the gait
+    :type beta: float
+    :param num_points: number of samples over one period
+    :type num_points: int
+    """
+    def __init__(self, beta: float, num_points: int = 4096) -> None:
+        self.beta = beta
+        self.num_points = num_points
+        s = np.linspace(0.0, 1.0, num_points + 1)
+        stance = (s > beta / 2) & (s < (2 - beta) / 2)
+        self.hip = np.where(
+            s <= beta / 2,
+            np.sin(np.pi * s / beta + np.pi),
+            np.where(
+                stance,
+                np.sin(np.pi * s / (1 - beta) + np.pi * (3 - 4 * beta) / (2 * (1 - beta))),
+                np.sin(np.pi * s / beta + np.pi * (beta - 1) / beta)
+            )
+        )
+        self.knee = np.where(
+            stance,
+            np.sin(np.pi * s / (1 - beta) - np.pi * beta / (2 * (1 - beta))),
+            0.0
+        )
+        self._table = np.stack([self.hip, self.knee], -1)
+        self._slope = np.concatenate([np.diff(self._table, axis = 0), np.zeros((1, 2))], 0)
+
+    def evaluate(self, t, T, theta_h, theta_k, direction) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorised equivalent of `Quadruped._compute_joint_pos`.
+
+        All arguments broadcast against each other, the leading dimensions
+        index legs and robots.
+
+        :returns: joint positions with a trailing dimension of size 3 and the timer frequency
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+        s = np.mod(t, T) / T
+        pos = s * self.num_points
+        i0 = pos.astype(np.int64)
+        shape = (pos - i0)[..., np.newaxis] * self._slope[i0] + self._table[i0]
+        hip = theta_h * shape[..., 0]
+        knee = theta_k * shape[..., 1]
+        stance = (s > self.beta / 2) & (s < (2 - self.beta) / 2)
+        omega = 2 * np.pi / (T * np.where(stance, 1 - self.beta, self.beta))
+        joint_pos = np.empty(hip.shape + (3,), dtype = hip.dtype)
+        joint_pos[..., 0] = direction * hip
+        joint_pos[..., 1] = -direction * knee
+        joint_pos[..., 2] = direction * (0.5 * knee + KNEE_OFFSET)
+        return joint_pos, omega
+
+
+_gait_trajectory_cache: Dict[Tuple[float, int], GaitTrajectory] = {}
+
+
+def get_gait_trajectory(beta: float, num_points: int = 4096) -> GaitTrajectory:
+    """Returns the `GaitTrajectory` for `beta`, tabulating it on first use."""
+    key = (float(beta), num_points)
+    if key not in _gait_trajectory_cache:
+        _gait_trajectory_cache[key] = GaitTrajectory(beta, num_points)
+    return _gait_trajectory_cache[key]
+
+
+_LEG_GROUP = np.array([0, 1, 1, 0], dtype = np.int64)
+_LEG_DIRECTION = np.array([1.0, -1.0, -1.0, 1.0], dtype = np.float32)
+
+
+_heading_signs_cache: Dict[Tuple[str, str], np.ndarray] = {}
+
+
+def get_heading_signs(task: str, direction: str) -> np.ndarray:
+    """Sign flips applied to the 12 joint positions for `task` and `direction`."""
+    if (task, direction) in _heading_signs_cache:
+        return _heading_signs_cache[(task, direction)]
+    signs = np.ones((12,), dtype = np.float32)
+    if task == 'straight':
+        if direction == 'backward':
+            signs[[0, 3, 6, 9]] = -1.0
+        elif direction == 'left':
+            signs[[3, 9]] = -1.0
+        elif direction == 'right':
+            signs[[0, 6]] = -1.0
+    elif task == 'rotate':
+        if direction == 'left':
+            signs[[3, 6]] = -1.0
+        elif direction == 'right':
+            signs[[0, 9]] = -1.0
+    _heading_signs_cache[(task, direction)] = signs
+    return signs
+
+
+def get_joint_pos(t, gamma, amplitude, omega, beta, task, direction) -> Tuple[np.ndarray, np.ndarray]:
+    """Batched equivalent of `Quadruped._get_joint_pos`.
+
+    :param t: time of each robot, shape `(N,)` or scalar
+    :type t: np.ndarray
+    :param gamma: phase offset of each leg, shape `(N, 4)` or `(4,)`
+    :type gamma: np.ndarray
+    :param amplitude: amplitude of the two leg groups, shape `(N, 2)` or `(2,)`
+    :type amplitude: np.ndarray
+    :param omega: frequency of the two leg groups, shape `(N, 2)` or `(2,)`
+    :type omega: np.ndarray
+    :param beta: duty factor of the gait
+    :type beta: float
+    :param task: task of the robots
+    :type task: str
+    :param direction: direction of the robots
+    :type direction: str
+    :returns: joint positions of shape `(N, 12)` or `(12,)` and the timer frequency of each leg
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    amplitude = np.asarray(amplitude)[..., _LEG_GROUP] * AMPLITUDE_SCALE
+    T = 2 * np.pi / np.asarray(omega, dtype = np.float64)[..., _LEG_GROUP]
+    t = np.asarray(t, dtype = np.float64)[..., np.newaxis] + np.asarray(gamma) * T
+    joint_pos, timer_omega = get_gait_trajectory(beta).evaluate(
+        t, T, amplitude, amplitude, _LEG_DIRECTION
+    )
+    joint_pos = joint_pos.reshape(joint_pos.shape[:-2] + (12,)) * get_heading_signs(task, direction)
+    return joint_pos.astype(np.float32), timer_omega
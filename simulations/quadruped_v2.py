@@ -5,6 +5,7 @@ import os
 import mujoco_py
 from neurorobotics.utils.env_utils import convert_observation_to_space
 from neurorobotics.networks.cpg import ModifiedHopfCPG
+from neurorobotics.utils.telemetry import TelemetryRecorder
 import xml.etree.ElementTree as ET
 import tempfile
 
@@ -32,7 +33,7 @@ class Quadruped(gym.GoalEnv, gym.utils.EzPickle):
         gym.utils.EzPickle.__init__(self)
         self._reward = 0.0
         self._track_lst = track_lst
-        self._track_item = {key : [] for key in self._track_lst}
+        self._track_item = TelemetryRecorder(self._track_lst)
         self._step = 0
         self.verbose = 0
         if model_path.startswith("/"):
@@ -382,9 +383,9 @@ class Quadruped(gym.GoalEnv, gym.utils.EzPickle):
         self.ob = self.reset_model()
 
         if len(self._track_lst) > 0 and self.verbose > 0:
-            for item in self._track_lst:
+            for item in self._track_item.keys():
                 with open(os.path.join('assets', 'episode','ant_{}.npy'.format(item)), 'wb') as f:
-                    np.save(f, np.stack(self._track_item[item], axis = 0))
+                    np.save(f, self._track_item.get(item))
         #self.d1, self.d2, self.d3, self.stability, upright = self.calculate_stability_reward(self.desired_goal)
         self._reset_track_lst()
         self._track_attr()
@@ -436,31 +437,30 @@ class Quadruped(gym.GoalEnv, gym.utils.EzPickle):
         """
             modify this according to need
         """
-        self._track_item['joint_pos'].append(self.joint_pos.copy())
-        self._track_item['action'].append(self.action.copy())
-        self._track_item['velocity'].append(self.sim.data.qvel[:6].copy())
-        self._track_item['position'].append(self.sim.data.qpos[:3].copy())
-        self._track_item['true_joint_pos'].append(self.sim.data.qpos[-self._num_joints:].copy())
-        self._track_item['sensordata'].append(self.sim.data.sensordata.copy())
-        self._track_item['qpos'].append(self.sim.data.qpos.copy())
-        self._track_item['qvel'].append(self.sim.data.qvel.copy())
-        #self._track_item['observation'].append(ob['observation'].copy())
-        self._track_item['heading_ctrl'].append(self.heading_ctrl.copy())
-        self._track_item['omega_o'].append(self.omega.copy())
-        self._track_item['z'].append(self.z.copy())
-        self._track_item['mu'].append(self.mu.copy())
-        self._track_item['reward'].append(np.array([self._reward], dtype = np.float32))
-        #self._track_item['rewards'].append(np.array(self._rewards, dtype = np.float32))
+        self._track_item.record('joint_pos', self.joint_pos)
+        self._track_item.record('action', self.action)
+        self._track_item.record('velocity', self.sim.data.qvel[:6])
+        self._track_item.record('position', self.sim.data.qpos[:3])
+        self._track_item.record('true_joint_pos', self.sim.data.qpos[-self._num_joints:])
+        self._track_item.record('sensordata', self.sim.data.sensordata)
+        self._track_item.record('qpos', self.sim.data.qpos)
+        self._track_item.record('qvel', self.sim.data.qvel)
+        #self._track_item.record('observation', ob['observation'])
+        self._track_item.record('heading_ctrl', self.heading_ctrl)
+        self._track_item.record('omega_o', self.omega)
+        self._track_item.record('z', self.z)
+        self._track_item.record('mu', self.mu)
+        self._track_item.record('reward', np.array([self._reward], dtype = np.float32))
+        #self._track_item.record('rewards', np.array(self._rewards, dtype = np.float32))
 
     def _get_track_item(self, item):
-        return self._track_item[item].copy()
+        return self._track_item.get(item).copy()
 
     def _reset_track_lst(self):
         """
              modify this according to need
         """
-        del self._track_item
-        self._track_item = {key : [] for key in self._track_lst}
+        self._track_item.reset()
         return self._track_item
 
     def _compute_joint_pos(self, t, T, theta_h, theta_k, beta, direction):
@@ -598,7 +598,7 @@ class Quadruped(gym.GoalEnv, gym.utils.EzPickle):
             print(self._n_steps)
         while(np.abs(phase) <= np.pi * self._update_action_every):
             if params['version'] == 0:
-                self.joint_pos = self._get_joint_pos(self._amplitude, omega)
+                self.joint_pos, _ = self._get_joint_pos(self._amplitude, omega)
             elif params['version'] == 1:
                 self.joint_pos = self._get_joint_pos_v2(self._amplitude, omega)
             timer_omega = max(omega)
@@ -0,0 +1,169 @@
+"""
+Reward decomposition of the maze environments.
+
+A reward is the sum of declared `RewardComponent`, each computed from a
+compact state vector with the fields of `STATE_FIELDS`. States of many agents
+are stacked along the leading axes and computed at once. Components are
+returned as an array indexed as `RewardFunction.names`, so consumers such as
+`utils.callbacks.Callback` aggregate them by index instead of by key::
+
+    reward_function = RewardFunction(inner_reward_scaling=1.0, target_speed=2.25)
+    state = reward_function.state()
+    state[STATE['coverage_gain']] = 0.1
+    components = reward_function.compute(state)
+    reward = reward_function.total(components)
+"""
+
+import math
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from neurorobotics.constants import params
+
+# Fields of the state vector of an environment step.
+STATE_FIELDS: Tuple[str, ...] = (
+    # reward returned by the step of the agent model, used when the target is not in the frame
+    'wrapped_reward',
+    # 1 if the target is in the frame
+    'inframe',
+    # planar speed, angle between the heading and the goal, and yaw rate of the agent
+    'speed',
+    'heading_error',
+    'yaw_rate',
+    # `Maze.reward` of the task and 1 if the task is completed
+    'task_reward',
+    'success',
+    # 1 if the agent is close to a wall, number of blind directions and 1 on contact with an obstacle
+    'almost_collision',
+    'blind',
+    'contact',
+    # 1 if the agent left the maze
+    'outbound',
+    # coverage of the map gained during the step
+    'coverage_gain',
+)
+STATE: Dict[str, int] = {name: i for i, name in enumerate(STATE_FIELDS)}
+
+
+class RewardComponent(NamedTuple):
+    """Term of a reward.
+
+    `compute(state, config)` maps states of shape `(..., len(STATE_FIELDS))`
+    to values of shape `(...)`. Components linear in the state declare
+    `weights(config)` instead, the coefficients of the fields, and are
+    computed together with a single matrix product. The state of a single
+    agent has shape `(len(STATE_FIELDS),)`, and `compute` may return a float.
+    """
+    name: str
+    compute: Optional[Callable[[np.ndarray, Dict[str, float]], np.ndarray]] = None
+    weights: Optional[Callable[[Dict[str, float]], Dict[str, float]]] = None
+
+
+def inner_reward(state: np.ndarray, config: Dict[str, float]) -> np.ndarray:
+    """Progress towards the visible target, from "https://ieeexplore.ieee.org/document/8398461"."""
+    if state.ndim == 1:
+        # A single agent, without the call overhead of numpy on scalars
+        if state[STATE['inframe']] <= 0:
+            return state[STATE['wrapped_reward']]
+        speed, heading_error, yaw_rate = state[[STATE['speed'], STATE['heading_error'], STATE['yaw_rate']]].tolist()
+        return config['inner_reward_scaling'] * ((speed / config['target_speed']) * math.cos(heading_error) * (
+            1 - (abs(yaw_rate) / config['max_vyaw'])) * 0.005)
+    progress = (state[..., STATE['speed']] / config['target_speed']) * np.cos(state[..., STATE['heading_error']]) * (
+        1 - (np.abs(state[..., STATE['yaw_rate']]) / config['max_vyaw'])) * 0.005
+    progress = config['inner_reward_scaling'] * progress
+    return np.where(state[..., STATE['inframe']] > 0, progress, state[..., STATE['wrapped_reward']])
+
+
+def outer_reward(config: Dict[str, float]) -> Dict[str, float]:
+    """Reward of the task, with a bonus on success."""
+    return {'task_reward': 0.005, 'success': 1.0}
+
+
+def collision_penalty(config: Dict[str, float]) -> Dict[str, float]:
+    """Penalties for walls ahead, contacts with obstacles and leaving the maze."""
+    scaling = config['inner_reward_scaling']
+    return {
+        'almost_collision': -0.005 * scaling,
+        'blind': -0.005 * scaling,
+        'contact': -0.99 * scaling,
+        'outbound': -0.05 * scaling
+    }
+
+
+def coverage_reward(config: Dict[str, float]) -> Dict[str, float]:
+    """Reward for exploring the map."""
+    return {'coverage_gain': 0.05}
+
+
+SIMPLE_ROOM_COMPONENTS: List[RewardComponent] = [
+    RewardComponent('inner_reward', compute=inner_reward),
+    RewardComponent('outer_reward', weights=outer_reward),
+    RewardComponent('collision_penalty', weights=collision_penalty),
+    RewardComponent('coverage_reward', weights=coverage_reward),
+]
+
+
+class RewardFunction:
+    """Computes the components of a reward from state vectors.
+
+    :param components: components of the reward, in the order of the computed arrays
+    :type components: Optional[Sequence[RewardComponent]]
+    :param inner_reward_scaling: scale of the rewards and penalties of the agent
+    :type inner_reward_scaling: float
+    :param target_speed: speed of the agent giving the full inner reward
+    :type target_speed: float
+    :param max_vyaw: yaw rate of the agent cancelling the inner reward
+    :type max_vyaw: Optional[float]
+    """
+    def __init__(
+        self,
+        components: Optional[Sequence[RewardComponent]] = None,
+        inner_reward_scaling: float = 1.0,
+        target_speed: float = 2.25,
+        max_vyaw: Optional[float] = None
+    ):
+        self.components = list(SIMPLE_ROOM_COMPONENTS if components is None else components)
+        self.names: Tuple[str, ...] = tuple(component.name for component in self.components)
+        self.index: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        self.config = {
+            'inner_reward_scaling': inner_reward_scaling,
+            'target_speed': target_speed,
+            'max_vyaw': params['max_vyaw'] if max_vyaw is None else max_vyaw,
+        }
+        # Coefficients of the linear components, zero for the others
+        self._weights = np.zeros((len(STATE_FIELDS), len(self.components)), dtype=np.float64)
+        self._computed = []
+        for i, component in enumerate(self.components):
+            assert (component.compute is None) != (component.weights is None), \
+                'Reward component `{}` needs either `compute` or `weights`'.format(component.name)
+            if component.weights is None:
+                self._computed.append((i, component.compute))
+            else:
+                for field, weight in component.weights(self.config).items():
+                    self._weights[STATE[field], i] = weight
+        # Rows of the components, for the dot products of a single agent
+        self._weights_t = np.ascontiguousarray(self._weights.T)
+
+    def __len__(self) -> int:
+        return len(self.components)
+
+    def state(self, *shape: int) -> np.ndarray:
+        """Zero states of `shape` agents, of shape `shape + (len(STATE_FIELDS),)`."""
+        return np.zeros(shape + (len(STATE_FIELDS),), dtype=np.float64)
+
+    def compute(self, state: np.ndarray) -> np.ndarray:
+        """Components of the states, of shape `state.shape[:-1] + (len(self),)`."""
+        if state.ndim == 1:
+            out = self._weights_t.dot(state)
+            for i, compute in self._computed:
+                out[i] = compute(state, self.config)
+            return out
+        out = state @ self._weights
+        for i, compute in self._computed:
+            out[..., i] = compute(state, self.config)
+        return out
+
+    def total(self, components: np.ndarray) -> np.ndarray:
+        """Rewards of the components computed by `compute`."""
+        return components.sum(-1)
@@ -0,0 +1,349 @@
+"""
+Pre-generated maze tasks drawn by `Environment._set_structure` on reset.
+
+Generating a task scans the maze for open cells, places and colours the
+objects, and the environment then samples a start pose, plans the shortest
+path to the goal and fits a spline course along it. `TaskBank.generate` runs
+this once for many tasks in worker processes, each task seeded with its own
+seed, and stores the objects, the start pose, the path, the waypoints and the
+spline course as columnar arrays. Variable length arrays are concatenated with
+the `*_offsets` of each task. Banks are saved to one compressed `.npz` file::
+
+    bank = TaskBank.generate(create_simple_room_maze, SimpleRoomEnv, 1000, seed=params['seed'], n_workers=4)
+    bank.save('simple_room.npz')
+    env = SimpleRoomEnv(model_cls, create_simple_room_maze, task_bank=TaskBank.load('simple_room.npz'))
+
+Draws follow a sequence seeded by `replay`, so a replay with the same seed
+resets the environments on the same tasks. Environments seeded with
+`Environment.seed` draw with their own generator instead, so the copies of a
+vectorized environment, which share the bank or hold pickled copies of it,
+draw different sequences.
+"""
+
+import random
+import multiprocessing as mp
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Type
+
+import numpy as np
+
+from neurorobotics.simulations import maze_task
+from neurorobotics.simulations.maze_env_utils import MazeCell, compile_maze
+
+# Spline course of `Environment._find_cubic_spline_path`
+COURSE_FIELDS: Tuple[str, ...] = ('cx', 'cy', 'cyaw', 'ck', 's')
+
+
+class TaskEntry(NamedTuple):
+    """A banked task, the output of the task generator and the plan of the environment.
+
+    `sample` is the tuple returned by the task generator. The environment
+    starts at `init_pos` and `init_ori`, `start_pos` and `start_ori` as set by
+    `Environment._set_init`, and follows the graph nodes `path`, the
+    waypoints `wx` and `wy` and the spline `course` with the fields
+    `COURSE_FIELDS`.
+    """
+    seed: int
+    sample: Tuple[Any, ...]
+    init_pos: np.ndarray
+    init_ori: float
+    start_pos: np.ndarray
+    start_ori: float
+    path: List[int]
+    wx: List[float]
+    wy: List[float]
+    course: Tuple[List[float], ...]
+
+
+def plan_task(env_cls: Type, sample: Tuple[Any, ...], maze_size_scaling: float) -> Dict[str, Any]:
+    """Start pose, shortest path and spline course of a task as planned by `env_cls` on reset.
+
+    The planning methods of the environment only read the maze and the task,
+    they run on an instance without a simulation.
+
+    :param env_cls: environment class, a subclass of `maze_env.Environment`
+    :type env_cls: Type
+    :param sample: tuple returned by the task generator
+    :type sample: Tuple[Any, ...]
+    :param maze_size_scaling: size of the cells of the maze
+    :type maze_size_scaling: float
+    :return: the planned arrays of a task
+    :rtype: Dict[str, Any]
+    """
+    planner = object.__new__(env_cls)
+    planner._maze_size_scaling = maze_size_scaling
+    planner._task_entry = None
+    planner._set_task(sample)
+    init_pos, init_ori = planner._set_init(planner._agent_pos)
+    # `set_goal_path` plans from the position set by `wrapped_env.set_xy(init_pos)`
+    planner._plan_path(np.asarray(init_pos, dtype=np.float64))
+    return {
+        'init_pos': init_pos,
+        'init_ori': init_ori,
+        'start_pos': planner._start_pos,
+        'start_ori': planner._start_ori,
+        'path': planner.sampled_path,
+        'waypoints': np.stack([planner.wx, planner.wy], -1),
+        'course': np.stack([getattr(planner, name) for name in COURSE_FIELDS], -1),
+    }
+
+
+def _generate_tasks(
+    generator: Callable,
+    env_cls: Type,
+    seeds: Sequence[int],
+    maze_size_scaling: float
+) -> List[Tuple[Tuple[Any, ...], Dict[str, Any]]]:
+    # Generation and planning draw from the global generators, as on reset
+    state = random.getstate(), np.random.get_state()
+    tasks = []
+    try:
+        for seed in seeds:
+            random.seed(int(seed))
+            np.random.seed(int(seed))
+            sample = generator(maze_size_scaling)
+            tasks.append((sample, plan_task(env_cls, sample, maze_size_scaling)))
+    finally:
+        random.setstate(state[0])
+        np.random.set_state(state[1])
+    return tasks
+
+
+def _generate_worker(args: Tuple[Callable, Type, Sequence[int], float]) -> List[Tuple[Tuple[Any, ...], Dict[str, Any]]]:
+    return _generate_tasks(*args)
+
+
+def _ragged(values: List[np.ndarray], dtype: Any) -> Tuple[np.ndarray, np.ndarray]:
+    # Concatenated values and the offsets of each task
+    flat = np.concatenate([np.asarray(value, dtype=dtype) for value in values])
+    offsets = np.concatenate([[0], np.cumsum([len(value) for value in values])]).astype(np.int64)
+    return flat, offsets
+
+
+class TaskBank:
+    """Tasks of one task generator and environment class, drawn in O(1).
+
+    :param arrays: columnar arrays of the tasks, as written by `save`
+    :type arrays: Dict[str, np.ndarray]
+    :param seed: seed of the sequence of drawn tasks, see `replay`
+    :type seed: Optional[int]
+    """
+    def __init__(self, arrays: Dict[str, np.ndarray], seed: Optional[int] = None) -> None:
+        self.arrays = arrays
+        self.kind = str(arrays['kind'])
+        self.task_cls = getattr(maze_task, str(arrays['task_cls']))
+        self.maze_size_scaling = float(arrays['maze_size_scaling'])
+        # Structure and open cells of the maze, shared by all tasks and never modified by the environments
+        self.structure = compile_maze([[MazeCell(value) for value in row] for row in arrays['grid'].tolist()]).structure
+        self.open_position_indices = arrays['open_position_indices'].tolist()
+        self.site_types = arrays['site_types'].tolist()
+        self._index = {seed: i for i, seed in enumerate(arrays['seeds'].tolist())}
+        self.replay(seed)
+
+    def __len__(self) -> int:
+        return len(self.arrays['seeds'])
+
+    @property
+    def seeds(self) -> np.ndarray:
+        return self.arrays['seeds']
+
+    def index(self, seed: int) -> int:
+        """Index of the task generated with `seed`."""
+        return self._index[seed]
+
+    def replay(self, seed: Optional[int] = None) -> None:
+        """Restarts the sequence of tasks returned by `draw`, the same for the same `seed`."""
+        self._rng = np.random.default_rng(seed)
+
+    def draw(self, rng: Optional[np.random.Generator] = None) -> TaskEntry:
+        """Next task of the sequence seeded by `replay`, or drawn with `rng`."""
+        return self.entry(int((self._rng if rng is None else rng).integers(len(self))))
+
+    def entry(self, index: int) -> TaskEntry:
+        """Task at `index`, with new task objects.
+
+        :param index: index of the task
+        :type index: int
+        :return: the task
+        :rtype: TaskEntry
+        """
+        a = self.arrays
+        goal_index = int(a['goal_index'][index])
+        objects = []
+        for k in range(a['object_pos'].shape[1]):
+            characteristics = {
+                'threshold': float(a['object_threshold'][index, k]),
+                'target': k == goal_index,
+            }
+            if self.kind == 'object':
+                characteristics.update({
+                    'rgb': maze_task.Rgb(*a['object_rgb'][index, k].tolist()),
+                    'size': a['object_size'][index, k].tolist(),
+                    'site_type': self.site_types[a['object_site_type'][index, k]],
+                    'hsv_low': a['object_hsv_low'][index, k].tolist(),
+                    'hsv_high': a['object_hsv_high'][index, k].tolist(),
+                })
+                object_cls = maze_task.MazeObject
+            else:
+                characteristics['position_error_threshold'] = float(a['object_position_error_threshold'][index, k])
+                object_cls = maze_task.MazePosition
+            objects.append(object_cls(
+                pos=a['object_pos'][index, k].copy(),
+                characteristics=characteristics,
+                reward_scale=float(a['object_reward_scale'][index, k])
+            ))
+        task = self.task_cls(
+            structure=self.structure,
+            objects=objects,
+            goal_index=goal_index,
+            scale=float(a['scale']),
+            reward_threshold=float(a['reward_threshold'])
+        )
+        sample = (task, self.structure, self.open_position_indices, a['agent_pos'][index].tolist())
+        if 'agent_ori' in a:
+            sample = sample + (float(a['agent_ori'][index]),)
+        path = slice(a['path_offsets'][index], a['path_offsets'][index + 1])
+        waypoints = a['waypoints'][a['waypoint_offsets'][index]:a['waypoint_offsets'][index + 1]]
+        course = a['course'][a['course_offsets'][index]:a['course_offsets'][index + 1]]
+        return TaskEntry(
+            seed=int(a['seeds'][index]),
+            sample=sample,
+            init_pos=a['init_pos'][index].copy(),
+            init_ori=float(a['init_ori'][index]),
+            start_pos=a['start_pos'][index].copy(),
+            start_ori=float(a['start_ori'][index]),
+            path=a['path'][path].tolist(),
+            wx=waypoints[:, 0].tolist(),
+            wy=waypoints[:, 1].tolist(),
+            course=tuple(course.T.tolist())
+        )
+
+    @classmethod
+    def from_tasks(
+        cls,
+        seeds: Sequence[int],
+        tasks: List[Tuple[Tuple[Any, ...], Dict[str, Any]]],
+        maze_size_scaling: float,
+        seed: Optional[int] = None
+    ) -> 'TaskBank':
+        """Bank of the generated and planned `tasks` of `seeds`.
+
+        :param seeds: seed of each task
+        :type seeds: Sequence[int]
+        :param tasks: tuple returned by the task generator and arrays of `plan_task` of each task
+        :type tasks: List[Tuple[Tuple[Any, ...], Dict[str, Any]]]
+        :param maze_size_scaling: size of the cells of the maze
+        :type maze_size_scaling: float
+        :param seed: seed of the sequence of drawn tasks
+        :type seed: Optional[int]
+        :rtype: TaskBank
+        """
+        samples = [sample for sample, _ in tasks]
+        plans = [plan for _, plan in tasks]
+        first = samples[0][0]
+        kinds = {obj.kind for sample in samples for obj in sample[0].objects}
+        assert len(kinds) == 1, 'Banked tasks must have objects of one kind, got {}'.format(kinds)
+        kind = kinds.pop()
+        assert len({len(sample[0].objects) for sample in samples}) == 1, 'Banked tasks must have the same number of objects'
+        arrays = {
+            'kind': np.array(kind),
+            'task_cls': np.array(type(first).__name__),
+            'maze_size_scaling': np.array(maze_size_scaling, dtype=np.float64),
+            'scale': np.array(first.scale, dtype=np.float64),
+            'reward_threshold': np.array(first.reward_threshold, dtype=np.float64),
+            'grid': compile_maze(samples[0][1]).grid,
+            'open_position_indices': np.array(samples[0][2], dtype=np.int16).reshape(-1, 2),
+            'seeds': np.array(seeds, dtype=np.int64),
+            'goal_index': np.array([sample[0].goal_index for sample in samples], dtype=np.int8),
+            'agent_pos': np.array([sample[3] for sample in samples], dtype=np.int16),
+            'init_pos': np.array([plan['init_pos'] for plan in plans], dtype=np.float64),
+            'init_ori': np.array([plan['init_ori'] for plan in plans], dtype=np.float64),
+            'start_pos': np.array([plan['start_pos'] for plan in plans], dtype=np.float32),
+            'start_ori': np.array([plan['start_ori'] for plan in plans], dtype=np.float64),
+            'object_pos': np.array([[obj.pos for obj in sample[0].objects] for sample in samples], dtype=np.float32),
+            'object_threshold': np.array([[obj.threshold for obj in sample[0].objects] for sample in samples], dtype=np.float64),
+            'object_reward_scale': np.array(
+                [[obj.reward_scale for obj in sample[0].objects] for sample in samples], dtype=np.float64),
+        }
+        if len(samples[0]) > 4:
+            arrays['agent_ori'] = np.array([sample[4] for sample in samples], dtype=np.float64)
+        objects = [sample[0].objects for sample in samples]
+        if kind == 'object':
+            site_types = sorted({obj.site_type for task_objects in objects for obj in task_objects})
+            arrays['site_types'] = np.array(site_types)
+            arrays['object_rgb'] = np.array([[tuple(obj.rgb) for obj in o] for o in objects], dtype=np.float64)
+            arrays['object_size'] = np.array([[obj.custom_size for obj in o] for o in objects], dtype=np.float64)
+            arrays['object_site_type'] = np.array(
+                [[site_types.index(obj.site_type) for obj in o] for o in objects], dtype=np.int8)
+            arrays['object_hsv_low'] = np.array([[obj.min_range for obj in o] for o in objects], dtype=np.float32)
+            arrays['object_hsv_high'] = np.array([[obj.max_range for obj in o] for o in objects], dtype=np.float32)
+        else:
+            arrays['site_types'] = np.array([], dtype=str)
+            arrays['object_position_error_threshold'] = np.array(
+                [[obj.position_error_threshold for obj in o] for o in objects], dtype=np.float64)
+        arrays['path'], arrays['path_offsets'] = _ragged([plan['path'] for plan in plans], np.int32)
+        arrays['waypoints'], arrays['waypoint_offsets'] = _ragged([plan['waypoints'] for plan in plans], np.float64)
+        arrays['course'], arrays['course_offsets'] = _ragged([plan['course'] for plan in plans], np.float64)
+        return cls(arrays, seed)
+
+    @classmethod
+    def generate(
+        cls,
+        generator: Callable,
+        env_cls: Type,
+        size: int,
+        maze_size_scaling: float = 4.0,
+        seed: int = 0,
+        n_workers: int = 1,
+        chunk_size: int = 64
+    ) -> 'TaskBank':
+        """Generates and plans `size` tasks, the task `i` seeded with `seed + i`.
+
+        Workers are forked where possible, generation holds no simulation
+        state. The tasks do not depend on the number of workers.
+
+        :param generator: picklable task generator, e.g. `maze_task.create_simple_room_maze`
+        :type generator: Callable
+        :param env_cls: environment class planning the tasks, e.g. `maze_env.SimpleRoomEnv`
+        :type env_cls: Type
+        :param size: number of tasks
+        :type size: int
+        :param maze_size_scaling: size of the cells of the maze
+        :type maze_size_scaling: float
+        :param seed: seed of the first task, also seeds the sequence of drawn tasks
+        :type seed: int
+        :param n_workers: number of worker processes, tasks are generated in process with 1
+        :type n_workers: int
+        :param chunk_size: number of tasks per job of the workers
+        :type chunk_size: int
+        :rtype: TaskBank
+        """
+        seeds = list(range(seed, seed + size))
+        chunks = [
+            (generator, env_cls, seeds[i:i + chunk_size], maze_size_scaling) for i in range(0, size, chunk_size)
+        ]
+        n_workers = max(min(n_workers, len(chunks)), 1)
+        if n_workers == 1:
+            results = [_generate_worker(chunk) for chunk in chunks]
+        else:
+            ctx = mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else 'spawn')
+            with ctx.Pool(n_workers) as pool:
+                results = pool.map(_generate_worker, chunks)
+        return cls.from_tasks(seeds, [task for result in results for task in result], maze_size_scaling, seed)
+
+    def save(self, path: str) -> None:
+        """Writes the bank to the compressed `.npz` file `path`."""
+        np.savez_compressed(path, **self.arrays)
+
+    @classmethod
+    def load(cls, path: str, seed: Optional[int] = None) -> 'TaskBank':
+        """Reads a bank written by `save`.
+
+        :param path: `.npz` file of the bank
+        :type path: str
+        :param seed: seed of the sequence of drawn tasks
+        :type seed: Optional[int]
+        :rtype: TaskBank
+        """
+        with np.load(path) as data:
+            arrays = {key: data[key] for key in data.files}
+        return cls(arrays, seed)
@@ -19,7 +19,7 @@ from typing import Any, List, Optional, Tuple, Type
 import gym
 import numpy as np
 import networkx as nx
-from neurorobotics.simulations import maze_env_utils, maze_task
+from neurorobotics.simulations import collision, maze_env_utils, maze_task
 from neurorobotics.simulations.agent_model import AgentModel
 from neurorobotics.utils.env_utils import convert_observation_to_space, \
     calc_spline_course, TargetCourse, proportional_control, \
@@ -254,6 +254,7 @@ class MazeEnv(tfa.environments.py_environment.PyEnvironment):
                 self.obstacles_ids.append(self.model._geom_name2id[name])
             elif name != 'floor':
                 self.agent_ids.append(self.model._geom_name2id[name])
+        self._contact_filter = collision.ContactFilter(self.model.ngeom, self.obstacles_ids, self.agent_ids)
 
         # Environment Utility Methods
         self.get_xy = lambda: self.wrapped_env.get_xy()
@@ -776,18 +777,7 @@ class MazeEnv(tfa.environments.py_environment.PyEnvironment):
 
     def _is_in_collision(self):
         # Checks if the last action caused collision
-        for contact in self.data.contact:
-            geom1 = contact.geom1
-            geom2 = contact.geom2
-            if geom1 != 0 and geom2 != 0:
-                if geom1 in self.obstacles_ids:
-                    if geom2 in self.agent_ids:
-                        return True
-                if geom2 in self.obstacles_ids:
-                    if geom1 in self.agent_ids:
-                        return True
-            else:
-                return False
+        return self._contact_filter.in_collision(self.data)
 
 
     def check_position(self, pos):
@@ -0,0 +1,122 @@
+import time
+import argparse
+import torch
+from neurorobotics.constants import params
+from neurorobotics.bg.models import BasalGanglia
+
+
+def reference_forward(model, inputs):
+    # `BasalGanglia.forward` before the lateral weights were precomputed and the iterations scripted.
+    stimulus_t, stimulus_t_1 = inputs
+    batch_size = stimulus_t.shape[0]
+    v_t = model.vf(stimulus_t)
+    v_t_1 = model.vf(stimulus_t_1)
+    deltavf = v_t - v_t_1
+    V_D1 = torch.zeros((batch_size, model.FF_Dim_in)).to(stimulus_t.device)
+    V_D2 = torch.zeros((batch_size, model.FF_Dim_in)).to(stimulus_t.device)
+    lamd1 = 1 / (1 + torch.exp(-model.log_a1.exp() * (deltavf - model.thetad1)))
+    lamd2 = 1 / (1 + torch.exp(model.log_a2.exp() * (deltavf - model.thetad2)))
+    J_D1 = model.fc_jd1(stimulus_t)
+    J_D2 = model.fc_jd2(stimulus_t)
+    K_D1 = model.fc_kd1(stimulus_t)
+    K_D2 = model.fc_kd2(stimulus_t)
+    for FFiter in range(model.FF_steps):
+        V_D1 = J_D1 * (1 - V_D1) + (1 - K_D1) * V_D1
+        V_D2 = J_D2 * (1 - V_D2) + (1 - K_D2) * V_D2
+        V_D1 = torch.sigmoid(lamd1 * V_D1)
+        V_D2 = torch.sigmoid(lamd2 * V_D2)
+    V_GPi_DP = model.fc_d1gpi(V_D1)
+    V_GPi = torch.zeros((batch_size, model.num_gpi)).to(stimulus_t.device)
+    xgpe = torch.zeros((batch_size, model.num_gpe)).to(stimulus_t.device)
+    xstn = torch.zeros((batch_size, model.num_stn)).to(stimulus_t.device)
+    vstn = torch.tanh(lamd2 * xstn)
+    hx = torch.rand((batch_size, model.num_gpi)).to(stimulus_t.device)
+    weights_glat = torch.ones((model.num_gpe, model.num_gpe)) - torch.eye(model.num_gpe)
+    weights_slat = torch.ones((model.num_stn, model.num_stn)) - torch.eye(model.num_stn)
+    for it in range(model.stn_gpe_iter):
+        dxgpe = model.eta_gpe * (
+            -xgpe + model.wsg * vstn +
+            torch.nn.functional.linear(
+                xgpe,
+                model.epsilon_glat * weights_glat.to(stimulus_t.device) +
+                torch.ones((model.num_gpe, model.num_gpe)).to(stimulus_t.device)
+            ) - V_D2
+        )
+        xgpe = xgpe + dxgpe
+        dxstn = model.eta_stn * (
+            -xstn + model.wgs * xgpe +
+            torch.nn.functional.linear(vstn, model.epsilon_slat * weights_slat.to(stimulus_t.device))
+        )
+        xstn = xstn + dxstn
+        vstn = torch.tanh(lamd2 * xstn)
+        V_GPi_IP = lamd2 * model.fc_stngpi(vstn)
+        dvgpi = model.eta_gpi * (-V_GPi - V_GPi_DP + 2 * V_GPi_IP)
+        V_GPi = V_GPi + dvgpi
+        Ith = -V_GPi
+        hx = model.thalamus(Ith, hx)
+        out = model.linear(hx)
+    return out, v_t
+
+
+def check(model, batch_size):
+    stimulus_t = torch.randn((batch_size, model.num_ctx))
+    stimulus_t_1 = torch.randn((batch_size, model.num_ctx))
+    outputs = []
+    for forward in [reference_forward, lambda model, inputs: model(inputs)]:
+        model.zero_grad()
+        torch.manual_seed(params['seed'])
+        out, v_t = forward(model, [stimulus_t, stimulus_t_1])
+        (out.sum() + v_t.sum()).backward()
+        grads = [param.grad.clone() for param in model.parameters() if param.grad is not None]
+        outputs.append((out.detach(), v_t.detach(), grads))
+    (out, v_t, grads), (expected_out, expected_v_t, expected_grads) = outputs[1], outputs[0]
+    assert torch.allclose(out, expected_out, atol=1e-6)
+    assert torch.allclose(v_t, expected_v_t, atol=1e-6)
+    assert len(grads) == len(expected_grads)
+    for grad, expected_grad in zip(grads, expected_grads):
+        assert torch.allclose(grad, expected_grad, atol=1e-5, rtol=1e-4)
+
+
+def benchmark(forward, model, batch_size, repeats):
+    inputs = [torch.randn((batch_size, model.num_ctx)), torch.randn((batch_size, model.num_ctx))]
+    for _ in range(3):
+        forward(model, inputs)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        out, v_t = forward(model, inputs)
+        (out.sum() + v_t.sum()).backward()
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test and benchmark `BasalGanglia` against its unoptimised forward pass.')
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 50,
+        help = 'number of timed forward and backward passes'
+    )
+    args = parser.parse_args()
+    torch.manual_seed(params['seed'])
+    torch.set_num_threads(1)
+
+    # Iterations of the `BasalGanglia` defaults and `ControlNetwork`, the striatum has one unit per GPe unit
+    configs = [
+        {'num_ctx': params['num_ctx'], 'FF_Dim_in': 40},
+        {'num_ctx': params['num_ctx'], 'FF_Dim_in': 40, 'FF_steps': 20, 'stn_gpe_iter': 50},
+    ]
+    for config in configs:
+        model = BasalGanglia(**config)
+        for batch_size in [1, params['batch_size']]:
+            check(model, batch_size)
+    print('Optimised forward pass matches the reference')
+
+    print('{:>10} {:>14} {:>12} {:>16} {:>16}'.format('FF_steps', 'stn_gpe_iter', 'batch', 'reference ms', 'optimised ms'))
+    for config in configs:
+        model = BasalGanglia(**config)
+        for batch_size in [1, params['batch_size']]:
+            reference = benchmark(reference_forward, model, batch_size, args.repeats)
+            optimised = benchmark(lambda model, inputs: model(inputs), model, batch_size, args.repeats)
+            print('{:>10} {:>14} {:>12} {:>16.3f} {:>16.3f}'.format(
+                model.FF_steps, model.stn_gpe_iter, batch_size, reference * 1e3, optimised * 1e3))
@@ -0,0 +1,165 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import functools
+import numpy as np
+import torch
+import gym
+from gym import spaces
+from neurorobotics.constants import params
+from neurorobotics.data.shards import ShardedDataset, collate, detect_colors, generate_dataset
+
+
+class FrameEnv(gym.Env):
+    # Observations of the autoencoder keys of `SimpleRoomEnv` with smaller frames, no simulation.
+    # Each frame carries its global index, so read frames can be checked against their labels.
+    def __init__(self, frame_size, max_episode_size):
+        self.observation_space = spaces.Dict({
+            'scale_1': spaces.Box(low=0, high=255, shape=(frame_size, frame_size, 3), dtype=np.uint8),
+            'scale_2': spaces.Box(low=0, high=255, shape=(frame_size, frame_size, 3), dtype=np.uint8),
+            'depth': spaces.Box(low=0, high=1, shape=(1, frame_size, frame_size), dtype=np.float32),
+            'index': spaces.Box(low=0, high=np.inf, shape=(1,), dtype=np.int64),
+            'sampled_action': spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+        })
+        self.action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+        self.max_episode_size = max_episode_size
+        self.rng = np.random.default_rng()
+        self.seed_ = 0
+        self.episode = -1
+        self.steps = 0
+
+    def seed(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.seed_ = seed
+        return [seed]
+
+    def _obs(self):
+        shape = self.observation_space['scale_1'].shape
+        index = self.seed_ * 10 ** 6 + self.episode * 10 ** 3 + self.steps
+        return {
+            'scale_1': self.rng.integers(0, 256, size=shape, dtype=np.uint8),
+            'scale_2': self.rng.integers(0, 256, size=shape, dtype=np.uint8),
+            'depth': np.full(self.observation_space['depth'].shape, self.steps / self.max_episode_size, dtype=np.float32),
+            'index': np.array([index], dtype=np.int64),
+            'sampled_action': self.rng.uniform(-1, 1, size=(2,)).astype(np.float32)
+        }
+
+    def reset(self):
+        self.episode += 1
+        self.steps = 0
+        return self._obs()
+
+    def step(self, action):
+        self.steps += 1
+        return self._obs(), 0.0, self.steps >= self.max_episode_size, {}
+
+    def detect_color(self, frame, display=False):
+        # As many boxes as the step modulo 3, so labels can be checked against the frame index.
+        n = self.steps % 3
+        return [[0.1 * i, 0.1 * i, 0.2, 0.2] for i in range(n)], [i for i in range(n)]
+
+
+def make_env(frame_size, max_episode_size):
+    return FrameEnv(frame_size, max_episode_size)
+
+
+def check_dataset(path, index, n_workers, episodes, max_episode_size):
+    size = episodes * max_episode_size
+    assert index['size'] == size
+    # Every frame is read once per pass, by one of the loader workers, with its own labels.
+    dataset = ShardedDataset(path, labels=True, seed=params['seed'])
+    loader = torch.utils.data.DataLoader(dataset, batch_size=params['batch_size'], num_workers=2, collate_fn=collate)
+    indices = []
+    for batch in loader:
+        assert batch['scale_1'].dtype == torch.uint8 and batch['scale_1'].shape[1] == 3
+        assert batch['depth'].dtype == torch.float32
+        for i, (index_, boxes, classes) in enumerate(zip(batch['index'][:, 0], batch['boxes'], batch['classes'])):
+            steps = int(index_) % 10 ** 3
+            assert len(classes) == steps % 3 and boxes.shape == (steps % 3, 4)
+            assert torch.allclose(batch['depth'][i], torch.tensor(steps / max_episode_size))
+        indices.extend(batch['index'][:, 0].tolist())
+    assert len(indices) == size and len(set(indices)) == size
+    assert {index_ // 10 ** 6 for index_ in indices} == {params['seed'] + rank for rank in range(n_workers)}
+
+    # Batches of the dataset are the frames of a pass, in another order each epoch.
+    dataset = ShardedDataset(path, keys=['index'], batch_size=params['batch_size'], seed=params['seed'])
+    loader = torch.utils.data.DataLoader(dataset, batch_size=None, num_workers=2)
+    orders = []
+    for epoch in range(2):
+        dataset.set_epoch(epoch)
+        orders.append(torch.cat([batch['index'][:, 0] for batch in loader]).tolist())
+        assert sorted(orders[-1]) == sorted(indices) and len(orders[-1]) == size
+    assert orders[0] != orders[1]
+    assert len(loader) == sum(-(-shard['size'] // params['batch_size']) for shard in index['shards'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test and benchmark sharded dataset generation and streaming for encoder pretraining.')
+    parser.add_argument(
+        '--frame_size',
+        type = int,
+        default = 64,
+        help = 'height and width of the frames'
+    )
+    parser.add_argument(
+        '--episodes',
+        type = int,
+        default = 8,
+        help = 'number of generated episodes'
+    )
+    parser.add_argument(
+        '--max_episode_size',
+        type = int,
+        default = 250,
+        help = 'number of steps per episode'
+    )
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+    path = tempfile.mkdtemp()
+    env_fn = functools.partial(make_env, args.frame_size, args.max_episode_size)
+
+    try:
+        print('{:>12} {:>10} {:>10} {:>14} {:>10} {:>16} {:>16}'.format(
+            'compression', 'workers', 'shards', 'frames/s', 'MB', 'read frames/s', 'loader frames/s'))
+        for compression in ['none', 'zlib']:
+            for n_workers in [1, 2]:
+                start = time.perf_counter()
+                index = generate_dataset(
+                    path, env_fn, ['scale_1', 'scale_2', 'depth', 'index'], args.episodes, n_workers=n_workers,
+                    label_fn=functools.partial(detect_colors, key='scale_1'), shard_size=300,
+                    compression=compression, seed=params['seed']
+                )
+                generation = index['size'] / (time.perf_counter() - start)
+                size = sum(
+                    os.path.getsize(os.path.join(root, name))
+                    for root, _, names in os.walk(path) for name in names
+                ) / 2 ** 20
+                check_dataset(path, index, n_workers, args.episodes, args.max_episode_size)
+
+                keys = ['scale_1', 'scale_2', 'depth']
+                start = time.perf_counter()
+                for batch in ShardedDataset(path, keys=keys, batch_size=params['batch_size']):
+                    pass
+                read = index['size'] / (time.perf_counter() - start)
+                loader = torch.utils.data.DataLoader(
+                    ShardedDataset(path, keys=keys, batch_size=params['batch_size']), batch_size=None, num_workers=2
+                )
+                start = time.perf_counter()
+                for batch in loader:
+                    pass
+                loaded = index['size'] / (time.perf_counter() - start)
+                print('{:>12} {:>10} {:>10} {:>14.1f} {:>10.1f} {:>16.1f} {:>16.1f}'.format(
+                    compression, n_workers, len(index['shards']), generation, size, read, loaded))
+        print('Sharded datasets hold every generated frame with its labels')
+        # Without any frame there is no shard to read the layout of the keys from
+        try:
+            generate_dataset(path, env_fn, ['scale_1'], 0, seed=params['seed'])
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('Expected a ValueError for a dataset without frames')
+    finally:
+        shutil.rmtree(path)
@@ -103,7 +103,7 @@ if __name__ == '__main__':
         ac = env.get_action()
         if reward != 0.0:
             count += 1
-        if info['collision_penalty'] != 0:
+        if info['reward_components'][info['reward_keys'].index('collision_penalty')] != 0:
             count_collisions += 1
         pbar.update(1)
         steps += 1
@@ -135,28 +135,28 @@ if __name__ == '__main__':
     ax[0][2].set_xlabel('steps')
     ax[0][2].set_ylabel('coverage reward')
     coverage_reward = np.array([
-        info['coverage_reward'] for info in INFO
+        info['reward_components'][info['reward_keys'].index('coverage_reward')] for info in INFO
     ], dtype = np.float32)
     coverage_reward = np.clip(coverage_reward, a_min = -0.020, a_max = 0.020)
     ax[0][2].plot(coverage_reward)
     ax[0][3].set_xlabel('steps')
     ax[0][3].set_ylabel('inner reward')
     inner_reward = np.array([
-        info['inner_reward'] for info in INFO
+        info['reward_components'][info['reward_keys'].index('inner_reward')] for info in INFO
     ], dtype = np.float32)
     inner_reward = np.clip(inner_reward, a_min = -0.020, a_max = 0.020)
     ax[0][3].plot(inner_reward)
     ax[1][2].set_xlabel('steps')
     ax[1][2].set_ylabel('collision penalty')
     collision_penalty = np.array([
-        info['collision_penalty'] for info in INFO
+        info['reward_components'][info['reward_keys'].index('collision_penalty')] for info in INFO
     ], dtype = np.float32)
     collision_penalty = np.clip(collision_penalty, a_min = -0.020, a_max = 0.020)
     ax[1][2].plot(collision_penalty)
     ax[1][3].set_xlabel('steps')
     ax[1][3].set_ylabel('outer reward')
     outer_reward = np.array([
-        info['outer_reward'] for info in INFO
+        info['reward_components'][info['reward_keys'].index('outer_reward')] for info in INFO
     ], dtype = np.float32)
     outer_reward = np.clip(outer_reward, a_min = -0.020, a_max = 0.020)
     ax[1][3].plot(outer_reward)
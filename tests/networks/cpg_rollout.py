@@ -0,0 +1,97 @@
+import time
+import argparse
+import numpy as np
+import torch
+from neurorobotics.constants import params
+from neurorobotics.networks.cpg import get_polynomial_coef, hopf_mod, \
+    ModifiedHopfCPGTorch, ModifiedHopfCPGRollout, compile_rollout
+
+
+def check_equivalence(C, num_osc, steps, dt):
+    phi = np.arange(num_osc, dtype = np.float32) * 2 * np.pi / num_osc
+    z = np.concatenate([np.cos(phi), np.sin(phi)], -1).astype(np.float32)
+    omega = 1.6 * np.ones((num_osc,), dtype = np.float32)
+    mu = np.ones((num_osc,), dtype = np.float32)
+    Z_ref = hopf_mod(num_osc, omega, mu, z.copy(), C, params['degree'], steps, dt)
+    rollout = ModifiedHopfCPGRollout(num_osc, C, dt)
+    with torch.no_grad():
+        Z = rollout(
+            torch.from_numpy(z)[None],
+            torch.from_numpy(omega)[None],
+            torch.from_numpy(mu)[None],
+            steps
+        )[:, 0].numpy()
+    err = np.max(np.abs(Z - Z_ref))
+    print('Max absolute error against `hopf_mod`: {:.3e}'.format(err))
+    assert err < 1e-3
+
+
+def benchmark(fn, steps, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return steps * repeats / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark batched Modified Hopf CPG rollouts on CPU.')
+    parser.add_argument(
+        '--num_osc',
+        type = int,
+        default = 4,
+        help = 'number of oscillators'
+    )
+    parser.add_argument(
+        '--timesteps',
+        type = int,
+        default = 500,
+        help = 'number of steps per rollout'
+    )
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 3,
+        help = 'number of timed rollouts per configuration'
+    )
+    parser.add_argument(
+        '--backward',
+        action = 'store_true',
+        help = 'include the backward pass in the timings'
+    )
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+    dt = params['dt']
+    C = get_polynomial_coef(params['degree'], params['thresholds'], dt * 50)
+    check_equivalence(C, args.num_osc, args.timesteps, dt)
+
+    step = ModifiedHopfCPGTorch(args.num_osc)
+    rollout = ModifiedHopfCPGRollout(args.num_osc, C, dt)
+    backends = {'eager': rollout, 'script': compile_rollout(rollout, 'script')}
+    C_torch = torch.as_tensor(C, dtype = torch.float32)
+    print('{:>6} {:>10} {:>14} {:>14}'.format('B', 'backend', 'steps/sec', 'osc-steps/sec'))
+    for B in [1, 64, 1024]:
+        Z = torch.rand((B, 2 * args.num_osc))
+        omega = torch.rand((B, args.num_osc)) * np.pi + np.pi / 6
+        mu = torch.rand((B, args.num_osc))
+        omega.requires_grad_(args.backward)
+
+        def run_step_loop():
+            z = Z
+            for _ in range(args.timesteps):
+                z = step(z, omega, mu, C_torch, params['degree'], dt)
+            if args.backward:
+                z.sum().backward()
+
+        rate = benchmark(run_step_loop, args.timesteps, args.repeats)
+        print('{:>6} {:>10} {:>14.1f} {:>14.1f}'.format(B, 'step-loop', rate, rate * B))
+        for name, module in backends.items():
+
+            def run_rollout():
+                out = module(Z, omega, mu, args.timesteps)
+                if args.backward:
+                    out.sum().backward()
+
+            rate = benchmark(run_rollout, args.timesteps, args.repeats)
+            print('{:>6} {:>10} {:>14.1f} {:>14.1f}'.format(B, name, rate, rate * B))
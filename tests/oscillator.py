@@ -0,0 +1,139 @@
+import time
+import argparse
+import numpy as np
+from neurorobotics.constants import params
+from neurorobotics.oscillator import _get_beta, _get_omega_choice, _get_polynomial_coef, \
+    cpg_step_v2, cpg_v2, get_phase_response, hopf_mod, hopf_mod_step
+
+
+def reference_feedback(omega, mu, C, degree, theta, P, h = 1e-4):
+    # Feedback of `cpg_step_v2` at asymptotic phase `theta` from a dense integration over the cycle.
+    beta = _get_beta(omega, C, degree).astype(np.float64)
+    mean = np.abs(1 / (2 * beta * (1 - beta)))
+    amplitude = (1 - 2 * beta) / (2 * beta * (1 - beta))
+    phi = np.linspace(0, 2 * np.pi, 200001)
+
+    def w(phi, i):
+        wrapped = np.arctan2(np.sin(phi), np.cos(phi))
+        return np.abs(omega[i]) * (mean[i] + amplitude[i] * _get_omega_choice(wrapped)) * params['alpha']
+
+    q = np.zeros(2 * len(omega))
+    for i in range(len(omega)):
+        rate = 1 / w(phi, i)
+        t = np.concatenate([[0.0], np.cumsum(np.diff(phi) * (rate[1:] + rate[:-1]) / 2)])
+        frequency = 2 * np.pi / t[-1]
+        radius = np.sqrt(mu[i] / params['beta'])
+
+        def zsf(theta):
+            cycle_phi = np.interp(np.mod(theta, 2 * np.pi), frequency * t, phi)
+            scale = frequency / (w(cycle_phi, i) * radius)
+            return np.array([-scale * np.sin(cycle_phi), scale * np.cos(cycle_phi)])
+
+        dzsf = (zsf(theta[i] + h) - zsf(theta[i] - h)) / (2 * h)
+        q[[i, i + len(omega)]] = np.sqrt(P) * dzsf / np.linalg.norm(dzsf)
+    return q
+
+
+def simulated_period(omega, mu, C, degree, dt, periods = 3):
+    # Time between upward crossings of the x axis of `hopf_mod` started on the limit cycle
+    z = np.concatenate([np.sqrt(mu / params['beta']), np.zeros_like(mu)], -1)
+    prc = get_phase_response(omega, mu, C, degree)
+    N = int((periods + 0.5) * prc.period.max() / dt)
+    Z, _ = hopf_mod(omega, mu, z, C, degree, N, dt)
+    out = []
+    for i in range(len(omega)):
+        y = Z[:, len(omega) + i]
+        crossings = np.nonzero((y[:-1] < 0) & (y[1:] >= 0))[0]
+        # Crossing times interpolated between the steps
+        times = (crossings + 1 + y[crossings] / (y[crossings] - y[crossings + 1])) * dt
+        out.append(np.mean(np.diff(times)))
+    return np.array(out)
+
+
+def check_phase_response(omega, mu, phase, C, degree, dt):
+    prc = get_phase_response(omega, mu, C, degree)
+    assert get_phase_response(omega, mu, C, degree) is prc
+    assert np.allclose(prc.period, simulated_period(omega, mu, C, degree, dt), rtol = 1e-3)
+    # Phases away from the switches of `_get_omega_choice` at angles 0 and pi
+    switches = np.stack([np.zeros_like(omega), prc.phase(np.concatenate([-np.ones_like(omega), np.zeros_like(omega)]))])
+    rng = np.random.default_rng(params['seed'])
+    checked = 0
+    z = np.concatenate([np.sqrt(mu / params['beta']) * np.cos(phase), np.sqrt(mu / params['beta']) * np.sin(phase)])
+    while checked < 50:
+        t = rng.uniform(0, 10, size = omega.shape).astype(np.float32)
+        theta = np.mod(prc.frequency * t + phase, 2 * np.pi)
+        distance = np.abs(np.angle(np.exp(1j * (theta[np.newaxis] - switches))))
+        if distance.min() < 0.05:
+            continue
+        checked += 1
+        expected = reference_feedback(omega, mu, C, degree, theta, params['power'])
+        z_next, w, q = cpg_step_v2(omega, mu, z, t, phase, C, degree, dt, prc)
+        assert np.allclose(q, expected, atol = 2e-3), (q, expected)
+        # The step of `cpg_step_v2` is the plain step with the feedback
+        z_ref, w_ref = hopf_mod_step(omega, mu, z, C, degree, dt)
+        assert np.array_equal(w, w_ref) and np.allclose(z_next, z_ref + dt * q, rtol = 0, atol = 1e-12)
+        assert np.array_equal(cpg_step_v2(omega, mu, z, t, phase, C, degree, dt)[0], z_next)
+    # Without feedback power `cpg_step_v2` is the plain step
+    power = params['power']
+    params['power'] = 0.0
+    try:
+        assert np.array_equal(cpg_step_v2(omega, mu, z, t, phase, C, degree, dt, prc)[0], hopf_mod_step(omega, mu, z, C, degree, dt)[0])
+    finally:
+        params['power'] = power
+    # `cpg_v2` unrolls `cpg_step_v2` from the limit cycle at `phase`
+    N = 200
+    Z, W, T, Q = cpg_v2(omega, mu, phase, C, degree, N, dt)
+    t = np.zeros(mu.shape, dtype = np.float32)
+    for i in range(N):
+        z, w, q = cpg_step_v2(omega, mu, z, t, phase, C, degree, dt, prc)
+        t += dt
+        assert np.array_equal(Z[i], z) and np.array_equal(W[i], w) and np.array_equal(Q[i], q) and np.array_equal(T[i], t)
+    return prc, z
+
+
+def timeit(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Test the phase response tables of `cpg_step_v2` against a dense integration and benchmark a feedback step.')
+    parser.add_argument(
+        '--num_osc',
+        type = int,
+        default = 4,
+        help = 'number of oscillators'
+    )
+    parser.add_argument(
+        '--dt',
+        type = float,
+        default = 0.001,
+        help = 'sampling period'
+    )
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 2000,
+        help = 'number of timed steps'
+    )
+    args = parser.parse_args()
+    num_osc = args.num_osc
+    C = _get_polynomial_coef(params['degree'], params['thresholds'], args.dt * 50)
+    omega = np.arange(1, num_osc + 1, dtype = np.float32) * np.pi * 2 / (num_osc + 1)
+    mu = np.linspace(0.5, 1.0, num_osc).astype(np.float32)
+    phase = np.linspace(0, np.pi, num_osc).astype(np.float32)
+    prc, z = check_phase_response(omega, mu, phase, C, params['degree'], args.dt)
+    print('Phase response tables match the dense integration and the simulated period')
+
+    t = np.ones(mu.shape, dtype = np.float32)
+    print('{:>28} {:>10}'.format('step', 'us'))
+    rows = [
+        ('hopf_mod_step', lambda: hopf_mod_step(omega, mu, z, C, params['degree'], args.dt)),
+        ('cpg_step_v2, cached lookup', lambda: cpg_step_v2(omega, mu, z, t, phase, C, params['degree'], args.dt)),
+        ('cpg_step_v2, prebuilt table', lambda: cpg_step_v2(omega, mu, z, t, phase, C, params['degree'], args.dt, prc)),
+    ]
+    for name, fn in rows:
+        print('{:>28} {:>10.1f}'.format(name, timeit(fn, args.repeats) * 1e6))
@@ -0,0 +1,140 @@
+import time
+import argparse
+import numpy as np
+from neurorobotics.constants import params
+from neurorobotics.reward import FitnessFunction, FitnessFunctionV2
+from neurorobotics.reward.zmp import ZMP
+from neurorobotics.reward.trajectory import TrajectoryFitnessFunction, \
+    TrajectoryFitnessFunctionV2
+
+
+def random_trajectory(rng, steps, Tb):
+    t = np.mod(np.arange(steps) * params['dt'], Tb)
+    feet = {
+        key: rng.normal(size = (steps, 3)) for key in ['A', 'B', 'AL', 'BL', 'AF', 'BF']
+    }
+    # Degenerate support polygons exercise the fallbacks of the per step API.
+    feet['BL'][::7] = feet['AL'][::7]
+    feet['B'][::11] = feet['A'][::11]
+    feet['AF'][::13] = feet['A'][::13]
+    data = {
+        key: rng.normal(size = (steps, 3)) for key in ['com', 'force', 'torque', 'acc', 'v_real', 'v_exp']
+    }
+    data['pos'] = np.cumsum(data['v_real'] * params['dt'], 0)
+    data['last_pos'] = np.concatenate([np.zeros((1, 3)), data['pos'][:-1]], 0)
+    data['desired_motion'] = rng.normal(size = (steps, 6))
+    data['joint_torque'] = rng.normal(size = (steps, 12))
+    data['joint_vel'] = rng.normal(size = (steps, 12))
+    return t, feet, data
+
+
+def max_error(a, b):
+    a, b = np.asarray(a), np.asarray(b)
+    assert np.array_equal(np.isnan(a), np.isnan(b))
+    mask = ~np.isnan(a)
+    # The ZMP divides by the normal force, relative error stays meaningful
+    # when it nearly vanishes.
+    return np.max(np.abs(a[mask] - b[mask]) / (1.0 + np.abs(b[mask])), initial = 0.0)
+
+
+def per_step_v1(t, Tb, feet, data, eta):
+    # `reward.FitnessFunction` is constructed with the `ZMP` of `reward.zmp_v2`
+    # since the module rebinds the name, use the force and torque based one.
+    fitness = FitnessFunction(params)
+    fitness.zmp = ZMP(params)
+    zmp, stability, motion = [], [], []
+    for i in range(len(t)):
+        fitness.build(t[i], Tb, *[{'position': feet[key][i]} for key in ['A', 'B', 'AL', 'BL', 'AF', 'BF']])
+        stability.append(fitness.stability_reward(
+            data['com'][i], data['force'][i], data['torque'][i],
+            data['v_real'][i], data['v_exp'][i], eta, None, None
+        ))
+        zmp.append(fitness.zmp(
+            data['com'][i], data['force'][i], data['torque'][i],
+            data['v_real'][i], data['v_exp'][i], eta
+        ))
+        motion.append([
+            fitness.COT(data['joint_torque'][i], data['joint_vel'][i], data['v_real'][i], 1.0, 9.8, params['dt']),
+            fitness.motion_reward(data['pos'][i], data['last_pos'][i], data['desired_motion'][i]),
+            fitness.motion_reward_v2(data['pos'][i], data['last_pos'][i], data['v_real'][i], data['desired_motion'][i]),
+            fitness.motion_reward_v3(data['pos'][i], data['last_pos'][i], data['v_real'][i], data['desired_motion'][i]),
+        ])
+    return np.stack(zmp, 0), np.array(stability), np.array(motion)
+
+
+def batched_v1(t, Tb, feet, data, eta):
+    fitness = TrajectoryFitnessFunction(params)
+    fitness.build(t, Tb, *[feet[key] for key in ['A', 'B', 'AL', 'BL', 'AF', 'BF']])
+    args = [data[key] for key in ['com', 'force', 'torque', 'v_real', 'v_exp']]
+    stability = np.stack(fitness.stability_reward(*args, eta), -1)
+    motion = np.stack([
+        fitness.COT(data['joint_torque'], data['joint_vel'], data['v_real'], 1.0, 9.8, params['dt']),
+        fitness.motion_reward(data['pos'], data['last_pos'], data['desired_motion']),
+        fitness.motion_reward_v2(data['pos'], data['last_pos'], data['v_real'], data['desired_motion']),
+        fitness.motion_reward_v3(data['pos'], data['last_pos'], data['v_real'], data['desired_motion']),
+    ], -1)
+    return fitness.zmp(*args, eta), stability, motion
+
+
+def per_step_v2(t, Tb, feet, data, eta):
+    fitness = FitnessFunctionV2(params)
+    zmp, planes, stability = [], [], []
+    for i in range(len(t)):
+        # `FitnessFunctionV2.build` modifies degenerate feet in place.
+        fitness.build(t[i], Tb, *[feet[key][i].copy() for key in ['A', 'B', 'AL', 'BL', 'AF', 'BF']])
+        stability.append(fitness.stability_reward(
+            data['com'][i], data['acc'][i], data['v_real'][i], data['v_exp'][i], eta
+        ))
+        zmp.append(fitness.zmp(data['com'][i], data['acc'][i], data['v_real'][i], data['v_exp'][i], eta))
+        planes.append(fitness.zmp.plane)
+    return np.stack(zmp, 0), np.stack(planes, 0), np.array(stability)
+
+
+def batched_v2(t, Tb, feet, data, eta):
+    fitness = TrajectoryFitnessFunctionV2(params)
+    fitness.build(t, Tb, *[feet[key] for key in ['A', 'B', 'AL', 'BL', 'AF', 'BF']])
+    args = [data[key] for key in ['com', 'acc', 'v_real', 'v_exp']]
+    stability = np.stack(fitness.stability_reward(*args, eta), -1)
+    return fitness.zmp(*args, eta), fitness.plane, stability
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test batched trajectory rewards against the per step `reward.FitnessFunction` API.')
+    parser.add_argument(
+        '--timesteps',
+        type = int,
+        default = 5000,
+        help = 'number of steps in the random trajectory'
+    )
+    parser.add_argument(
+        '--tol',
+        type = float,
+        default = 1e-6,
+        help = 'maximum allowed relative error'
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(params['seed'])
+    Tb = 0.7
+    eta = 0.1
+    t, feet, data = random_trajectory(rng, args.timesteps, Tb)
+
+    (zmp_ref, stability_ref, motion_ref), loop = timed(per_step_v1, t, Tb, feet, data, eta)
+    (zmp, stability, motion), batched = timed(batched_v1, t, Tb, feet, data, eta)
+    errors = [max_error(zmp, zmp_ref), max_error(stability, stability_ref), max_error(motion, motion_ref)]
+    print('FitnessFunction   zmp {:.3e} stability {:.3e} motion {:.3e}'.format(*errors))
+    print('                  loop {:.2f} ms, batched {:.2f} ms'.format(loop * 1e3, batched * 1e3))
+    assert max(errors) < args.tol, errors
+
+    (zmp_ref, plane_ref, stability_ref), loop = timed(per_step_v2, t, Tb, feet, data, eta)
+    (zmp, plane, stability), batched = timed(batched_v2, t, Tb, feet, data, eta)
+    errors = [max_error(zmp, zmp_ref), max_error(plane, plane_ref), max_error(stability, stability_ref)]
+    print('FitnessFunctionV2 zmp {:.3e} plane {:.3e} stability {:.3e}'.format(*errors))
+    print('                  loop {:.2f} ms, batched {:.2f} ms'.format(loop * 1e3, batched * 1e3))
+    assert max(errors) < args.tol, errors
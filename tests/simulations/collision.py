@@ -0,0 +1,186 @@
+import time
+import argparse
+import numpy as np
+from neurorobotics.constants import params
+from neurorobotics.simulations.collision import ContactFilter, WallDistanceField, WallSegments
+from neurorobotics.simulations.maze_env_utils import CollisionDetector, compile_maze
+from neurorobotics.simulations.maze_task import MAPS
+
+
+def reference_check_position(structure, row, row_frac, col, col_frac):
+    # `Environment.check_position` on the list of lists.
+    blind = [False, False, False, False]
+    collision = False
+    outbound = False
+    neighbors = [(row, col + 1), (row, col - 1), (row + 1, col), (row - 1, col)]
+    rpos = np.array([row_frac - 0.5, col_frac - 0.5], dtype=np.float32)
+    if row > 0 and col > 0 and row < len(structure) - 1 and col < len(structure[0]) - 1:
+        for i, (nrow, ncol) in enumerate(neighbors):
+            if not structure[nrow][ncol].is_empty():
+                distance = float(np.dot(rpos, np.array([nrow - row, ncol - col], dtype=np.float32)))
+                if distance > 0.325:
+                    collision = True
+                if distance > 0.35:
+                    blind[i] = True
+    else:
+        outbound = True
+    return collision, blind, outbound
+
+
+def reference_in_collision(contacts, ncon, obstacles_ids, agent_ids):
+    # Contacts between the agent and obstacles among the active contacts.
+    for contact in contacts[:ncon]:
+        geom1, geom2 = contact.geom1, contact.geom2
+        if geom1 != 0 and geom2 != 0:
+            if (geom1 in obstacles_ids and geom2 in agent_ids) or (geom2 in obstacles_ids and geom1 in agent_ids):
+                return True
+    return False
+
+
+class Contact:
+    def __init__(self, geom1, geom2):
+        self.geom1 = geom1
+        self.geom2 = geom2
+
+
+class Data:
+    # Contacts as a list of structs as in `mujoco_py`.
+    def __init__(self, contacts, ncon):
+        self.contact = contacts
+        self.ncon = ncon
+
+
+class ContactArrays:
+    # Contacts as arrays of fields as in the `mujoco` bindings.
+    def __init__(self, contacts):
+        self.geom1 = np.array([contact.geom1 for contact in contacts])
+        self.geom2 = np.array([contact.geom2 for contact in contacts])
+
+
+def check_distance_field(structure, rng):
+    maze = compile_maze(structure)
+    field = maze.distance_field()
+    h, w = maze.shape
+    n = 500
+    rows, cols = rng.integers(-1, h + 1, n), rng.integers(-1, w + 1, n)
+    row_fracs, col_fracs = rng.uniform(size=n), rng.uniform(size=n)
+    collisions, blinds, outbounds = field.query(rows, row_fracs, cols, col_fracs)
+    for k in range(n):
+        expected = reference_check_position(structure, rows[k], row_fracs[k], cols[k], col_fracs[k])
+        assert field.check(rows[k], row_fracs[k], cols[k], col_fracs[k]) == expected
+        assert (bool(collisions[k]), blinds[k].tolist(), bool(outbounds[k])) == expected
+    # Distances to the faces of the walls along the axes
+    for (i, j) in zip(*np.nonzero(maze.empty)):
+        for k, (dr, dc) in enumerate(maze.OFFSETS_4):
+            steps = 1
+            while 0 <= i + steps * dr < h and 0 <= j + steps * dc < w and maze.empty[i + steps * dr, j + steps * dc]:
+                steps += 1
+            assert field.distances[k, i, j] == steps - 0.5
+    inside = ~outbounds
+    clearance = field.clearance(rows[inside], row_fracs[inside], cols[inside], col_fracs[inside])
+    assert np.all((clearance < 0.5 - 0.325 + 1e-6) >= collisions[inside])
+
+
+def check_segments(structure, rng):
+    maze = compile_maze(structure)
+    radius = 0.5
+    detector = CollisionDetector(structure, 4.0, 0.0, 0.0, radius)
+    n = 300
+    h, w = maze.shape
+    starts = rng.uniform(-4.0, 4.0 * max(h, w), size=(n, 2))
+    ends = starts + rng.normal(scale=3.0, size=(n, 2))
+    ends[:10] = starts[:10]
+    hits, points, rests = detector.detect_many(starts, ends)
+    for k in range(n):
+        collision = detector.detect(starts[k], ends[k])
+        assert (collision is None) == (not hits[k])
+        if collision is not None:
+            assert np.allclose(points[k], collision.point) and np.allclose(rests[k], collision.rest())
+        else:
+            assert np.isnan(points[k]).all() and np.isnan(rests[k]).all()
+    # Touching segments intersect, moves along a wall and empty walls do not
+    walls = WallSegments([[0.0, 0.0]], [[1.0, 0.0]])
+    hit, index, point, _ = walls.intersect([[0.5, -1.0], [-1.0, 0.0], [2.0, 1.0]], [[0.5, 0.0], [2.0, 0.0], [2.0, 2.0]])
+    assert hit.tolist() == [True, False, False] and index.tolist() == [0, -1, -1] and np.allclose(point[0], [0.5, 0.0])
+    hit, _, _, _ = WallSegments(np.zeros((0, 2)), np.zeros((0, 2))).intersect([[0.0, 0.0]], [[1.0, 1.0]])
+    assert not hit.any()
+
+
+def check_contacts(rng):
+    ngeom = 40
+    obstacles_ids = rng.choice(np.arange(1, ngeom), 15, replace=False).tolist()
+    agent_ids = [i for i in range(1, ngeom) if i not in obstacles_ids][:10]
+    contact_filter = ContactFilter(ngeom, obstacles_ids, agent_ids)
+    for _ in range(300):
+        contacts = [Contact(*rng.integers(0, ngeom, 2)) for _ in range(20)]
+        ncon = int(rng.integers(0, 21))
+        expected = reference_in_collision(contacts, ncon, obstacles_ids, agent_ids)
+        assert contact_filter.in_collision(Data(contacts, ncon)) == expected
+        assert contact_filter.in_collision(Data(ContactArrays(contacts), ncon)) == expected
+    # Contacts with the world do not hide later collisions, inactive contacts are ignored
+    contacts = [Contact(0, agent_ids[0]), Contact(obstacles_ids[0], agent_ids[0]), Contact(obstacles_ids[1], agent_ids[1])]
+    assert contact_filter.in_collision(Data(contacts, 2))
+    assert not contact_filter.in_collision(Data(contacts[::-1][1:] + contacts[:1], 0))
+
+
+def timeit(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test the vectorized collision queries against the loops they replace and benchmark them.')
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 1000,
+        help = 'number of timed calls'
+    )
+    parser.add_argument(
+        '--agents',
+        type = int,
+        default = 64,
+        help = 'number of agents of the batched queries'
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(params['seed'])
+    for name in ['simple_room', 'local_planner']:
+        check_distance_field(MAPS[name], rng)
+        check_segments(MAPS[name], rng)
+    check_contacts(rng)
+    # Cells outside the maze are occupied
+    field = WallDistanceField(np.eye(3, dtype=bool), [(0, 1)])
+    assert field.distances[0].tolist() == [[2.5, 1.5, 0.5], [0.5, 1.5, 0.5], [1.5, 0.5, 0.5]]
+    print('Collision queries match the loops they replace')
+
+    structure = MAPS['simple_room']
+    maze = compile_maze(structure)
+    field = maze.distance_field()
+    detector = CollisionDetector(structure, 4.0, 0.0, 0.0, 0.5)
+    contacts = [Contact(*rng.integers(1, 40, 2)) for _ in range(20)]
+    data = Data(contacts, len(contacts))
+    obstacles_ids, agent_ids = list(range(20, 30)), list(range(1, 5))
+    contact_filter = ContactFilter(40, obstacles_ids, agent_ids)
+    n = args.agents
+    rows, cols = rng.integers(1, maze.shape[0] - 1, n), rng.integers(1, maze.shape[1] - 1, n)
+    row_fracs, col_fracs = rng.uniform(size=n), rng.uniform(size=n)
+    starts = rng.uniform(0.0, 4.0 * maze.shape[0], size=(n, 2))
+    ends = starts + rng.normal(scale=3.0, size=(n, 2))
+    print('{:>28} {:>12} {:>14}'.format('query', 'loop us', 'vectorized us'))
+    rows_timed = [
+        ('check_position', lambda: reference_check_position(structure, 3, 0.9, 3, 0.2),
+            lambda: field.check(3, 0.9, 3, 0.2)),
+        ('check_position x{}'.format(n),
+            lambda: [reference_check_position(structure, *args) for args in zip(rows, row_fracs, cols, col_fracs)],
+            lambda: field.query(rows, row_fracs, cols, col_fracs)),
+        ('in_collision, 20 contacts', lambda: reference_in_collision(contacts, len(contacts), obstacles_ids, agent_ids),
+            lambda: contact_filter.in_collision(data)),
+        ('detect x{}'.format(n), lambda: [detector.detect(s, e) for s, e in zip(starts, ends)],
+            lambda: detector.detect_many(starts, ends)),
+    ]
+    for name, reference, vectorized in rows_timed:
+        repeats = args.repeats if 'x' not in name.split()[-1] else max(args.repeats // 20, 1)
+        print('{:>28} {:>12.1f} {:>14.1f}'.format(name, timeit(reference, repeats) * 1e6, timeit(vectorized, repeats) * 1e6))
@@ -0,0 +1,173 @@
+import time
+import argparse
+import itertools as it
+import numpy as np
+import networkx as nx
+from neurorobotics.constants import params
+from neurorobotics.simulations.maze_env_utils import MazeCell, CompiledMaze, CollisionDetector, Line, compile_maze
+from neurorobotics.simulations.maze_env import SimpleRoomEnv
+from neurorobotics.simulations.maze_task import MAPS, create_simple_room_maze, create_local_planner_area
+
+
+def reference_check_position(structure, row, row_frac, col, col_frac):
+    # `Environment.check_position` on the list of lists.
+    blind = [False, False, False, False]
+    collision = False
+    outbound = False
+    neighbors = [(row, col + 1), (row, col - 1), (row + 1, col), (row - 1, col)]
+    rpos = np.array([row_frac - 0.5, col_frac - 0.5], dtype=np.float32)
+    if row > 0 and col > 0 and row < len(structure) - 1 and col < len(structure[0]) - 1:
+        for i, (nrow, ncol) in enumerate(neighbors):
+            if not structure[nrow][ncol].is_empty():
+                distance = np.dot(rpos, np.array([nrow - row, ncol - col], dtype=np.float32))
+                if distance > 0.325:
+                    collision = True
+                if distance > 0.35:
+                    blind[i] = True
+    else:
+        outbound = True
+    return collision, blind, outbound
+
+
+def reference_graph(structure):
+    # `Environment._create_maze_graph` on the list of lists.
+    num_row, num_col = len(structure), len(structure[0])
+    graph = nx.DiGraph()
+    graph.add_nodes_from(np.arange(0, num_row * num_col))
+    for i, j in it.product(range(num_row), range(num_col)):
+        for r, c in [(i - 1, j), (i, j - 1), (i + 1, j), (i, j + 1),
+                     (i + 1, j + 1), (i + 1, j - 1), (i - 1, j + 1), (i - 1, j - 1)]:
+            if 0 <= r < num_row and 0 <= c < num_col and not structure[r][c].is_wall_or_chasm():
+                graph.add_edge(i * num_col + j, r * num_col + c)
+    return graph
+
+
+def reference_top_view(structure, block_size):
+    img = np.zeros((int(block_size * len(structure)), int(block_size * len(structure[0])), 3), dtype=np.uint8)
+    for i, j in it.product(range(len(structure)), range(len(structure[0]))):
+        if structure[i][j].is_wall_or_chasm():
+            img[int(block_size * i): int(block_size * (i + 1)), int(block_size * j): int(block_size * (j + 1))] = 128
+    return img
+
+
+def reference_lines(structure, size_scaling, torso_x, torso_y, radius):
+    # `CollisionDetector.__init__` on the list of lists.
+    h, w = len(structure), len(structure[0])
+    lines = []
+    for i, j in it.product(range(h), range(w)):
+        if not structure[i][j].is_block():
+            continue
+        y_base, x_base = i * size_scaling - torso_y, j * size_scaling - torso_x
+        offset = size_scaling * 0.5 + radius
+        min_y, max_y, min_x, max_x = y_base - offset, y_base + offset, x_base - offset, x_base + offset
+        for dx, dy in CollisionDetector.NEIGHBORS:
+            if not (0 <= i + dy < h and 0 <= j + dx < w and structure[i + dy][j + dx].is_empty()):
+                continue
+            lines.append(Line(
+                (max_x if dx == 1 else min_x, max_y if dy == 1 else min_y),
+                (min_x if dx == -1 else max_x, min_y if dy == -1 else max_y),
+            ))
+    return lines
+
+
+def random_structure(rng, size):
+    cells = list(MazeCell)
+    p = np.array([0.3 if cell in [MazeCell.EMPTY, MazeCell.BLOCK] else 0.4 / (len(cells) - 2) for cell in cells])
+    structure = [[cells[k] for k in row] for row in rng.choice(len(cells), size=(size, size), p=p / p.sum())]
+    structure[rng.integers(size)][rng.integers(size)] = MazeCell.ROBOT
+    return structure
+
+
+def make_env(structure):
+    # Only the state used by the maze lookups, no simulation.
+    env = object.__new__(SimpleRoomEnv)
+    env._maze_structure = structure
+    env._maze = compile_maze(structure)
+    env._maze_size_scaling = 4.0
+    env._init_torso_x, env._init_torso_y = env._find_robot()
+    return env
+
+
+def check_maze(structure, rng):
+    maze = compile_maze(structure)
+    assert compile_maze(maze.structure) is maze and hash(CompiledMaze(structure)) == hash(maze)
+    assert maze.structure == structure
+    layers = {
+        'blocks': MazeCell.is_block, 'chasms': MazeCell.is_chasm, 'walls': MazeCell.is_wall_or_chasm,
+        'empty': MazeCell.is_empty, 'robot': MazeCell.is_robot, 'object_balls': MazeCell.is_object_ball,
+        'movable': MazeCell.can_move
+    }
+    for name, predicate in layers.items():
+        assert np.array_equal(getattr(maze, name), [[predicate(cell) for cell in row] for row in structure]), name
+    try:
+        maze.grid[0, 0] = 0
+        raise AssertionError('Expected a read only grid')
+    except ValueError:
+        pass
+
+    env = make_env(structure)
+    for _ in range(200):
+        row, col = rng.integers(-1, maze.shape[0] + 1), rng.integers(-1, maze.shape[1] + 1)
+        row_frac, col_frac = rng.uniform(size=2)
+        env._xy_to_rowcol_v2 = lambda x, y: ((row, row_frac), (col, col_frac))
+        assert env.check_position((0.0, 0.0)) == reference_check_position(structure, row, row_frac, col, col_frac)
+
+    env._create_maze_graph()
+    expected = reference_graph(structure)
+    assert list(env._maze_graph.edges()) == list(expected.edges())
+    for node in env._maze_graph.nodes():
+        assert env._maze_graph.nodes[node]['struct'] == structure[node // maze.shape[1]][node % maze.shape[1]]
+    for block_size in [params['top_view_size'], 12.5]:
+        assert np.array_equal(maze.top_view(block_size), reference_top_view(structure, block_size))
+    lines = CollisionDetector(structure, 4.0, *env._find_robot(), 0.5).lines
+    expected = reference_lines(structure, 4.0, *env._find_robot(), 0.5)
+    assert [(line.p1, line.p2) for line in lines] == [(line.p1, line.p2) for line in expected]
+
+
+def timeit(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test the compiled maze lookups against the `MazeCell` list of lists and benchmark them.')
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 1000,
+        help = 'number of timed calls'
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(params['seed'])
+    for structure in MAPS.values():
+        if len(set(len(row) for row in structure)) == 1 and any(cell.is_robot() for row in structure for cell in row):
+            check_maze(structure, rng)
+    for size in [3, 5, 8, 12]:
+        for _ in range(5):
+            check_maze(random_structure(rng, size), rng)
+    for task_generator in [create_simple_room_maze, create_local_planner_area]:
+        task, structure, open_positions, agent_pos = task_generator(4.0)[:4]
+        maze = compile_maze(structure)
+        assert open_positions == [[i, j] for i, j in it.product(*map(range, maze.shape)) if not structure[i][j].is_wall_or_chasm()]
+        assert structure[agent_pos[0]][agent_pos[1]].is_robot()
+    print('Compiled maze lookups match the `MazeCell` list of lists')
+
+    structure = MAPS['simple_room']
+    env = make_env(structure)
+    env._xy_to_rowcol_v2 = lambda x, y: ((3, 0.9), (3, 0.2))
+    print('{:>20} {:>14} {:>14}'.format('lookup', 'lists us', 'compiled us'))
+    rows = [
+        ('check_position', lambda: reference_check_position(structure, 3, 0.9, 3, 0.2), lambda: env.check_position((0.0, 0.0))),
+        ('maze graph', lambda: reference_graph(structure), env._create_maze_graph),
+        ('top view', lambda: reference_top_view(structure, params['top_view_size']),
+            lambda: env._maze.top_view(params['top_view_size']).copy()),
+        ('collision lines', lambda: reference_lines(structure, 4.0, 0, 0, 0.5),
+            lambda: CollisionDetector(env._maze, 4.0, 0, 0, 0.5)),
+        ('compile_maze', lambda: CompiledMaze(structure), lambda: compile_maze(structure)),
+    ]
+    for name, reference, compiled in rows:
+        repeats = args.repeats if name == 'check_position' else max(args.repeats // 10, 1)
+        print('{:>20} {:>14.1f} {:>14.1f}'.format(name, timeit(reference, repeats) * 1e6, timeit(compiled, repeats) * 1e6))
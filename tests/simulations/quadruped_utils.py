@@ -0,0 +1,101 @@
+import time
+import argparse
+import numpy as np
+from neurorobotics.constants import params
+from neurorobotics.simulations.quadruped import Quadruped
+from neurorobotics.simulations.quadruped_utils import get_gait_trajectory, \
+    get_heading_signs, get_joint_pos
+
+
+def reference_joint_pos(t, gamma, amplitude, omega, beta, task, direction):
+    out = []
+    omegas = []
+    for leg in range(4):
+        group = 0 if leg in [0, 3] else 1
+        sign = 1.0 if leg in [0, 3] else -1.0
+        T = 2 * np.pi / omega[group]
+        ac, timer_omega = Quadruped._compute_joint_pos(
+            None, t + gamma[leg] * T, T,
+            amplitude[group] * 1.0471, amplitude[group] * 1.0471, beta, sign
+        )
+        out.extend(ac)
+        omegas.append(timer_omega)
+    out = np.array(out, dtype = np.float32) * get_heading_signs(task, direction)
+    return out, np.array(omegas)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test accuracy of the tabulated gait trajectories against `Quadruped._compute_joint_pos`.')
+    parser.add_argument(
+        '--samples',
+        type = int,
+        default = 10000,
+        help = 'number of random configurations to test'
+    )
+    parser.add_argument(
+        '--tol',
+        type = float,
+        default = 1e-4,
+        help = 'maximum allowed absolute error in radians'
+    )
+    args = parser.parse_args()
+    gaits = {'ds_crawl': 0.75, 'ls_crawl': 0.75, 'trot': 0.5, 'bound': 0.25}
+    rng = np.random.default_rng(params['seed'])
+    max_err = 0.0
+    for gait, beta in gaits.items():
+        t = rng.uniform(0.0, 10.0, size = (args.samples,))
+        gamma = rng.choice([0.0, 0.25, 0.5, 0.75], size = (args.samples, 4))
+        amplitude = rng.uniform(0.0, 1.0, size = (args.samples, 2))
+        omega = rng.uniform(0.1, 2 * np.pi, size = (args.samples, 2))
+        for task, direction in [('straight', 'forward'), ('straight', 'backward'), ('rotate', 'left'), ('turn', 'right')]:
+            out, timer_omega = get_joint_pos(t, gamma, amplitude, omega, beta, task, direction)
+            ref = np.stack([
+                reference_joint_pos(t[i], gamma[i], amplitude[i], omega[i], beta, task, direction)[0]
+                for i in range(args.samples)
+            ], 0)
+            err = np.max(np.abs(out - ref))
+            max_err = max(max_err, err)
+            print('{:>10} {:>8} {:>8} max abs error {:.3e}'.format(gait, task, direction, err))
+    assert max_err < args.tol, max_err
+
+    # The single robot path of the environment matches the table
+    class Opt:
+        timestep = 0.005
+
+    class Model:
+        opt = Opt()
+
+    env = object.__new__(Quadruped)
+    env._num_legs = 4
+    env.model = Model()
+    env._frame_skip = 1
+    for i, (task, direction) in enumerate([('straight', 'forward'), ('straight', 'left'), ('rotate', 'right'), ('turn', 'right')]):
+        env.task, env.direction, env.beta = task, direction, 0.75
+        env._step = 10 * i + 3
+        env.gamma = gamma[i]
+        out, timer_omega = env._get_joint_pos(amplitude[i], omega[i])
+        # Both leg groups follow the first amplitude and frequency except when turning
+        groups = [0, 1] if task == 'turn' else [0, 0]
+        expected, omegas = get_joint_pos(
+            env._step * env.dt, gamma[i], amplitude[i][groups], omega[i][groups], 0.75, task, direction)
+        assert np.max(np.abs(out - expected)) < args.tol and np.isclose(timer_omega, omegas[-1])
+
+    trajectory = get_gait_trajectory(0.5)
+    start = time.perf_counter()
+    for i in range(args.samples):
+        reference_joint_pos(t[i], gamma[i], amplitude[i], omega[i], 0.5, 'straight', 'forward')
+    reference = (time.perf_counter() - start) / args.samples
+    start = time.perf_counter()
+    for i in range(args.samples):
+        get_joint_pos(t[i], gamma[i], amplitude[i], omega[i], 0.5, 'straight', 'forward')
+    single = (time.perf_counter() - start) / args.samples
+    start = time.perf_counter()
+    get_joint_pos(t, gamma, amplitude, omega, 0.5, 'straight', 'forward')
+    batched = (time.perf_counter() - start) / args.samples
+    start = time.perf_counter()
+    for i in range(args.samples):
+        env._get_joint_pos(amplitude[i], omega[i])
+    scalar = (time.perf_counter() - start) / args.samples
+    print('per robot step: reference {:.2f} us, _get_joint_pos {:.2f} us, table {:.2f} us, batched table {:.3f} us'.format(
+        reference * 1e6, scalar * 1e6, single * 1e6, batched * 1e6))
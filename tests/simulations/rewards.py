@@ -0,0 +1,179 @@
+import time
+import argparse
+import numpy as np
+from neurorobotics.constants import params
+from neurorobotics.simulations.maze_task import create_simple_room_maze
+from neurorobotics.simulations.rewards import STATE, STATE_FIELDS, RewardComponent, RewardFunction, SIMPLE_ROOM_COMPONENTS
+
+
+def reference_components(state, inner_reward_scaling, vmax):
+    # Rewards computed inline by `SimpleRoomEnv.step` before the reward decomposition.
+    s = dict(zip(STATE_FIELDS, state.tolist()))
+    inner_reward = s['wrapped_reward']
+    if bool(s['inframe']):
+        inner_reward = (s['speed'] / vmax) * np.cos(s['heading_error']) * (
+            1 - (np.abs(s['yaw_rate']) / params['max_vyaw'])) * 0.005
+        inner_reward = inner_reward_scaling * inner_reward
+    outer_reward = s['task_reward'] * 0.005
+    collision_penalty = 0.0
+    if s['almost_collision']:
+        collision_penalty += -0.005 * inner_reward_scaling
+    for _ in range(int(s['blind'])):
+        collision_penalty += -0.005 * inner_reward_scaling
+    if s['contact']:
+        collision_penalty += -0.99 * inner_reward_scaling
+    if s['success']:
+        outer_reward += 1.0
+    if s['outbound']:
+        collision_penalty += -0.05 * inner_reward_scaling
+    coverage_reward = s['coverage_gain'] * 0.05
+    return [inner_reward, outer_reward, collision_penalty, coverage_reward]
+
+
+def reference_task_reward(task, achieved_goal, start_pos, inframe):
+    # `SimpleRoom.reward` looping over the objects.
+    reward = 0.0
+    for i, obj in enumerate(task.objects):
+        if i == task.goal_index:
+            if inframe:
+                reward += 0.5 * obj.reward_scale + (
+                    1 - np.linalg.norm(achieved_goal[:2] - obj.pos) / np.linalg.norm(start_pos - obj.pos))
+                if np.linalg.norm(achieved_goal[:2] - obj.pos) <= 2.5 * obj.threshold:
+                    reward += 1.0 * obj.reward_scale
+        else:
+            if obj.neighbor(achieved_goal):
+                reward += -0.1
+    return reward
+
+
+def random_states(rng, n):
+    state = np.zeros((n, len(STATE_FIELDS)))
+    state[:, STATE['wrapped_reward']] = rng.normal(size=n)
+    state[:, STATE['inframe']] = rng.integers(0, 2, n)
+    state[:, STATE['speed']] = rng.uniform(0, 3, n)
+    state[:, STATE['heading_error']] = rng.uniform(-np.pi, np.pi, n)
+    state[:, STATE['yaw_rate']] = rng.uniform(-1.5, 1.5, n)
+    state[:, STATE['task_reward']] = rng.normal(size=n)
+    for name in ['success', 'almost_collision', 'contact', 'outbound']:
+        state[:, STATE[name]] = rng.uniform(size=n) < 0.2
+    state[:, STATE['blind']] = rng.integers(0, 5, n)
+    state[:, STATE['coverage_gain']] = rng.uniform(-0.1, 0.1, n)
+    return state
+
+
+def check_components(rng):
+    reward_function = RewardFunction(inner_reward_scaling=0.5, target_speed=2.25)
+    assert reward_function.names == tuple(component.name for component in SIMPLE_ROOM_COMPONENTS)
+    states = random_states(rng, 200)
+    components = reward_function.compute(states)
+    assert components.shape == (200, 4)
+    for state, row in zip(states, components):
+        expected = reference_components(state, 0.5, 2.25)
+        assert np.allclose(reward_function.compute(state), expected, rtol=0, atol=1e-12)
+        assert np.allclose(row, expected, rtol=0, atol=1e-12)
+    assert np.allclose(reward_function.total(components), components.sum(-1))
+    # Batches of any shape
+    assert reward_function.compute(states.reshape(10, 20, -1)).shape == (10, 20, 4)
+    assert reward_function.state(3, 2).shape == (3, 2, len(STATE_FIELDS))
+
+    # Components are pluggable
+    speed = RewardComponent('speed', compute=lambda state, config: state[..., STATE['speed']] * config['inner_reward_scaling'])
+    gain = RewardComponent('gain', weights=lambda config: {'coverage_gain': config['target_speed']})
+    reward_function = RewardFunction(SIMPLE_ROOM_COMPONENTS[2:] + [speed, gain], inner_reward_scaling=2.0, target_speed=3.0)
+    assert reward_function.names == ('collision_penalty', 'coverage_reward', 'speed', 'gain')
+    assert reward_function.index['speed'] == 2
+    components = reward_function.compute(states)
+    assert np.allclose(components[:, 2], 2.0 * states[:, STATE['speed']])
+    assert np.allclose(components[:, 3], 3.0 * states[:, STATE['coverage_gain']])
+
+
+def check_task_reward(rng):
+    task = create_simple_room_maze(4.0)[0]
+    n = 300
+    positions = np.array([obj.pos for obj in task.objects])
+    # Positions around the objects to reach the thresholds
+    achieved_goals = positions[rng.integers(0, len(positions), n)] + rng.normal(scale=2.0, size=(n, 2))
+    achieved_goals = np.concatenate([achieved_goals, rng.uniform(-np.pi, np.pi, (n, 1))], -1)
+    start_positions = rng.normal(scale=5.0, size=(n, 2)).astype(np.float32)
+    inframe = rng.integers(0, 2, n)
+    rewards = task.rewards(achieved_goals, start_positions, inframe)
+    for k in range(n):
+        expected = reference_task_reward(task, achieved_goals[k], start_positions[k], inframe[k])
+        assert np.isclose(rewards[k], expected, rtol=1e-12, atol=1e-12)
+        observations = {
+            'achieved_goal': achieved_goals[k], 'start_pos': start_positions[k],
+            'inframe': np.array([inframe[k]], dtype=np.float32)
+        }
+        assert np.isclose(task.reward(observations), expected, rtol=1e-12, atol=1e-12)
+    # The object arrays are rebuilt when the task is reset
+    goal_index = (task.goal_index + 1) % len(task.objects)
+    task.reset(task.structure, task.objects, goal_index)
+    assert np.isclose(
+        task.rewards(achieved_goals[:1], start_positions[:1], [1])[0],
+        reference_task_reward(task, achieved_goals[0], start_positions[0], 1)
+    )
+    return task, achieved_goals, start_positions, inframe
+
+
+def timeit(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test the reward decomposition against the inline rewards and benchmark the reward overhead of a step.')
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 2000,
+        help = 'number of timed calls'
+    )
+    parser.add_argument(
+        '--agents',
+        type = int,
+        default = 64,
+        help = 'number of agents of the batched rewards'
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(params['seed'])
+    check_components(rng)
+    task, achieved_goals, start_positions, inframe = check_task_reward(rng)
+    print('Reward components match the inline rewards of `SimpleRoomEnv.step`')
+
+    reward_function = RewardFunction(inner_reward_scaling=1.0, target_speed=2.25)
+    n = args.agents
+    states = random_states(rng, n)
+    state = states[0].copy()
+    observations = {
+        'achieved_goal': achieved_goals[0], 'start_pos': start_positions[0], 'inframe': np.array([1.0], dtype=np.float32)
+    }
+
+    def inline_step():
+        task_reward = reference_task_reward(task, achieved_goals[0], start_positions[0], 1)
+        components = reference_components(state, 1.0, 2.25)
+        info = {'reward_keys': ['inner_reward', 'outer_reward', 'collision_penalty', 'coverage_reward']}
+        info.update(zip(info['reward_keys'], components))
+        return task_reward, sum(components), info
+
+    def decomposed_step():
+        state[STATE['task_reward']] = task.reward(observations)
+        components = reward_function.compute(state)
+        return float(reward_function.total(components)), {'reward_keys': reward_function.names, 'reward_components': components}
+
+    print('{:>24} {:>12} {:>14}'.format('rewards', 'inline us', 'decomposed us'))
+    rows = [
+        ('step', inline_step, decomposed_step),
+        ('task reward', lambda: reference_task_reward(task, achieved_goals[0], start_positions[0], 1),
+            lambda: task.reward(observations)),
+        ('step x{}'.format(n), lambda: [reference_components(s, 1.0, 2.25) for s in states],
+            lambda: reward_function.compute(states)),
+        ('task reward x{}'.format(n),
+            lambda: [reference_task_reward(task, *args) for args in zip(achieved_goals[:n], start_positions[:n], inframe[:n])],
+            lambda: task.rewards(achieved_goals[:n], start_positions[:n], inframe[:n])),
+    ]
+    for name, inline, decomposed in rows:
+        repeats = args.repeats if 'x' not in name.split()[-1] else max(args.repeats // 20, 1)
+        print('{:>24} {:>12.1f} {:>14.1f}'.format(name, timeit(inline, repeats) * 1e6, timeit(decomposed, repeats) * 1e6))
@@ -0,0 +1,194 @@
+import os
+import time
+import pickle
+import random
+import argparse
+import tempfile
+import numpy as np
+from neurorobotics.constants import params
+from neurorobotics.simulations.maze_env import LocalPlannerEnv, SimpleRoomEnv
+from neurorobotics.simulations.maze_task import create_local_planner_area, create_simple_room_maze
+from neurorobotics.simulations.task_bank import TaskBank, plan_task
+
+GENERATORS = [
+    (create_simple_room_maze, SimpleRoomEnv),
+    (create_local_planner_area, LocalPlannerEnv),
+]
+
+
+def generate(generator, env_cls, seed, maze_size_scaling=4.0):
+    # Task of `seed` generated and planned on the fly, as on reset
+    random.seed(seed)
+    np.random.seed(seed)
+    sample = generator(maze_size_scaling)
+    return sample, plan_task(env_cls, sample, maze_size_scaling)
+
+
+def env_without_simulation(env_cls, bank):
+    # State of an environment read by `_set_structure` and `_plan_path`
+    env = object.__new__(env_cls)
+    env._maze_size_scaling = bank.maze_size_scaling
+    env._task_bank = bank
+    env._task_entry = None
+    env._task_rng = None
+    return env
+
+
+def drawn_seeds(env, n):
+    seeds = []
+    for _ in range(n):
+        env._set_structure()
+        seeds.append(env._task_entry.seed)
+    return seeds
+
+
+def check_seeded_draws(env_cls, bank):
+    # Copies of an environment pickled with the bank, as by `SubprocVecEnv`, draw the same tasks until seeded
+    env = env_without_simulation(env_cls, bank)
+    copies = [pickle.loads(pickle.dumps(env)) for _ in range(2)]
+    assert drawn_seeds(copies[0], 20) == drawn_seeds(copies[1], 20)
+    # Seeded with their rank as by `VecEnv.seed`, the copies draw different sequences, reproduced by the seed
+    for rank, copy in enumerate(copies):
+        copy.seed(params['seed'] + rank)
+    sequences = [drawn_seeds(copy, 20) for copy in copies]
+    assert sequences[0] != sequences[1]
+    copies[1].seed(params['seed'])
+    assert drawn_seeds(copies[1], 20) == sequences[0]
+    # Environments sharing the bank, as in `DummyVecEnv`, draw independently of each other
+    shared = [env_without_simulation(env_cls, bank) for _ in range(2)]
+    for rank, env in enumerate(shared):
+        env.seed(params['seed'] + rank)
+    interleaved = [drawn_seeds(env, 1)[0] for _ in range(20) for env in shared]
+    assert [interleaved[0::2], interleaved[1::2]] == sequences
+
+
+def check_objects(objects, expected):
+    assert len(objects) == len(expected)
+    for obj, other in zip(objects, expected):
+        assert type(obj) == type(other) and obj.kind == other.kind
+        assert obj.pos.dtype == other.pos.dtype and np.array_equal(obj.pos, other.pos)
+        assert obj.threshold == other.threshold and obj.is_target == other.is_target
+        assert obj.reward_scale == other.reward_scale and obj.custom_size == other.custom_size
+        if obj.kind == 'object':
+            assert obj.rgb == other.rgb and obj.rgb.rgba_str() == other.rgb.rgba_str()
+            assert obj.site_type == other.site_type
+            assert np.array_equal(obj.min_range, other.min_range) and np.array_equal(obj.max_range, other.max_range)
+        else:
+            assert obj.position_error_threshold == other.position_error_threshold and obj.ori == other.ori
+
+
+def check_entry(entry, generator, env_cls):
+    sample, plan = generate(generator, env_cls, entry.seed)
+    task, expected = entry.sample[0], sample[0]
+    assert type(task) == type(expected) and task.goal_index == expected.goal_index
+    assert task.scale == expected.scale and task.reward_threshold == expected.reward_threshold
+    check_objects(task.objects, expected.objects)
+    assert entry.sample[1] == sample[1] and task.structure == expected.structure
+    assert entry.sample[2] == sample[2] and entry.sample[3] == sample[3]
+    assert entry.sample[4:] == sample[4:]
+    assert np.array_equal(entry.init_pos, plan['init_pos']) and entry.init_ori == plan['init_ori']
+    assert np.array_equal(entry.start_pos, plan['start_pos']) and entry.start_ori == plan['start_ori']
+    assert entry.path == plan['path']
+    assert np.array_equal(np.stack([entry.wx, entry.wy], -1), plan['waypoints'])
+    assert np.array_equal(np.stack(entry.course, -1), plan['course'])
+
+
+def check_bank(generator, env_cls, size, n_workers):
+    seed = params['seed']
+    bank = TaskBank.generate(generator, env_cls, size, seed=seed, n_workers=n_workers, chunk_size=8)
+    assert len(bank) == size and bank.seeds.tolist() == list(range(seed, seed + size))
+    # Generation does not depend on the workers and leaves the global generators untouched
+    state = np.random.get_state()[1].copy(), random.getstate()
+    serial = TaskBank.generate(generator, env_cls, size, seed=seed, n_workers=1)
+    assert np.array_equal(np.random.get_state()[1], state[0]) and random.getstate() == state[1]
+    assert serial.arrays.keys() == bank.arrays.keys()
+    for key in bank.arrays:
+        assert np.array_equal(serial.arrays[key], bank.arrays[key]), key
+    for index in range(size):
+        check_entry(bank.entry(index), generator, env_cls)
+        assert bank.index(bank.entry(index).seed) == index
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bank.npz')
+        bank.save(path)
+        loaded = TaskBank.load(path, seed=seed)
+    for key in bank.arrays:
+        assert np.array_equal(loaded.arrays[key], bank.arrays[key]), key
+    # Replays draw the same tasks
+    bank.replay(3)
+    seeds = [bank.draw().seed for _ in range(20)]
+    loaded.replay(3)
+    assert [loaded.draw().seed for _ in range(20)] == seeds
+    assert len(set(seeds)) > 1
+
+    # Environments restore the banked plan
+    env = env_without_simulation(env_cls, bank)
+    bank.replay(5)
+    env._set_structure()
+    entry = env._task_entry
+    env._plan_path(entry.init_pos)
+    assert env.sampled_path == entry.path and [env.wx, env.wy] == [entry.wx, entry.wy]
+    assert env.final == [entry.wx[-1], entry.wy[-1]] and (env.cx, env.cy, env.cyaw, env.ck, env.s) == entry.course
+    if env_cls is LocalPlannerEnv:
+        assert env._agent_ori == entry.sample[4]
+    bank.replay(5)
+    assert bank.draw().seed == entry.seed
+    check_seeded_draws(env_cls, bank)
+    return bank
+
+
+def timeit(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test the task bank against on the fly task generation and benchmark the task setup of a reset.')
+    parser.add_argument(
+        '--size',
+        type = int,
+        default = 48,
+        help = 'number of tasks of the tested banks'
+    )
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 200,
+        help = 'number of timed resets'
+    )
+    parser.add_argument(
+        '--n_workers',
+        type = int,
+        default = 2,
+        help = 'number of worker processes generating the banks'
+    )
+    args = parser.parse_args()
+    banks = [check_bank(generator, env_cls, args.size, args.n_workers) for generator, env_cls in GENERATORS]
+    print('Banked tasks match the tasks generated on the fly')
+
+    print('{:>28} {:>14} {:>12}'.format('reset task setup', 'on the fly us', 'banked us'))
+    for (generator, env_cls), bank in zip(GENERATORS, banks):
+        env = env_without_simulation(env_cls, bank)
+
+        def on_the_fly():
+            # `_set_structure`, `_set_init` and the planning of `set_goal_path` without a task bank
+            env._task_entry = None
+            env._set_task(generator(bank.maze_size_scaling))
+            init_pos, _ = env._set_init(env._agent_pos)
+            env._plan_path(np.asarray(init_pos, dtype=np.float64))
+
+        def banked():
+            env._set_structure()
+            env._plan_path(env._task_entry.init_pos)
+
+        print('{:>28} {:>14.1f} {:>12.1f}'.format(
+            env_cls.__name__, timeit(on_the_fly, args.repeats) * 1e6, timeit(banked, args.repeats) * 1e6))
+
+    print('{:>28} {:>14}'.format('generation', 'tasks / s'))
+    for n_workers in sorted({1, args.n_workers}):
+        start = time.perf_counter()
+        TaskBank.generate(create_simple_room_maze, SimpleRoomEnv, args.size * 4, seed=params['seed'], n_workers=n_workers)
+        print('{:>28} {:>14.1f}'.format('{} workers'.format(n_workers), args.size * 4 / (time.perf_counter() - start)))
@@ -9,6 +9,7 @@ from neurorobotics.simulations.point import PointEnv, BlindPointEnv
 from neurorobotics.constants import params
 from neurorobotics.utils.schedules import linear_schedule
 from neurorobotics.utils.feature_extractors import DictToTensorFeaturesExtractor, LocalPlannerFeaturesExtractor
+from neurorobotics.utils.ensemble import EnsembleTD3Policy
 
 
 if __name__ == '__main__':
@@ -65,7 +66,7 @@ if __name__ == '__main__':
         env_class=env_class,
         agent_class=agent_class,
         task_generator=task_generator,
-        policy_class='MultiInputPolicy',
+        policy_class=EnsembleTD3Policy if params['ensemble_critic'] else 'MultiInputPolicy',
         params=params,
         lr_schedule=linear_schedule(params['lr'], params['final_lr']),
         action_noise=action_noise,
@@ -0,0 +1,115 @@
+import time
+import argparse
+import functools
+import numpy as np
+import gym
+import stable_baselines3 as sb3
+from neurorobotics.constants import params
+from neurorobotics.utils.actors import learn_async
+
+
+class SlowStep(gym.Wrapper):
+    # Stands in for the rendering and mapping cost of a `SimpleRoomEnv` step.
+    def __init__(self, env, delay):
+        super(SlowStep, self).__init__(env)
+        self.delay = delay
+
+    def step(self, action):
+        time.sleep(self.delay)
+        return self.env.step(action)
+
+
+class LagCallback(sb3.common.callbacks.BaseCallback):
+    # Reads the policy lag of the transitions added last from the `learn_async` locals.
+    def _on_step(self):
+        return True
+
+    def _on_training_end(self):
+        self.policy_lag = np.mean(self.locals['lags'])
+
+
+def make_env(delay):
+    return sb3.common.vec_env.dummy_vec_env.DummyVecEnv([
+        lambda: sb3.common.monitor.Monitor(SlowStep(gym.make('Pendulum-v1'), delay))
+    ])
+
+
+def make_model(delay, learning_starts):
+    n_actions = 1
+    return sb3.TD3(
+        'MlpPolicy',
+        make_env(delay),
+        learning_starts=learning_starts,
+        batch_size=params['batch_size'],
+        train_freq=(1, 'episode'),
+        gradient_steps=-1,
+        action_noise=sb3.common.noise.NormalActionNoise(np.zeros(n_actions), 0.1 * np.ones(n_actions)),
+        policy_kwargs={'net_arch': [256, 256]},
+        seed=params['seed'],
+        device='cpu',
+    )
+
+
+def evaluate(model, episodes=5):
+    rewards, _ = sb3.common.evaluation.evaluate_policy(
+        model, make_env(0.0), n_eval_episodes=episodes, return_episode_rewards=True
+    )
+    return np.mean(rewards)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark asynchronous actor/learner training against synchronous TD3.')
+    parser.add_argument(
+        '--timesteps',
+        type = int,
+        default = 6000,
+        help = 'number of environment steps'
+    )
+    parser.add_argument(
+        '--delay',
+        type = float,
+        default = 0.004,
+        help = 'seconds added to every environment step'
+    )
+    parser.add_argument(
+        '--n_actors',
+        type = int,
+        nargs = '+',
+        default = [1, 2],
+        help = 'numbers of actor processes to benchmark'
+    )
+    args = parser.parse_args()
+    # Warm up on a sixth of the steps, so that any `--timesteps` leaves transitions to train on.
+    learning_starts = args.timesteps // 6
+
+    print('{:>12} {:>8} {:>10} {:>12} {:>12} {:>12}'.format(
+        'mode', 'actors', 'seconds', 'updates', 'policy lag', 'eval reward'))
+    model = make_model(args.delay, learning_starts)
+    start = time.perf_counter()
+    model.learn(total_timesteps=args.timesteps)
+    print('{:>12} {:>8} {:>10.1f} {:>12} {:>12} {:>12.1f}'.format(
+        'sync', 1, time.perf_counter() - start, model._n_updates, '-', evaluate(model)))
+
+    for n_actors in args.n_actors:
+        model = make_model(args.delay, learning_starts)
+        callback = LagCallback()
+        start = time.perf_counter()
+        learn_async(
+            model,
+            functools.partial(make_env, args.delay),
+            total_timesteps=args.timesteps,
+            callback=callback,
+            n_actors=n_actors,
+            utd_ratio=params['utd_ratio'],
+            sync_freq=params['weight_sync_freq'],
+            chunk_size=params['actor_chunk_size'],
+            log_interval=None,
+            seed=params['seed']
+        )
+        elapsed = time.perf_counter() - start
+        # Learning starts after the warm up, the remaining transitions each get `utd_ratio` updates.
+        assert model._n_updates == int(params['utd_ratio'] * (args.timesteps - learning_starts))
+        print('{:>12} {:>8} {:>10.1f} {:>12} {:>12} {:>12.1f}'.format(
+            'async', n_actors, elapsed, model._n_updates,
+            '{:.1f}'.format(callback.policy_lag), evaluate(model)))
@@ -0,0 +1,133 @@
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+import torch
+import gym
+from gym import spaces
+from neurorobotics.constants import params
+from neurorobotics.utils.benchmark import PhaseTimer, benchmark_env, compare, load, print_comparison, run, save
+
+
+class Agent:
+    # Stands in for `PointEnv`, stepping renders the observation.
+    def step(self, action):
+        time.sleep(2e-3)
+        return self._get_obs(), 0.0, False, {}
+
+    def _get_obs(self):
+        time.sleep(1e-3)
+        return np.zeros(2, dtype=np.float32)
+
+    def close(self):
+        pass
+
+
+class PhaseEnv(gym.Env):
+    # Calls the methods timed in `SimpleRoomEnv` steps, `reset` creates a new agent as `set_env` does.
+    def __init__(self, max_episode_size=10):
+        self.observation_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+        self.action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+        self.max_episode_size = max_episode_size
+        self.wrapped_env = Agent()
+        self.t = 0
+
+    def get_maps(self):
+        time.sleep(3e-3)
+
+    def get_action(self):
+        time.sleep(1e-3)
+        return np.zeros(1, dtype=np.float32)
+
+    def reset(self):
+        self.wrapped_env = Agent()
+        self.t = 0
+        return self.wrapped_env._get_obs()
+
+    def step(self, action):
+        self.t += 1
+        obs, _, _, _ = self.wrapped_env.step(action)
+        self.get_maps()
+        self.get_action()
+        return obs, 0.0, self.t >= self.max_episode_size, {}
+
+
+def check_phases():
+    env = PhaseEnv()
+    results = benchmark_env(env, 25, 2)
+    # The resets at the end of the episodes are timed too.
+    assert results['step']['n'] == 25 and results['reset']['n'] == 2 + 25 // env.max_episode_size
+    # Nested calls only count in the innermost phase.
+    expected = {'mujoco': 2e-3, 'render': 1e-3, 'mapping': 3e-3, 'planning': 1e-3}
+    for phase, duration in expected.items():
+        median = results['step/{}'.format(phase)]['median']
+        assert duration <= median < duration + 1e-3, (phase, median)
+    total = sum(results['step/{}'.format(phase)]['median'] for phase in list(expected) + ['other'])
+    assert abs(total - results['step']['median']) < 1e-3
+    # The wrappers are removed, also from the agents created by resets.
+    assert 'get_maps' not in vars(env) and 'step' not in vars(env.wrapped_env)
+
+    try:
+        benchmark_env(PhaseEnv(), 5, 0)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('Expected a ValueError without reset')
+
+    timer = PhaseTimer()
+    agent = Agent()
+    agent.step = agent.step
+    original = agent.step
+    timer.patch(agent, 'step', 'mujoco')
+    timer.restore()
+    assert agent.step is original
+
+
+def check_compare(results):
+    baseline = {'machine': dict(results['machine']), 'benchmarks': {
+        name: dict(value) for name, value in results['benchmarks'].items()
+    }}
+    faster, slower = sorted(baseline['benchmarks'])[:2]
+    baseline['benchmarks'][faster]['median'] *= 2
+    baseline['benchmarks'][slower]['median'] /= 2
+    baseline['benchmarks']['removed'] = {'median': 1.0}
+    rows = {row['name']: row for row in compare(results, baseline, threshold=0.1)}
+    assert rows[slower]['regression'] and abs(rows[slower]['ratio'] - 2) < 1e-6
+    assert not rows[faster]['regression'] and abs(rows[faster]['ratio'] - 0.5) < 1e-6
+    assert sum(row['regression'] for row in rows.values()) == 1
+    assert 'removed' not in rows
+    print_comparison(list(rows.values()), results, baseline)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test the benchmark suite and run it on the environments available.')
+    parser.add_argument(
+        '--steps',
+        type = int,
+        default = 50,
+        help = 'number of timed environment steps'
+    )
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 10,
+        help = 'number of timed calls per benchmark'
+    )
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+    check_phases()
+    print('Environment steps are broken down into exclusive phases')
+
+    results = run(steps=args.steps, buffer_size=500, timesteps=100, repeats=args.repeats)
+    for name in ['cpg/numpy', 'cpg/rollout', 'buffer/add', 'buffer/sample',
+                 'features_extractor/forward', 'features_extractor/backward']:
+        assert results['benchmarks'][name]['n'] > 0
+    for name in ['SimpleRoom', 'LocalPlanner']:
+        assert 'env/{}/step'.format(name) in results['benchmarks'] or 'env/{}'.format(name) in results['skipped']
+    path = os.path.join(tempfile.mkdtemp(), 'benchmark.json')
+    save(results, path)
+    assert load(path) == results
+    check_compare(load(path))
+    print('Results are saved and compared against baselines')
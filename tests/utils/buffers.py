@@ -0,0 +1,182 @@
+import time
+import argparse
+import numpy as np
+import torch
+import gym
+import stable_baselines3 as sb3
+from gym import spaces
+from neurorobotics.constants import params
+from neurorobotics.utils.buffers import FrameDictReplayBuffer, FrameTD3
+
+
+def make_spaces(frame_shape, history_steps):
+    observation_space = spaces.Dict({
+        'frame_t': spaces.Box(low=0, high=255, shape=frame_shape, dtype=np.uint8),
+        'sensors': spaces.Box(low=-1, high=1, shape=(5 + 2 * history_steps,), dtype=np.float32),
+        'inframe': spaces.Box(low=0, high=1, shape=(1,), dtype=np.float32),
+        'positions': spaces.Box(low=-40, high=40, shape=(3 * history_steps + 2,), dtype=np.float32),
+        'bbx': spaces.Box(low=0, high=1, shape=(4,), dtype=np.float32),
+        'sampled_action': spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32),
+    })
+    action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+    return observation_space, action_space
+
+
+def random_obs(rng, observation_space):
+    obs = {}
+    for key, space in observation_space.spaces.items():
+        if key == 'frame_t':
+            # Top view like frames are mostly flat regions.
+            c, h, w = space.shape
+            blocks = rng.integers(0, 256, size=(c, h // 8 + 1, w // 8 + 1), dtype=np.uint8)
+            obs[key] = np.repeat(np.repeat(blocks, 8, 1), 8, 2)[:, :h, :w][np.newaxis]
+        else:
+            obs[key] = rng.uniform(space.low, space.high).astype(space.dtype)[np.newaxis]
+    return obs
+
+
+def fill(buffers, rng, observation_space, action_space, steps, episode_size):
+    obs = random_obs(rng, observation_space)
+    t = 0
+    for _ in range(steps):
+        next_obs = random_obs(rng, observation_space)
+        t += 1
+        done = np.array([t == episode_size or rng.uniform() < 0.002])
+        infos = [{'TimeLimit.truncated': bool(t == episode_size)}]
+        action = rng.uniform(-1, 1, size=(1,) + action_space.shape).astype(np.float32)
+        reward = rng.normal(size=(1,)).astype(np.float32)
+        for buffer in buffers:
+            buffer.add(obs, next_obs, action, reward, done, infos)
+        if done[0]:
+            # `VecEnv` resets, the terminal observation is not observed again.
+            obs = random_obs(rng, observation_space)
+            t = 0
+        else:
+            obs = next_obs
+
+
+def compare(reference, buffer, inds):
+    ref = reference._get_samples(inds)
+    out = buffer._get_samples(inds)
+    for key in ref.observations.keys():
+        assert torch.equal(ref.observations[key], out.observations[key]), key
+        assert torch.equal(ref.next_observations[key], out.next_observations[key]), key
+    for name in ['actions', 'rewards', 'dones']:
+        assert torch.equal(getattr(ref, name), getattr(out, name)), name
+
+
+class CounterEnv(gym.Env):
+    # Every reset and step observes the next count, episodes do not end.
+    def __init__(self):
+        self.observation_space = spaces.Dict({
+            'count': spaces.Box(low=0, high=np.inf, shape=(1,), dtype=np.float32)
+        })
+        self.action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+        self.count = 0
+
+    def reset(self):
+        self.count += 1
+        return {'count': np.array([self.count], dtype=np.float32)}
+
+    def step(self, action):
+        return self.reset(), 0.0, False, {}
+
+
+def check_reset_without_done():
+    # The first observation after a reset without done must be written.
+    observation_space = spaces.Dict({'count': spaces.Box(low=0, high=np.inf, shape=(1,), dtype=np.float32)})
+    action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+    buffer = FrameDictReplayBuffer(10, observation_space, action_space)
+    action, reward, done = np.zeros((1, 2), dtype=np.float32), np.zeros(1, dtype=np.float32), np.array([False])
+    buffer.add({'count': np.array([[1.]])}, {'count': np.array([[2.]])}, action, reward, done, [{}])
+    buffer.truncate()
+    buffer.add({'count': np.array([[100.]])}, {'count': np.array([[101.]])}, action, reward, done, [{}])
+    samples = buffer._get_samples(np.arange(2))
+    assert samples.observations['count'].flatten().tolist() == [1, 100]
+    assert samples.next_observations['count'].flatten().tolist() == [2, 101]
+
+    # A second `learn` resets the environment.
+    model = FrameTD3(
+        'MultiInputPolicy', CounterEnv(), buffer_size=100, learning_starts=100, train_freq=1,
+        replay_buffer_class=FrameDictReplayBuffer, seed=params['seed']
+    )
+    model.learn(total_timesteps=10)
+    model.learn(total_timesteps=10)
+    assert model.replay_buffer.pos == 20
+    samples = model.replay_buffer._get_samples(np.arange(20))
+    assert torch.all(samples.next_observations['count'] - samples.observations['count'] == 1)
+
+
+def sb3_nbytes(buffer):
+    nbytes = buffer.actions.nbytes + buffer.rewards.nbytes + buffer.dones.nbytes + buffer.timeouts.nbytes
+    return nbytes + sum(obs.nbytes for obs in buffer.observations.values()) + \
+        sum(obs.nbytes for obs in buffer.next_observations.values())
+
+
+def throughput(buffer, batch_size, repeats):
+    buffer.sample(batch_size)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        buffer.sample(batch_size)
+    return repeats * batch_size / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test `FrameDictReplayBuffer` against the SB3 `DictReplayBuffer` and report memory and throughput.')
+    parser.add_argument(
+        '--buffer_size',
+        type = int,
+        default = 5000,
+        help = 'number of transitions in each buffer'
+    )
+    parser.add_argument(
+        '--frame_size',
+        type = int,
+        default = 75,
+        help = 'height and width of `frame_t`'
+    )
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 50,
+        help = 'number of timed batches'
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(params['seed'])
+    check_reset_without_done()
+    print('Trajectories are truncated on resets without done')
+    observation_space, action_space = make_spaces((3, args.frame_size, args.frame_size), params['history_steps'])
+    reference = sb3.common.buffers.DictReplayBuffer(args.buffer_size, observation_space, action_space)
+    buffers = {
+        'frame dedup': FrameDictReplayBuffer(args.buffer_size, observation_space, action_space),
+        'frame dedup + zlib': FrameDictReplayBuffer(
+            args.buffer_size, observation_space, action_space, compression={'frame_t': 'zlib'}
+        ),
+        'frame dedup + zlib + float16': FrameDictReplayBuffer(
+            args.buffer_size, observation_space, action_space,
+            compression={'frame_t': 'zlib', 'positions': 'float16', 'sensors': 'float16'}
+        ),
+    }
+    # Wrap around the buffers to test overwritten episodes.
+    fill([reference] + list(buffers.values()), rng, observation_space, action_space,
+        int(1.5 * args.buffer_size), params['max_episode_size'])
+
+    valid = (np.arange(1, args.buffer_size) + reference.pos) % args.buffer_size
+    compare(reference, buffers['frame dedup'], valid)
+    compare(reference, buffers['frame dedup + zlib'], valid)
+    print('Sampled transitions match `DictReplayBuffer`')
+
+    print('{:>30} {:>16} {:>18}'.format('buffer', 'GB / M transitions', 'samples / sec'))
+    batch_size = params['batch_size']
+    print('{:>30} {:>16.2f} {:>18.1f}'.format(
+        'sb3 DictReplayBuffer',
+        sb3_nbytes(reference) / args.buffer_size * 1e6 / 1e9,
+        throughput(reference, batch_size, args.repeats)
+    ))
+    for name, buffer in buffers.items():
+        print('{:>30} {:>16.2f} {:>18.1f}'.format(
+            name,
+            buffer.nbytes / args.buffer_size * 1e6 / 1e9,
+            throughput(buffer, batch_size, args.repeats)
+        ))
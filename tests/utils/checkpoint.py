@@ -0,0 +1,264 @@
+import os
+import copy
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import torch
+import gym
+import stable_baselines3 as sb3
+from gym import spaces
+from neurorobotics.constants import params
+from neurorobotics.utils.buffers import FrameDictReplayBuffer
+from neurorobotics.utils.checkpoint import AsyncCheckpointer
+
+
+class FrameEnv(gym.Env):
+    # Observations of `SimpleRoomEnv` with smaller frames, no simulation.
+    def __init__(self, frame_size):
+        self.observation_space = spaces.Dict({
+            'frame_t': spaces.Box(low=0, high=255, shape=(3, frame_size, frame_size), dtype=np.uint8),
+            'sensors': spaces.Box(low=-1, high=1, shape=(params['history_steps'] * 8,), dtype=np.float32)
+        })
+        self.action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+
+    def reset(self):
+        return {key: np.zeros(space.shape, dtype=space.dtype) for key, space in self.observation_space.spaces.items()}
+
+    def step(self, action):
+        return self.reset(), 0.0, False, {}
+
+
+def make_model(frame_size, buffer_size, replay_buffer_class):
+    model = sb3.TD3(
+        'MultiInputPolicy',
+        FrameEnv(frame_size),
+        buffer_size=buffer_size,
+        batch_size=params['batch_size'],
+        replay_buffer_class=replay_buffer_class,
+        policy_kwargs={'net_arch': [256, 256]},
+        seed=params['seed'],
+        device='cpu'
+    )
+    model.set_logger(sb3.common.logger.Logger(None, []))
+    return model
+
+
+def add(model, rng, n):
+    # Random transitions with episodes of `max_episode_size` steps, counted as collected steps.
+    frame_shape = model.observation_space['frame_t'].shape
+    obs = getattr(model, '_test_obs', None) or model.env.reset()
+    for _ in range(n):
+        next_obs = {
+            'frame_t': rng.integers(0, 256, size=(1,) + frame_shape, dtype=np.uint8),
+            'sensors': rng.uniform(-1, 1, size=(1, params['history_steps'] * 8)).astype(np.float32)
+        }
+        model.num_timesteps += 1
+        done = model.num_timesteps % params['max_episode_size'] == 0
+        model.replay_buffer.add(
+            obs, next_obs, rng.uniform(-1, 1, size=(1, 2)), rng.normal(size=(1,)),
+            np.array([done]), [{'TimeLimit.truncated': done}]
+        )
+        obs = next_obs
+    model._test_obs = obs
+
+
+def assert_buffers_equal(a, b):
+    assert a.pos == b.pos and a.full == b.full
+    for name in ['actions', 'rewards', 'dones', 'timeouts']:
+        assert np.array_equal(getattr(a, name), getattr(b, name))
+    for key in a.observations:
+        assert np.array_equal(a.observations[key], b.observations[key])
+    if isinstance(a, FrameDictReplayBuffer):
+        assert a.terminal_observations.keys() == b.terminal_observations.keys()
+        for index, terminal in a.terminal_observations.items():
+            for key in terminal:
+                assert np.array_equal(terminal[key], b.terminal_observations[index][key])
+    else:
+        for key in a.next_observations:
+            assert np.array_equal(a.next_observations[key], b.next_observations[key])
+
+
+def truncate(buffer):
+    # Restored buffers end their last trajectory, the sampled transitions are kept.
+    if isinstance(buffer, FrameDictReplayBuffer):
+        buffer.truncate()
+
+
+def load(checkpointer, frame_size):
+    env = FrameEnv(frame_size)
+    # Spaces are taken from the environment
+    return checkpointer.load(sb3.TD3, env=env, custom_objects={
+        'observation_space': env.observation_space, 'action_space': env.action_space
+    })
+
+
+def check_resume(path, frame_size, replay_buffer_class, rng):
+    # Checkpoints written incrementally around a wrap of the buffer resume training exactly.
+    buffer_size = 600
+    model = make_model(frame_size, buffer_size, replay_buffer_class)
+    checkpointer = AsyncCheckpointer(path, 'model', keep_last=2, save_replay_buffer=True)
+    for n in [250, 100, 100, 300, 50, 120]:
+        add(model, rng, n)
+        model.train(gradient_steps=5, batch_size=params['batch_size'])
+        checkpointer.save(model)
+    checkpointer.close()
+    assert len(checkpointer.checkpoints()) == 2
+
+    checkpointer = AsyncCheckpointer(path, 'model', keep_last=2, save_replay_buffer=True)
+    loaded = load(checkpointer, frame_size)
+    loaded.set_logger(sb3.common.logger.Logger(None, []))
+    assert loaded.num_timesteps == model.num_timesteps
+    truncate(model.replay_buffer)
+    assert_buffers_equal(model.replay_buffer, loaded.replay_buffer)
+    model.train(gradient_steps=10, batch_size=params['batch_size'])
+    load(checkpointer, frame_size)
+    loaded.train(gradient_steps=10, batch_size=params['batch_size'])
+    for a, b in zip(model.policy.parameters(), loaded.policy.parameters()):
+        assert torch.equal(a, b)
+
+    # Checkpoints after resuming add to the restored replay buffer.
+    add(model, rng, 80)
+    loaded._test_obs = model._test_obs
+    loaded.num_timesteps = model.num_timesteps
+    loaded.replay_buffer = model.replay_buffer
+    checkpointer.save(loaded)
+    checkpointer.close()
+    restored = load(checkpointer, frame_size)
+    truncate(model.replay_buffer)
+    assert_buffers_equal(model.replay_buffer, restored.replay_buffer)
+
+
+def check_reset_timesteps(path, frame_size, rng):
+    # Snapshots after `learn(reset_num_timesteps=True)` keep the transitions added since the last one.
+    model = make_model(frame_size, 600, FrameDictReplayBuffer)
+    checkpointer = AsyncCheckpointer(path, 'model', keep_last=None, save_replay_buffer=True)
+    for n in [250, 100]:
+        add(model, rng, n)
+        checkpointer.save(model)
+    model.num_timesteps = 0
+    add(model, rng, 30)
+    checkpointer.save(model)
+    checkpointer.close()
+
+    checkpointer = AsyncCheckpointer(path, 'model', keep_last=None, save_replay_buffer=True)
+    loaded = load(checkpointer, frame_size)
+    assert loaded.num_timesteps == 30
+    truncate(model.replay_buffer)
+    assert_buffers_equal(model.replay_buffer, loaded.replay_buffer)
+    checkpointer.close()
+
+
+def check_interrupted(path, frame_size, rng):
+    # A checkpoint whose replay buffer was not written falls back to the previous one.
+    model = make_model(frame_size, 600, FrameDictReplayBuffer)
+    checkpointer = AsyncCheckpointer(path, 'model', keep_last=2, save_replay_buffer=True)
+    for n in [250, 100]:
+        add(model, rng, n)
+        checkpointer.save(model)
+    checkpointer.wait()
+    # Copy of the arrays compared by `assert_buffers_equal`
+    buffer = copy.copy(model.replay_buffer)
+    for name in ['actions', 'rewards', 'dones', 'timeouts']:
+        setattr(buffer, name, getattr(buffer, name).copy())
+    buffer.observations = copy.deepcopy(buffer.observations)
+    buffer.terminal_observations = copy.deepcopy(buffer.terminal_observations)
+    saved = buffer, model.num_timesteps
+
+    def interrupted(snapshot):
+        raise KeyboardInterrupt
+
+    checkpointer.replay.write = interrupted
+    add(model, rng, 100)
+    checkpointer.save(model)
+    try:
+        checkpointer.close()
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('Expected the interrupted write to be raised')
+    assert len(checkpointer.checkpoints()) == 3
+
+    checkpointer = AsyncCheckpointer(path, 'model', keep_last=2, save_replay_buffer=True)
+    loaded = load(checkpointer, frame_size)
+    assert loaded.num_timesteps == saved[1]
+    truncate(saved[0])
+    assert_buffers_equal(saved[0], loaded.replay_buffer)
+    checkpointer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test and benchmark the training stall of asynchronous checkpoints against `model.save`.')
+    parser.add_argument(
+        '--frame_size',
+        type = int,
+        default = 64,
+        help = 'height and width of the frames'
+    )
+    parser.add_argument(
+        '--buffer_size',
+        type = int,
+        default = 20000,
+        help = 'number of transitions in the replay buffer'
+    )
+    parser.add_argument(
+        '--checkpoints',
+        type = int,
+        default = 5,
+        help = 'number of timed checkpoints'
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(params['seed'])
+    torch.manual_seed(params['seed'])
+    torch.set_num_threads(1)
+    path = tempfile.mkdtemp()
+
+    try:
+        for replay_buffer_class in [sb3.common.buffers.DictReplayBuffer, FrameDictReplayBuffer]:
+            check_resume(os.path.join(path, replay_buffer_class.__name__), 40, replay_buffer_class, rng)
+        check_reset_timesteps(os.path.join(path, 'reset'), 40, rng)
+        check_interrupted(os.path.join(path, 'interrupted'), 40, rng)
+        print('Resumed checkpoints match the saved models and replay buffers')
+
+        print('{:>14} {:>10} {:>14} {:>14} {:>14}'.format('mode', 'replay', 'stall ms', 'write ms', 'MB'))
+        model = make_model(args.frame_size, args.buffer_size, FrameDictReplayBuffer)
+        add(model, rng, args.buffer_size // 2)
+        new = args.buffer_size // (2 * args.checkpoints)
+        for replay in [False, True]:
+            stalls = []
+            directory = os.path.join(path, 'sync_{}'.format(replay))
+            os.makedirs(directory)
+            for i in range(args.checkpoints):
+                add(model, rng, new)
+                start = time.perf_counter()
+                model.save(os.path.join(directory, 'model_{}'.format(i)))
+                if replay:
+                    model.save_replay_buffer(os.path.join(directory, 'replay_buffer'))
+                stalls.append(time.perf_counter() - start)
+            size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)) / 2 ** 20
+            print('{:>14} {:>10} {:>14.1f} {:>14} {:>14.1f}'.format(
+                'model.save', str(replay), np.mean(stalls) * 1e3, '-', size / args.checkpoints))
+
+            stalls, writes = [], []
+            directory = os.path.join(path, 'async_{}'.format(replay))
+            checkpointer = AsyncCheckpointer(directory, 'model', save_replay_buffer=replay)
+            # The first checkpoint writes the whole replay buffer
+            checkpointer.save(model)
+            checkpointer.wait()
+            for i in range(args.checkpoints):
+                add(model, rng, new)
+                start = time.perf_counter()
+                checkpointer.save(model)
+                stalls.append(time.perf_counter() - start)
+                checkpointer.wait()
+                writes.append(time.perf_counter() - start)
+            checkpointer.close()
+            size = sum(
+                os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names
+            ) / 2 ** 20
+            print('{:>14} {:>10} {:>14.1f} {:>14.1f} {:>14.1f}'.format(
+                'async', str(replay), np.mean(stalls) * 1e3, np.mean(writes) * 1e3, size / (args.checkpoints + 1)))
+    finally:
+        shutil.rmtree(path)
@@ -1,17 +1,120 @@
 import os
+import time
 import argparse
-from neurorobotics.utils.conversion import convert_to_onnx
+import tempfile
+import numpy as np
+import torch
+import gym
+import stable_baselines3 as sb3
+from gym import spaces
+from neurorobotics.constants import params
+from neurorobotics.utils.conversion import convert_to_onnx, export_encoder, load_encoder, replay_calibration
+from neurorobotics.utils.feature_extractors import ExportedFeaturesExtractor
 from neurorobotics.networks.cpg import ModifiedHopfCPG
+from neurorobotics.bg.models import VisualCortexV4
+
+
+def latency(encoder, frame, repeats):
+    with torch.no_grad():
+        for _ in range(3):
+            encoder(frame)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            encoder(frame)
+    return (time.perf_counter() - start) / repeats
+
+
+def make_buffer(observation_space, rng):
+    # Replay frames of smooth images, as calibration data for static quantization.
+    buffer = sb3.common.buffers.ReplayBuffer(
+        200, observation_space, spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32), device='cpu'
+    )
+    height, width = observation_space.shape[1:]
+    grid = np.stack(np.meshgrid(np.linspace(0, 1, width), np.linspace(0, 1, height)))
+    for _ in range(200):
+        phase = rng.uniform(0, 2 * np.pi, size=(3, 1, 1))
+        frame = (127.5 * (1 + np.sin(6 * grid.sum(0)[None] + phase))).astype(np.uint8)
+        buffer.add(frame[None], frame[None], rng.uniform(-1, 1, size=(1, 2)), np.zeros(1), np.zeros(1), [{}])
+    return buffer
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
-        description='Test conversion of Modified Hopf CPG to onnx for DeepC deployment.')
+        description='Test conversion of Modified Hopf CPG to onnx for DeepC deployment, '
+            'and test and benchmark exported visual encoders.')
     parser.add_argument(
         '--outpath',
         type=str,
         help='Output Path to ONNX Model.'
     )
+    parser.add_argument(
+        '--frame_size',
+        type = int,
+        nargs = 2,
+        default = [120, 160],
+        help = 'height and width of the frames'
+    )
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 50,
+        help = 'number of timed frames'
+    )
     args = parser.parse_args()
-    model = ModifiedHopfCPG(4)
-    convert_to_onnx(model, args.outpath)
+    if args.outpath is not None:
+        model = ModifiedHopfCPG(4)
+        convert_to_onnx(model, args.outpath)
 
+    rng = np.random.default_rng(params['seed'])
+    torch.manual_seed(params['seed'])
+    torch.set_num_threads(1)
+    observation_space = spaces.Box(low=0, high=255, shape=(3,) + tuple(args.frame_size), dtype=np.uint8)
+    model = VisualCortexV4(observation_space, params['num_ctx']).eval()
+    buffer = make_buffer(observation_space, rng)
+    frames = next(replay_calibration(buffer, 8, 1))
+    with torch.no_grad():
+        expected = model(frames)
+    path = tempfile.mkdtemp()
+
+    print('{:>12} {:>12} {:>14} {:>14}'.format('quantize', 'ms/frame', 'max error', 'relative error'))
+    print('{:>12} {:>12.2f} {:>14} {:>14}'.format('eager', latency(model, frames[:1], args.repeats) * 1e3, '-', '-'))
+    for quantize in [None, 'dynamic', 'static']:
+        outpath = os.path.join(path, 'encoder_{}.pt'.format(quantize))
+        export_encoder(
+            model, frames[:1], outpath, feature_maps=True, quantize=quantize,
+            calibration=replay_calibration(buffer, params['batch_size'], 4)
+        )
+        encoder = load_encoder(outpath)
+        with torch.no_grad():
+            outputs = encoder(frames)
+        # The FPN levels follow the features, for batches of any size.
+        assert len(outputs) == 1 + len(expected[1])
+        for output, target in zip(outputs, [expected[0]] + list(expected[1].values())):
+            assert output.shape == target.shape
+        error = (outputs[0] - expected[0]).abs().max().item()
+        relative = error / expected[0].abs().max().item()
+        if quantize is None:
+            for output, target in zip(outputs, [expected[0]] + list(expected[1].values())):
+                assert torch.allclose(output, target, atol=1e-5)
+        else:
+            assert relative < 0.1
+        print('{:>12} {:>12.2f} {:>14.2e} {:>14.2e}'.format(
+            str(quantize), latency(encoder, frames[:1], args.repeats) * 1e3, error, relative))
+    print('Exported encoders match the eager encoder')
+
+    export_encoder(model, frames[:1], os.path.join(path, 'encoder.pt'))
+    extractor = ExportedFeaturesExtractor(observation_space, os.path.join(path, 'encoder.pt'))
+    assert extractor.features_dim == params['num_ctx']
+    with torch.no_grad():
+        assert torch.allclose(extractor(frames), expected[0], atol=1e-5)
+    policy = sb3.td3.policies.TD3Policy(
+        observation_space,
+        spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32),
+        lambda _: 1e-3,
+        net_arch=[64, 64],
+        features_extractor_class=ExportedFeaturesExtractor,
+        features_extractor_kwargs={'path': os.path.join(path, 'encoder.pt')}
+    )
+    actions, _ = policy.predict(buffer.observations[0])
+    assert actions.shape == (1, 2)
+    print('Exported encoders run as features extractors')
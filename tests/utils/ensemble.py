@@ -0,0 +1,150 @@
+import time
+import copy
+import argparse
+import numpy as np
+import torch
+import gym
+import stable_baselines3 as sb3
+from gym import spaces
+from neurorobotics.constants import params
+from neurorobotics.utils.buffers import FrameTD3
+from neurorobotics.utils.ensemble import EnsembleCritic, EnsembleTD3Policy
+from neurorobotics.utils.torch_utils import polyak_update
+
+
+class VectorEnv(gym.Env):
+    # Observations of the size of the `SimpleRoomEnv` sensors, no simulation.
+    def __init__(self):
+        self.observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(params['history_steps'] * 8,), dtype=np.float32)
+        self.action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+
+    def reset(self):
+        return np.zeros(self.observation_space.shape, dtype=np.float32)
+
+    def step(self, action):
+        return self.reset(), 0.0, False, {}
+
+
+def make_critics(net_arch, n_critics, share_features_extractor):
+    observation_space = VectorEnv().observation_space
+    action_space = VectorEnv().action_space
+    extractor = sb3.common.torch_layers.FlattenExtractor(observation_space)
+    kwargs = {
+        'observation_space': observation_space,
+        'action_space': action_space,
+        'net_arch': net_arch,
+        'features_extractor': extractor,
+        'features_dim': extractor.features_dim,
+        'activation_fn': torch.nn.Tanh,
+        'n_critics': n_critics,
+        'share_features_extractor': share_features_extractor
+    }
+    critic = sb3.common.policies.ContinuousCritic(**kwargs)
+    ensemble = EnsembleCritic(**kwargs)
+    ensemble.load_critic(critic)
+    return critic, ensemble
+
+
+def check_critics(net_arch, n_critics, share_features_extractor, rng):
+    critic, ensemble = make_critics(net_arch, n_critics, share_features_extractor)
+    obs = torch.as_tensor(rng.normal(size=(params['batch_size'], params['history_steps'] * 8)).astype(np.float32))
+    actions = torch.as_tensor(rng.uniform(-1, 1, size=(params['batch_size'], 2)).astype(np.float32))
+    expected, values = critic(obs, actions), ensemble(obs, actions)
+    assert len(values) == n_critics
+    for q, value in zip(expected, values):
+        assert value.shape == q.shape
+        assert torch.allclose(q, value, atol=1e-5)
+    assert torch.allclose(critic.q1_forward(obs, actions), ensemble.q1_forward(obs, actions), atol=1e-5)
+
+    # Gradients of the stacked weights are those of each Q-network.
+    sum(q.sum() for q in expected).backward()
+    sum(value.sum() for value in values).backward()
+    for i, layer in enumerate(ensemble.layers):
+        linears = [[m for m in q_net if isinstance(m, torch.nn.Linear)][i] for q_net in critic.q_networks]
+        for j, linear in enumerate(linears):
+            assert torch.allclose(linear.weight.grad.t(), layer.weight.grad[j], atol=1e-4)
+            assert torch.allclose(linear.bias.grad, layer.bias.grad[j, 0], atol=1e-4)
+
+    # Cached features are recomputed after in place updates of the observations.
+    with torch.no_grad():
+        before = ensemble(obs, actions)[0].clone()
+        obs.mul_(2.0)
+        critic_after, after = critic(obs, actions)[0], ensemble(obs, actions)[0]
+    assert torch.allclose(critic_after, after, atol=1e-5) and not torch.allclose(before, after)
+
+
+def make_model(algorithm_class, policy_class, net_arch, n_critics):
+    model = algorithm_class(
+        policy_class,
+        VectorEnv(),
+        buffer_size=params['buffer_size'],
+        batch_size=params['batch_size'],
+        policy_kwargs={'net_arch': net_arch, 'n_critics': n_critics, 'activation_fn': torch.nn.Tanh},
+        seed=params['seed'],
+        device='cpu'
+    )
+    model.set_logger(sb3.common.logger.Logger(None, []))
+    rng = np.random.default_rng(params['seed'])
+    obs = rng.normal(size=(params['buffer_size'] + 1, 1, params['history_steps'] * 8)).astype(np.float32)
+    for i in range(params['buffer_size']):
+        model.replay_buffer.add(
+            obs[i], obs[i + 1], rng.uniform(-1, 1, size=(1, 2)), rng.normal(size=(1,)),
+            np.array([False]), [{}]
+        )
+    return model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test and benchmark the ensemble critic against the TD3 critics of stable baselines.')
+    parser.add_argument(
+        '--gradient_steps',
+        type = int,
+        default = 1000,
+        help = 'number of timed gradient steps'
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(params['seed'])
+    torch.manual_seed(params['seed'])
+    torch.set_num_threads(1)
+
+    for net_arch, n_critics, share in [([150, 300, 150], 2, True), (params['critic_net_arch'], 3, False), ([], 1, True)]:
+        check_critics(net_arch, n_critics, share, rng)
+    print('Ensemble critics match the stable baselines critics')
+
+    _, ensemble = make_critics(params['critic_net_arch'], params['n_critics'], True)
+    params_list = [torch.randn(256, 256) for _ in range(20)]
+    targets = [torch.randn(256, 256) for _ in range(20)]
+    expected = copy.deepcopy(targets)
+    sb3.common.utils.polyak_update(params_list, expected, params['tau'])
+    polyak_update(params_list, targets, params['tau'])
+    assert all(torch.allclose(a, b) for a, b in zip(expected, targets))
+    print('Fused Polyak update matches stable baselines')
+
+    models = [make_model(algorithm_class, 'MlpPolicy', [64, 64], 2) for algorithm_class in [sb3.TD3, FrameTD3]]
+    for model in models:
+        model.set_random_seed(params['seed'])
+        model.train(gradient_steps=20, batch_size=params['batch_size'])
+    for a, b in zip(models[0].policy.parameters(), models[1].policy.parameters()):
+        assert torch.allclose(a, b, atol=1e-6)
+    print('FrameTD3 updates match stable baselines TD3')
+
+    print('{:>16} {:>10} {:>20} {:>14} {:>14} {:>10}'.format(
+        'net_arch', 'n_critics', 'policy', 'updates/s', 'polyak us', 'tensors'))
+    for net_arch, n_critics in [([150, 300, 150], 2), (params['critic_net_arch'], params['n_critics'])]:
+        for algorithm_class, policy_class, update in [
+            (sb3.TD3, 'MlpPolicy', sb3.common.utils.polyak_update), (FrameTD3, EnsembleTD3Policy, polyak_update)
+        ]:
+            model = make_model(algorithm_class, policy_class, net_arch, n_critics)
+            model.train(gradient_steps=10, batch_size=params['batch_size'])
+            start = time.perf_counter()
+            model.train(gradient_steps=args.gradient_steps, batch_size=params['batch_size'])
+            updates = args.gradient_steps / (time.perf_counter() - start)
+            critic, target = list(model.critic.parameters()), list(model.critic_target.parameters())
+            start = time.perf_counter()
+            for _ in range(100):
+                update(critic, target, params['tau'])
+            polyak = (time.perf_counter() - start) / 100
+            print('{:>16} {:>10} {:>20} {:>14.1f} {:>14.1f} {:>10}'.format(
+                str(net_arch), n_critics, policy_class if isinstance(policy_class, str) else policy_class.__name__,
+                updates, polyak * 1e6, len(critic)))
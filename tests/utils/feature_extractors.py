@@ -0,0 +1,116 @@
+import time
+import argparse
+import numpy as np
+import torch
+import gym
+import stable_baselines3 as sb3
+from gym import spaces
+from neurorobotics.constants import params
+from neurorobotics.utils.buffers import FrameDictReplayBuffer
+from neurorobotics.utils.feature_extractors import DictToTensorFeaturesExtractor
+
+
+class FrameEnv(gym.Env):
+    # Observations of `SimpleRoomEnv` with smaller frames, no simulation.
+    def __init__(self, frame_size):
+        self.observation_space = spaces.Dict({
+            'frame_t': spaces.Box(low=0, high=255, shape=(3, frame_size, frame_size), dtype=np.uint8),
+            'sensors': spaces.Box(low=-1, high=1, shape=(params['history_steps'] * 8,), dtype=np.float32)
+        })
+        self.action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+
+    def reset(self):
+        return {key: np.zeros(space.shape, dtype=space.dtype) for key, space in self.observation_space.spaces.items()}
+
+    def step(self, action):
+        return self.reset(), 0.0, False, {}
+
+
+def make_model(frame_size, buffer_size, cache, share_features_extractor, frozen):
+    env = FrameEnv(frame_size)
+    model = sb3.TD3(
+        'MultiInputPolicy',
+        env,
+        buffer_size=buffer_size,
+        batch_size=params['batch_size'],
+        replay_buffer_class=FrameDictReplayBuffer,
+        policy_delay=params['policy_delay'],
+        policy_kwargs={
+            'net_arch': params['net_arch'],
+            'features_extractor_class': DictToTensorFeaturesExtractor,
+            'features_extractor_kwargs': {'features_dim': params['num_ctx'], 'cache': cache},
+            'share_features_extractor': share_features_extractor,
+        },
+        seed=params['seed'],
+        device='cpu'
+    )
+    model.set_logger(sb3.common.logger.Logger(None, []))
+    extractors = {
+        id(network.features_extractor): network.features_extractor
+        for network in [model.actor, model.actor_target, model.critic, model.critic_target]
+    }
+    if frozen:
+        for extractor in extractors.values():
+            for param in extractor.cnn.parameters():
+                param.requires_grad = False
+    passes = [0]
+
+    def count(module, inputs, output):
+        passes[0] += 1
+    for extractor in extractors.values():
+        extractor.cnn.register_forward_hook(count)
+
+    rng = np.random.default_rng(params['seed'])
+    obs = env.reset()
+    for i in range(buffer_size):
+        next_obs = {
+            'frame_t': rng.integers(0, 256, size=(1, 3, frame_size, frame_size), dtype=np.uint8),
+            'sensors': rng.uniform(-1, 1, size=(1, params['history_steps'] * 8)).astype(np.float32)
+        }
+        done = (i + 1) % params['max_episode_size'] == 0
+        model.replay_buffer.add(
+            obs, next_obs, rng.uniform(-1, 1, size=(1, 2)), rng.normal(size=(1,)),
+            np.array([done]), [{'TimeLimit.truncated': done}]
+        )
+        obs = next_obs
+    return model, passes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test and benchmark the feature cache of `DictToTensorFeaturesExtractor` in TD3 updates.')
+    parser.add_argument(
+        '--frame_size',
+        type = int,
+        default = 64,
+        help = 'height and width of the frames'
+    )
+    parser.add_argument(
+        '--gradient_steps',
+        type = int,
+        default = 50,
+        help = 'number of timed gradient steps'
+    )
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+    buffer_size = 2000
+
+    print('{:>8} {:>8} {:>8} {:>14} {:>14}'.format('shared', 'frozen', 'cache', 'ms/update', 'cnn/update'))
+    for share_features_extractor, frozen in [(True, False), (False, False), (True, True)]:
+        results = []
+        for cache in [False, True]:
+            model, passes = make_model(args.frame_size, buffer_size, cache, share_features_extractor, frozen)
+            np.random.seed(params['seed'])
+            torch.manual_seed(params['seed'])
+            passes[0] = 0
+            start = time.perf_counter()
+            model.train(gradient_steps=args.gradient_steps, batch_size=params['batch_size'])
+            elapsed = (time.perf_counter() - start) / args.gradient_steps
+            results.append(list(model.policy.parameters()))
+            print('{:>8} {:>8} {:>8} {:>14.1f} {:>14.2f}'.format(
+                str(share_features_extractor), str(frozen), str(cache),
+                elapsed * 1e3, passes[0] / args.gradient_steps))
+        # Cached features give the same updates, including the gradients of the shared features extractor.
+        for a, b in zip(*results):
+            assert torch.equal(a, b)
+    print('Cached features give the same updates')
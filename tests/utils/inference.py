@@ -0,0 +1,212 @@
+import time
+import argparse
+import tempfile
+import threading
+import numpy as np
+import torch
+import gym
+import stable_baselines3 as sb3
+from gym import spaces
+from neurorobotics.constants import params
+from neurorobotics.utils.feature_extractors import DictToTensorFeaturesExtractor, LocalPlannerFeaturesExtractor
+from neurorobotics.utils.inference import PolicyServer, run_episodes
+from neurorobotics.utils.callbacks import Callback
+
+
+class DictEnv(gym.Env):
+    # Observations of `SimpleRoomEnv` with smaller frames, or of `LocalPlannerEnv`, no simulation.
+    def __init__(self, observation_space, max_episode_size=50):
+        self.observation_space = observation_space
+        self.action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+        self.max_episode_size = max_episode_size
+        self.rng = np.random.default_rng(params['seed'])
+        self.steps = 0
+        self.resets = 0
+
+    def _obs(self):
+        return {
+            key: (self.rng.uniform(size=space.shape) * (255 if space.dtype == np.uint8 else 1)).astype(space.dtype)
+            for key, space in self.observation_space.spaces.items()
+        }
+
+    def reset(self):
+        self.steps = 0
+        self.resets += 1
+        return self._obs()
+
+    def step(self, action):
+        assert self.action_space.contains(action.astype(np.float32))
+        self.steps += 1
+        return self._obs(), float(np.sum(action)), self.steps >= self.max_episode_size, {}
+
+
+def simple_room_space(frame_size):
+    return spaces.Dict({
+        'frame_t': spaces.Box(low=0, high=255, shape=(3, frame_size, frame_size), dtype=np.uint8),
+        'sensors': spaces.Box(low=-1, high=1, shape=(params['history_steps'] * 8,), dtype=np.float32)
+    })
+
+
+def local_planner_space():
+    return spaces.Dict({
+        'sensors': spaces.Box(low=-1, high=1, shape=(params['history_steps'] * 8,), dtype=np.float32),
+        'achieved_goal': spaces.Box(low=-np.inf, high=np.inf, shape=(2,), dtype=np.float32),
+        'desired_goal': spaces.Box(low=-np.inf, high=np.inf, shape=(2,), dtype=np.float32)
+    })
+
+
+def make_policy(observation_space, features_extractor_class):
+    return sb3.td3.policies.MultiInputPolicy(
+        observation_space,
+        spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32),
+        lambda _: 1e-3,
+        net_arch=params['net_arch'],
+        features_extractor_class=features_extractor_class,
+        features_extractor_kwargs={'features_dim': params['num_ctx']}
+    )
+
+
+def check_server(policy, env):
+    observations = [env.reset() for _ in range(16)]
+    expected = [policy.predict(obs, deterministic=True)[0] for obs in observations]
+    vectorized = {key: np.stack([obs[key] for obs in observations[:4]]) for key in observations[0]}
+    with PolicyServer(policy, max_batch_size=8, deadline=5e-3) as server:
+        results = [None] * len(observations)
+
+        def call(i):
+            results[i] = server.predict(observations[i], deterministic=True)[0]
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(len(observations))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Concurrent calls are batched and get their own actions.
+        assert server.mean_batch_size > 1
+        for action, target in zip(results, expected):
+            assert action.shape == target.shape and np.allclose(action, target, atol=1e-5)
+        actions, _ = server.predict(vectorized, deterministic=True)
+        assert np.allclose(actions, np.stack(expected[:4]), atol=1e-5)
+
+        # Weights swapped in while serving are used from the next call on.
+        other = make_policy(env.observation_space, type(policy.actor.features_extractor))
+        assert server.update(other.state_dict()) == 1
+        assert np.allclose(server.predict(observations[0], deterministic=True)[0],
+                           other.predict(observations[0], deterministic=True)[0], atol=1e-5)
+
+
+def benchmark(policy, env_fn, n_envs, steps, deadline):
+    # Each environment thread alternates steps with action requests, as in concurrent rollouts.
+    envs = [env_fn() for _ in range(n_envs)]
+    observations = [env.reset() for env in envs]
+    start = time.perf_counter()
+    for _ in range(steps):
+        for i, env in enumerate(envs):
+            action, _ = policy.predict(observations[i], deterministic=True)
+            observations[i] = env.step(action)[0]
+    direct = n_envs * steps / (time.perf_counter() - start)
+
+    latencies = []
+    with PolicyServer(policy, max_batch_size=n_envs, deadline=deadline) as server:
+        def worker(env):
+            obs = env.reset()
+            for _ in range(steps):
+                called = time.perf_counter()
+                action, _ = server.predict(obs, deterministic=True)
+                latencies.append(time.perf_counter() - called)
+                obs = env.step(action)[0]
+        threads = [threading.Thread(target=worker, args=(env,)) for env in envs]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        served = n_envs * steps / (time.perf_counter() - start)
+        batch_size = server.mean_batch_size
+    return direct, served, batch_size, np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test and benchmark batched policy inference against per environment `predict` calls.')
+    parser.add_argument(
+        '--frame_size',
+        type = int,
+        default = 64,
+        help = 'height and width of the frames'
+    )
+    parser.add_argument(
+        '--steps',
+        type = int,
+        default = 200,
+        help = 'number of timed steps per environment'
+    )
+    parser.add_argument(
+        '--n_envs',
+        type = int,
+        nargs = '+',
+        default = [1, 4, 16, 32],
+        help = 'numbers of concurrent environments'
+    )
+    args = parser.parse_args()
+    torch.manual_seed(params['seed'])
+    torch.set_num_threads(1)
+
+    configs = [
+        ('SimpleRoom', simple_room_space(args.frame_size), DictToTensorFeaturesExtractor),
+        ('LocalPlanner', local_planner_space(), LocalPlannerFeaturesExtractor)
+    ]
+    for name, observation_space, features_extractor_class in configs:
+        policy = make_policy(observation_space, features_extractor_class)
+        check_server(policy, DictEnv(observation_space))
+    print('Served actions match direct predictions')
+
+    for name, observation_space, features_extractor_class in configs:
+        policy = make_policy(observation_space, features_extractor_class)
+        envs = [DictEnv(observation_space) for _ in range(3)]
+        vec_envs = [sb3.common.vec_env.DummyVecEnv([lambda: DictEnv(observation_space)]) for _ in range(3)]
+        with PolicyServer(policy) as server:
+            rewards, lengths = run_episodes(server, envs, 5)
+            assert len(rewards) == 5 and lengths == [50] * 5
+            observations = [None] * 3
+            for _ in range(2):
+                rewards, lengths = run_episodes(server, vec_envs, 5, observations=observations)
+                assert len(rewards) == 5 and lengths == [50] * 5
+        # Vectorized environments continue from their automatic resets.
+        assert [env.resets for env in envs] == [2, 2, 1]
+        assert [env.envs[0].resets for env in vec_envs] == [5, 5, 3]
+    print('Concurrent episodes run through the server')
+
+    # Evaluations of `Callback` through the server match `evaluate_policy`
+    observation_space = local_planner_space()
+    model = sb3.TD3('MultiInputPolicy', DictEnv(observation_space), policy_kwargs={'net_arch': [64, 64]}, device='cpu')
+    model.set_logger(sb3.common.logger.Logger(None, []))
+    expected, _ = sb3.common.evaluation.evaluate_policy(
+        model, DictEnv(observation_space), n_eval_episodes=1, return_episode_rewards=True, warn=False)
+    with tempfile.TemporaryDirectory() as logdir:
+        callback = Callback(
+            DictEnv(observation_space), logdir, n_eval_episodes=3, eval_freq=1, render_every=10, log_path=logdir,
+            verbose=0, warn=False,
+            eval_env_fns=[lambda: sb3.common.vec_env.DummyVecEnv([lambda: DictEnv(observation_space)])] * 3)
+        callback.init_callback(model)
+        for i in range(2):
+            callback.on_step()
+            if i == 0:
+                server, envs = callback.server, callback.eval_envs
+                assert np.allclose(callback.evaluations_results[-1], expected * 3)
+            assert callback.eval_envs is envs and callback.evaluations_length[-1] == [50] * 3
+        # The environments are kept between the evaluations.
+        assert server.version == 1 and [env.envs[0].resets for env in envs] == [3, 3, 3]
+        callback.on_training_end()
+        assert callback.server is None and callback.eval_envs is None
+    print('Callback evaluations run through the server')
+
+    print('{:>14} {:>8} {:>10} {:>12} {:>12} {:>12} {:>10} {:>10}'.format(
+        'env', 'n_envs', 'deadline', 'direct/s', 'served/s', 'batch size', 'p50 ms', 'p95 ms'))
+    for name, observation_space, features_extractor_class in configs:
+        policy = make_policy(observation_space, features_extractor_class)
+        for n_envs in args.n_envs:
+            for deadline in [1e-3, 5e-3]:
+                direct, served, batch_size, p50, p95 = benchmark(
+                    policy, lambda: DictEnv(observation_space), n_envs, args.steps, deadline)
+                print('{:>14} {:>8} {:>10.3f} {:>12.1f} {:>12.1f} {:>12.1f} {:>10.2f} {:>10.2f}'.format(
+                    name, n_envs, deadline, direct, served, batch_size, p50 * 1e3, p95 * 1e3))
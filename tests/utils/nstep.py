@@ -0,0 +1,153 @@
+import time
+import argparse
+import numpy as np
+from gym import spaces
+from neurorobotics.constants import params
+from neurorobotics.utils.nstep import NStepReplayBuffer, NStepLambdaReplayBuffer, \
+    NStepDictReplayBuffer, NStepLambdaDictReplayBuffer
+
+
+def make_stream(rng, steps, obs_size, episode_size, done_prob):
+    # Episodes end either on a terminal state or on a time limit.
+    obs = rng.normal(size=(steps + 1, obs_size)).astype(np.float32)
+    rewards = rng.normal(size=(steps,)).astype(np.float32)
+    dones = rng.uniform(size=(steps,)) < done_prob
+    timeouts = np.zeros((steps,), dtype=bool)
+    t = 0
+    for i in range(steps):
+        t += 1
+        if t == episode_size and not dones[i]:
+            dones[i] = timeouts[i] = True
+        if dones[i]:
+            t = 0
+    values = rng.normal(size=(steps,))
+    return obs, rewards, dones, timeouts, values
+
+
+def fill(buffer, stream, dict_obs=False):
+    obs, rewards, dones, timeouts, _ = stream
+    for i in range(len(rewards)):
+        o, next_o = obs[i][np.newaxis], obs[i + 1][np.newaxis]
+        if dict_obs:
+            o, next_o = {'obs': o}, {'obs': next_o}
+        buffer.add(
+            o, next_o, np.zeros((1, 2), dtype=np.float32), rewards[i:i + 1],
+            dones[i:i + 1], [{'TimeLimit.truncated': bool(timeouts[i])}]
+        )
+
+
+def reference_target(stream, t, n_steps, gamma, lmbda):
+    # Truncated λ-return of transition `t`, walking its window.
+    _, rewards, dones, timeouts, values = stream
+    returns, partial = [], 0.0
+    for m in range(1, n_steps + 1):
+        s = t + m - 1
+        if s >= len(rewards):
+            break
+        partial += gamma ** (m - 1) * rewards[s]
+        terminal = dones[s] and not timeouts[s]
+        returns.append(partial + (0.0 if terminal else gamma ** m * values[s]))
+        if dones[s]:
+            break
+    returns += [returns[-1]] * (n_steps - len(returns))
+    weights = [(1 - lmbda) * lmbda ** (m - 1) for m in range(1, n_steps)] + [lmbda ** (n_steps - 1)]
+    return np.dot(weights, returns)
+
+
+def window_targets(buffer, values, batch_inds, newest, n_steps, gamma, lmbda):
+    # Per sample recomputation of the returns over the window of each index.
+    size = buffer.buffer_size
+    steps = np.arange(n_steps)
+    inds = (batch_inds[:, np.newaxis] + steps[np.newaxis]) % size
+    dones = buffer.dones[inds, 0]
+    # Steps after the end of the episode or after the newest transition are not part of the window.
+    after = (inds - newest - 1) % size < (batch_inds[:, np.newaxis] - newest - 1) % size
+    valid = np.cumprod(np.concatenate([np.ones((len(batch_inds), 1)), 1 - dones[:, :-1]], 1), 1) * (1 - after)
+    terminal = dones * (1 - buffer.timeouts[inds, 0])
+    partial = np.cumsum(valid * gamma ** steps * buffer.rewards[inds, 0], 1)
+    returns = partial + valid * (1 - terminal) * gamma ** (steps + 1) * values[inds]
+    last = valid.sum(1).astype(np.int64) - 1
+    returns = np.where(steps[np.newaxis] <= last[:, np.newaxis], returns, returns[np.arange(len(last)), last][:, np.newaxis])
+    weights = np.append((1 - lmbda) * lmbda ** steps[:-1], lmbda ** (n_steps - 1))
+    return returns @ weights
+
+
+def buffer_targets(buffer, values, batch_inds):
+    returns = buffer.n_step_returns
+    bootstrap = returns.bootstrap_inds[batch_inds]
+    return returns.returns[batch_inds] + (returns.bootstrap_weights[batch_inds] * values[bootstrap]).sum(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test and benchmark the n-step and λ-return replay buffers.')
+    parser.add_argument(
+        '--buffer_size',
+        type = int,
+        default = 100000,
+        help = 'number of stored transitions'
+    )
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 200,
+        help = 'number of timed batches'
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(params['seed'])
+    np.random.seed(params['seed'])
+    gamma = params['gamma']
+    observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(8,), dtype=np.float32)
+    dict_space = spaces.Dict({'obs': observation_space})
+    action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+
+    # The buffer wraps around, only the last `size - 1` transitions are sampled.
+    size, steps = 500, 1337
+    stream = make_stream(rng, steps, 8, 40, 0.02)
+    values = np.zeros((size,))
+    values[np.arange(steps) % size] = stream[4]
+    for n_steps, lmbda in [(1, 1.0), (5, 1.0), (10, 0.9), (3, 0.5)]:
+        buffer_class = NStepReplayBuffer if lmbda == 1.0 else NStepLambdaReplayBuffer
+        dict_buffer_class = NStepDictReplayBuffer if lmbda == 1.0 else NStepLambdaDictReplayBuffer
+        buffer = buffer_class(size, observation_space, action_space, n_steps=n_steps, gamma=gamma, lmbda=lmbda)
+        dict_buffer = dict_buffer_class(size, dict_space, action_space, n_steps=n_steps, gamma=gamma, lmbda=lmbda)
+        fill(buffer, stream)
+        fill(dict_buffer, stream, dict_obs=True)
+        ts = np.arange(steps - size + 1, steps)
+        ref = np.array([reference_target(stream, t, n_steps, gamma, lmbda) for t in ts])
+        assert np.allclose(buffer_targets(buffer, values, ts % size), ref, atol=1e-5)
+        assert np.allclose(window_targets(buffer, values, ts % size, (steps - 1) % size, n_steps, gamma, lmbda), ref, atol=1e-5)
+
+        samples = buffer._get_samples(ts % size)
+        dict_samples = dict_buffer._get_samples(ts % size)
+        # Next observations of the transitions ending each bootstrap step.
+        bootstrap = ts[:, np.newaxis] + (buffer.n_step_returns.bootstrap_inds[ts % size] - ts[:, np.newaxis]) % size
+        next_obs = stream[0][bootstrap + 1]
+        assert np.array_equal(samples.next_observations.numpy(), next_obs.reshape(-1, 8))
+        assert np.array_equal(samples.next_observations.numpy(), dict_samples.next_observations['obs'].numpy())
+        assert np.array_equal(samples.rewards.numpy(), dict_samples.rewards.numpy())
+        assert np.array_equal(samples.discounts.numpy(), dict_samples.discounts.numpy())
+    print('Precomputed returns match the brute force λ-returns')
+
+    print('{:>8} {:>8} {:>12} {:>16} {:>16}'.format('n_steps', 'lmbda', 'add us', 'window ms', 'precomputed ms'))
+    stream = make_stream(rng, args.buffer_size, 64, params['max_episode_size'], 0.002)
+    for n_steps, lmbda in [(1, 1.0), (5, 1.0), (10, 1.0), (10, 0.9)]:
+        buffer = NStepLambdaReplayBuffer(
+            args.buffer_size, spaces.Box(low=-np.inf, high=np.inf, shape=(64,), dtype=np.float32), action_space,
+            n_steps=n_steps, gamma=gamma, lmbda=lmbda
+        )
+        start = time.perf_counter()
+        fill(buffer, stream)
+        add = (time.perf_counter() - start) / args.buffer_size
+        values = rng.normal(size=(args.buffer_size,))
+        batches = [rng.integers(0, args.buffer_size - 1, size=params['batch_size']) for _ in range(args.repeats)]
+        start = time.perf_counter()
+        for batch_inds in batches:
+            window_targets(buffer, values, batch_inds, args.buffer_size - 1, n_steps, gamma, lmbda)
+        window = (time.perf_counter() - start) / args.repeats
+        start = time.perf_counter()
+        for batch_inds in batches:
+            buffer_targets(buffer, values, batch_inds)
+        precomputed = (time.perf_counter() - start) / args.repeats
+        print('{:>8} {:>8} {:>12.2f} {:>16.3f} {:>16.3f}'.format(
+            n_steps, lmbda, add * 1e6, window * 1e3, precomputed * 1e3))
@@ -0,0 +1,81 @@
+import os
+import sys
+import argparse
+import subprocess
+import importlib.util
+import numpy as np
+from neurorobotics.utils import optional
+
+# Modules imported by the workers of vectorized environments, with the heavy
+# dependencies they imported eagerly before they were made lazy.
+TARGETS = {
+    'neurorobotics.simulations.maze_env': ['torch', 'torchvision', 'open3d', 'matplotlib.pyplot', 'tqdm', 'pandas', 'PIL.Image'],
+    'neurorobotics.simulations.quadruped': ['torchvision', 'open3d', 'matplotlib.pyplot', 'pandas', 'PIL.Image'],
+    'neurorobotics.oscillator': ['torch', 'torchvision', 'open3d', 'matplotlib.pyplot', 'pandas', 'PIL.Image'],
+}
+HEAVY = ['torch', 'torchvision', 'open3d', 'matplotlib', 'tqdm', 'pandas', 'PIL', 'fastapi', 'uvicorn']
+
+
+def import_time(modules, repeats):
+    # Total import time in seconds of a fresh interpreter importing `modules`, from `python -X importtime`.
+    code = 'import sys\n{}\nprint(",".join(m for m in {} if m in sys.modules))'.format(
+        '\n'.join('import {}'.format(module) for module in modules), HEAVY)
+    times = []
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-W', 'ignore', '-c', code],
+            capture_output=True, text=True, env=dict(os.environ)
+        )
+        assert result.returncode == 0, result.stderr[-2000:]
+        total = 0
+        for line in result.stderr.splitlines():
+            if line.startswith('import time:') and 'self [us]' not in line:
+                total += int(line.split('|')[0].split(':')[1])
+        times.append(total * 1e-6)
+    loaded = result.stdout.strip().splitlines()[-1]
+    return np.median(times), [module for module in loaded.split(',') if module]
+
+
+def check_lazy_import():
+    optional.register('missing', ['_missing_dependency'], 'testing')
+    assert not optional.available('missing')
+    module = optional.lazy_import('_missing_dependency', 'missing')
+    assert not optional.is_loaded(module)
+    try:
+        module.value
+        raise AssertionError('Expected an ImportError')
+    except ImportError as e:
+        assert 'missing' in str(e) and '_missing_dependency' in str(e)
+    del optional.FEATURES['missing']
+
+    # Modules already imported are returned as is, others on first attribute access.
+    assert optional.lazy_import('os') is os
+    module = optional.lazy_import('json')
+    if 'json' not in sys.modules:
+        assert not optional.is_loaded(module)
+    assert module.loads('[1]') == [1] and optional.is_loaded(module)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test lazy imports of optional dependencies and benchmark the import time of worker processes.')
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 3,
+        help = 'number of timed interpreters per configuration'
+    )
+    args = parser.parse_args()
+    check_lazy_import()
+    print('Optional features: {}'.format(', '.join(
+        '{} ({})'.format(name, 'available' if available else 'missing') for name, available in optional.features().items())))
+
+    print('{:>38} {:>10} {:>10} {:>8}   {}'.format('module', 'lazy s', 'eager s', 'ratio', 'heavy modules imported'))
+    for target, eager in TARGETS.items():
+        eager = [module for module in eager if importlib.util.find_spec(module.split('.')[0]) is not None]
+        lazy_time, loaded = import_time([target], args.repeats)
+        eager_time, _ = import_time([target] + eager, args.repeats)
+        print('{:>38} {:>10.3f} {:>10.3f} {:>8.2f}   {}'.format(
+            target, lazy_time, eager_time, eager_time / lazy_time, ', '.join(loaded) or '-'))
+        for module in ['torchvision', 'matplotlib', 'pandas']:
+            assert module not in loaded, (target, module)
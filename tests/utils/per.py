@@ -0,0 +1,165 @@
+import time
+import argparse
+import numpy as np
+from neurorobotics.constants import params
+from neurorobotics.utils.legacy.per import SumSegmentTree, MinSegmentTree
+from neurorobotics.utils.per import PriorityTree, PrioritizedFrameDictReplayBuffer
+from gym import spaces
+
+
+class LegacyTrees:
+    # Priority bookkeeping of the legacy `PrioritizedReplayBuffer`.
+    def __init__(self, capacity):
+        it_capacity = 1
+        while it_capacity < capacity:
+            it_capacity *= 2
+        self.sum = SumSegmentTree(it_capacity)
+        self.min = MinSegmentTree(it_capacity)
+
+    def update(self, idxes, priorities):
+        self.sum[idxes] = priorities
+        self.min[idxes] = priorities
+
+    def sample(self, batch_size, size, beta):
+        total = self.sum.sum(0, size)
+        mass = np.random.random(size=batch_size) * total
+        batch_inds = self.sum.find_prefixsum_idx(mass)
+        p_min = self.min.min() / self.sum.sum()
+        max_weight = (p_min * size) ** (-beta)
+        p_sample = self.sum[batch_inds] / self.sum.sum()
+        return batch_inds, (p_sample * size) ** (-beta) / max_weight
+
+
+class FlatTrees:
+    def __init__(self, capacity):
+        self.tree = PriorityTree(capacity)
+
+    def update(self, idxes, priorities):
+        self.tree.update(idxes, priorities)
+
+    def sample(self, batch_size, size, beta):
+        batch_inds = self.tree.sample(batch_size, size)
+        return batch_inds, self.tree.weights(batch_inds, size, beta)
+
+
+def check_tree(rng, capacity, steps, batch_size):
+    legacy = LegacyTrees(capacity)
+    tree = PriorityTree(capacity)
+    reference = np.zeros((capacity,))
+    for _ in range(steps):
+        # Repeated indices keep the last priority.
+        idxes = rng.integers(0, capacity, size=batch_size)
+        priorities = rng.uniform(1e-3, 2.0, size=batch_size)
+        legacy.update(np.sort(idxes), priorities[np.argsort(idxes, kind='stable')])
+        tree.update(idxes, priorities)
+        reference[idxes] = priorities
+    assert np.allclose(tree[np.arange(capacity)], reference)
+    assert np.isclose(tree.total, legacy.sum.sum()) and np.isclose(tree.total, reference.sum())
+    assert tree.min == legacy.min.min() == reference[reference > 0].min()
+
+    prefixsum = rng.uniform(0, tree.total, size=1000)
+    expected = np.searchsorted(np.cumsum(reference), prefixsum, side='right')
+    assert np.array_equal(tree.find_prefixsum_idx(prefixsum), expected)
+    if capacity > 1:
+        # The legacy descent indexes past a single leaf tree.
+        assert np.array_equal(legacy.sum.find_prefixsum_idx(prefixsum), expected)
+
+    # Stratified samples follow the priorities.
+    counts = np.bincount(np.concatenate([tree.sample(batch_size) for _ in range(2000)]), minlength=capacity)
+    assert np.abs(counts / counts.sum() - reference / reference.sum()).max() < 0.01
+
+    tree.clear(np.arange(capacity // 2))
+    reference[:capacity // 2] = 0
+    assert np.isclose(tree.total, reference.sum())
+    assert tree.min == reference[reference > 0].min()
+    assert tree.sample(batch_size).min() >= capacity // 2
+
+
+def random_obs(rng):
+    return {
+        'frame_t': rng.integers(0, 256, size=(1, 3, 32, 32), dtype=np.uint8),
+        'sensors': rng.uniform(-1, 1, size=(1, 8)).astype(np.float32),
+    }
+
+
+def check_buffer(rng, buffer_size, steps, episode_size):
+    observation_space = spaces.Dict({
+        'frame_t': spaces.Box(low=0, high=255, shape=(3, 32, 32), dtype=np.uint8),
+        'sensors': spaces.Box(low=-1, high=1, shape=(8,), dtype=np.float32),
+    })
+    action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+    buffer = PrioritizedFrameDictReplayBuffer(buffer_size, observation_space, action_space)
+    obs = random_obs(rng)
+    for t in range(steps):
+        next_obs = random_obs(rng)
+        done = np.array([(t + 1) % episode_size == 0])
+        buffer.add(obs, next_obs, rng.uniform(-1, 1, size=(1, 2)), rng.normal(size=(1,)), done, [{}])
+        obs = random_obs(rng) if done[0] else next_obs
+        if buffer.full:
+            # The oldest transition lost its observation.
+            assert buffer.tree[buffer.pos] == 0
+    samples = buffer.sample(params['batch_size'])
+    assert samples.weights.shape == (params['batch_size'], 1)
+    assert np.all(samples.indices != buffer.pos)
+    for key in samples.observations.keys():
+        assert np.array_equal(
+            samples.observations[key].numpy(),
+            buffer._decode(key, samples.indices).reshape(samples.observations[key].shape)
+        )
+    buffer.update_priorities(samples.indices[:1], np.array([10.0]))
+    assert np.isclose(buffer.tree[samples.indices[0]], (10.0 + buffer.epsilon) ** buffer.alpha)
+    # New transitions get the largest priority.
+    buffer.add(obs, random_obs(rng), rng.uniform(-1, 1, size=(1, 2)), rng.normal(size=(1,)), np.array([False]), [{}])
+    assert np.isclose(buffer.tree[buffer.pos - 1], (10.0 + buffer.epsilon) ** buffer.alpha)
+
+
+def benchmark(trees, rng, capacity, batch_size, repeats, beta):
+    # Fills the trees with one transition per step, then alternates batched
+    # priority updates and samples as a training step does.
+    start = time.perf_counter()
+    for i in range(repeats * batch_size):
+        trees.update(i, 1.0)
+    add = (time.perf_counter() - start) / (repeats * batch_size)
+    trees.update(np.arange(capacity), rng.uniform(1e-3, 2.0, size=capacity))
+    sample, update = 0.0, 0.0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        idxes, weights = trees.sample(batch_size, capacity, beta)
+        sample += time.perf_counter() - start
+        priorities = rng.uniform(1e-3, 2.0, size=batch_size)
+        start = time.perf_counter()
+        trees.update(np.sort(idxes), priorities)
+        update += time.perf_counter() - start
+    return add, sample / repeats, update / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test and benchmark the flat priority trees against the legacy segment trees.')
+    parser.add_argument(
+        '--capacity',
+        type = int,
+        default = 1000000,
+        help = 'number of priorities in the benchmarked trees'
+    )
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 100,
+        help = 'number of timed batches'
+    )
+    args = parser.parse_args()
+    np.random.seed(params['seed'])
+    rng = np.random.default_rng(params['seed'])
+
+    for capacity in [1, 7, 64, 1000]:
+        check_tree(rng, capacity, 20, 32)
+    check_buffer(rng, 200, 500, 50)
+    print('Priority trees match the legacy segment trees and brute force')
+
+    print('{:>14} {:>8} {:>14} {:>14} {:>14}'.format('trees', 'batch', 'add us', 'sample ms', 'update ms'))
+    for batch_size in [params['batch_size'], 1024]:
+        for name, trees in [('legacy', LegacyTrees(args.capacity)), ('flat', FlatTrees(args.capacity))]:
+            add, sample, update = benchmark(trees, rng, args.capacity, batch_size, args.repeats, params['per_beta'])
+            print('{:>14} {:>8} {:>14.2f} {:>14.3f} {:>14.3f}'.format(
+                name, batch_size, add * 1e6, sample * 1e3, update * 1e3))
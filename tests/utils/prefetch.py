@@ -0,0 +1,207 @@
+import time
+import argparse
+from typing import Dict, NamedTuple
+import numpy as np
+import torch
+import gym
+import stable_baselines3 as sb3
+from gym import spaces
+from neurorobotics.constants import params
+from neurorobotics.utils.buffers import FrameDictReplayBuffer, SequenceSampler
+from neurorobotics.utils.prefetch import BatchPrefetcher, prefetched
+
+
+class SequenceSamples(NamedTuple):
+    observations: Dict[str, torch.Tensor]
+    actions: torch.Tensor
+    states: torch.Tensor
+
+
+class SequenceBuffer:
+    # Stands in for the recurrent buffers, whose sequences are gathered by their `SequenceSampler`.
+    def __init__(self, buffer_size, max_seq_len, rng):
+        self.device = torch.device('cpu')
+        self.obs = {
+            'sensors': rng.normal(size=(buffer_size, 1, 16)).astype(np.float32),
+            'frame': rng.integers(0, 256, size=(buffer_size, 1, 3, 16, 16), dtype=np.uint8)
+        }
+        self.actions = rng.normal(size=(buffer_size, 1, 2)).astype(np.float32)
+        self.states = rng.normal(size=(buffer_size, 1, 1, 32)).astype(np.float32)
+        self.sampler = SequenceSampler(buffer_size, max_seq_len, device=self.device)
+        dones = rng.uniform(size=(buffer_size,)) < 0.02
+        for pos in range(buffer_size):
+            self.sampler.add(pos, dones[pos])
+
+    def sample(self, batch_size, env=None):
+        batch_inds = np.random.randint(0, len(self.actions), size=batch_size)
+        inds, include = self.sampler.indices(batch_inds, len(self.actions), False)
+        return SequenceSamples(
+            observations={key: self.sampler.gather(key, obs, inds, include) for key, obs in self.obs.items()},
+            actions=self.sampler.gather('actions', self.actions, inds, include),
+            states=self.sampler.gather('states', self.states, inds[:, 0], include[:, 0], env_axis=2)
+        )
+
+
+class DictEnv(gym.Env):
+    # Vector observations of the size of the `SimpleRoomEnv` sensors, no simulation.
+    def __init__(self):
+        self.observation_space = spaces.Dict({
+            'sensors': spaces.Box(low=-np.inf, high=np.inf, shape=(params['history_steps'] * 8,), dtype=np.float32),
+            'goal': spaces.Box(low=-np.inf, high=np.inf, shape=(4,), dtype=np.float32),
+            'velocity': spaces.Box(low=-np.inf, high=np.inf, shape=(6,), dtype=np.float32)
+        })
+        self.action_space = spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+
+    def reset(self):
+        return {key: np.zeros(space.shape, dtype=np.float32) for key, space in self.observation_space.spaces.items()}
+
+    def step(self, action):
+        return self.reset(), 0.0, False, {}
+
+
+def clone(sample):
+    if isinstance(sample, torch.Tensor):
+        return sample.clone()
+    if isinstance(sample, dict):
+        return {key: clone(value) for key, value in sample.items()}
+    if isinstance(sample, tuple):
+        return type(sample)(*[clone(value) for value in sample])
+    return sample
+
+
+def assert_equal(a, b):
+    if isinstance(a, torch.Tensor):
+        assert torch.equal(a, b)
+    elif isinstance(a, dict):
+        for key in a:
+            assert_equal(a[key], b[key])
+    elif isinstance(a, tuple):
+        for x, y in zip(a, b):
+            assert_equal(x, y)
+
+
+def check_samples(buffer, batch_size, n_batches, repeats=20):
+    # Prefetched batches follow the same random sequence as direct sampling.
+    np.random.seed(params['seed'])
+    expected = [clone(buffer.sample(batch_size)) for _ in range(repeats)]
+    np.random.seed(params['seed'])
+    prefetcher = BatchPrefetcher(buffer, n_batches)
+    for sample in expected:
+        assert_equal(sample, prefetcher.sample(batch_size))
+    prefetcher.stop()
+
+
+def check_paused(buffer, batch_size):
+    # The worker does not sample while paused.
+    prefetcher = BatchPrefetcher(buffer, 2)
+    with prefetcher.paused():
+        prefetcher.start(batch_size)
+        time.sleep(0.2)
+        assert prefetcher._ready.qsize() == 0
+    prefetcher.sample(batch_size)
+    prefetcher.stop()
+
+
+def make_model(algorithm_class, rng, **kwargs):
+    env = DictEnv()
+    model = algorithm_class(
+        'MultiInputPolicy',
+        env,
+        buffer_size=params['buffer_size'],
+        batch_size=params['batch_size'],
+        replay_buffer_class=FrameDictReplayBuffer,
+        policy_kwargs={'net_arch': [64, 64]},
+        seed=params['seed'],
+        device='cpu',
+        **kwargs
+    )
+    model.set_logger(sb3.common.logger.Logger(None, []))
+    obs = env.reset()
+    for i in range(params['buffer_size']):
+        next_obs = {
+            key: rng.normal(size=(1,) + space.shape).astype(np.float32)
+            for key, space in env.observation_space.spaces.items()
+        }
+        done = (i + 1) % params['max_episode_size'] == 0
+        model.replay_buffer.add(
+            obs, next_obs, rng.uniform(-1, 1, size=(1, 2)), rng.normal(size=(1,)),
+            np.array([done]), [{'TimeLimit.truncated': done}]
+        )
+        obs = next_obs
+    return model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test and benchmark prefetched replay sampling against sampling in the gradient loop.')
+    parser.add_argument(
+        '--gradient_steps',
+        type = int,
+        default = 2000,
+        help = 'number of timed gradient steps'
+    )
+    parser.add_argument(
+        '--train_steps',
+        type = int,
+        default = 100,
+        help = 'number of gradient steps per call to `train`, as with one call per episode'
+    )
+    parser.add_argument(
+        '--n_batches',
+        type = int,
+        nargs = '+',
+        default = [1, 2, 4],
+        help = 'numbers of batches sampled ahead to benchmark'
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(params['seed'])
+    torch.set_num_threads(1)
+
+    check_samples(SequenceBuffer(5000, params['max_seq_len'] + params['burn_in_seq_len'], rng), 64, 2)
+    model = make_model(sb3.TD3, rng)
+    check_samples(model.replay_buffer, params['batch_size'], 3)
+    print('Prefetched samples match direct samples')
+
+    # Updates from prefetched batches are the same as the direct ones.
+    models = []
+    for algorithm_class, kwargs in [(sb3.TD3, {}), (prefetched(sb3.TD3), {'prefetch_batches': 2})]:
+        model = make_model(algorithm_class, np.random.default_rng(params['seed']), **kwargs)
+        np.random.seed(params['seed'])
+        torch.manual_seed(params['seed'])
+        model.train(gradient_steps=50, batch_size=params['batch_size'])
+        models.append(model)
+    for a, b in zip(models[0].policy.parameters(), models[1].policy.parameters()):
+        assert torch.equal(a, b)
+    # Batches sampled ahead are kept between the calls to `train`.
+    model = make_model(prefetched(sb3.TD3), np.random.default_rng(params['seed']), prefetch_batches=2)
+    np.random.seed(params['seed'])
+    torch.manual_seed(params['seed'])
+    for _ in range(2):
+        model.train(gradient_steps=25, batch_size=params['batch_size'])
+        assert model.prefetcher._worker is not None and model.replay_buffer is not model.prefetcher
+    for a, b in zip(models[0].policy.parameters(), model.policy.parameters()):
+        assert torch.equal(a, b)
+    model.prefetcher.stop()
+    check_paused(model.replay_buffer, params['batch_size'])
+    # Collected transitions are stored while the worker is paused, it is stopped at the end of `learn`.
+    model = make_model(prefetched(sb3.TD3), rng, prefetch_batches=2, train_freq=1, gradient_steps=1)
+    model.learn(total_timesteps=200)
+    assert model.prefetcher._worker is None and model._n_updates > 50
+    print('Prefetched updates match direct updates')
+
+    start = time.perf_counter()
+    for _ in range(args.gradient_steps):
+        models[0].replay_buffer.sample(params['batch_size'])
+    print('Direct sampling: {:.3f} ms per batch'.format((time.perf_counter() - start) / args.gradient_steps * 1e3))
+
+    print('{:>12} {:>12} {:>14}'.format('mode', 'n_batches', 'updates/s'))
+    configs = [(sb3.TD3, {})] + [(prefetched(sb3.TD3), {'prefetch_batches': n}) for n in args.n_batches]
+    for algorithm_class, kwargs in configs:
+        model = make_model(algorithm_class, rng, **kwargs)
+        model.train(gradient_steps=10, batch_size=params['batch_size'])
+        start = time.perf_counter()
+        for _ in range(args.gradient_steps // args.train_steps):
+            model.train(gradient_steps=args.train_steps, batch_size=params['batch_size'])
+        elapsed = time.perf_counter() - start
+        print('{:>12} {:>12} {:>14.1f}'.format(
+            'prefetch' if kwargs else 'direct', kwargs.get('prefetch_batches', '-'), args.gradient_steps / elapsed))
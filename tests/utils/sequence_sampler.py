@@ -0,0 +1,107 @@
+import time
+import argparse
+import numpy as np
+from neurorobotics.constants import params
+from neurorobotics.utils.buffers import SequenceSampler
+
+
+def expand_include(include, shape):
+    length = len(include.shape)
+    assert shape[:length] == include.shape
+    shape = shape[length:]
+    for item in shape:
+        include = np.repeat(np.expand_dims(include, -1), item, -1)
+    return include
+
+
+def reference_samples(arrays, dones, states, batch_inds, max_seq_len, buffer_size):
+    # Sequence gather of the legacy recurrent `DictReplayBuffer._get_samples`.
+    offsets = np.repeat(np.expand_dims(np.arange(-(max_seq_len - 1), 1), 0), len(batch_inds), 0)
+    inds = np.repeat(np.expand_dims(batch_inds, 1), max_seq_len, 1) + offsets
+    inds[inds < 0] = inds[inds < 0] + buffer_size
+    include = np.flip(np.multiply.accumulate(np.flip(1 - dones[inds, 0], 1), 1), 1)
+    obs = {
+        key: obs[inds, 0, :] * expand_include(include, obs[inds, 0, :].shape).astype(obs.dtype)
+        for key, obs in arrays.items()
+    }
+    state_include = np.prod(include, 1)
+    state = states[inds[:, 0], :, 0] * expand_include(
+        state_include, states[inds[:, 0], :, 0].shape
+    ).astype(states.dtype)
+    return obs, state
+
+
+def sampler_samples(sampler, arrays, states, batch_inds, pos, full):
+    inds, include = sampler.indices(batch_inds, pos, full)
+    obs = {key: sampler.gather(key, obs, inds, include) for key, obs in arrays.items()}
+    state = sampler.gather('states', states, inds[:, 0], include[:, 0], env_axis=2)
+    return obs, state
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Test and benchmark `SequenceSampler` against the legacy recurrent sequence gather.')
+    parser.add_argument(
+        '--buffer_size',
+        type = int,
+        default = 20000,
+        help = 'number of stored transitions'
+    )
+    parser.add_argument(
+        '--frame_size',
+        type = int,
+        default = 64,
+        help = 'height and width of the stored frames'
+    )
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 50,
+        help = 'number of timed batches'
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(params['seed'])
+    size = args.buffer_size
+    arrays = {
+        'frame_t': rng.integers(0, 255, size=(size, 1, 3, args.frame_size, args.frame_size), dtype=np.uint8),
+        'sensors': rng.normal(size=(size, 1, 64)).astype(np.float32),
+        'positions': rng.normal(size=(size, 1, 32)).astype(np.float32),
+    }
+    states = rng.normal(size=(size, 1, 1, 256)).astype(np.float32)
+    dones = (rng.uniform(size=(size, 1)) < 0.02).astype(np.float32)
+    # The buffer has wrapped around once, `pos` is the next index to write.
+    pos = size // 3
+    batch_size = params['batch_size']
+
+    print('{:>8} {:>8} {:>14} {:>14}'.format('seq_len', 'burn_in', 'legacy ms', 'sampler ms'))
+    for max_seq_len, burn_in in [(params['max_seq_len'], 0), (params['max_seq_len'], params['burn_in_seq_len']), (20, 0)]:
+        sampler = SequenceSampler(size, max_seq_len, burn_in)
+        for i in list(range(pos, size)) + list(range(pos)):
+            sampler.add(i, dones[i, 0])
+        seq_len = sampler.seq_len
+
+        # The legacy gather zeroes windows ending with a done and does not
+        # stop at the oldest transition, compare on the other windows.
+        candidates = (np.arange(pos + seq_len, pos + size) % size)
+        candidates = candidates[dones[candidates, 0] == 0]
+        batch_inds = rng.choice(candidates, size=batch_size)
+        ref_obs, ref_state = reference_samples(arrays, dones, states, batch_inds, seq_len, size)
+        obs, state = sampler_samples(sampler, arrays, states, batch_inds, pos, True)
+        for key in ref_obs.keys():
+            assert np.array_equal(ref_obs[key], obs[key].numpy()), key
+        assert np.array_equal(ref_state, state.numpy())
+        # Batches kept across samples are not overwritten by later gathers
+        sampler_samples(sampler, arrays, states, rng.choice(candidates, size=batch_size), pos, True)
+        for key in ref_obs.keys():
+            assert np.array_equal(ref_obs[key], obs[key].numpy()), key
+        assert np.array_equal(ref_state, state.numpy())
+
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            reference_samples(arrays, dones, states, rng.choice(candidates, size=batch_size), seq_len, size)
+        legacy = (time.perf_counter() - start) / args.repeats
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            sampler_samples(sampler, arrays, states, rng.choice(candidates, size=batch_size), pos, True)
+        fast = (time.perf_counter() - start) / args.repeats
+        print('{:>8} {:>8} {:>14.2f} {:>14.2f}'.format(max_seq_len, burn_in, legacy * 1e3, fast * 1e3))
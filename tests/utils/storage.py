@@ -0,0 +1,131 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from neurorobotics.constants import params
+from neurorobotics.utils.storage import ReplayStorage
+
+
+def allocate(storage, size, frame_shape, sensor_size, state_size):
+    return {
+        'frame_t': storage.zeros('observations_frame_t', (size, 1) + frame_shape, np.uint8),
+        'sensors': storage.zeros('observations_sensors', (size, 1, sensor_size), np.float32),
+        'states': storage.zeros('states', (size, 1, 1, state_size), np.float32),
+        'actions': storage.zeros('actions', (size, 2), np.float32),
+        'rewards': storage.zeros('rewards', (size, 1), np.float32),
+        'dones': storage.zeros('dones', (size, 1), np.float32),
+    }
+
+
+def fill(arrays, rng, size, chunk):
+    # Writes rows one at a time as `add` does, generating the data in chunks.
+    for start in range(0, size, chunk):
+        data = {
+            key: rng.integers(0, 255, size=(chunk,) + array.shape[1:]).astype(array.dtype)
+            for key, array in arrays.items()
+        }
+        for i in range(min(chunk, size - start)):
+            for key, array in arrays.items():
+                array[start + i] = data[key][i]
+
+
+def gather(arrays, batch_inds, max_seq_len, size):
+    # Index pattern of the recurrent `DictReplayBuffer._get_samples`.
+    inds = batch_inds[:, np.newaxis] + np.arange(-(max_seq_len - 1), 1)[np.newaxis]
+    inds[inds < 0] += size
+    return {
+        'frame_t': arrays['frame_t'][inds, 0, :],
+        'sensors': arrays['sensors'][inds, 0, :],
+        'states': arrays['states'][inds[:, 0], :, 0],
+        'actions': arrays['actions'][batch_inds],
+        'rewards': arrays['rewards'][batch_inds],
+        'dones': arrays['dones'][inds, 0],
+    }
+
+
+def throughput(arrays, rng, size, batch_size, max_seq_len, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        gather(arrays, rng.integers(0, size, size=batch_size), max_seq_len, size)
+    return repeats * batch_size / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark memory mapped replay storage against in memory arrays.')
+    parser.add_argument(
+        '--transitions',
+        type = int,
+        default = 1000000,
+        help = 'number of stored transitions'
+    )
+    parser.add_argument(
+        '--frame_size',
+        type = int,
+        default = 16,
+        help = 'height and width of the stored frames'
+    )
+    parser.add_argument(
+        '--hot_window',
+        type = int,
+        default = 4096,
+        help = 'rows of each array kept in memory'
+    )
+    parser.add_argument(
+        '--max_seq_len',
+        type = int,
+        default = 10,
+        help = 'length of the sampled sequences'
+    )
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 50,
+        help = 'number of timed batches'
+    )
+    args = parser.parse_args()
+    shape = (3, args.frame_size, args.frame_size)
+    path = tempfile.mkdtemp()
+    try:
+        memory = allocate(ReplayStorage(), args.transitions, shape, 64, 128)
+        storage = ReplayStorage(os.path.join(path, 'buffer'), args.hot_window)
+        disk = allocate(storage, args.transitions, shape, 64, 128)
+        start = time.perf_counter()
+        fill(memory, np.random.default_rng(params['seed']), args.transitions, 65536)
+        memory_fill = time.perf_counter() - start
+        start = time.perf_counter()
+        fill(disk, np.random.default_rng(params['seed']), args.transitions, 65536)
+        disk_fill = time.perf_counter() - start
+        print('Filled {} transitions: memory {:.1f} s, memmap {:.1f} s'.format(
+            args.transitions, memory_fill, disk_fill))
+
+        # Rows still in the hot window must be read from memory.
+        rng = np.random.default_rng(params['seed'])
+        batch_inds = np.concatenate([
+            rng.integers(0, args.transitions, size=params['batch_size']),
+            np.arange(args.transitions - 8, args.transitions)
+        ])
+        ref = gather(memory, batch_inds, args.max_seq_len, args.transitions)
+        out = gather(disk, batch_inds, args.max_seq_len, args.transitions)
+        for key in ref.keys():
+            assert np.array_equal(ref[key], out[key]), key
+
+        storage.flush(pos=0, full=True)
+        resumed_storage = ReplayStorage(os.path.join(path, 'buffer'), args.hot_window, resume=True)
+        resumed = allocate(resumed_storage, args.transitions, shape, 64, 128)
+        assert resumed_storage.load_state() == {'pos': 0, 'full': True}
+        out = gather(resumed, batch_inds, args.max_seq_len, args.transitions)
+        for key in ref.keys():
+            assert np.array_equal(ref[key], out[key]), key
+        print('Memory mapped and resumed samples match in memory samples')
+
+        nbytes = sum(array.nbytes for array in memory.values())
+        print('{:>10} {:>14} {:>14}'.format('storage', 'GB in RAM', 'samples / sec'))
+        for name, arrays in [('memory', memory), ('memmap', disk)]:
+            rate = throughput(arrays, rng, args.transitions, params['batch_size'], args.max_seq_len, args.repeats)
+            ram = nbytes if name == 'memory' else args.hot_window * nbytes / args.transitions
+            print('{:>10} {:>14.3f} {:>14.1f}'.format(name, ram / 1e9, rate))
+    finally:
+        shutil.rmtree(path)
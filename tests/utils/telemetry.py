@@ -0,0 +1,124 @@
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from neurorobotics.constants import params
+from neurorobotics.utils.telemetry import TelemetryRecorder
+
+
+def random_steps(rng, keys, steps):
+    # Values of each step, with the shapes and dtypes tracked by `Quadruped._track_attr`
+    shapes = {key: (int(rng.integers(1, 30)),) for key in keys}
+    dtypes = {key: [np.float32, np.float64][i % 2] for i, key in enumerate(keys)}
+    return [
+        {key: rng.normal(size = shapes[key]).astype(dtypes[key]) for key in keys}
+        for _ in range(steps)
+    ]
+
+
+def reference_record(steps, keys):
+    # Lists of copies of the `_track_item` dict before the recorder.
+    track_item = {key: [] for key in keys}
+    for step in steps:
+        for key in keys:
+            if key in step:
+                track_item[key].append(step[key].copy())
+    return track_item
+
+
+def check_recorder(recorder, steps, keys):
+    expected = reference_record(steps, keys)
+    for step in steps:
+        for key, value in step.items():
+            recorder.record(key, value)
+            # Values may be modified in place after they are recorded
+            value += 1
+    for key in keys:
+        assert key in recorder
+        column = recorder[key]
+        assert np.array_equal(column, np.stack(expected[key], 0)) and column.dtype == expected[key][0].dtype
+        assert np.array_equal(column, recorder.get(key)) and not column.flags.writeable
+    assert len(recorder) == len(steps)
+
+
+def check_growth(steps):
+    # Columns double in size, the number of resizes is logarithmic in the number of steps
+    recorder = TelemetryRecorder(['x'], chunk_size = 4)
+    sizes = []
+    for i in range(steps):
+        recorder.record('x', np.array([i], dtype = np.int64))
+        column = recorder._slots['x'][0]
+        if not sizes or sizes[-1] != len(column):
+            sizes.append(len(column))
+    assert sizes == [4 * 2 ** i for i in range(len(sizes))]
+    assert np.array_equal(recorder['x'][:, 0], np.arange(steps))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Test the telemetry recorder against the per key lists it replaces and benchmark a recorded step.')
+    parser.add_argument(
+        '--steps',
+        type = int,
+        default = 5000,
+        help = 'number of recorded steps'
+    )
+    parser.add_argument(
+        '--keys',
+        type = int,
+        default = 14,
+        help = 'number of recorded keys'
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(params['seed'])
+    keys = ['key_{}'.format(i) for i in range(args.keys)]
+    steps = random_steps(rng, keys, args.steps)
+
+    recorder = TelemetryRecorder(keys, chunk_size = 16)
+    check_recorder(recorder, [{key: value.copy() for key, value in step.items()} for step in steps], keys)
+    # Keys outside the selection are not recorded
+    recorder.record('ignored', np.zeros(3))
+    assert 'ignored' not in recorder
+    # A reset rewinds the columns, later records overwrite the rows of earlier views
+    view = recorder['key_0']
+    recorder.reset()
+    assert len(recorder) == 0 and len(recorder['key_0']) == 0
+    check_recorder(recorder, [{key: value.copy() for key, value in step.items()} for step in steps[50:100]], keys)
+    assert np.array_equal(view[:50], np.stack(reference_record(steps[50:100], ['key_0'])['key_0'], 0))
+    check_growth(1000)
+
+    with tempfile.TemporaryDirectory() as path:
+        recorder = TelemetryRecorder(keys, chunk_size = 16, path = path)
+        check_recorder(recorder, [{key: value.copy() for key, value in step.items()} for step in steps[:1000]], keys)
+        recorder.flush()
+        expected = reference_record(steps[:1000], keys)
+        for key in keys:
+            assert np.array_equal(np.load(os.path.join(path, '{}.npy'.format(key))), np.stack(expected[key], 0))
+        recorder.save(os.path.join(path, 'telemetry.npz'))
+        with np.load(os.path.join(path, 'telemetry.npz')) as data:
+            assert all(np.array_equal(data[key], np.stack(expected[key], 0)) for key in keys)
+    print('Recorded telemetry matches the per key lists')
+
+    values = steps[0]
+    start = time.perf_counter()
+    track_item = {key: [] for key in keys}
+    for _ in range(args.steps):
+        for key in keys:
+            track_item[key].append(values[key].copy())
+    lists = (time.perf_counter() - start) / args.steps
+    start = time.perf_counter()
+    {key: np.stack(track_item[key], 0) for key in keys}
+    stack = (time.perf_counter() - start) / args.steps
+    recorder = TelemetryRecorder(keys)
+    recorded = []
+    # The first episode allocates and grows the columns, the next episodes reuse them after `reset`
+    for episode in range(2):
+        recorder.reset()
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            for key in keys:
+                recorder.record(key, values[key])
+        recorded.append((time.perf_counter() - start) / args.steps)
+    print('per step with {} keys: lists {:.1f} us + {:.1f} us to stack, recorder {:.1f} us, {:.1f} us after a reset'.format(
+        args.keys, lists * 1e6, stack * 1e6, recorded[0] * 1e6, recorded[1] * 1e6))
@@ -1,11 +1,46 @@
 import os
 import shutil
+import functools
 from typing import Callable, Type, Dict, Union
 from neurorobotics.simulations.maze_env import Environment
 from neurorobotics.simulations.agent_model import AgentModel
 from neurorobotics.utils.callbacks import Callback
+from neurorobotics.utils.buffers import FrameDictReplayBuffer, FrameTD3
+from neurorobotics.utils.per import PrioritizedFrameDictReplayBuffer, PrioritizedTD3
+from neurorobotics.utils.nstep import NStepDictReplayBuffer, NStepLambdaDictReplayBuffer, TD3Lambda
+from neurorobotics.utils.actors import learn_async
+from neurorobotics.utils.prefetch import prefetched
+from neurorobotics.utils.checkpoint import AsyncCheckpointer, AsyncCheckpointCallback
 import stable_baselines3 as sb3
 
+
+def make_env(
+        env_class: Type[Environment],
+        agent_class: Type[AgentModel],
+        task_generator: Callable,
+        params: Dict,
+        ) -> sb3.common.vec_env.VecEnv:
+    """Creates a monitored environment for training, evaluation and the actor processes of asynchronous training.
+
+    :param env_class: class of env to spawn
+    :type env_class: Type[Environment]
+    :param params: parameters to be fed to the method. imported from neurorobotics/constants.py
+    :type params: Dict
+    """
+    env = env_class(
+           model_cls=agent_class,
+           maze_task_generator=task_generator,
+           max_episode_size=params['max_episode_size'],
+           n_steps=params['history_steps'],
+           frame_skip=params['frame_skip']
+    )
+    return sb3.common.vec_env.vec_transpose.VecTransposeImage(
+            sb3.common.vec_env.dummy_vec_env.DummyVecEnv([
+                    lambda: sb3.common.monitor.Monitor(env)
+                    ])
+            )
+
+
 def train(
         env_class: Type[Environment],
         agent_class: Type[AgentModel],
@@ -40,42 +75,44 @@ def train(
     os.mkdir(os.path.join(logdir, 'plots'))
     os.mkdir(os.path.join(logdir, 'videos'))
 
-    train_env = env_class(
-           model_cls=agent_class,
-           maze_task_generator=task_generator,
-           max_episode_size=params['max_episode_size'],
-           n_steps=params['history_steps'],
-           frame_skip=params['frame_skip']
-    )
-
-    
-    image_size = ( 
-        int(2 * train_env.top_view_size * len(train_env._maze_structure[0])),
-        int(2 * train_env.top_view_size * len(train_env._maze_structure))
+    env_fn = functools.partial(make_env, env_class, agent_class, task_generator, params)
+    train_env = env_fn()
+    eval_env = env_fn()
+    eval_env_fns = None
+    if params.get('eval_threads', 0) > 0:
+        # Evaluations without video step their environments concurrently through a policy server
+        eval_env_fns = [env_fn] * params['eval_threads']
+    env = train_env.unwrapped.envs[0].unwrapped
+    image_size = (
+        int(2 * env.top_view_size * len(env._maze_structure[0])),
+        int(2 * env.top_view_size * len(env._maze_structure))
     )
 
-    train_env = sb3.common.vec_env.vec_transpose.VecTransposeImage(
-            sb3.common.vec_env.dummy_vec_env.DummyVecEnv([
-                    lambda: sb3.common.monitor.Monitor(train_env)
-                    ])
-            )
+    kwargs = {}
+    if params.get('prioritized_replay', False):
+        algorithm_class = PrioritizedTD3
+        replay_buffer_class = PrioritizedFrameDictReplayBuffer
+        replay_buffer_kwargs = {'alpha': params['per_alpha'], 'beta': params['per_beta']}
+    elif params.get('return_steps', 0) > 0:
+        # n-step or truncated λ-returns, computed when transitions are added
+        algorithm_class = TD3Lambda
+        if params.get('return_lambda', 1.0) < 1.0:
+            replay_buffer_class = NStepLambdaDictReplayBuffer
+        else:
+            replay_buffer_class = NStepDictReplayBuffer
+        replay_buffer_kwargs = None
+        kwargs['n_steps'] = params['return_steps']
+        kwargs['lmbda'] = params.get('return_lambda', 1.0)
+    else:
+        algorithm_class = FrameTD3
+        replay_buffer_class = FrameDictReplayBuffer
+        replay_buffer_kwargs = None
+    if params.get('prefetch_batches', 0) > 0:
+        # Batches are sampled in a worker thread while the previous gradient step runs.
+        algorithm_class = prefetched(algorithm_class)
+        kwargs['prefetch_batches'] = params['prefetch_batches']
 
-
-    eval_env = env_class(
-           model_cls=agent_class,
-           maze_task_generator=task_generator,
-           max_episode_size=params['max_episode_size'],
-           n_steps=params['history_steps'],
-           frame_skip=params['frame_skip']
-    )
-
-    eval_env = sb3.common.vec_env.vec_transpose.VecTransposeImage(
-            sb3.common.vec_env.dummy_vec_env.DummyVecEnv([
-                    lambda: sb3.common.monitor.Monitor(eval_env)
-                    ])
-            )
-
-    model = sb3.TD3(
+    model = algorithm_class(
             policy=policy_class,
             env=train_env,
             learning_rate=lr_schedule,
@@ -87,8 +124,8 @@ def train(
             train_freq=(1, 'episode'),
             gradient_steps=-1,
             action_noise=action_noise,
-            replay_buffer_class=sb3.common.buffers.DictReplayBuffer,
-            replay_buffer_kwargs=None,
+            replay_buffer_class=replay_buffer_class,
+            replay_buffer_kwargs=replay_buffer_kwargs,
             optimize_memory_usage=False,
             policy_delay=params['policy_delay'],
             target_policy_noise=0.2,
@@ -100,13 +137,21 @@ def train(
             device=device,
             _init_setup_model=True,
             verbose=2,
+            **kwargs
     )
 
+    # Checkpoints are written off the training thread
+    checkpointer = AsyncCheckpointer(
+        save_path=os.path.join(logdir, 'models'),
+        name_prefix='td3_model',
+        keep_last=params['keep_checkpoints'],
+        save_replay_buffer=params['checkpoint_replay_buffer'],
+        verbose=2
+    )
     callbacks = sb3.common.callbacks.CallbackList([
-        sb3.common.callbacks.CheckpointCallback(
+        AsyncCheckpointCallback(
             save_freq=params['save_freq'],
-            save_path=os.path.join(logdir, 'models'),
-            name_prefix='td3_model',
+            checkpointer=checkpointer,
             verbose=2
         ),
         Callback(
@@ -118,14 +163,31 @@ def train(
             image_size=image_size,
             log_path=os.path.join(logdir, 'evaluations'),
             best_model_save_path=os.path.join(logdir, 'models'),
+            checkpointer=checkpointer,
             verbose=2,
-            warn=True)
+            warn=True,
+            eval_env_fns=eval_env_fns)
     ])
 
-    model.learn(
-        total_timesteps=params['total_timesteps'],
-        callback=callbacks
-    )
+    if params.get('n_actors', 0) > 0:
+        # Actor processes collect while this process trains.
+        learn_async(
+            model,
+            env_fn,
+            total_timesteps=params['total_timesteps'],
+            callback=callbacks,
+            n_actors=params['n_actors'],
+            utd_ratio=params['utd_ratio'],
+            sync_freq=params['weight_sync_freq'],
+            chunk_size=params['actor_chunk_size'],
+            seed=params['seed']
+        )
+    else:
+        model.learn(
+            total_timesteps=params['total_timesteps'],
+            callback=callbacks
+        )
+    checkpointer.close()
     model.save(os.path.join(logdir, "final_model"))
 
     return model
@@ -1,16 +1,44 @@
-from neurorobotics.utils import cpg_utils
-from neurorobotics.utils import cv_utils
-from neurorobotics.utils import env_utils
-from neurorobotics.utils import point_cloud
-from neurorobotics.utils import torch_utils
-from neurorobotics.utils import visualise
-from neurorobotics.utils import feature_extractors
-from neurorobotics.utils import schedules
-import torch
-import numpy as np
+"""Utilities, submodules are imported on first access as
+`neurorobotics.utils.<name>`, see `neurorobotics.utils.optional`.
+"""
+import importlib
 import random
+import numpy as np
+
+_SUBMODULES = [
+    'cpg_utils',
+    'cv_utils',
+    'env_utils',
+    'point_cloud',
+    'torch_utils',
+    'visualise',
+    'feature_extractors',
+    'schedules',
+    'telemetry',
+    'buffers',
+    'per',
+    'nstep',
+    'prefetch',
+    'ensemble',
+    'inference',
+    'checkpoint',
+    'benchmark',
+    'optional',
+]
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('{}.{}'.format(__name__, name))
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + _SUBMODULES)
+
 
 def set_seeds(seed):
+    import torch
     torch.manual_seed(seed)  # Sets seed for PyTorch RNG
     torch.cuda.manual_seed_all(seed)  # Sets seeds of GPU RNG
     np.random.seed(seed=seed)  # Set seed for NumPy RNG
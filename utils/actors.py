@@ -0,0 +1,324 @@
+"""Asynchronous actor/learner training for off-policy algorithms.
+
+`ActorPool` runs copies of the environment in separate processes. Each actor
+steps its environment with a CPU copy of the actor network and sends chunks of
+transitions to the learner, which adds them to its replay buffer. The learner
+publishes its actor weights through shared memory every `sync_freq` gradient
+steps, and actors load them before their next step. `learn_async` drives an
+`OffPolicyAlgorithm` this way, keeping the number of gradient steps per
+collected transition at `utd_ratio`. Processes are started with `spawn`, so
+environments holding OpenGL or MuJoCo state are never forked, and everything
+runs on CPU-only machines.
+"""
+import copy
+import time
+import queue
+import contextlib
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import gym
+import stable_baselines3 as sb3
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from neurorobotics.utils import set_seeds
+
+Transition = Tuple[Any, Any, np.ndarray, np.ndarray, np.ndarray, bool, int]
+
+
+def _without_rng(space: gym.spaces.Space) -> gym.spaces.Space:
+    # Copy of `space` without its sampling state, which actors reseed anyway.
+    space = copy.copy(space)
+    space._np_random = None
+    if isinstance(space, gym.spaces.Dict):
+        space.spaces = type(space.spaces)((key, _without_rng(value)) for key, value in space.spaces.items())
+    return space
+
+
+def _actor_worker(
+    rank: int,
+    env_fn: Callable[[], sb3.common.vec_env.VecEnv],
+    shared_actor: torch.nn.Module,
+    version: Any,
+    lock: Any,
+    transitions: Any,
+    stop: Any,
+    steps: Any,
+    learning_starts: int,
+    action_noise: Optional[sb3.common.noise.ActionNoise],
+    chunk_size: int,
+    seed: Optional[int]
+) -> None:
+    torch.set_num_threads(1)
+    if seed is not None:
+        set_seeds(seed + rank)
+    env = env_fn()
+    action_space = env.action_space
+    if seed is not None:
+        env.seed(seed + rank)
+        action_space.seed(seed + rank)
+    actor = copy.deepcopy(shared_actor)
+    actor.eval()
+    local_version = -1
+    obs = env.reset()
+    chunk, episodes = [], []
+    while not stop.is_set():
+        if version.value != local_version:
+            with lock:
+                actor.load_state_dict(shared_actor.state_dict())
+                local_version = version.value
+
+        # Same exploration as `OffPolicyAlgorithm._sample_action`, in the scaled action space.
+        if steps.value < learning_starts:
+            scaled_action = 2.0 * (np.array([action_space.sample()]) - action_space.low) / \
+                (action_space.high - action_space.low) - 1.0
+        else:
+            with torch.no_grad():
+                scaled_action = actor(sb3.common.utils.obs_as_tensor(obs, 'cpu')).numpy()
+            if action_noise is not None:
+                scaled_action = np.clip(scaled_action + action_noise(), -1, 1)
+        action = action_space.low + 0.5 * (scaled_action + 1.0) * (action_space.high - action_space.low)
+
+        new_obs, reward, done, infos = env.step(action)
+        with steps.get_lock():
+            steps.value += 1
+        next_obs = new_obs
+        if done[0] and infos[0].get('terminal_observation') is not None:
+            terminal = infos[0]['terminal_observation']
+            if isinstance(terminal, dict):
+                next_obs = {key: value[np.newaxis] for key, value in terminal.items()}
+            else:
+                next_obs = terminal[np.newaxis]
+        chunk.append((
+            obs, next_obs, scaled_action, reward, done,
+            bool(infos[0].get('TimeLimit.truncated', False)), local_version
+        ))
+        if 'episode' in infos[0]:
+            episodes.append(infos[0]['episode'])
+        obs = new_obs
+        if done[0] and action_noise is not None:
+            action_noise.reset()
+
+        if len(chunk) >= chunk_size or done[0]:
+            while not stop.is_set():
+                try:
+                    transitions.put((rank, chunk, episodes), timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            chunk, episodes = [], []
+    env.close()
+
+
+class ActorPool:
+    """Environment processes collecting transitions with periodically synced actor weights.
+
+    :param env_fn: picklable function creating the `VecEnv` of one actor
+    :type env_fn: Callable[[], sb3.common.vec_env.VecEnv]
+    :param actor: actor network mapping observations to scaled actions, copied to each process
+    :type actor: torch.nn.Module
+    :param n_actors: number of actor processes
+    :type n_actors: int
+    :param learning_starts: number of collected steps with uniformly random actions
+    :type learning_starts: int
+    :param action_noise: exploration noise, each actor gets its own copy
+    :type action_noise: Optional[sb3.common.noise.ActionNoise]
+    :param chunk_size: max number of transitions per message to the learner
+    :type chunk_size: int
+    :param seed: seed of the first actor, the others get the following seeds
+    :type seed: Optional[int]
+    """
+    def __init__(
+        self,
+        env_fn: Callable[[], sb3.common.vec_env.VecEnv],
+        actor: torch.nn.Module,
+        n_actors: int = 1,
+        learning_starts: int = 100,
+        action_noise: Optional[sb3.common.noise.ActionNoise] = None,
+        chunk_size: int = 64,
+        seed: Optional[int] = None
+    ):
+        assert n_actors > 0
+        self.n_actors = n_actors
+        ctx = mp.get_context('spawn')
+        memo = {id(space): _without_rng(space) for space in [actor.observation_space, actor.action_space]}
+        self.shared_actor = copy.deepcopy(actor, memo).cpu()
+        self.shared_actor.share_memory()
+        self.version = ctx.Value('q', -1, lock=False)
+        self.lock = ctx.Lock()
+        self.transitions = ctx.Queue(maxsize=4 * n_actors)
+        self.stop = ctx.Event()
+        self.steps = ctx.Value('q', 0)
+        self.processes = [
+            ctx.Process(
+                target=_actor_worker,
+                args=(
+                    rank, env_fn, self.shared_actor, self.version, self.lock, self.transitions,
+                    self.stop, self.steps, learning_starts, copy.deepcopy(action_noise), chunk_size, seed
+                ),
+                daemon=True
+            ) for rank in range(n_actors)
+        ]
+
+    def start(self) -> None:
+        for process in self.processes:
+            process.start()
+
+    def sync(self, actor: torch.nn.Module, version: int) -> None:
+        """Publishes the weights of `actor`, tagging the following transitions with `version`."""
+        with self.lock:
+            for shared, param in zip(self.shared_actor.state_dict().values(), actor.state_dict().values()):
+                shared.copy_(param.detach())
+            self.version.value = version
+
+    def collect(self, timeout: Optional[float] = None) -> List[Tuple[int, List[Transition], List[Dict[str, Any]]]]:
+        """Returns the chunks sent so far, waiting up to `timeout` seconds for one if there are none."""
+        chunks = []
+        try:
+            if timeout is not None:
+                chunks.append(self.transitions.get(timeout=timeout))
+            while True:
+                chunks.append(self.transitions.get_nowait())
+        except queue.Empty:
+            pass
+        return chunks
+
+    def close(self) -> None:
+        self.stop.set()
+        # Unblock actors waiting on a full queue.
+        self.collect()
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+
+def learn_async(
+    model: sb3.common.off_policy_algorithm.OffPolicyAlgorithm,
+    env_fn: Callable[[], sb3.common.vec_env.VecEnv],
+    total_timesteps: int,
+    callback: sb3.common.type_aliases.MaybeCallback = None,
+    n_actors: int = 1,
+    utd_ratio: float = 1.0,
+    sync_freq: int = 100,
+    chunk_size: int = 64,
+    log_interval: int = 4,
+    seed: Optional[int] = None,
+    tb_log_name: str = 'run'
+) -> sb3.common.off_policy_algorithm.OffPolicyAlgorithm:
+    """Trains `model` with `n_actors` asynchronous actor processes, replacing `model.learn`.
+
+    The learner takes `utd_ratio` gradient steps per transition collected after
+    `learning_starts`, waiting for data when ahead and training continuously
+    otherwise. Besides the usual logs it records `async/policy_lag`, the mean
+    number of gradient steps between the weights used to collect a transition
+    and the learner when adding it, `async/update_to_data`, `async/learner_wait`,
+    the fraction of time spent waiting for transitions, and `async/actor_fps`.
+
+    :param model: TD3 like model whose `actor` maps observations to scaled actions
+    :type model: sb3.common.off_policy_algorithm.OffPolicyAlgorithm
+    :param env_fn: picklable function creating the `VecEnv` of one actor
+    :type env_fn: Callable[[], sb3.common.vec_env.VecEnv]
+    :param total_timesteps: number of transitions to collect
+    :type total_timesteps: int
+    :param callback: callbacks called for every added transition
+    :type callback: sb3.common.type_aliases.MaybeCallback
+    :param n_actors: number of actor processes
+    :type n_actors: int
+    :param utd_ratio: gradient steps per collected transition
+    :type utd_ratio: float
+    :param sync_freq: gradient steps between weight syncs
+    :type sync_freq: int
+    :param chunk_size: max number of transitions per message to the learner
+    :type chunk_size: int
+    :param log_interval: number of episodes between logs
+    :type log_interval: int
+    :param seed: seed of the first actor
+    :type seed: Optional[int]
+    :param tb_log_name: name of the tensorboard run
+    :type tb_log_name: str
+    """
+    assert not model.optimize_memory_usage, 'Transitions of different actors are interleaved'
+    total_timesteps, callback = model._setup_learn(total_timesteps, None, callback, tb_log_name=tb_log_name)
+    callback.on_training_start(locals(), globals())
+    replay_buffer = model.replay_buffer
+    truncate = getattr(replay_buffer, 'truncate', None)
+    # Transitions are added while the batch prefetcher of a `prefetched` model is paused.
+    paused = getattr(model, 'prefetch_paused', contextlib.nullcontext)
+
+    pool = ActorPool(
+        env_fn, model.actor, n_actors, model.learning_starts, model.action_noise, chunk_size, seed
+    )
+    pool.sync(model.actor, model._n_updates)
+    pool.start()
+
+    start = time.time()
+    wait = 0.0
+    updates = 0
+    last_rank = None
+    lags = deque(maxlen=1000)
+    episodes_since_log = 0
+    continue_training = True
+    try:
+        while continue_training and model.num_timesteps < total_timesteps:
+            due = int(utd_ratio * (model.num_timesteps - model.learning_starts)) - updates
+            if due > 0:
+                chunks = pool.collect()
+            else:
+                # The learner is ahead of the actors.
+                waited = time.time()
+                chunks = pool.collect(timeout=1.0)
+                wait += time.time() - waited
+
+            for rank, chunk, episodes in chunks:
+                if rank != last_rank and truncate is not None:
+                    with paused():
+                        truncate()
+                last_rank = rank
+                for obs, next_obs, action, reward, done, timeout, version in chunk:
+                    with paused():
+                        replay_buffer.add(obs, next_obs, action, reward, done, [{'TimeLimit.truncated': timeout}])
+                    lags.append(model._n_updates - version)
+                    model.num_timesteps += 1
+                    callback.update_locals(locals())
+                    if callback.on_step() is False:
+                        continue_training = False
+                        break
+                    if model.num_timesteps >= total_timesteps:
+                        break
+                if not continue_training or model.num_timesteps >= total_timesteps:
+                    break
+                model.ep_info_buffer.extend(episodes)
+                model._episode_num += len(episodes)
+                episodes_since_log += len(episodes)
+            model._update_current_progress_remaining(model.num_timesteps, total_timesteps)
+
+            due = int(utd_ratio * (model.num_timesteps - model.learning_starts)) - updates
+            if due > 0 and model.num_timesteps >= model.learning_starts:
+                # Sync at least every `sync_freq` gradient steps.
+                gradient_steps = min(due, sync_freq - updates % sync_freq)
+                model.train(gradient_steps=gradient_steps, batch_size=model.batch_size)
+                updates += gradient_steps
+                if updates % sync_freq == 0:
+                    pool.sync(model.actor, model._n_updates)
+
+            if log_interval is not None and episodes_since_log >= log_interval:
+                episodes_since_log = 0
+                elapsed = time.time() - start
+                model.logger.record('async/policy_lag', np.mean(lags) if lags else 0.0)
+                model.logger.record('async/update_to_data', updates / max(model.num_timesteps - model.learning_starts, 1))
+                model.logger.record('async/learner_wait', wait / max(elapsed, 1e-8))
+                model.logger.record('async/actor_fps', pool.steps.value / max(elapsed, 1e-8))
+                model._dump_logs()
+    finally:
+        pool.close()
+
+    # Catch up with the gradient steps due for the last transitions.
+    due = int(utd_ratio * (model.num_timesteps - model.learning_starts)) - updates
+    if continue_training and due > 0:
+        model.train(gradient_steps=due, batch_size=model.batch_size)
+    if getattr(model, 'prefetcher', None) is not None:
+        model.prefetcher.stop()
+
+    callback.on_training_end()
+    return model
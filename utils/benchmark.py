@@ -0,0 +1,543 @@
+"""Throughput benchmarks of the environments and the training components.
+
+The suite runs headless on CPU and times `SimpleRoomEnv` and `LocalPlannerEnv`
+`reset` and `step`, CPG integration, replay buffer `add` and `sample`, and a
+features extractor forward pass. Environment steps are broken down into
+phases by `PhaseTimer`, which wraps the methods of an environment instance
+without modifying its class: MuJoCo (`wrapped_env.step`), render
+(`wrapped_env._get_obs`), perception (target detection), mapping (allocentric
+map and coverage) and planning (pure pursuit actions). Time spent in nested
+phases is only counted in the innermost phase, the rest of the step is counted
+as `other`.
+
+Results are written to JSON together with machine metadata. Every timing is
+stored in seconds with its mean, median, 95th percentile and number of
+samples. `compare` checks results against a stored baseline and flags the
+benchmarks whose median grew by more than a threshold. Benchmarks that cannot
+run, e.g. environments without a MuJoCo installation, are recorded as skipped.
+
+Usage::
+
+    python -m neurorobotics.utils.benchmark --output benchmark.json
+    python -m neurorobotics.utils.benchmark --output new.json --compare benchmark.json --threshold 0.1
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import subprocess
+import traceback
+import numpy as np
+import torch
+import gym
+from typing import Any, Callable, Dict, List, Tuple
+from neurorobotics.constants import params
+
+Stats = Dict[str, float]
+Results = Dict[str, Any]
+
+
+def summarize(times: List[float]) -> Stats:
+    """Statistics of durations in seconds, as stored in the results."""
+    times = np.asarray(times, dtype=np.float64)
+    return {
+        'mean': float(np.mean(times)),
+        'median': float(np.median(times)),
+        'p95': float(np.percentile(times, 95)),
+        'std': float(np.std(times)),
+        'n': int(len(times))
+    }
+
+
+def time_calls(fn: Callable[[], Any], repeats: int, warmup: int = 1) -> Stats:
+    """Times `repeats` calls of `fn` after `warmup` untimed calls."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+def machine_info() -> Dict[str, Any]:
+    """Metadata of the machine and the software the results were measured with."""
+    info = {
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'torch': torch.__version__,
+        'torch_threads': torch.get_num_threads(),
+        'gym': gym.__version__,
+    }
+    try:
+        import mujoco_py
+        info['mujoco_py'] = getattr(mujoco_py, '__version__', None)
+    except ImportError:
+        info['mujoco_py'] = None
+    try:
+        info['commit'] = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        info['commit'] = None
+    return info
+
+
+class PhaseTimer:
+    """Accumulates the time spent in methods of objects, grouped into phases.
+
+    Methods are wrapped on the instances, hence calls through `self` inside
+    the objects are timed as well. Time is exclusive: a phase called from
+    another phase is subtracted from the outer one.
+    """
+    def __init__(self):
+        self.totals: Dict[str, float] = {}
+        self._stack: List[List[float]] = []
+        self._patched: List[Tuple[Any, str, Any]] = []
+
+    def patch(self, obj: Any, name: str, phase: str) -> bool:
+        """Times calls of `obj.<name>` as `phase`.
+
+        :returns: whether `obj` has the method
+        :rtype: bool
+        """
+        method = getattr(obj, name, None)
+        if method is None or not callable(method):
+            return False
+        self.totals.setdefault(phase, 0.0)
+
+        def timed(*args, **kwargs):
+            frame = [time.perf_counter(), 0.0]
+            self._stack.append(frame)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._stack.pop()
+                elapsed = time.perf_counter() - frame[0]
+                self.totals[phase] += elapsed - frame[1]
+                if self._stack:
+                    self._stack[-1][1] += elapsed
+        self._patched.append((obj, name, vars(obj).get(name)))
+        setattr(obj, name, timed)
+        return True
+
+    def reset(self) -> Dict[str, float]:
+        """Returns the accumulated times and starts over."""
+        totals = dict(self.totals)
+        for phase in self.totals:
+            self.totals[phase] = 0.0
+        return totals
+
+    def restore(self) -> None:
+        """Removes the wrappers."""
+        for obj, name, original in reversed(self._patched):
+            if original is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, original)
+        self._patched = []
+
+
+ENV_PHASES = [
+    ('wrapped_env', 'step', 'mujoco'),
+    ('wrapped_env', '_get_obs', 'render'),
+    ('', '_SimpleRoomEnv__create_attention_window', 'perception'),
+    ('', 'get_maps', 'mapping'),
+    ('', 'get_coverage', 'mapping'),
+    ('', 'get_action', 'planning'),
+    ('', 'set_goal_path', 'planning'),
+]
+
+
+def patch_env(env: gym.Env, timer: PhaseTimer) -> List[str]:
+    """Wraps the methods of `ENV_PHASES` found on `env`, returns the timed phases."""
+    phases = []
+    for attr, name, phase in ENV_PHASES:
+        obj = getattr(env, attr) if attr else env
+        if timer.patch(obj, name, phase) and phase not in phases:
+            phases.append(phase)
+    return phases
+
+
+def make_env(name: str, max_episode_size: int) -> gym.Env:
+    from neurorobotics.simulations.maze_env import SimpleRoomEnv, LocalPlannerEnv
+    from neurorobotics.simulations.point import BlindPointEnv, PointEnv
+    from neurorobotics.simulations.maze_task import create_local_planner_area, create_simple_room_maze
+    if name == 'SimpleRoom':
+        return SimpleRoomEnv(PointEnv, create_simple_room_maze, max_episode_size=max_episode_size)
+    if name == 'LocalPlanner':
+        return LocalPlannerEnv(BlindPointEnv, create_local_planner_area, max_episode_size=max_episode_size)
+    raise ValueError('Expected one of `SimpleRoom` or `LocalPlanner`, got {}'.format(name))
+
+
+def benchmark_env(env: gym.Env, steps: int, resets: int, seed: int = 0) -> Dict[str, Stats]:
+    """Times `reset` and `step` of `env` with random actions, and each phase of the steps.
+
+    The `resets` first resets and those at the end of the episodes are timed,
+    the latter are excluded from the step times.
+    """
+    if resets < 1:
+        raise ValueError('Expected at least one reset before the steps, got {}'.format(resets))
+    env.action_space.seed(seed)
+    timer = PhaseTimer()
+
+    def reset() -> Tuple[float, List[str]]:
+        # `reset` creates a new `wrapped_env`, the methods are wrapped again afterwards
+        timer.restore()
+        start = time.perf_counter()
+        env.reset()
+        elapsed = time.perf_counter() - start
+        phases = patch_env(env, timer)
+        timer.reset()
+        return elapsed, phases
+
+    try:
+        reset_times = []
+        for _ in range(resets):
+            elapsed, phases = reset()
+            reset_times.append(elapsed)
+        step_times = []
+        phase_times = {phase: [] for phase in phases + ['other']}
+        for _ in range(steps):
+            action = env.action_space.sample()
+            start = time.perf_counter()
+            _, _, done, _ = env.step(action)
+            elapsed = time.perf_counter() - start
+            totals = timer.reset()
+            step_times.append(elapsed)
+            for phase in phases:
+                phase_times[phase].append(totals[phase])
+            phase_times['other'].append(max(elapsed - sum(totals.values()), 0.0))
+            if done:
+                elapsed, _ = reset()
+                reset_times.append(elapsed)
+    finally:
+        timer.restore()
+    results = {'reset': summarize(reset_times), 'step': summarize(step_times)}
+    for phase, times in phase_times.items():
+        results['step/{}'.format(phase)] = summarize(times)
+    return results
+
+
+def benchmark_cpg(num_osc: int, timesteps: int, batch_size: int, repeats: int) -> Dict[str, Stats]:
+    """Times `timesteps` steps of the NumPy oscillator and of the batched PyTorch rollout."""
+    from neurorobotics.networks.cpg import get_polynomial_coef, hopf_mod, ModifiedHopfCPGRollout
+    dt = params['dt']
+    C = get_polynomial_coef(params['degree'], params['thresholds'], dt * 50)
+    phi = np.arange(num_osc, dtype=np.float32) * 2 * np.pi / num_osc
+    z = np.concatenate([np.cos(phi), np.sin(phi)], -1).astype(np.float32)
+    omega = 1.6 * np.ones((num_osc,), dtype=np.float32)
+    mu = np.ones((num_osc,), dtype=np.float32)
+    rollout = ModifiedHopfCPGRollout(num_osc, C, dt)
+    Z = torch.from_numpy(z)[None].repeat(batch_size, 1)
+    omega_t = torch.from_numpy(omega)[None].repeat(batch_size, 1)
+    mu_t = torch.from_numpy(mu)[None].repeat(batch_size, 1)
+
+    def run_rollout():
+        with torch.no_grad():
+            rollout(Z, omega_t, mu_t, timesteps)
+    return {
+        'numpy': time_calls(lambda: hopf_mod(num_osc, omega, mu, z.copy(), C, params['degree'], timesteps, dt), repeats),
+        'rollout': time_calls(run_rollout, repeats),
+    }
+
+
+def frame_space(frame_size: int) -> gym.spaces.Dict:
+    # Observations of `SimpleRoomEnv` as stored by the replay buffers, channel first frames.
+    return gym.spaces.Dict({
+        'frame_t': gym.spaces.Box(low=0, high=255, shape=(3, frame_size, frame_size), dtype=np.uint8),
+        'sensors': gym.spaces.Box(low=-1, high=1, shape=(params['history_steps'] * 8,), dtype=np.float32)
+    })
+
+
+def benchmark_buffer(
+    observation_space: gym.spaces.Dict,
+    buffer_size: int,
+    batch_size: int,
+    repeats: int,
+    seed: int = 0
+) -> Dict[str, Stats]:
+    """Times `add` of single transitions and `sample` of batches of `FrameDictReplayBuffer`."""
+    from neurorobotics.utils.buffers import FrameDictReplayBuffer
+    rng = np.random.default_rng(seed)
+    action_space = gym.spaces.Box(low=-1, high=1, shape=(2,), dtype=np.float32)
+    buffer = FrameDictReplayBuffer(buffer_size, observation_space, action_space, device='cpu')
+    observations = [
+        {
+            key: (rng.uniform(size=(1,) + space.shape) * (255 if space.dtype == np.uint8 else 1)).astype(space.dtype)
+            for key, space in observation_space.spaces.items()
+        } for _ in range(16)
+    ]
+    action = rng.uniform(-1, 1, size=(1, 2)).astype(np.float32)
+    step = [0]
+
+    def add():
+        i = step[0]
+        step[0] += 1
+        done = step[0] % params['max_episode_size'] == 0
+        buffer.add(
+            observations[i % 16], observations[(i + 1) % 16], action, np.zeros(1),
+            np.array([done]), [{'TimeLimit.truncated': done}]
+        )
+    add_stats = time_calls(add, buffer_size, warmup=0)
+    return {
+        'add': add_stats,
+        'sample': time_calls(lambda: buffer.sample(batch_size), repeats),
+    }
+
+
+def benchmark_features_extractor(
+    observation_space: gym.spaces.Dict,
+    batch_size: int,
+    repeats: int
+) -> Dict[str, Stats]:
+    """Times the forward pass of `DictToTensorFeaturesExtractor` on a batch, without and with gradients."""
+    from neurorobotics.utils.feature_extractors import DictToTensorFeaturesExtractor
+    extractor = DictToTensorFeaturesExtractor(observation_space, params['num_ctx'], cache=False)
+    observations = {
+        key: torch.rand((batch_size,) + space.shape) * (255 if space.dtype == np.uint8 else 1)
+        for key, space in observation_space.spaces.items()
+    }
+
+    def forward():
+        with torch.no_grad():
+            extractor(observations)
+
+    def backward():
+        extractor(observations).sum().backward()
+    return {
+        'forward': time_calls(forward, repeats),
+        'backward': time_calls(backward, repeats),
+    }
+
+
+def run(
+    envs: List[str] = ['SimpleRoom', 'LocalPlanner'],
+    steps: int = 200,
+    resets: int = 5,
+    frame_size: int = 64,
+    buffer_size: int = 2000,
+    batch_size: int = params['batch_size'],
+    num_osc: int = 4,
+    timesteps: int = 500,
+    repeats: int = 20,
+    seed: int = params['seed'],
+    verbose: int = 1
+) -> Results:
+    """Runs the suite, returns the results with the machine metadata.
+
+    :param envs: environments to benchmark, `SimpleRoom` and or `LocalPlanner`
+    :type envs: List[str]
+    :param steps: number of timed environment steps
+    :type steps: int
+    :param resets: number of timed environment resets before the steps, at least 1
+    :type resets: int
+    :param frame_size: height and width of the frames in the replay buffer and features extractor benchmarks
+    :type frame_size: int
+    :param buffer_size: size of the replay buffer, also the number of timed `add`
+    :type buffer_size: int
+    :param batch_size: size of the sampled and encoded batches
+    :type batch_size: int
+    :param num_osc: number of oscillators of the CPG
+    :type num_osc: int
+    :param timesteps: number of CPG steps per timed call
+    :type timesteps: int
+    :param repeats: number of timed calls of the other benchmarks
+    :type repeats: int
+    :param seed: seed of the random actions, observations and weights
+    :type seed: int
+    :param verbose: print the timings as they are measured
+    :type verbose: int
+    :returns: `machine`, `config`, `benchmarks` with the statistics of each benchmark and `skipped` with the reasons benchmarks did not run
+    :rtype: Results
+    """
+    config = {
+        'envs': list(envs), 'steps': steps, 'resets': resets, 'frame_size': frame_size,
+        'buffer_size': buffer_size, 'batch_size': batch_size, 'num_osc': num_osc,
+        'timesteps': timesteps, 'repeats': repeats, 'seed': seed
+    }
+    results = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'config': config,
+        'benchmarks': {},
+        'skipped': {}
+    }
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+    def add(group: str, fn: Callable[[], Dict[str, Stats]]) -> None:
+        try:
+            stats = fn()
+        except Exception as e:
+            results['skipped'][group] = '{}: {}'.format(type(e).__name__, e)
+            if verbose > 1:
+                traceback.print_exc()
+            if verbose > 0:
+                print('{:<36} skipped, {}'.format(group, results['skipped'][group]))
+            return
+        for name, value in stats.items():
+            key = '{}/{}'.format(group, name)
+            results['benchmarks'][key] = value
+            if verbose > 0:
+                print('{:<36} {:>12.3f} ms {:>12.3f} ms p95 {:>8}'.format(
+                    key, value['median'] * 1e3, value['p95'] * 1e3, value['n']))
+
+    def env_benchmark(name: str) -> Callable[[], Dict[str, Stats]]:
+        def fn():
+            env = make_env(name, params['max_episode_size'])
+            try:
+                return benchmark_env(env, steps, resets, seed)
+            finally:
+                env.close()
+        return fn
+
+    for name in envs:
+        add('env/{}'.format(name), env_benchmark(name))
+    add('cpg', lambda: benchmark_cpg(num_osc, timesteps, 1, repeats))
+    add('cpg/batch_{}'.format(batch_size), lambda: {'rollout': benchmark_cpg(num_osc, timesteps, batch_size, repeats)['rollout']})
+    add('buffer', lambda: benchmark_buffer(frame_space(frame_size), buffer_size, batch_size, repeats, seed))
+    add('features_extractor', lambda: benchmark_features_extractor(frame_space(frame_size), batch_size, repeats))
+    return results
+
+
+def save(results: Results, path: str) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path: str) -> Results:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def compare(
+    results: Results,
+    baseline: Results,
+    threshold: float = 0.1,
+    statistic: str = 'median'
+) -> List[Dict[str, Any]]:
+    """Compares the benchmarks present in both `results` and `baseline`.
+
+    :param results: current results
+    :type results: Results
+    :param baseline: stored results to compare with
+    :type baseline: Results
+    :param threshold: relative increase of `statistic` over the baseline flagged as a regression
+    :type threshold: float
+    :param statistic: statistic compared, one of `mean`, `median` or `p95`
+    :type statistic: str
+    :returns: per benchmark `name`, `baseline`, `current`, `ratio` of current over baseline time and `regression`
+    :rtype: List[Dict[str, Any]]
+    """
+    rows = []
+    for name in sorted(set(results['benchmarks']) & set(baseline['benchmarks'])):
+        old = baseline['benchmarks'][name][statistic]
+        new = results['benchmarks'][name][statistic]
+        ratio = new / old if old > 0 else float('inf') if new > 0 else 1.0
+        rows.append({
+            'name': name,
+            'baseline': old,
+            'current': new,
+            'ratio': ratio,
+            'regression': ratio > 1 + threshold
+        })
+    return rows
+
+
+def print_comparison(rows: List[Dict[str, Any]], results: Results, baseline: Results) -> None:
+    keys = ['platform', 'processor', 'cpu_count', 'torch', 'numpy']
+    different = [key for key in keys if results['machine'].get(key) != baseline['machine'].get(key)]
+    if different:
+        print('Warning: the baseline was measured with a different {}'.format(', '.join(different)))
+    print('{:<36} {:>14} {:>14} {:>8}'.format('benchmark', 'baseline ms', 'current ms', 'ratio'))
+    for row in rows:
+        print('{:<36} {:>14.3f} {:>14.3f} {:>8.2f}{}'.format(
+            row['name'], row['baseline'] * 1e3, row['current'] * 1e3, row['ratio'],
+            '  REGRESSION' if row['regression'] else ''))
+    missing = sorted(set(baseline['benchmarks']) - set(results['benchmarks']))
+    if missing:
+        print('Not measured: {}'.format(', '.join(missing)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark environment, CPG, replay buffer and features extractor throughput on CPU.')
+    parser.add_argument(
+        '--output',
+        type = str,
+        default = None,
+        help = 'path of the JSON results'
+    )
+    parser.add_argument(
+        '--compare',
+        type = str,
+        default = None,
+        help = 'path of baseline JSON results to check for regressions'
+    )
+    parser.add_argument(
+        '--threshold',
+        type = float,
+        default = 0.1,
+        help = 'relative slowdown over the baseline flagged as a regression'
+    )
+    parser.add_argument(
+        '--statistic',
+        type = str,
+        default = 'median',
+        choices = ['mean', 'median', 'p95'],
+        help = 'statistic compared with the baseline'
+    )
+    parser.add_argument(
+        '--envs',
+        type = str,
+        nargs = '*',
+        default = ['SimpleRoom', 'LocalPlanner'],
+        help = 'environments to benchmark'
+    )
+    parser.add_argument(
+        '--steps',
+        type = int,
+        default = 200,
+        help = 'number of timed environment steps'
+    )
+    parser.add_argument(
+        '--frame_size',
+        type = int,
+        default = 64,
+        help = 'height and width of the frames'
+    )
+    parser.add_argument(
+        '--repeats',
+        type = int,
+        default = 20,
+        help = 'number of timed calls per benchmark'
+    )
+    parser.add_argument(
+        '--threads',
+        type = int,
+        default = 1,
+        help = 'number of torch threads'
+    )
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+    results = run(envs=args.envs, steps=args.steps, frame_size=args.frame_size, repeats=args.repeats)
+    if args.output is not None:
+        save(results, args.output)
+    if args.compare is not None:
+        baseline = load(args.compare)
+        rows = compare(results, baseline, args.threshold, args.statistic)
+        print_comparison(rows, results, baseline)
+        if any(row['regression'] for row in rows):
+            sys.exit(1)
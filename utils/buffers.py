@@ -0,0 +1,428 @@
+"""Replay buffers for dictionary observation spaces.
+
+`FrameDictReplayBuffer` is a drop in replacement for
+`stable_baselines3.common.buffers.DictReplayBuffer` that stores every
+observation once. Within an episode the next observation of transition `i` is
+the observation of transition `i + 1`, so only terminal observations are kept
+separately. Image keys stay `uint8` and keys with little information content
+can be stored at reduced precision or compressed.
+"""
+import io
+import zlib
+import warnings
+import numpy as np
+import torch
+import stable_baselines3 as sb3
+from gym import spaces
+from typing import Any, Dict, List, Optional, Tuple, Union
+from neurorobotics.utils.torch_utils import polyak_update
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+COMPRESSIONS = ['float16', 'zlib']
+
+
+def is_image_key(space: spaces.Space) -> bool:
+    """Whether `space` holds 8 bit images, following `Environment._set_observation_space`."""
+    return isinstance(space, spaces.Box) and len(space.shape) >= 2 and \
+        np.all(space.low == 0) and np.all(space.high == 255)
+
+
+class FrameDictReplayBuffer(sb3.common.buffers.DictReplayBuffer):
+    """Dict replay buffer storing each observation once.
+
+    Transitions must be added in order along each episode, as done by
+    `OffPolicyAlgorithm._store_transition`. The observation of transition
+    `i + 1` is written together with transition `i`, hence while the buffer is
+    full the oldest transition is not sampled. `truncate` must be called when
+    the next transition does not follow the last one, as done by `FrameTD3`.
+
+    :param buffer_size: max number of transitions in the buffer
+    :type buffer_size: int
+    :param observation_space: observation space
+    :type observation_space: gym.spaces.Dict
+    :param action_space: action space
+    :type action_space: gym.spaces.Space
+    :param device: device of the sampled tensors
+    :type device: Union[torch.device, str]
+    :param n_envs: number of parallel environments, only 1 is supported
+    :type n_envs: int
+    :param optimize_memory_usage: unused, memory is always optimised
+    :type optimize_memory_usage: bool
+    :param handle_timeout_termination: ignore dones due to `TimeLimit.truncated`
+    :type handle_timeout_termination: bool
+    :param compression: storage of each key, one of `COMPRESSIONS`. Other keys are stored as is, image keys as `uint8`.
+    :type compression: Optional[Dict[str, str]]
+    """
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Dict,
+        action_space: spaces.Space,
+        device: Union[torch.device, str] = 'cpu',
+        n_envs: int = 1,
+        optimize_memory_usage: bool = False,
+        handle_timeout_termination: bool = True,
+        compression: Optional[Dict[str, str]] = None
+    ):
+        super(sb3.common.buffers.ReplayBuffer, self).__init__(
+            buffer_size, observation_space, action_space, device, n_envs=n_envs
+        )
+        assert isinstance(self.obs_shape, dict), 'FrameDictReplayBuffer must be used with Dict obs space only'
+        assert n_envs == 1, 'Replay buffer only support single environment for now'
+        self.optimize_memory_usage = optimize_memory_usage
+        self.handle_timeout_termination = handle_timeout_termination
+        self.compression = {} if compression is None else dict(compression)
+        for key, method in self.compression.items():
+            assert key in self.obs_shape, 'Unknown observation key {}'.format(key)
+            assert method in COMPRESSIONS, 'Unknown compression {}'.format(method)
+
+        self.dtypes = {key: observation_space[key].dtype for key in self.obs_shape.keys()}
+        self.observations = {}
+        for key, shape in self.obs_shape.items():
+            method = self.compression.get(key)
+            if method == 'zlib':
+                self.observations[key] = np.empty((self.buffer_size,), dtype=object)
+            elif method == 'float16':
+                self.observations[key] = np.zeros((self.buffer_size,) + shape, dtype=np.float16)
+            elif is_image_key(observation_space[key]):
+                self.observations[key] = np.zeros((self.buffer_size,) + shape, dtype=np.uint8)
+            else:
+                self.observations[key] = np.zeros((self.buffer_size,) + shape, dtype=self.dtypes[key])
+        self.next_observations = None
+        # Next observations of the transitions ending an episode, by index.
+        self.terminal_observations: Dict[int, Dict[str, np.ndarray]] = {}
+        self._continuing = False
+
+        self.actions = np.zeros((self.buffer_size, self.action_dim), dtype=action_space.dtype)
+        self.rewards = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.dones = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.timeouts = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+
+        if psutil is not None:
+            mem_available = psutil.virtual_memory().available
+            if self.nbytes > mem_available:
+                warnings.warn(
+                    'This system does not have apparently enough memory to store the complete '
+                    'replay buffer {:.2f}GB > {:.2f}GB'.format(self.nbytes / 1e9, mem_available / 1e9)
+                )
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the stored transitions in bytes."""
+        nbytes = self.actions.nbytes + self.rewards.nbytes + self.dones.nbytes + self.timeouts.nbytes
+        for key, obs in self.observations.items():
+            if obs.dtype == object:
+                nbytes += obs.nbytes + sum(len(item) for item in obs if item is not None)
+            else:
+                nbytes += obs.nbytes
+        for obs in self.terminal_observations.values():
+            nbytes += sum(item.nbytes for item in obs.values())
+        return nbytes
+
+    def _encode(self, key: str, obs: np.ndarray) -> Any:
+        if self.compression.get(key) == 'zlib':
+            return zlib.compress(np.ascontiguousarray(obs, dtype=self.dtypes[key]).tobytes(), 1)
+        return obs
+
+    def _decode(self, key: str, inds: np.ndarray) -> np.ndarray:
+        obs = self.observations[key]
+        if obs.dtype == object:
+            return np.stack([
+                np.frombuffer(zlib.decompress(obs[i]), dtype=self.dtypes[key]) for i in inds
+            ], 0).reshape((len(inds),) + self.obs_shape[key])
+        return obs[inds].astype(self.dtypes[key], copy=False)
+
+    def _write(self, index: int, obs: Dict[str, np.ndarray]) -> None:
+        # Terminal observations of `VecEnv` come without the env dimension.
+        for key, shape in self.obs_shape.items():
+            self.observations[key][index] = self._encode(key, np.asarray(obs[key]).reshape(shape))
+
+    def add(
+        self,
+        obs: Dict[str, np.ndarray],
+        next_obs: Dict[str, np.ndarray],
+        action: np.ndarray,
+        reward: np.ndarray,
+        done: np.ndarray,
+        infos: List[Dict[str, Any]],
+    ) -> None:
+        self.terminal_observations.pop(self.pos, None)
+        if not self._continuing:
+            self._write(self.pos, obs)
+        if np.any(done):
+            self.terminal_observations[self.pos] = {
+                key: np.array(next_obs[key], dtype=self.dtypes[key]).reshape(shape)
+                for key, shape in self.obs_shape.items()
+            }
+            self._continuing = False
+        else:
+            self._write((self.pos + 1) % self.buffer_size, next_obs)
+            self._continuing = True
+
+        self.actions[self.pos] = np.array(action).copy()
+        self.rewards[self.pos] = np.array(reward).copy()
+        self.dones[self.pos] = np.array(done).copy()
+        if self.handle_timeout_termination:
+            self.timeouts[self.pos] = np.array([info.get('TimeLimit.truncated', False) for info in infos])
+
+        self.pos += 1
+        if self.pos == self.buffer_size:
+            self.full = True
+            self.pos = 0
+
+    def truncate(self) -> None:
+        """Ends the current trajectory without a done, e.g. before adding transitions of another actor."""
+        if self._continuing:
+            last = (self.pos - 1) % self.buffer_size
+            self.terminal_observations[last] = {
+                key: self._decode(key, np.array([self.pos]))[0] for key in self.observations.keys()
+            }
+            self._continuing = False
+
+    def sample(self, batch_size: int, env: Optional[sb3.common.vec_env.VecNormalize] = None) -> sb3.common.type_aliases.DictReplayBufferSamples:
+        if self.full:
+            # The observation of the transition at `pos` may already belong to the next one.
+            batch_inds = (np.random.randint(1, self.buffer_size, size=batch_size) + self.pos) % self.buffer_size
+        else:
+            batch_inds = np.random.randint(0, self.pos, size=batch_size)
+        return self._get_samples(batch_inds, env=env)
+
+    def _next_observations(self, inds: np.ndarray) -> Dict[str, np.ndarray]:
+        """Next observations of the transitions at `inds`."""
+        next_inds = (inds + 1) % self.buffer_size
+        next_obs = {key: self._decode(key, next_inds) for key in self.observations.keys()}
+        if self.terminal_observations:
+            for i, index in enumerate(inds):
+                terminal = self.terminal_observations.get(index)
+                if terminal is not None:
+                    for key, obs in terminal.items():
+                        next_obs[key][i] = obs
+        return next_obs
+
+    def _get_samples(self, batch_inds: np.ndarray, env: Optional[sb3.common.vec_env.VecNormalize] = None) -> sb3.common.type_aliases.DictReplayBufferSamples:
+        obs_ = {key: self._decode(key, batch_inds) for key in self.observations.keys()}
+        obs_ = self._normalize_obs(obs_, env)
+        next_obs_ = self._normalize_obs(self._next_observations(batch_inds), env)
+        return sb3.common.type_aliases.DictReplayBufferSamples(
+            observations={key: self.to_torch(obs) for key, obs in obs_.items()},
+            actions=self.to_torch(self.actions[batch_inds]),
+            next_observations={key: self.to_torch(obs) for key, obs in next_obs_.items()},
+            dones=self.to_torch(self.dones[batch_inds] * (1 - self.timeouts[batch_inds])),
+            rewards=self.to_torch(self._normalize_reward(self.rewards[batch_inds], env)),
+        )
+
+
+class FrameTD3(sb3.TD3):
+    """TD3 truncating the trajectory of its replay buffer when the next transition does not continue it.
+
+    `FrameDictReplayBuffer` and the n-step buffers expect the observation of
+    the next added transition to be the last next observation, which is not
+    the case once the environment is reset by `learn` or a replay buffer is
+    loaded, see `FrameDictReplayBuffer.truncate`. The target networks are
+    updated with the fused `polyak_update` of `utils.torch_utils`.
+    """
+    def _truncate_replay_buffer(self) -> None:
+        truncate = getattr(self.replay_buffer, 'truncate', None)
+        if truncate is not None:
+            truncate()
+
+    def _setup_learn(
+        self,
+        total_timesteps: int,
+        eval_env: Optional[sb3.common.type_aliases.GymEnv],
+        callback: sb3.common.type_aliases.MaybeCallback = None,
+        eval_freq: int = 10000,
+        n_eval_episodes: int = 5,
+        log_path: Optional[str] = None,
+        reset_num_timesteps: bool = True,
+        tb_log_name: str = 'run',
+    ) -> Tuple[int, sb3.common.callbacks.BaseCallback]:
+        if reset_num_timesteps or self._last_obs is None:
+            # The environment is reset below without a done.
+            self._truncate_replay_buffer()
+        return super(FrameTD3, self)._setup_learn(
+            total_timesteps, eval_env, callback, eval_freq, n_eval_episodes, log_path, reset_num_timesteps, tb_log_name
+        )
+
+    def load_replay_buffer(self, path: Union[str, io.BufferedIOBase], truncate_last_traj: bool = True) -> None:
+        super(FrameTD3, self).load_replay_buffer(path, truncate_last_traj)
+        self._truncate_replay_buffer()
+
+    def train(self, gradient_steps: int, batch_size: int = 100) -> None:
+        # Update learning rate according to lr schedule
+        self._update_learning_rate([self.actor.optimizer, self.critic.optimizer])
+
+        actor_losses, critic_losses = [], []
+
+        for _ in range(gradient_steps):
+
+            self._n_updates += 1
+            # Sample replay buffer
+            replay_data = self.replay_buffer.sample(batch_size, env=self._vec_normalize_env)
+
+            with torch.no_grad():
+                # Select action according to policy and add clipped noise
+                noise = replay_data.actions.clone().data.normal_(0, self.target_policy_noise)
+                noise = noise.clamp(-self.target_noise_clip, self.target_noise_clip)
+                next_actions = (self.actor_target(replay_data.next_observations) + noise).clamp(-1, 1)
+
+                # Compute the next Q-values: min over all critics targets
+                next_q_values = torch.cat(self.critic_target(replay_data.next_observations, next_actions), dim=1)
+                next_q_values, _ = torch.min(next_q_values, dim=1, keepdim=True)
+                target_q_values = replay_data.rewards + (1 - replay_data.dones) * self.gamma * next_q_values
+
+            # Get current Q-values estimates for each critic network
+            current_q_values = self.critic(replay_data.observations, replay_data.actions)
+
+            # Compute critic loss
+            critic_loss = sum([torch.nn.functional.mse_loss(current_q, target_q_values) for current_q in current_q_values])
+            critic_losses.append(critic_loss.item())
+
+            # Optimize the critics
+            self.critic.optimizer.zero_grad()
+            critic_loss.backward()
+            self.critic.optimizer.step()
+
+            # Delayed policy updates
+            if self._n_updates % self.policy_delay == 0:
+                # Compute actor loss
+                actor_loss = -self.critic.q1_forward(replay_data.observations, self.actor(replay_data.observations)).mean()
+                actor_losses.append(actor_loss.item())
+
+                # Optimize the actor
+                self.actor.optimizer.zero_grad()
+                actor_loss.backward()
+                self.actor.optimizer.step()
+
+                polyak_update(self.critic.parameters(), self.critic_target.parameters(), self.tau)
+                polyak_update(self.actor.parameters(), self.actor_target.parameters(), self.tau)
+
+        self.logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        if len(actor_losses) > 0:
+            self.logger.record("train/actor_loss", np.mean(actor_losses))
+        self.logger.record("train/critic_loss", np.mean(critic_losses))
+
+
+class SequenceSampler:
+    """Gathers fixed length windows of transitions ending at sampled indices.
+
+    The index of the first transition of the current episode is recorded for
+    every added transition, so the steps of each window that belong to the
+    episode of its last transition are known without scanning the dones.
+    Each key is gathered once and the steps of other episodes are zeroed.
+    Batches on the CPU are gathered into new tensors owned by the caller,
+    batches on a CUDA device are staged in reusable pinned tensors, reused
+    once their copy to the device has completed.
+
+    :param buffer_size: max number of transitions in the buffer
+    :type buffer_size: int
+    :param max_seq_len: number of training steps of each window
+    :type max_seq_len: int
+    :param burn_in_seq_len: number of steps before the training steps used to warm up recurrent states
+    :type burn_in_seq_len: int
+    :param device: device of the sampled tensors
+    :type device: Union[torch.device, str]
+    :param episode_starts: array of shape `(buffer_size,)` to record the episode starts in, e.g. allocated by a `ReplayStorage`
+    :type episode_starts: Optional[np.ndarray]
+    """
+    def __init__(
+        self,
+        buffer_size: int,
+        max_seq_len: int,
+        burn_in_seq_len: int = 0,
+        device: Union[torch.device, str] = 'cpu',
+        episode_starts: Optional[np.ndarray] = None
+    ):
+        self.buffer_size = buffer_size
+        self.max_seq_len = max_seq_len
+        self.burn_in_seq_len = burn_in_seq_len
+        self.seq_len = burn_in_seq_len + max_seq_len
+        self.device = torch.device(device)
+        self.staging = self.device.type == 'cuda'
+        if episode_starts is None:
+            episode_starts = np.zeros((buffer_size,), dtype=np.int64)
+        self.episode_starts = episode_starts
+        self.episode_start = 0
+        self._offsets = np.arange(-(self.seq_len - 1), 1, dtype=np.int64)
+        # Pinned staging tensors and the events of their last copy to the device
+        self._batches: Dict[str, torch.Tensor] = {}
+        self._copies: Dict[str, Any] = {}
+
+    def add(self, pos: int, done: bool) -> None:
+        """Records the episode of the transition added at `pos`."""
+        self.episode_starts[pos] = self.episode_start
+        if done:
+            self.episode_start = (pos + 1) % self.buffer_size
+
+    def indices(self, batch_inds: np.ndarray, pos: int, full: bool):
+        """Indices of the windows ending at `batch_inds` and the mask of their valid steps.
+
+        A step is valid if it belongs to the episode of the last step of its
+        window and has not been overwritten.
+
+        :returns: indices and mask of shape `(len(batch_inds), seq_len)`
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+        inds = (batch_inds[:, np.newaxis] + self._offsets[np.newaxis]) % self.buffer_size
+        steps = (batch_inds - np.asarray(self.episode_starts[batch_inds])) % self.buffer_size
+        available = (batch_inds - pos) % self.buffer_size if full else batch_inds
+        steps = np.minimum(steps, available)
+        mask = -self._offsets[np.newaxis] <= steps[:, np.newaxis]
+        return inds, mask
+
+    def _batch(self, name: str, shape: Tuple[int, ...], dtype: np.dtype) -> torch.Tensor:
+        if not self.staging:
+            return torch.from_numpy(np.empty(shape, dtype=dtype))
+        batch = self._batches.get(name)
+        if batch is None or tuple(batch.shape) != shape:
+            batch = torch.from_numpy(np.empty(shape, dtype=dtype)).pin_memory()
+            self._batches[name] = batch
+        elif name in self._copies:
+            # The previous copy to the device still reads the staging tensor
+            self._copies.pop(name).synchronize()
+        return batch
+
+    def gather(
+        self,
+        name: str,
+        array: np.ndarray,
+        inds: np.ndarray,
+        mask: Optional[np.ndarray] = None,
+        env_axis: int = 1
+    ) -> torch.Tensor:
+        """Gathers the rows `inds` of the first environment of `array`, zeroing the rows where `mask` is false.
+
+        The returned tensor does not share memory with later gathers and may
+        be kept across samples.
+
+        :param name: name of the reusable batch tensor
+        :type name: str
+        :param array: stored values of shape `(buffer_size, ...)`
+        :type array: np.ndarray
+        :param inds: indices to gather of any shape
+        :type inds: np.ndarray
+        :param mask: mask of the same shape as `inds`
+        :type mask: Optional[np.ndarray]
+        :param env_axis: axis of the environments in `array`
+        :type env_axis: int
+        """
+        env = (slice(None),) * (env_axis - 1) + (0,)
+        shape = array.shape[1:env_axis] + array.shape[env_axis + 1:]
+        batch = self._batch(name, inds.shape + shape, array.dtype)
+        out = batch.numpy()
+        if isinstance(array, np.ndarray):
+            np.take(array[(slice(None),) + env], inds, axis=0, out=out)
+        else:
+            out[...] = array[(inds,) + env]
+        if mask is not None:
+            out *= mask.reshape(mask.shape + (1,) * (out.ndim - mask.ndim)).astype(out.dtype)
+        if not self.staging:
+            return batch
+        batch = batch.to(self.device, non_blocking=True)
+        self._copies[name] = torch.cuda.Event()
+        self._copies[name].record()
+        return batch
@@ -6,8 +6,11 @@ import gym
 import stable_baselines3 as sb3
 import numpy as np
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from neurorobotics.utils.optional import lazy_import
+from neurorobotics.utils.checkpoint import AsyncCheckpointer
+from neurorobotics.utils.inference import PolicyServer, run_episodes
+plt = lazy_import('matplotlib.pyplot', 'plotting')
+backend_agg = lazy_import('matplotlib.backends.backend_agg', 'plotting')
 
 
 class Callback(sb3.common.callbacks.EventCallback):
@@ -36,6 +39,8 @@ class Callback(sb3.common.callbacks.EventCallback):
     :param best_model_save_path: Path to a folder where the best model
         according to performance on the eval env will be saved.
     type best_model_save_path: str
+    :param checkpointer: Writes the best model off the training thread when given.
+    :type checkpointer: Optional[AsyncCheckpointer]
     :param deterministic: Whether the evaluation should
         use a stochastic or deterministic actions.
     :type deterministic: bool
@@ -45,6 +50,11 @@ class Callback(sb3.common.callbacks.EventCallback):
     :rype verbose: int
     :param warn: Passed to ``evaluate_policy`` (warns if ``eval_env`` has not been
         wrapped with a Monitor wrapper)
+    :param eval_env_fns: Functions creating environments stepped concurrently through
+        a ``PolicyServer`` for the evaluations without video, ``eval_env`` is used if ``None``.
+        The environments are created on the first evaluation, continue from their automatic resets
+        on the next ones and are closed at the end of training.
+    :type eval_env_fns: Optional[List[Callable[[], gym.Env]]]
     """
 
     def __init__(
@@ -58,10 +68,12 @@ class Callback(sb3.common.callbacks.EventCallback):
         image_size: Tuple[int] = (1024, 1024),
         log_path: str = None,
         best_model_save_path: str = None,
+        checkpointer: Optional[AsyncCheckpointer] = None,
         deterministic: bool = True,
         render: bool = False,
         verbose: int = 1,
         warn: bool = True,
+        eval_env_fns: Optional[List[Callable[[], gym.Env]]] = None,
     ):
         super(Callback, self).__init__(callback_on_new_best, verbose=verbose)
         self.logdir = logdir
@@ -81,6 +93,11 @@ class Callback(sb3.common.callbacks.EventCallback):
 
         self.eval_env = eval_env
         self.best_model_save_path = best_model_save_path
+        self.checkpointer = checkpointer
+        self.eval_env_fns = eval_env_fns
+        self.server: Optional[PolicyServer] = None
+        self.eval_envs: Optional[List[gym.Env]] = None
+        self.eval_observations: Optional[List[Any]] = None
         # Logs will be written in ``evaluations.npz``
         if log_path is not None:
             log_path = os.path.join(log_path, "evaluations")
@@ -135,12 +152,13 @@ class Callback(sb3.common.callbacks.EventCallback):
                     cv2.VideoWriter_fourcc(*"MJPG"), 10, self.image_size, isColor=True
                 )
                 REWARDS = []
-                COMPONENTS = {}
+                KEYS = []
+                COMPONENTS = []
                 COLORS = []
                 fig, ax = plt.subplots(1, 1, figsize=(6.5, 6.5))
                 fig1, ax1 = plt.subplots(1, 1, figsize=(6.5, 6.5))
-                canvas = FigureCanvas(fig)
-                canvas1 = FigureCanvas(fig1)
+                canvas = backend_agg.FigureCanvasAgg(fig)
+                canvas1 = backend_agg.FigureCanvasAgg(fig1)
                 ax.set_xlabel('steps')
                 ax.set_ylabel('reward')
                 ax1.set_xlabel('steps')
@@ -161,17 +179,12 @@ class Callback(sb3.common.callbacks.EventCallback):
                         A dictionary containing all global variables of the callback's scope
                     """
                     REWARDS.append(_locals['rewards'][0])
-                    if len(COMPONENTS) == 0 and len(COLORS) == 0:
-                        for component in _locals['infos'][0]['reward_keys']:
-                            COMPONENTS[component] = [_locals['infos'][0][component]]
-                            COLORS.append('#%06X' % randint(0, 0xFFFFFF))
-                    elif len(COMPONENTS) > 0 and len(COLORS) == 0:
-                        for component in _locals['infos'][0]['reward_keys']:
-                            COMPONENTS[component].append(_locals['infos'][0][component])
-                            COLORS.append('#%06X' % randint(0, 0xFFFFFF))
-                    else:
-                        for component in _locals['infos'][0]['reward_keys']:
-                            COMPONENTS[component].append(_locals['infos'][0][component])
+                    if len(KEYS) == 0:
+                        KEYS.extend(_locals['infos'][0]['reward_keys'])
+                    if len(COLORS) == 0:
+                        COLORS.extend('#%06X' % randint(0, 0xFFFFFF) for _ in KEYS)
+                    # Components are arrays indexed as `KEYS`
+                    COMPONENTS.append(_locals['infos'][0]['reward_components'])
                     screen = self.eval_env.render(mode="rgb_array")
                     size = screen.shape[:2]
                     if 'frame_t' in _locals['observations'].keys():
@@ -191,8 +204,9 @@ class Callback(sb3.common.callbacks.EventCallback):
                         image = cv2.resize(image, size)
 
                         ax1.clear()
-                        for i, (component, lst) in enumerate(COMPONENTS.items()):
-                            ax1.plot(lst, color=COLORS[i], linestyle='--', label=component)
+                        components = np.stack(COMPONENTS)
+                        for i, component in enumerate(KEYS):
+                            ax1.plot(components[:, i], color=COLORS[i], linestyle='--', label=component)
                         ax1.legend(loc='upper left')
                         canvas1.draw()
                         image1 = np.frombuffer(canvas1.tostring_rgb(), dtype='uint8')
@@ -209,21 +223,23 @@ class Callback(sb3.common.callbacks.EventCallback):
                     if _locals['done']:
                         REWARDS.clear()
                         COLORS.clear()
-                        for component in COMPONENTS.keys():
-                            COMPONENTS[component].clear()
-
-
-
-            episode_rewards, episode_lengths = sb3.common.evaluation.evaluate_policy(
-                self.model,
-                self.eval_env,
-                n_eval_episodes=self.n_eval_episodes,
-                render=self.render,
-                deterministic=self.deterministic,
-                return_episode_rewards=True,
-                warn=self.warn,
-                callback=callback,
-            )
+                        COMPONENTS.clear()
+
+
+
+            if video is None and self.eval_env_fns is not None:
+                episode_rewards, episode_lengths = self._evaluate_concurrently()
+            else:
+                episode_rewards, episode_lengths = sb3.common.evaluation.evaluate_policy(
+                    self.model,
+                    self.eval_env,
+                    n_eval_episodes=self.n_eval_episodes,
+                    render=self.render,
+                    deterministic=self.deterministic,
+                    return_episode_rewards=True,
+                    warn=self.warn,
+                    callback=callback,
+                )
 
             if self.n_calls % self.render_freq == 0:
                 cv2.destroyAllWindows()
@@ -273,7 +289,9 @@ class Callback(sb3.common.callbacks.EventCallback):
             if mean_reward > self.best_mean_reward:
                 if self.verbose > 0:
                     print("New best mean reward!")
-                if self.best_model_save_path is not None:
+                if self.best_model_save_path is not None and self.checkpointer is not None:
+                    self.checkpointer.save(self.model, os.path.join(self.best_model_save_path, "best_model"))
+                elif self.best_model_save_path is not None:
                     self.model.save(os.path.join(self.best_model_save_path, "best_model"))
                 self.best_mean_reward = mean_reward
                 # Trigger callback if needed
@@ -282,6 +300,27 @@ class Callback(sb3.common.callbacks.EventCallback):
 
         return True
 
+    def _evaluate_concurrently(self) -> Tuple[List[float], List[int]]:
+        # The server and environments are created on the first evaluation, the next ones update the weights
+        if self.server is None:
+            self.eval_envs = [env_fn() for env_fn in self.eval_env_fns]
+            self.eval_observations = [None] * len(self.eval_envs)
+            self.server = PolicyServer(self.model.policy)
+            self.server.start()
+        else:
+            self.server.update(self.model.policy.state_dict())
+        return run_episodes(self.server, self.eval_envs, self.n_eval_episodes, self.deterministic, self.eval_observations)
+
+    def _on_training_end(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        if self.eval_envs is not None:
+            for env in self.eval_envs:
+                env.close()
+            self.eval_envs = None
+            self.eval_observations = None
+
     def update_child_locals(self, locals_: Dict[str, Any]) -> None:
         """
         Update the references to the local variables.
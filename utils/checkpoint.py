@@ -0,0 +1,404 @@
+"""Checkpoints written off the training thread.
+
+`AsyncCheckpointer.save` stalls training only to snapshot the model: the
+attributes saved by `BaseAlgorithm.save` are serialised and the state dicts
+copied to CPU memory. A background thread then writes the same zip archive
+as `BaseAlgorithm.save`, so checkpoints load with `load` of the algorithm,
+and removes the oldest checkpoints beyond `keep_last`. With
+`save_replay_buffer`, only the rows of the replay buffer written since the
+last checkpoint are copied and appended to the replay directory as a chunk,
+and the chunks are compacted into one when they hold more rows than the
+buffer. The replay index is written after the archive, and
+`AsyncCheckpointer.load` restores the latest checkpoint matching the replay
+index with its replay buffer and random number generator states, so
+training resumes exactly, also after an interruption between the two.
+"""
+import os
+import re
+import glob
+import queue
+import pickle
+import random
+import zipfile
+import threading
+import numpy as np
+import torch
+import stable_baselines3 as sb3
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+REPLAY_DIRECTORY = 'replay'
+
+
+def _to_cpu(obj: Any, memo: Optional[Dict[Any, torch.Tensor]] = None) -> Any:
+    # Copies of the tensors of nested state dicts, e.g. of optimisers, in CPU memory.
+    # Tensors sharing memory, e.g. of a shared features extractor, share their copy as `torch.save` would.
+    memo = {} if memo is None else memo
+    if isinstance(obj, torch.Tensor):
+        key = (obj.data_ptr(), obj.shape, obj.stride(), obj.dtype, obj.device)
+        if key not in memo:
+            memo[key] = obj.detach().to('cpu', copy=True)
+        return memo[key]
+    if isinstance(obj, dict):
+        return type(obj)((key, _to_cpu(value, memo)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(value, memo) for value in obj)
+    return obj
+
+
+def snapshot_model(model: sb3.common.base_class.BaseAlgorithm) -> Tuple[str, Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Serialised data, CPU state dicts and PyTorch variables of `model`, as saved by `BaseAlgorithm.save`."""
+    data = model.__dict__.copy()
+    exclude = set(model._excluded_save_params())
+    state_dicts_names, torch_variable_names = model._get_torch_save_params()
+    for torch_var in state_dicts_names + torch_variable_names:
+        exclude.add(torch_var.split('.')[0])
+    for param_name in exclude:
+        data.pop(param_name, None)
+    pytorch_variables = None
+    if torch_variable_names is not None:
+        pytorch_variables = {
+            name: _to_cpu(sb3.common.save_util.recursive_getattr(model, name)) for name in torch_variable_names
+        }
+    return sb3.common.save_util.data_to_json(data), _to_cpu(model.get_parameters()), pytorch_variables
+
+
+def write_archive(
+    path: str,
+    serialized_data: str,
+    params: Dict[str, Any],
+    pytorch_variables: Optional[Dict[str, Any]]
+) -> None:
+    """Writes a snapshot to the zip archive `path` in the format of `save_to_zip_file`, replacing it atomically."""
+    tmp = path + '.tmp'
+    with zipfile.ZipFile(tmp, mode='w') as archive:
+        archive.writestr('data', serialized_data)
+        if pytorch_variables is not None:
+            with archive.open('pytorch_variables.pth', mode='w') as pytorch_variables_file:
+                torch.save(pytorch_variables, pytorch_variables_file)
+        for file_name, dict_ in params.items():
+            with archive.open(file_name + '.pth', mode='w') as param_file:
+                torch.save(dict_, param_file)
+        archive.writestr('_stable_baselines3_version', sb3.__version__)
+    os.replace(tmp, path)
+
+
+def _row_arrays(buffer: sb3.common.buffers.BaseBuffer) -> Dict[Tuple[str, ...], np.ndarray]:
+    # Arrays indexed by buffer position, as attributes or dicts of arrays of the buffer.
+    arrays = {}
+    for name, value in buffer.__dict__.items():
+        if isinstance(value, np.ndarray) and value.ndim > 0 and len(value) == buffer.buffer_size:
+            arrays[(name,)] = value
+        elif isinstance(value, dict) and len(value) > 0 and all(
+            isinstance(item, np.ndarray) and item.ndim > 0 and len(item) == buffer.buffer_size
+            for item in value.values()
+        ):
+            for key, item in value.items():
+                arrays[(name, key)] = item
+    return arrays
+
+
+class ReplayCheckpoint:
+    """Incremental snapshots of a replay buffer in a directory.
+
+    Rows of the arrays indexed by buffer position are stored in chunks, the
+    rest of the buffer, e.g. its position or terminal observations, with the
+    index of the chunks in `state.pkl`. Rows are those of the transitions
+    added since the last snapshot and their neighbours, which hold the next
+    observations of `FrameDictReplayBuffer`. The first chunk holds all the
+    rows, and is rewritten once the following ones hold more rows than the
+    buffer or the transitions added since the last snapshot do not match the
+    change of `num_timesteps` and buffer position.
+
+    :param path: directory of the chunks
+    :type path: str
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.chunks: List[str] = []
+        self.rows = 0
+        self.last_timesteps: Optional[int] = None
+        self.last_pos = 0
+        # New chunks never overwrite those of earlier runs
+        self.n_chunks = 1 + max([-1] + [
+            int(name[len('chunk_'):-len('.pkl')]) for name in os.listdir(path) if re.match(r'chunk_\d+\.pkl$', name)
+        ])
+
+    def snapshot(self, buffer: sb3.common.buffers.BaseBuffer, num_timesteps: int) -> Dict[str, Any]:
+        """Copies the rows to write and the other attributes of `buffer`, to be written with `write`."""
+        arrays = _row_arrays(buffer)
+        added = None
+        if self.last_timesteps is not None:
+            added = num_timesteps - self.last_timesteps
+            # `learn(reset_num_timesteps=True)` restarts `num_timesteps`, the rows are then unknown.
+            if added < 0 or (self.last_pos + added) % buffer.buffer_size != buffer.pos:
+                added = None
+        if added is None or added + 2 >= buffer.buffer_size or self.rows + added + 2 > buffer.buffer_size:
+            # All the rows, first, when the added rows are unknown and once the chunks hold more rows than the buffer
+            inds = None if buffer.full else np.arange(min(buffer.pos + 1, buffer.buffer_size))
+            base = True
+        else:
+            inds = np.arange(self.last_pos - 1, self.last_pos + added + 1) % buffer.buffer_size
+            base = False
+        rows = {name: (array.copy() if inds is None else array[inds]) for name, array in arrays.items()}
+        self.rows = 0 if base else self.rows + len(inds)
+        names = {name[0] for name in arrays.keys()}
+        state = {
+            key: value for key, value in buffer.__dict__.items()
+            if key not in names and key not in ['observation_space', 'action_space', 'device']
+        }
+        self.last_timesteps = num_timesteps
+        self.last_pos = buffer.pos
+        return {'inds': inds, 'base': base, 'rows': rows, 'state': pickle.dumps(state, pickle.HIGHEST_PROTOCOL),
+                'num_timesteps': num_timesteps}
+
+    def write(self, snapshot: Dict[str, Any]) -> None:
+        """Writes a snapshot, then removes the chunks it replaces."""
+        name = 'chunk_{:06d}.pkl'.format(self.n_chunks)
+        self.n_chunks += 1
+        with open(os.path.join(self.path, name), 'wb') as f:
+            pickle.dump({'inds': snapshot['inds'], 'rows': snapshot['rows']}, f, pickle.HIGHEST_PROTOCOL)
+        stale = self.chunks if snapshot['base'] else []
+        self.chunks = [name] if snapshot['base'] else self.chunks + [name]
+        tmp = os.path.join(self.path, 'state.pkl.tmp')
+        with open(tmp, 'wb') as f:
+            pickle.dump({
+                'chunks': self.chunks,
+                'state': snapshot['state'],
+                'num_timesteps': snapshot['num_timesteps']
+            }, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, os.path.join(self.path, 'state.pkl'))
+        for chunk in stale:
+            os.remove(os.path.join(self.path, chunk))
+
+    def saved_timesteps(self) -> Optional[int]:
+        """`num_timesteps` of the last written snapshot, `None` if there is none."""
+        path = os.path.join(self.path, 'state.pkl')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)['num_timesteps']
+
+    def load(self, buffer: sb3.common.buffers.BaseBuffer) -> int:
+        """Restores the last snapshot into `buffer`, of the same size, and returns its `num_timesteps`.
+
+        Following snapshots add to the restored ones.
+        """
+        with open(os.path.join(self.path, 'state.pkl'), 'rb') as f:
+            index = pickle.load(f)
+        arrays = _row_arrays(buffer)
+        self.rows = 0
+        for i, chunk in enumerate(index['chunks']):
+            with open(os.path.join(self.path, chunk), 'rb') as f:
+                data = pickle.load(f)
+            for name, rows in data['rows'].items():
+                if data['inds'] is None:
+                    arrays[name][:] = rows
+                else:
+                    arrays[name][data['inds']] = rows
+            if i > 0:
+                self.rows += len(data['inds'])
+        buffer.__dict__.update(pickle.loads(index['state']))
+        # The environment of the saved trajectory is gone.
+        truncate = getattr(buffer, 'truncate', None)
+        if truncate is not None:
+            truncate()
+        self.chunks = list(index['chunks'])
+        self.last_timesteps = index['num_timesteps']
+        self.last_pos = buffer.pos
+        return index['num_timesteps']
+
+
+class AsyncCheckpointer:
+    """Saves models from a background thread.
+
+    Checkpoints are named `{name_prefix}_{num_timesteps}_steps.zip`, as by
+    `CheckpointCallback`, with the random number generator states in a
+    `.rng` file next to each archive.
+
+    :param save_path: directory of the checkpoints
+    :type save_path: str
+    :param name_prefix: common prefix of the checkpoints
+    :type name_prefix: str
+    :param keep_last: number of checkpoints kept, all if `None`
+    :type keep_last: Optional[int]
+    :param save_replay_buffer: whether to save the replay buffer incrementally under `save_path/replay`
+    :type save_replay_buffer: bool
+    :param verbose: verbosity level
+    :type verbose: int
+    """
+    def __init__(
+        self,
+        save_path: str,
+        name_prefix: str = 'rl_model',
+        keep_last: Optional[int] = None,
+        save_replay_buffer: bool = False,
+        verbose: int = 0
+    ):
+        self.save_path = save_path
+        self.name_prefix = name_prefix
+        self.keep_last = keep_last
+        self.verbose = verbose
+        os.makedirs(save_path, exist_ok=True)
+        self.replay = ReplayCheckpoint(os.path.join(save_path, REPLAY_DIRECTORY)) if save_replay_buffer else None
+        # One pending checkpoint at most, the next save waits for it
+        self._jobs: queue.Queue = queue.Queue(maxsize=1)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def _checkpoint_path(self, num_timesteps: int) -> str:
+        return os.path.join(self.save_path, '{}_{}_steps.zip'.format(self.name_prefix, num_timesteps))
+
+    def checkpoints(self) -> List[str]:
+        """Paths of the rotated checkpoints, oldest first."""
+        pattern = re.compile(r'{}_(\d+)_steps\.zip$'.format(re.escape(self.name_prefix)))
+        paths = []
+        for path in glob.glob(os.path.join(self.save_path, '{}_*_steps.zip'.format(self.name_prefix))):
+            match = pattern.search(os.path.basename(path))
+            if match is not None:
+                paths.append((int(match.group(1)), path))
+        return [path for _, path in sorted(paths)]
+
+    def save(self, model: sb3.common.base_class.BaseAlgorithm, path: Optional[str] = None) -> str:
+        """Snapshots `model` and queues it for writing.
+
+        :param model: model to save
+        :type model: sb3.common.base_class.BaseAlgorithm
+        :param path: path of the archive without rotation nor replay buffer, e.g. of the best model, a rotated checkpoint if `None`
+        :type path: Optional[str]
+        :returns: path of the archive
+        :rtype: str
+        """
+        self._raise()
+        rotate = path is None
+        if rotate:
+            path = self._checkpoint_path(model.num_timesteps)
+        elif not path.endswith('.zip'):
+            path += '.zip'
+        replay = None
+        if rotate and self.replay is not None and model.replay_buffer is not None:
+            replay = self.replay.snapshot(model.replay_buffer, model.num_timesteps)
+        rng = {
+            'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            'numpy': np.random.get_state(),
+            'random': random.getstate(),
+            'action_space': model.action_space.np_random.bit_generator.state
+            if hasattr(model.action_space.np_random, 'bit_generator') else None
+        }
+        self._jobs.put((path, snapshot_model(model), replay, rng, rotate))
+        return path
+
+    def wait(self) -> None:
+        """Blocks until the queued checkpoints are written."""
+        self._jobs.join()
+        self._raise()
+
+    def close(self) -> None:
+        self.wait()
+        self._jobs.put(None)
+        self._thread.join()
+
+    def _raise(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('Writing a checkpoint failed') from error
+
+    def _write(self) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                self._jobs.task_done()
+                return
+            path, snapshot, replay, rng, rotate = job
+            try:
+                with open(path[:-len('.zip')] + '.rng', 'wb') as f:
+                    pickle.dump(rng, f, pickle.HIGHEST_PROTOCOL)
+                write_archive(path, *snapshot)
+                # The replay index last, it never refers to a checkpoint that was not written
+                if replay is not None:
+                    self.replay.write(replay)
+                if rotate and self.keep_last is not None:
+                    for stale in self.checkpoints()[:-self.keep_last]:
+                        os.remove(stale)
+                        if os.path.exists(stale[:-len('.zip')] + '.rng'):
+                            os.remove(stale[:-len('.zip')] + '.rng')
+                if self.verbose > 1:
+                    print('Saving model checkpoint to {}'.format(path))
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._jobs.task_done()
+
+    def load(
+        self,
+        algorithm_class: Type[sb3.common.base_class.BaseAlgorithm],
+        path: Optional[str] = None,
+        env: Optional[Any] = None,
+        **kwargs
+    ) -> sb3.common.base_class.BaseAlgorithm:
+        """Loads a checkpoint, the latest by default, with its replay buffer and random number generator states.
+
+        By default, the checkpoint of the saved replay buffer is loaded if it
+        is older than the latest one, whose replay buffer was not written.
+
+        :param algorithm_class: class of the saved model
+        :type algorithm_class: Type[sb3.common.base_class.BaseAlgorithm]
+        :param path: checkpoint to load, the latest one if `None`
+        :type path: Optional[str]
+        :param env: environment of the loaded model
+        :type env: Optional[Any]
+        """
+        self.wait()
+        replay_timesteps = self.replay.saved_timesteps() if self.replay is not None else None
+        if path is None:
+            checkpoints = self.checkpoints()
+            if len(checkpoints) == 0:
+                raise FileNotFoundError('No checkpoint {}_*_steps.zip in {}'.format(self.name_prefix, self.save_path))
+            path = checkpoints[-1]
+            if replay_timesteps is not None and self._checkpoint_path(replay_timesteps) in checkpoints[:-1]:
+                path = self._checkpoint_path(replay_timesteps)
+                if self.verbose > 0:
+                    print('Loading {}, the replay buffer of {} was not written'.format(path, checkpoints[-1]))
+        model = algorithm_class.load(path, env=env, **kwargs)
+        if replay_timesteps is not None:
+            num_timesteps = self.replay.load(model.replay_buffer)
+            if num_timesteps != model.num_timesteps:
+                raise ValueError('Replay buffer of step {} does not match checkpoint {}'.format(num_timesteps, path))
+        rng_path = path[:-len('.zip')] + '.rng'
+        if os.path.exists(rng_path):
+            with open(rng_path, 'rb') as f:
+                rng = pickle.load(f)
+            torch.set_rng_state(rng['torch'])
+            if rng['cuda'] is not None and torch.cuda.is_available():
+                torch.cuda.set_rng_state_all(rng['cuda'])
+            np.random.set_state(rng['numpy'])
+            random.setstate(rng['random'])
+            if rng['action_space'] is not None:
+                model.action_space.np_random.bit_generator.state = rng['action_space']
+        return model
+
+
+class AsyncCheckpointCallback(sb3.common.callbacks.BaseCallback):
+    """`CheckpointCallback` saving through an `AsyncCheckpointer`.
+
+    :param save_freq: number of calls to `env.step()` between checkpoints
+    :type save_freq: int
+    :param checkpointer: checkpointer writing the checkpoints
+    :type checkpointer: AsyncCheckpointer
+    :param verbose: verbosity level
+    :type verbose: int
+    """
+    def __init__(self, save_freq: int, checkpointer: AsyncCheckpointer, verbose: int = 0):
+        super(AsyncCheckpointCallback, self).__init__(verbose)
+        self.save_freq = save_freq
+        self.checkpointer = checkpointer
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.save_freq == 0:
+            self.checkpointer.save(self.model)
+        return True
+
+    def _on_training_end(self) -> None:
+        self.checkpointer.wait()
@@ -1,5 +1,16 @@
+import copy
 import torch
 import torch.onnx
+import stable_baselines3 as sb3
+from typing import Any, Iterable, Iterator, Optional, Tuple, Union
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+EXPORT_FORMATS = ['torchscript', 'onnx']
+QUANTIZATIONS = ['dynamic', 'static']
 
 
 def convert_to_onnx(model, outpath):
@@ -29,3 +40,218 @@ def convert_to_onnx(model, outpath):
             do_constant_folding=True,
             input_names=['Z', 'omega', 'mu', 'C', 'degree', 'alpha', 'lmbd', 'cbeta', 'dt'],
             output_names=['Z'])
+
+
+def _flatten(output: Any) -> Tuple[torch.Tensor, ...]:
+    # Anything but tuples, lists and dicts is a tensor, or a proxy of one when traced in FX graph mode
+    if isinstance(output, dict):
+        output = list(output.values())
+    if not isinstance(output, (tuple, list)):
+        return (output,)
+    return tuple(tensor for item in output for tensor in _flatten(item))
+
+
+class FlatEncoder(torch.nn.Module):
+    """Visual encoder returning a flat tuple of tensors, as required for tracing.
+
+    The feature maps of `VisualCortexV4`, an `OrderedDict` of the FPN levels,
+    follow the features in the order of the levels.
+
+    :param model: encoder returning the features first, optionally with nested tuples or dicts of feature maps
+    :type model: torch.nn.Module
+    :param feature_maps: whether to return the feature maps, only the features are returned otherwise
+    :type feature_maps: bool
+    """
+    def __init__(self, model: torch.nn.Module, feature_maps: bool = False):
+        super(FlatEncoder, self).__init__()
+        self.model = model
+        self.feature_maps = feature_maps
+
+    def forward(self, observations: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        outputs = _flatten(self.model(observations))
+        return outputs if self.feature_maps else outputs[:1]
+
+
+def replay_calibration(
+    replay_buffer: sb3.common.buffers.BaseBuffer,
+    batch_size: int,
+    n_batches: int,
+    key: Optional[str] = None
+) -> Iterator[torch.Tensor]:
+    """Preprocessed observation batches of a replay buffer, as calibration data of `quantize_encoder`.
+
+    :param replay_buffer: replay buffer of the rollouts
+    :type replay_buffer: sb3.common.buffers.BaseBuffer
+    :param batch_size: number of frames per batch
+    :type batch_size: int
+    :param n_batches: number of batches
+    :type n_batches: int
+    :param key: key of the frames for dict observations
+    :type key: Optional[str]
+    """
+    space = replay_buffer.observation_space if key is None else replay_buffer.observation_space[key]
+    for _ in range(n_batches):
+        observations = replay_buffer.sample(batch_size).observations
+        if key is not None:
+            observations = observations[key]
+        yield sb3.common.preprocessing.preprocess_obs(observations.cpu(), space)
+
+
+def quantize_encoder(
+    model: torch.nn.Module,
+    example: torch.Tensor,
+    quantize: str,
+    calibration: Optional[Iterable[torch.Tensor]] = None
+) -> torch.nn.Module:
+    """Copy of `model` with int8 weights for CPU inference.
+
+    `dynamic` quantizes the weights of the linear layers, e.g. the large
+    `fc_out` of `VisualCortexV4`, and the activations at run time. `static`
+    quantizes all convolutions and linear layers with activation ranges
+    observed on the `calibration` batches, in FX graph mode.
+
+    :param model: encoder in evaluation mode
+    :type model: torch.nn.Module
+    :param example: example batch of observations
+    :type example: torch.Tensor
+    :param quantize: one of `QUANTIZATIONS`
+    :type quantize: str
+    :param calibration: batches of observations, as from `replay_calibration`, required for `static`
+    :type calibration: Optional[Iterable[torch.Tensor]]
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    if quantize == 'dynamic':
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if quantize != 'static':
+        raise ValueError('Expected quantize in {}, got {}'.format(QUANTIZATIONS, quantize))
+    if calibration is None:
+        raise ValueError('Static quantization requires calibration batches')
+    from torch.quantization import quantize_fx
+    qconfig = torch.quantization.get_default_qconfig(torch.backends.quantized.engine)
+    model = quantize_fx.prepare_fx(model, {'': qconfig}, (example,))
+    with torch.no_grad():
+        for observations in calibration:
+            model(observations)
+    return quantize_fx.convert_fx(model)
+
+
+def trace_encoder(
+    model: torch.nn.Module,
+    example: torch.Tensor,
+    feature_maps: bool = False,
+    quantize: Optional[str] = None,
+    calibration: Optional[Iterable[torch.Tensor]] = None,
+    optimize: bool = False
+) -> torch.jit.ScriptModule:
+    """Frozen TorchScript module of a visual encoder returning a tuple of tensors.
+
+    Freezing inlines the parameters as constants and folds batch norms and
+    constant scaling into the preceding convolutions.
+
+    :param model: encoder, e.g. `VisualCortexV4`
+    :type model: torch.nn.Module
+    :param example: example batch of observations, as passed to the features extractor
+    :type example: torch.Tensor
+    :param feature_maps: whether to return the feature maps after the features
+    :type feature_maps: bool
+    :param quantize: optional int8 quantization, see `quantize_encoder`
+    :type quantize: Optional[str]
+    :param calibration: batches of observations for static quantization
+    :type calibration: Optional[Iterable[torch.Tensor]]
+    :param optimize: whether to apply `torch.jit.optimize_for_inference`, which converts float models to MKLDNN layouts
+    :type optimize: bool
+    """
+    model = FlatEncoder(model, feature_maps).eval()
+    example = example.cpu()
+    if quantize is not None:
+        model = quantize_encoder(model, example, quantize, calibration)
+    with torch.no_grad():
+        module = torch.jit.freeze(torch.jit.trace(model.cpu().eval(), example))
+    if optimize and quantize is None:
+        module = torch.jit.optimize_for_inference(module)
+    return module
+
+
+def export_encoder(
+    model: torch.nn.Module,
+    example: torch.Tensor,
+    outpath: str,
+    export_format: str = 'torchscript',
+    feature_maps: bool = False,
+    quantize: Optional[str] = None,
+    calibration: Optional[Iterable[torch.Tensor]] = None
+) -> None:
+    """Exports a visual encoder for rollouts, to be loaded with `load_encoder`.
+
+    Exported encoders return a tuple of the features and, with
+    `feature_maps`, the flattened feature maps, for a batch of observations
+    of any size. Quantized encoders are only exported to TorchScript.
+
+    :param model: encoder, e.g. `VisualCortexV4`
+    :type model: torch.nn.Module
+    :param example: example batch of observations
+    :type example: torch.Tensor
+    :param outpath: path of the exported encoder, `.pt` for TorchScript, `.onnx` for ONNX
+    :type outpath: str
+    :param export_format: one of `EXPORT_FORMATS`
+    :type export_format: str
+    :param feature_maps: whether to return the feature maps after the features
+    :type feature_maps: bool
+    :param quantize: optional int8 quantization, see `quantize_encoder`
+    :type quantize: Optional[str]
+    :param calibration: batches of observations for static quantization
+    :type calibration: Optional[Iterable[torch.Tensor]]
+    """
+    if export_format == 'torchscript':
+        torch.jit.save(trace_encoder(model, example, feature_maps, quantize, calibration), outpath)
+        return
+    if export_format != 'onnx':
+        raise ValueError('Expected export_format in {}, got {}'.format(EXPORT_FORMATS, export_format))
+    if quantize is not None:
+        raise ValueError('Quantized encoders are only exported to TorchScript')
+    model = FlatEncoder(model, feature_maps).cpu().eval()
+    example = example.cpu()
+    with torch.no_grad():
+        n_outputs = len(model(example))
+    output_names = ['features'] + ['feature_map_{}'.format(i) for i in range(n_outputs - 1)]
+    torch.onnx.export(
+            model,
+            (example,),
+            outpath,
+            export_params=True,
+            opset_version=11,
+            do_constant_folding=True,
+            input_names=['observations'],
+            output_names=output_names,
+            dynamic_axes={name: {0: 'batch_size'} for name in ['observations'] + output_names})
+
+
+class OnnxEncoder(torch.nn.Module):
+    """Encoder exported to ONNX, run with `onnxruntime` on CPU.
+
+    :param path: path of the ONNX model
+    :type path: str
+    :param num_threads: number of threads of the inference session, the default of `onnxruntime` if `None`
+    :type num_threads: Optional[int]
+    """
+    def __init__(self, path: str, num_threads: Optional[int] = None):
+        super(OnnxEncoder, self).__init__()
+        if onnxruntime is None:
+            raise ImportError('Running ONNX encoders requires onnxruntime')
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, observations: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        outputs = self.session.run(None, {self.input_name: observations.detach().cpu().numpy()})
+        return tuple(torch.from_numpy(output) for output in outputs)
+
+
+def load_encoder(path: str) -> Union[torch.jit.ScriptModule, OnnxEncoder]:
+    """Loads an encoder written by `export_encoder`, on CPU."""
+    if path.endswith('.onnx'):
+        return OnnxEncoder(path, torch.get_num_threads())
+    return torch.jit.load(path, map_location='cpu')
@@ -1,8 +1,9 @@
 import numpy as np
-import pandas as pd
 from neurorobotics.constants import params
-import matplotlib.pyplot as plt
-from tqdm import tqdm
+from neurorobotics.utils.optional import lazy_import
+plt = lazy_import('matplotlib.pyplot', 'plotting')
+tqdm = lazy_import('tqdm', 'progress')
+pd = lazy_import('pandas', 'dataframes')
 
 def findLocalMaximaMinima(n, arr):
 
@@ -103,7 +104,7 @@ def test_cpg_entrainment(cpg, C, hopf_mod, hopf):
         label = 'driver'
     )
 
-    for lmbda in tqdm(lambdas):
+    for lmbda in tqdm.tqdm(lambdas):
         params['lambda'] = lmbda
         Z2, W2, Z1 = cpg(omega, mu, phase, C, params['degree'], N, dt)
         length = int(Z2.shape[0] - Z2.shape[0] % steps)
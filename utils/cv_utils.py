@@ -2,8 +2,9 @@ import cv2
 import numpy as np
 import os
 import math
-import matplotlib.pyplot as plt
+from neurorobotics.utils.optional import lazy_import
 from typing import Dict, List, NamedTuple, Optional, Tuple, Type
+plt = lazy_import('matplotlib.pyplot', 'plotting')
 
 
 def circle_detect_v2(img):
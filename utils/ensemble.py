@@ -0,0 +1,175 @@
+"""Ensemble critic evaluating all the Q-networks of TD3 with batched matmuls.
+
+`EnsembleCritic` is a drop in replacement for
+`stable_baselines3.common.policies.ContinuousCritic`. The weights of each
+layer of the `n_critics` Q-networks are stacked, so a forward pass is one
+matmul per layer instead of one per layer and critic. Features are extracted
+once per batch for all Q-networks and, when they do not require gradients, are
+reused by `q1_forward` until the parameters of the features extractor change.
+`EnsembleTD3Policy` is `TD3Policy` with an `EnsembleCritic`, configured with
+the same `policy_kwargs`.
+"""
+import math
+import torch
+import gym
+import stable_baselines3 as sb3
+from typing import Any, List, Optional, Tuple, Type, Union
+
+
+class EnsembleLinear(torch.nn.Module):
+    """`n` independent linear layers applied with one batched matmul.
+
+    Each layer is initialised like `torch.nn.Linear`.
+
+    :param n: number of layers
+    :type n: int
+    :param in_features: size of the inputs
+    :type in_features: int
+    :param out_features: size of the outputs
+    :type out_features: int
+    """
+    def __init__(self, n: int, in_features: int, out_features: int):
+        super(EnsembleLinear, self).__init__()
+        self.n = n
+        self.in_features = in_features
+        self.out_features = out_features
+        self.weight = torch.nn.Parameter(torch.empty(n, in_features, out_features))
+        self.bias = torch.nn.Parameter(torch.empty(n, 1, out_features))
+        self.reset_parameters()
+
+    def reset_parameters(self) -> None:
+        bound = 1 / math.sqrt(self.in_features) if self.in_features > 0 else 0
+        torch.nn.init.uniform_(self.weight, -bound, bound)
+        torch.nn.init.uniform_(self.bias, -bound, bound)
+
+    def load_linears(self, linears: List[torch.nn.Linear]) -> None:
+        """Copies the weights of `n` `torch.nn.Linear` layers."""
+        assert len(linears) == self.n
+        with torch.no_grad():
+            for i, linear in enumerate(linears):
+                self.weight[i].copy_(linear.weight.t())
+                self.bias[i, 0].copy_(linear.bias)
+
+    def forward(self, x: torch.Tensor, heads: Optional[slice] = None) -> torch.Tensor:
+        """Outputs of shape `(n, batch_size, out_features)`.
+
+        :param x: inputs shared by all layers of shape `(batch_size, in_features)` or of shape `(n, batch_size, in_features)`
+        :type x: torch.Tensor
+        :param heads: layers to apply, all by default
+        :type heads: Optional[slice]
+        """
+        weight, bias = self.weight, self.bias
+        if heads is not None:
+            weight, bias = weight[heads], bias[heads]
+        if x.dim() == 2:
+            return torch.matmul(x, weight) + bias
+        return torch.baddbmm(bias, x, weight)
+
+    def extra_repr(self) -> str:
+        return 'n={}, in_features={}, out_features={}'.format(self.n, self.in_features, self.out_features)
+
+
+class EnsembleCritic(sb3.common.policies.BaseModel):
+    """Critic networks of TD3 with stacked weights.
+
+    Takes the arguments of `ContinuousCritic` and returns the same tuple of
+    `n_critics` Q-values of shape `(batch_size, 1)`.
+
+    :param observation_space: observation space
+    :type observation_space: gym.spaces.Space
+    :param action_space: action space
+    :type action_space: gym.spaces.Space
+    :param net_arch: sizes of the hidden layers of each Q-network
+    :type net_arch: List[int]
+    :param features_extractor: network extracting the features of the observations
+    :type features_extractor: torch.nn.Module
+    :param features_dim: number of features
+    :type features_dim: int
+    :param activation_fn: activation function
+    :type activation_fn: Type[torch.nn.Module]
+    :param normalize_images: whether to divide images by 255
+    :type normalize_images: bool
+    :param n_critics: number of Q-networks
+    :type n_critics: int
+    :param share_features_extractor: whether the features extractor is shared with and only trained by the actor
+    :type share_features_extractor: bool
+    """
+    def __init__(
+        self,
+        observation_space: gym.spaces.Space,
+        action_space: gym.spaces.Space,
+        net_arch: List[int],
+        features_extractor: torch.nn.Module,
+        features_dim: int,
+        activation_fn: Type[torch.nn.Module] = torch.nn.ReLU,
+        normalize_images: bool = True,
+        n_critics: int = 2,
+        share_features_extractor: bool = True
+    ):
+        super(EnsembleCritic, self).__init__(
+            observation_space,
+            action_space,
+            features_extractor=features_extractor,
+            normalize_images=normalize_images
+        )
+        action_dim = sb3.common.preprocessing.get_action_dim(self.action_space)
+        self.share_features_extractor = share_features_extractor
+        self.n_critics = n_critics
+        sizes = [features_dim + action_dim] + list(net_arch) + [1]
+        self.layers = torch.nn.ModuleList([
+            EnsembleLinear(n_critics, in_features, out_features)
+            for in_features, out_features in zip(sizes[:-1], sizes[1:])
+        ])
+        self.activation = activation_fn()
+        self._features: Optional[Tuple[Any, Tuple[Any, ...], torch.Tensor]] = None
+
+    def load_critic(self, critic: sb3.common.policies.ContinuousCritic) -> None:
+        """Copies the Q-networks of a `ContinuousCritic` of the same architecture."""
+        for i, layer in enumerate(self.layers):
+            layer.load_linears([
+                [module for module in q_net if isinstance(module, torch.nn.Linear)][i]
+                for q_net in critic.q_networks
+            ])
+
+    def _extract(self, obs: Union[torch.Tensor, dict], grad: bool) -> torch.Tensor:
+        # Features without gradients are reused for the same observations and extractor parameters.
+        grad = grad and torch.is_grad_enabled()
+        tensors = list(obs.values()) if isinstance(obs, dict) else [obs]
+        # In place updates of the observations or parameters change their versions.
+        key = (self.training,) + tuple(tensor._version for tensor in tensors) + \
+            tuple(param._version for param in self.features_extractor.parameters())
+        if not grad and self._features is not None and self._features[0] is obs and self._features[1] == key:
+            return self._features[2]
+        with torch.set_grad_enabled(grad):
+            features = self.extract_features(obs)
+        self._features = None if grad else (obs, key, features)
+        return features
+
+    def q_values(self, obs: Union[torch.Tensor, dict], actions: torch.Tensor, heads: Optional[slice] = None) -> torch.Tensor:
+        """Q-values of shape `(n_critics, batch_size, 1)`, or of the Q-networks `heads`."""
+        # Learn the features extractor using the policy loss only when it is shared with the actor
+        features = self._extract(obs, not self.share_features_extractor and heads is None)
+        x = torch.cat([features, actions], dim=1)
+        for i, layer in enumerate(self.layers):
+            x = layer(x, heads)
+            if i < len(self.layers) - 1:
+                x = self.activation(x)
+        return x
+
+    def forward(self, obs: Union[torch.Tensor, dict], actions: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        return tuple(self.q_values(obs, actions).unbind(0))
+
+    def q1_forward(self, obs: Union[torch.Tensor, dict], actions: torch.Tensor) -> torch.Tensor:
+        """Q-values of the first network only, as used for the actor loss."""
+        return self.q_values(obs, actions, slice(0, 1))[0]
+
+
+class EnsembleTD3Policy(sb3.td3.policies.TD3Policy):
+    """`TD3Policy` with an `EnsembleCritic`, taking the same arguments.
+
+    Pass `features_extractor_class` in `policy_kwargs` for dict observations,
+    e.g. `CombinedExtractor` as in `MultiInputPolicy`.
+    """
+    def make_critic(self, features_extractor: Optional[sb3.common.torch_layers.BaseFeaturesExtractor] = None) -> EnsembleCritic:
+        critic_kwargs = self._update_features_extractor(self.critic_kwargs, features_extractor)
+        return EnsembleCritic(**critic_kwargs).to(self.device)
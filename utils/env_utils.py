@@ -2,9 +2,10 @@ import numpy as np
 import gym
 from collections import defaultdict, OrderedDict
 import math
-import matplotlib.pyplot as plt
+from neurorobotics.utils.optional import lazy_import
 import bisect
 import sys
+plt = lazy_import('matplotlib.pyplot', 'plotting')
 
 def convert_observation_to_space(observation, maximum = float('inf')):
     if isinstance(observation, dict):
@@ -2,7 +2,63 @@ import stable_baselines3 as sb3
 import gym
 import torch
 import numpy as np
-from typing import Dict
+from typing import Any, Dict, Optional
+
+
+class FeatureCache:
+    """Last outputs of modules for a batch of observations.
+
+    A batch is recognised by the identity and version of the observation
+    tensors that preprocessing leaves as they are, e.g. `float32` keys, and
+    the other keys must be equal to the cached ones. Outputs are reused while
+    the parameters of the module are not updated in place, e.g. by an
+    optimiser or a Polyak update, and are stored without gradients.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self) -> None:
+        self._entries: Dict[str, Any] = {}
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.clear()
+
+    @staticmethod
+    def _key(module: torch.nn.Module) -> Any:
+        return (module.training,) + tuple(param._version for param in module.parameters())
+
+    def get(self, name: str, observations: Dict[str, torch.Tensor], module: torch.nn.Module) -> Optional[torch.Tensor]:
+        """Output of `module` stored as `name` for `observations`, if any."""
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        tensors, versions, key, value = entry
+        if tensors.keys() != observations.keys() or key != self._key(module):
+            return None
+        same = [observations[key] is tensor for key, tensor in tensors.items()]
+        # At least one tensor of the same batch is passed on as is
+        if not any(same):
+            return None
+        for is_same, (key, tensor) in zip(same, tensors.items()):
+            obs = observations[key]
+            if is_same:
+                if obs._version != versions[key]:
+                    return None
+            elif obs.shape != tensor.shape or obs.dtype != tensor.dtype or not torch.equal(obs, tensor):
+                return None
+        return value
+
+    def put(self, name: str, observations: Dict[str, torch.Tensor], module: torch.nn.Module, value: torch.Tensor) -> None:
+        """Stores the output `value` of `module` for `observations` as `name`."""
+        self._entries[name] = (
+            dict(observations),
+            {key: tensor._version for key, tensor in observations.items()},
+            self._key(module),
+            value.detach()
+        )
 
 
 class DictToTensorFeaturesExtractor(sb3.common.torch_layers.BaseFeaturesExtractor):
@@ -13,13 +69,20 @@ class DictToTensorFeaturesExtractor(sb3.common.torch_layers.BaseFeaturesExtracto
     :type observation_space: gym.Space
     :param features_dim: Output 1D Tensor Dimension
     :type features_dim: int
+    :param cache: Reuse the features of the last batch. Actor and critic
+        sharing the features extractor, and actor and critic targets, then
+        encode each replay batch once per gradient step. Features are only
+        reused without gradients, except for the CNN output when it is frozen.
+    :type cache: bool
     """
     def __init__(
             self,
             observation_space: gym.Space,
-            features_dim: int
+            features_dim: int,
+            cache: bool = True
     ):
         super(DictToTensorFeaturesExtractor, self).__init__(observation_space, features_dim)
+        self.cache = FeatureCache() if cache else None
         self.cnn = torch.nn.Sequential(
             torch.nn.Conv2d(3, 24, kernel_size=8, stride=4, padding=4),
             torch.nn.ReLU(),
@@ -47,9 +110,25 @@ class DictToTensorFeaturesExtractor(sb3.common.torch_layers.BaseFeaturesExtracto
             self,
             observations: Dict[str, torch.Tensor]
     ) -> torch.Tensor:
-        visual_f = self.cnn(observations['frame_t'])
+        if self.cache is None:
+            visual_f = self.cnn(observations['frame_t'])
+            inp = torch.cat([observations['sensors'], visual_f], -1)
+            return self.mlp(inp)
+
+        grad = torch.is_grad_enabled()
+        if not grad:
+            features = self.cache.get('features', observations, self)
+            if features is not None:
+                return features
+        visual_f = None
+        if not grad or not any(param.requires_grad for param in self.cnn.parameters()):
+            visual_f = self.cache.get('cnn', observations, self.cnn)
+        if visual_f is None:
+            visual_f = self.cnn(observations['frame_t'])
+            self.cache.put('cnn', observations, self.cnn, visual_f)
         inp = torch.cat([observations['sensors'], visual_f], -1)
         features = self.mlp(inp)
+        self.cache.put('features', observations, self, features)
         return features
 
 
@@ -86,3 +165,42 @@ class LocalPlannerFeaturesExtractor(sb3.common.torch_layers.BaseFeaturesExtracto
                 observations['desired_goal']
                 ], -1)
         return self.mlp(x)
+
+
+class ExportedFeaturesExtractor(sb3.common.torch_layers.BaseFeaturesExtractor):
+    """Feature Extractor running a visual encoder exported with
+    `neurorobotics.utils.conversion.export_encoder`, e.g. a quantized
+    `VisualCortexV4`, for CPU rollouts. The encoder is frozen and only
+    returns its features.
+
+    :param observation_space: Observation Configuration.
+    :type observation_space: gym.Space
+    :param path: Path to the exported encoder.
+    :type path: str
+    :param key: Key of the frames for dict observations.
+    :type key: Optional[str]
+    """
+    def __init__(
+            self,
+            observation_space: gym.Space,
+            path: str,
+            key: Optional[str] = None
+    ):
+        from neurorobotics.utils.conversion import load_encoder
+        encoder = load_encoder(path)
+        space = observation_space if key is None else observation_space[key]
+        with torch.no_grad():
+            inp = torch.as_tensor(space.sample()[None]).float()
+            features_dim = encoder(inp)[0].shape[-1]
+        super(ExportedFeaturesExtractor, self).__init__(observation_space, features_dim)
+        self.encoder = encoder
+        self.key = key
+
+    def forward(
+            self,
+            observations: Any
+    ) -> torch.Tensor:
+        if self.key is not None:
+            observations = observations[self.key]
+        with torch.no_grad():
+            return self.encoder(observations.float().cpu())[0].to(observations.device)
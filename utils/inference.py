@@ -0,0 +1,265 @@
+"""Batched policy inference for many environments stepped concurrently.
+
+`PolicyServer` runs a policy in a background thread. Environment threads call
+`PolicyServer.predict`, which has the signature of `BasePolicy.predict`, and
+block until their action is ready. The server gathers the pending
+observations until `max_batch_size` observations are waiting or the oldest
+request has waited `deadline` seconds, runs one forward pass for all of them
+and returns each caller its actions. Box and dict observation spaces, e.g.
+those of `SimpleRoomEnv` and `LocalPlannerEnv`, are supported, with single
+or vectorized observations per call. The learner swaps in new weights with
+`PolicyServer.update` without stopping the server. `run_episodes` steps
+environments concurrently through a server, e.g. for evaluation.
+"""
+import copy
+import time
+import queue
+import threading
+import numpy as np
+import torch
+import gym
+import stable_baselines3 as sb3
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+Observation = Union[np.ndarray, Dict[str, np.ndarray]]
+
+
+class _Request:
+    __slots__ = ['observation', 'n', 'vectorized', 'deterministic', 'time', 'future']
+
+    def __init__(self, observation: Observation, n: int, vectorized: bool, deterministic: bool):
+        self.observation = observation
+        self.n = n
+        self.vectorized = vectorized
+        self.deterministic = deterministic
+        self.time = time.perf_counter()
+        self.future = Future()
+
+
+def _as_batch(observation: Any, space: gym.spaces.Space) -> Tuple[np.ndarray, bool]:
+    # Same conversion as `BasePolicy.predict`, channel last images are transposed.
+    if sb3.common.preprocessing.is_image_space(space):
+        observation = sb3.common.preprocessing.maybe_transpose(observation, space)
+    observation = np.asarray(observation)
+    vectorized = sb3.common.utils.is_vectorized_observation(observation, space)
+    return observation.reshape((-1,) + space.shape), vectorized
+
+
+class PolicyServer:
+    """Serves the actions of a policy to concurrent callers in batches.
+
+    :param policy: policy to serve, e.g. `model.policy`, which is copied
+    :type policy: sb3.common.policies.BasePolicy
+    :param max_batch_size: number of observations that triggers a forward pass
+    :type max_batch_size: int
+    :param deadline: max time in seconds the first request of a batch waits for others, which a lone caller waits every call
+    :type deadline: float
+    """
+    def __init__(
+        self,
+        policy: sb3.common.policies.BasePolicy,
+        max_batch_size: int = 64,
+        deadline: float = 1e-3,
+    ):
+        self.observation_space = policy.observation_space
+        self.action_space = policy.action_space
+        self.max_batch_size = max_batch_size
+        self.deadline = deadline
+        # Weights are loaded into the idle copy and swapped in between batches, the spaces are shared
+        memo = {id(space): space for space in [policy.observation_space, policy.action_space]}
+        self.policy = copy.deepcopy(policy, dict(memo))
+        self.policy.eval()
+        self._idle = copy.deepcopy(self.policy, dict(memo))
+        self.version = 0
+        self._serving = threading.Lock()
+        self._updating = threading.Lock()
+        self._requests: queue.Queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.n_batches = 0
+        self.n_observations = 0
+
+    def __enter__(self) -> 'PolicyServer':
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.n_observations / max(self.n_batches, 1)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._serve, daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        # Fail the requests left behind instead of blocking their callers
+        while True:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            request.future.set_exception(RuntimeError('PolicyServer was closed'))
+
+    def update(self, state_dict: Dict[str, torch.Tensor]) -> int:
+        """Loads new weights, e.g. `model.policy.state_dict()`, served from the next batch on.
+
+        :returns: version of the served weights, incremented by every update
+        :rtype: int
+        """
+        with self._updating:
+            self._idle.load_state_dict(state_dict)
+            with self._serving:
+                self.policy, self._idle = self._idle, self.policy
+                self.version += 1
+                return self.version
+
+    def predict(
+        self,
+        observation: Observation,
+        state: Optional[np.ndarray] = None,
+        mask: Optional[np.ndarray] = None,
+        deterministic: bool = False
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Actions for `observation`, as returned by `BasePolicy.predict`, computed in a batch with other callers."""
+        if self._thread is None:
+            raise RuntimeError('PolicyServer is not running, call start first')
+        if isinstance(observation, dict):
+            batch, vectorized = {}, False
+            for key, value in observation.items():
+                batch[key], is_vectorized = _as_batch(value, self.observation_space.spaces[key])
+                vectorized = vectorized or is_vectorized
+            n = len(next(iter(batch.values())))
+        else:
+            batch, vectorized = _as_batch(observation, self.observation_space)
+            n = len(batch)
+        if state is not None and not vectorized:
+            raise ValueError('Error: The environment must be vectorized when using recurrent policies.')
+        request = _Request(batch, n, vectorized, deterministic)
+        self._requests.put(request)
+        return request.future.result(), state
+
+    def _gather(self) -> List[_Request]:
+        try:
+            requests = [self._requests.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        n = requests[0].n
+        end = requests[0].time + self.deadline
+        while n < self.max_batch_size:
+            timeout = end - time.perf_counter()
+            try:
+                request = self._requests.get(timeout=timeout) if timeout > 0 else self._requests.get_nowait()
+            except queue.Empty:
+                break
+            requests.append(request)
+            n += request.n
+        return requests
+
+    def _run(self, requests: List[_Request], deterministic: bool) -> None:
+        if isinstance(requests[0].observation, dict):
+            batch = {
+                key: np.concatenate([request.observation[key] for request in requests])
+                for key in requests[0].observation.keys()
+            }
+        else:
+            batch = np.concatenate([request.observation for request in requests])
+        with self._serving:
+            actions, _ = self.policy.predict(batch, deterministic=deterministic)
+        self.n_batches += 1
+        self.n_observations += len(actions)
+        start = 0
+        for request in requests:
+            result = actions[start:start + request.n]
+            request.future.set_result(result if request.vectorized else result[0])
+            start += request.n
+
+    def _serve(self) -> None:
+        while not self._stop.is_set():
+            requests = self._gather()
+            for deterministic in [False, True]:
+                group = [request for request in requests if request.deterministic == deterministic]
+                if len(group) == 0:
+                    continue
+                try:
+                    self._run(group, deterministic)
+                except Exception as e:
+                    for request in group:
+                        request.future.set_exception(e)
+
+
+def run_episodes(
+    server: PolicyServer,
+    envs: List[Union[gym.Env, sb3.common.vec_env.VecEnv]],
+    n_episodes: int,
+    deterministic: bool = True,
+    observations: Optional[List[Optional[Observation]]] = None
+) -> Tuple[List[float], List[int]]:
+    """Runs `n_episodes` episodes split between the environments, each stepped in its own thread through `server`.
+
+    The environments are kept open. A `VecEnv` is only reset if it has no
+    current observation and continues from its automatic resets, which are
+    kept in `observations` for the next call.
+
+    :param server: running policy server
+    :type server: PolicyServer
+    :param envs: environments, e.g. single environment `VecEnv`
+    :type envs: List[Union[gym.Env, sb3.common.vec_env.VecEnv]]
+    :param n_episodes: total number of episodes
+    :type n_episodes: int
+    :param deterministic: whether to use deterministic actions
+    :type deterministic: bool
+    :param observations: current observation of each `VecEnv`, `None` before the first reset, updated in place
+    :type observations: Optional[List[Optional[Observation]]]
+    :returns: rewards and lengths of the episodes, as `evaluate_policy` with `return_episode_rewards`
+    :rtype: Tuple[List[float], List[int]]
+    """
+    rewards, lengths = [], []
+    lock = threading.Lock()
+    errors = []
+
+    if observations is None:
+        observations = [None] * len(envs)
+
+    def worker(i: int, env: Union[gym.Env, sb3.common.vec_env.VecEnv], episodes: int) -> None:
+        try:
+            vectorized = isinstance(env, sb3.common.vec_env.VecEnv)
+            for _ in range(episodes):
+                obs = observations[i] if vectorized else None
+                if obs is None:
+                    obs = env.reset()
+                done, total, steps = False, 0.0, 0
+                while not done:
+                    action, _ = server.predict(obs, deterministic=deterministic)
+                    obs, reward, done, info = env.step(action)
+                    total += float(np.sum(reward))
+                    steps += 1
+                if vectorized:
+                    observations[i] = obs
+                with lock:
+                    rewards.append(total)
+                    lengths.append(steps)
+        except Exception as e:
+            observations[i] = None
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=worker, args=(i, env, n_episodes // len(envs) + int(i < n_episodes % len(envs))))
+        for i, env in enumerate(envs)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return rewards, lengths
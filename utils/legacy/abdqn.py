@@ -4,7 +4,7 @@ import gym
 import stable_baselines3 as sb3
 from typing import Any, Dict, List, Optional, Tuple, Type, Union, NamedTuple
 from neurorobotics.bg.autoencoder import ResNet18Enc
-from neurorobotics.utils.per import SumSegmentTree, MinSegmentTree
+from neurorobotics.utils.per import PriorityTree
 
 TensorDict = Dict[Union[str, int], torch.Tensor]
 
@@ -287,11 +287,7 @@ class PrioritizedReplayBuffer(sb3.common.buffers.ReplayBuffer):
     ):
         assert alpha > 0.0
         self._alpha = alpha
-        it_capacity = 1
-        while it_capacity < buffer_size:
-            it_capacity *= 2
-        self._it_sum = SumSegmentTree(it_capacity)
-        self._it_min = MinSegmentTree(it_capacity)
+        self._tree = PriorityTree(buffer_size)
         self._max_priority = 1.0
 
         super(PrioritizedReplayBuffer, self).__init__(
@@ -313,6 +309,7 @@ class PrioritizedReplayBuffer(sb3.common.buffers.ReplayBuffer):
         done: np.ndarray,
         infos: List[Dict[str, Any]],
     ) -> None:
+        pos = self.pos
         super().add(
             obs,
             next_obs,
@@ -321,8 +318,7 @@ class PrioritizedReplayBuffer(sb3.common.buffers.ReplayBuffer):
             done,
             infos
         )
-        self._it_sum[self.pos] = self._max_priority ** self._alpha
-        self._it_min[self.pos] = self._max_priority ** self._alpha
+        self._tree.update(pos, self._max_priority ** self._alpha)
 
     def sample(self, batch_size: int, beta: float, env: Optional[sb3.common.vec_env.VecNormalize] = None) -> PrioritizedReplayBufferSamples:
         """
@@ -337,10 +333,7 @@ class PrioritizedReplayBuffer(sb3.common.buffers.ReplayBuffer):
         """
         assert beta > 0.0
         size = self.buffer_size - 1 if self.full else self.pos
-        mass = []
-        total = self._it_sum.sum(0, size)
-        mass = np.random.random(size=batch_size) * total
-        batch_inds = self._it_sum.find_prefixsum_idx(mass)
+        batch_inds = self._tree.sample(batch_size, size)
         return self._get_samples(batch_inds, beta, env=env)
 
     def _get_samples(self, batch_inds: np.ndarray, beta: float, env: Optional[sb3.common.vec_env.VecNormalize] = None) -> PrioritizedReplayBufferSamples:
@@ -350,12 +343,9 @@ class PrioritizedReplayBuffer(sb3.common.buffers.ReplayBuffer):
         else:
             next_obs = self._normalize_obs(self.next_observations[batch_inds, 0, :], env)
         
-        size = self.buffer_size if self.full else self.pos + 1
+        size = self.buffer_size if self.full else self.pos
        
-        p_min = self._it_min.min() / self._it_sum.sum()
-        max_weight = (p_min * size) ** (-beta)
-        p_sample = self._it_sum[batch_inds] / self._it_sum.sum()
-        weights = (p_sample * size) ** (-beta) / max_weight 
+        weights = self._tree.weights(batch_inds, size, beta)
 
         data = (
             self._normalize_obs(self.observations[batch_inds, 0, :], env),
@@ -385,8 +375,7 @@ class PrioritizedReplayBuffer(sb3.common.buffers.ReplayBuffer):
         assert np.min(priorities) > 0
         assert np.min(idxes) >= 0
         assert np.max(idxes) < size
-        self._it_sum[idxes] = priorities ** self._alpha
-        self._it_min[idxes] = priorities ** self._alpha
+        self._tree.update(idxes, priorities ** self._alpha)
         self._max_priority = max(self._max_priority, np.max(priorities))
 
 
@@ -404,11 +393,7 @@ class PrioritizedDictReplayBuffer(sb3.common.buffers.DictReplayBuffer):
     ):
         assert alpha > 0.0
         self._alpha = alpha
-        it_capacity = 1
-        while it_capacity < buffer_size:
-            it_capacity *= 2
-        self._it_sum = SumSegmentTree(it_capacity)
-        self._it_min = MinSegmentTree(it_capacity)
+        self._tree = PriorityTree(buffer_size)
         self._max_priority = 1.0
 
         super(PrioritizedDictReplayBuffer, self).__init__(
@@ -430,6 +415,7 @@ class PrioritizedDictReplayBuffer(sb3.common.buffers.DictReplayBuffer):
         done: np.ndarray,
         infos: List[Dict[str, Any]],
     ) -> None:
+        pos = self.pos
         super().add(
             obs,
             next_obs,
@@ -438,8 +424,7 @@ class PrioritizedDictReplayBuffer(sb3.common.buffers.DictReplayBuffer):
             done,
             infos
         )
-        self._it_sum[self.pos] = self._max_priority ** self._alpha
-        self._it_min[self.pos] = self._max_priority ** self._alpha
+        self._tree.update(pos, self._max_priority ** self._alpha)
 
     def sample(self, batch_size: int, beta: float, env: Optional[sb3.common.vec_env.VecNormalize] = None) -> PrioritizedDictReplayBufferSamples:
         """
@@ -454,10 +439,7 @@ class PrioritizedDictReplayBuffer(sb3.common.buffers.DictReplayBuffer):
         """
         assert beta > 0.0
         size = self.buffer_size - 1 if self.full else self.pos
-        mass = []
-        total = self._it_sum.sum(0, size)
-        mass = np.random.random(size=batch_size) * total
-        batch_inds = self._it_sum.find_prefixsum_idx(mass)
+        batch_inds = self._tree.sample(batch_size, size)
         return self._get_samples(batch_inds, beta, env=env)
 
     def _get_samples(self, batch_inds: np.ndarray, beta: float, env: Optional[sb3.common.vec_env.VecNormalize] = None) -> PrioritizedDictReplayBufferSamples:
@@ -469,12 +451,9 @@ class PrioritizedDictReplayBuffer(sb3.common.buffers.DictReplayBuffer):
         observations = {key: self.to_torch(obs) for key, obs in obs_.items()}
         next_observations = {key: self.to_torch(obs) for key, obs in next_obs_.items()}
 
-        size = self.buffer_size if self.full else self.pos + 1
+        size = self.buffer_size if self.full else self.pos
        
-        p_min = self._it_min.min() / self._it_sum.sum()
-        max_weight = (p_min * size) ** (-beta)
-        p_sample = self._it_sum[batch_inds] / self._it_sum.sum()
-        weights = (p_sample * size) ** (-beta) / max_weight 
+        weights = self._tree.weights(batch_inds, size, beta)
 
         return PrioritizedDictReplayBufferSamples(
             observations=observations,
@@ -497,13 +476,12 @@ class PrioritizedDictReplayBuffer(sb3.common.buffers.DictReplayBuffer):
         :param priorities: ([float]) List of updated priorities corresponding to transitions at the sampled idxes
             denoted by variable `idxes`.
         """ 
-        size = self.buffer_size if self.full else self.pos + 1
+        size = self.buffer_size if self.full else self.pos
         assert len(idxes) == len(priorities)
         assert np.min(priorities) > 0
         assert np.min(idxes) >= 0
         assert np.max(idxes) < size
-        self._it_sum[idxes] = priorities ** self._alpha
-        self._it_min[idxes] = priorities ** self._alpha
+        self._tree.update(idxes, priorities ** self._alpha)
         self._max_priority = max(self._max_priority, np.max(priorities))
 
 
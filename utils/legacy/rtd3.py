@@ -14,7 +14,9 @@ from pytorch_msssim import ssim
 from torch.utils.tensorboard import SummaryWriter
 import cv2
 import os
-from neurorobotics.utils.td3 import Actor, ContinuousCritic
+from neurorobotics.utils.legacy.td3 import Actor, ContinuousCritic
+from neurorobotics.utils.storage import ReplayStorage
+from neurorobotics.utils.buffers import SequenceSampler
 from stable_baselines3.common.buffers import DictReplayBuffer
 """
 Idea of burn in comes from the following paper:
@@ -114,6 +116,10 @@ class DictReplayBuffer(sb3.common.buffers.ReplayBuffer):
     :param n_envs: Number of parallel environments
     :param optimize_memory_usage: Enable a memory efficient variant Disabled for now (see https://github.com/DLR-RM/stable-baselines3/pull/243#discussion_r531535702)
     :param handle_timeout_termination: Handle timeout termination (due to timelimit) separately and treat the task as infinite horizon task. https://github.com/DLR-RM/stable-baselines3/issues/284
+    :param storage_path: directory to store the transitions in as memory mapped arrays, `None` keeps them in memory
+    :param hot_window: number of recently added transitions kept in memory before being written to `storage_path`
+    :param resume: restore the transitions stored under `storage_path` by the last `flush`
+    :param burn_in_seq_len: number of steps sampled before the `max_seq_len` training steps of each sequence
     """
 
     def __init__(
@@ -127,6 +133,10 @@ class DictReplayBuffer(sb3.common.buffers.ReplayBuffer):
         n_envs: int = 1,
         optimize_memory_usage: bool = False,
         handle_timeout_termination: bool = True,
+        storage_path: Optional[str] = None,
+        hot_window: int = 0,
+        resume: bool = False,
+        burn_in_seq_len: int = 0,
     ):
         assert state_spec is not None
         assert max_seq_len > 2
@@ -145,21 +155,29 @@ class DictReplayBuffer(sb3.common.buffers.ReplayBuffer):
         # disabling as this adds quite a bit of complexity
         # https://github.com/DLR-RM/stable-baselines3/pull/243#discussion_r531535702
         self.optimize_memory_usage = optimize_memory_usage
+        self.storage = ReplayStorage(storage_path, hot_window, resume)
 
         self.observations = {
-            key: np.zeros((self.buffer_size, self.n_envs) + _obs_shape, dtype=observation_space[key].dtype)
-            for key, _obs_shape in self.obs_shape.items()
+            key: self.storage.zeros(
+                'observations_{}'.format(key),
+                (self.buffer_size, self.n_envs) + _obs_shape,
+                dtype=observation_space[key].dtype
+            ) for key, _obs_shape in self.obs_shape.items()
         }
         self.next_observations = {
-            key: np.zeros((self.buffer_size, self.n_envs) + _obs_shape, dtype=observation_space[key].dtype)
-            for key, _obs_shape in self.obs_shape.items()
+            key: self.storage.zeros(
+                'next_observations_{}'.format(key),
+                (self.buffer_size, self.n_envs) + _obs_shape,
+                dtype=observation_space[key].dtype
+            ) for key, _obs_shape in self.obs_shape.items()
         }
         
         num_lstm_layers = self.state_spec[0]
         state_size = self.state_spec[1]
 
         self.states = [
-            np.zeros(
+            self.storage.zeros(
+                'states_0',
                 (
                     self.buffer_size,
                     num_lstm_layers,
@@ -168,7 +186,8 @@ class DictReplayBuffer(sb3.common.buffers.ReplayBuffer):
                 ),
                 dtype = np.float32
             ),
-            np.zeros(
+            self.storage.zeros(
+                'states_1',
                 (
                     self.buffer_size,
                     num_lstm_layers,
@@ -179,7 +198,8 @@ class DictReplayBuffer(sb3.common.buffers.ReplayBuffer):
             )
         ]
         self.next_states = [
-            np.zeros(
+            self.storage.zeros(
+                'next_states_0',
                 (
                     self.buffer_size,
                     num_lstm_layers,
@@ -188,7 +208,8 @@ class DictReplayBuffer(sb3.common.buffers.ReplayBuffer):
                 ),
                 dtype = np.float32
             ),
-            np.zeros(
+            self.storage.zeros(
+                'next_states_1',
                 (
                     self.buffer_size,
                     num_lstm_layers,
@@ -200,16 +221,29 @@ class DictReplayBuffer(sb3.common.buffers.ReplayBuffer):
         ]
 
         # only 1 env is supported
-        self.actions = np.zeros((self.buffer_size, self.action_dim), dtype=action_space.dtype)
-        self.rewards = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
-        self.dones = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.actions = self.storage.zeros('actions', (self.buffer_size, self.action_dim), dtype=action_space.dtype)
+        self.rewards = self.storage.zeros('rewards', (self.buffer_size, self.n_envs), dtype=np.float32)
+        self.dones = self.storage.zeros('dones', (self.buffer_size, self.n_envs), dtype=np.float32)
 
         # Handle timeouts termination properly if needed
         # see https://github.com/DLR-RM/stable-baselines3/issues/284
         self.handle_timeout_termination = handle_timeout_termination
-        self.timeouts = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.timeouts = self.storage.zeros('timeouts', (self.buffer_size, self.n_envs), dtype=np.float32)
+
+        self.sampler = SequenceSampler(
+            self.buffer_size,
+            self.max_seq_len,
+            burn_in_seq_len,
+            self.device,
+            self.storage.zeros('episode_starts', (self.buffer_size,), dtype=np.int64)
+        )
 
-        if psutil is not None:
+        if self.storage.resumed:
+            state = self.storage.load_state()
+            self.pos, self.full = state['pos'], state['full']
+            self.sampler.episode_start = state['episode_start']
+
+        if psutil is not None and not self.storage.on_disk:
             obs_nbytes = 0
             for _, obs in self.observations.items():
                 obs_nbytes += obs.nbytes
@@ -260,11 +294,17 @@ class DictReplayBuffer(sb3.common.buffers.ReplayBuffer):
         if self.handle_timeout_termination:
             self.timeouts[self.pos] = np.array([info.get("TimeLimit.truncated", False) for info in infos])
 
+        self.sampler.add(self.pos, np.any(done))
+
         self.pos += 1
         if self.pos == self.buffer_size:
             self.full = True
             self.pos = 0
 
+    def flush(self) -> None:
+        """Writes the transitions and the buffer position to `storage_path`."""
+        self.storage.flush(pos=self.pos, full=self.full, episode_start=int(self.sampler.episode_start))
+
     def sample(self, batch_size: int, env: Optional[sb3.common.vec_env.VecNormalize] = None) -> RecurrentDictReplayBufferSamples:
         """
         Sample elements from the replay buffer.
@@ -276,68 +316,46 @@ class DictReplayBuffer(sb3.common.buffers.ReplayBuffer):
 
     def _get_samples(self, batch_inds: np.ndarray, env: Optional[sb3.common.vec_env.VecNormalize] = None) -> RecurrentDictReplayBufferSamples:
 
-        # Computing all indices and zeroing in states and observations for sequence truncation
-        offsets = np.repeat(np.expand_dims(np.arange(-(self.max_seq_len - 1), 1), 0), len(batch_inds), 0)
-        inds = np.repeat(np.expand_dims(batch_inds, 1), self.max_seq_len, 1) + offsets
-        offset = self.buffer_size if self.full else self.pos
-        inds[inds < 0] = inds[inds < 0] + offset 
-        
-        dones = self.dones[inds, 0]
-        include = np.flip(np.multiply.accumulate(np.flip(1 - dones, 1), 1), 1)
-        
-        obs = self._normalize_obs({
-            key: obs[inds, 0, :] * self.__expand_include(
-                include,
-                obs[inds, 0, :].shape
-            ).astype(obs.dtype) for key, obs in self.observations.items()
-        })
-        next_obs = self._normalize_obs({
-            key: obs[inds, 0, :] * self.__expand_include(
-                include,
-                obs[inds, 0, :].shape
-            ).astype(obs.dtype) for key, obs in self.next_observations.items()
-        })
+        # Windows of `burn_in_seq_len + max_seq_len` steps ending at each sampled transition,
+        # the steps of other episodes are zeroed for sequence truncation
+        inds, include = self.sampler.indices(batch_inds, self.pos, self.full)
+
+        observations = {
+            key: self.sampler.gather('observations_{}'.format(key), obs, inds, include)
+            for key, obs in self.observations.items()
+        }
+        next_observations = {
+            key: self.sampler.gather('next_observations_{}'.format(key), obs, inds, include)
+            for key, obs in self.next_observations.items()
+        }
         dones = self.dones[batch_inds] * (1 - self.timeouts[batch_inds])
         actions = self.actions[batch_inds]
         rewards = self._normalize_reward(self.rewards[batch_inds], env)
-        state_include = np.prod(include, 1)
-        next_state_include = np.prod(include[:, 1:], 1)
-        states = [self.states[i][inds[:, 0], :, 0] * self.__expand_include(
-            state_include,
-            self.states[i][inds[:, 0], :, 0].shape,
-        ).astype(self.states[i].dtype) for i in range(len(self.states))]
-        next_states = [self.next_states[i][inds[:, 0], :, 0] * self.__expand_include(
-            next_state_include,
-            self.next_states[i][inds[:, 0], :, 0].shape,
-        ).astype(self.next_states[i].dtype) for i in range(len(self.next_states))]
-
-        # Convert to torch tensor
-        observations = {key: self.to_torch(obs) for key, obs in obs.items()}
-        next_observations = {key: self.to_torch(obs) for key, obs in next_obs.items()}
-        actions = self.to_torch(actions)
-        rewards = self.to_torch(rewards)
-        dones = self.to_torch(dones)
-        states = [self.to_torch(state).transpose(1, 0) for state in states]
-        next_states = [self.to_torch(next_state).transpose(1, 0) for next_state in next_states]
+        states = [self.sampler.gather(
+            'states_{}'.format(i),
+            self.states[i],
+            inds[:, 0],
+            include[:, 0],
+            env_axis=2
+        ).transpose(1, 0) for i in range(len(self.states))]
+        next_states = [self.sampler.gather(
+            'next_states_{}'.format(i),
+            self.next_states[i],
+            inds[:, 0],
+            include[:, 1],
+            env_axis=2
+        ).transpose(1, 0) for i in range(len(self.next_states))]
 
         return RecurrentDictReplayBufferSamples(
             observations=observations,
-            actions=actions,
+            actions=self.to_torch(actions),
             next_observations=next_observations,
-            dones=dones,
-            rewards=rewards,
+            dones=self.to_torch(dones),
+            rewards=self.to_torch(rewards),
             states=states,
             next_states=next_states
         )
 
-    def __expand_include(self, include, shape):
-        length = len(include.shape)
-        assert shape[:length] == include.shape
-        shape = shape[length:]
-        for item in shape:
-            include = np.repeat(np.expand_dims(include, -1), item, -1)
-        return include
-
 
 class ReplayBuffer(sb3.common.buffers.ReplayBuffer):
     """
@@ -353,6 +371,9 @@ class ReplayBuffer(sb3.common.buffers.ReplayBuffer):
     :param handle_timeout_termination: Handle timeout termination (due to timelimit)
         separately and treat the task as infinite horizon task.
         https://github.com/DLR-RM/stable-baselines3/issues/284
+    :param storage_path: directory to store the transitions in as memory mapped arrays, `None` keeps them in memory
+    :param hot_window: number of recently added transitions kept in memory before being written to `storage_path`
+    :param resume: restore the transitions stored under `storage_path` by the last `flush`
     """
 
     def __init__(
@@ -366,6 +387,9 @@ class ReplayBuffer(sb3.common.buffers.ReplayBuffer):
         n_envs: int = 1,
         optimize_memory_usage: bool = False,
         handle_timeout_termination: bool = True,
+        storage_path: Optional[str] = None,
+        hot_window: int = 0,
+        resume: bool = False,
     ):
         assert state_spec is not None
         assert max_seq_len > 2
@@ -384,21 +408,29 @@ class ReplayBuffer(sb3.common.buffers.ReplayBuffer):
         # disabling as this adds quite a bit of complexity
         # https://github.com/DLR-RM/stable-baselines3/pull/243#discussion_r531535702
         self.optimize_memory_usage = optimize_memory_usage
+        self.storage = ReplayStorage(storage_path, hot_window, resume)
 
         self.observations = {
-            key: np.zeros((self.buffer_size, self.n_envs) + _obs_shape, dtype=observation_space[key].dtype)
-            for key, _obs_shape in self.obs_shape.items()
+            key: self.storage.zeros(
+                'observations_{}'.format(key),
+                (self.buffer_size, self.n_envs) + _obs_shape,
+                dtype=observation_space[key].dtype
+            ) for key, _obs_shape in self.obs_shape.items()
         }
         self.next_observations = {
-            key: np.zeros((self.buffer_size, self.n_envs) + _obs_shape, dtype=observation_space[key].dtype)
-            for key, _obs_shape in self.obs_shape.items()
+            key: self.storage.zeros(
+                'next_observations_{}'.format(key),
+                (self.buffer_size, self.n_envs) + _obs_shape,
+                dtype=observation_space[key].dtype
+            ) for key, _obs_shape in self.obs_shape.items()
         }
         
         num_lstm_layers = self.state_spec[0]
         state_size = self.state_spec[1]
 
         self.states = [
-            np.zeros(
+            self.storage.zeros(
+                'states',
                 (
                     self.buffer_size,
                     self.n_envs,
@@ -409,7 +441,8 @@ class ReplayBuffer(sb3.common.buffers.ReplayBuffer):
             )
         ] * 2
         self.next_states = [
-            np.zeros(
+            self.storage.zeros(
+                'next_states',
                 (
                     self.buffer_size,
                     self.n_envs,
@@ -421,16 +454,20 @@ class ReplayBuffer(sb3.common.buffers.ReplayBuffer):
         ] * 2
 
         # only 1 env is supported
-        self.actions = np.zeros((self.buffer_size, self.action_dim), dtype=action_space.dtype)
-        self.rewards = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
-        self.dones = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.actions = self.storage.zeros('actions', (self.buffer_size, self.action_dim), dtype=action_space.dtype)
+        self.rewards = self.storage.zeros('rewards', (self.buffer_size, self.n_envs), dtype=np.float32)
+        self.dones = self.storage.zeros('dones', (self.buffer_size, self.n_envs), dtype=np.float32)
 
         # Handle timeouts termination properly if needed
         # see https://github.com/DLR-RM/stable-baselines3/issues/284
         self.handle_timeout_termination = handle_timeout_termination
-        self.timeouts = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.timeouts = self.storage.zeros('timeouts', (self.buffer_size, self.n_envs), dtype=np.float32)
 
-        if psutil is not None:
+        if self.storage.resumed:
+            state = self.storage.load_state()
+            self.pos, self.full = state['pos'], state['full']
+
+        if psutil is not None and not self.storage.on_disk:
             obs_nbytes = 0
             for _, obs in self.observations.items():
                 obs_nbytes += obs.nbytes
@@ -486,6 +523,10 @@ class ReplayBuffer(sb3.common.buffers.ReplayBuffer):
             self.full = True
             self.pos = 0
 
+    def flush(self) -> None:
+        """Writes the transitions and the buffer position to `storage_path`."""
+        self.storage.flush(pos=self.pos, full=self.full)
+
     def sample(self, batch_size: int, env: Optional[sb3.common.vec_env.VecNormalize] = None) -> RecurrentDictReplayBufferSamples:
         """
         Sample elements from the replay buffer.
@@ -572,6 +613,9 @@ class HerReplayBuffer(sb3.common.buffers.ReplayBuffer):
     :param n_envs: Number of parallel environments
     :param optimize_memory_usage: Enable a memory efficient variant Disabled for now (see https://github.com/DLR-RM/stable-baselines3/pull/243#discussion_r531535702)
     :param handle_timeout_termination: Handle timeout termination (due to timelimit) separately and treat the task as infinite horizon task. https://github.com/DLR-RM/stable-baselines3/issues/284
+    :param storage_path: directory to store the transitions in as memory mapped arrays, `None` keeps them in memory
+    :param hot_window: number of recently added transitions kept in memory before being written to `storage_path`
+    :param resume: restore the transitions stored under `storage_path` by the last `flush`
     """
 
     def __init__(
@@ -585,6 +629,9 @@ class HerReplayBuffer(sb3.common.buffers.ReplayBuffer):
         n_envs: int = 1,
         optimize_memory_usage: bool = False,
         handle_timeout_termination: bool = True,
+        storage_path: Optional[str] = None,
+        hot_window: int = 0,
+        resume: bool = False,
     ):
         assert state_spec is not None
         assert max_seq_len > 2
@@ -603,21 +650,29 @@ class HerReplayBuffer(sb3.common.buffers.ReplayBuffer):
         # disabling as this adds quite a bit of complexity
         # https://github.com/DLR-RM/stable-baselines3/pull/243#discussion_r531535702
         self.optimize_memory_usage = optimize_memory_usage
+        self.storage = ReplayStorage(storage_path, hot_window, resume)
 
         self.observations = {
-            key: np.zeros((self.buffer_size, self.n_envs) + _obs_shape, dtype=observation_space[key].dtype)
-            for key, _obs_shape in self.obs_shape.items()
+            key: self.storage.zeros(
+                'observations_{}'.format(key),
+                (self.buffer_size, self.n_envs) + _obs_shape,
+                dtype=observation_space[key].dtype
+            ) for key, _obs_shape in self.obs_shape.items()
         }
         self.next_observations = {
-            key: np.zeros((self.buffer_size, self.n_envs) + _obs_shape, dtype=observation_space[key].dtype)
-            for key, _obs_shape in self.obs_shape.items()
+            key: self.storage.zeros(
+                'next_observations_{}'.format(key),
+                (self.buffer_size, self.n_envs) + _obs_shape,
+                dtype=observation_space[key].dtype
+            ) for key, _obs_shape in self.obs_shape.items()
         }
         
         num_lstm_layers = self.state_spec[0]
         state_size = self.state_spec[1]
 
         self.states = [
-            np.zeros(
+            self.storage.zeros(
+                'states',
                 (
                     self.buffer_size,
                     self.n_envs,
@@ -628,7 +683,8 @@ class HerReplayBuffer(sb3.common.buffers.ReplayBuffer):
             )
         ] * 2
         self.next_states = [
-            np.zeros(
+            self.storage.zeros(
+                'next_states',
                 (
                     self.buffer_size,
                     self.n_envs,
@@ -640,16 +696,20 @@ class HerReplayBuffer(sb3.common.buffers.ReplayBuffer):
         ] * 2
 
         # only 1 env is supported
-        self.actions = np.zeros((self.buffer_size, self.action_dim), dtype=action_space.dtype)
-        self.rewards = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
-        self.dones = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.actions = self.storage.zeros('actions', (self.buffer_size, self.action_dim), dtype=action_space.dtype)
+        self.rewards = self.storage.zeros('rewards', (self.buffer_size, self.n_envs), dtype=np.float32)
+        self.dones = self.storage.zeros('dones', (self.buffer_size, self.n_envs), dtype=np.float32)
 
         # Handle timeouts termination properly if needed
         # see https://github.com/DLR-RM/stable-baselines3/issues/284
         self.handle_timeout_termination = handle_timeout_termination
-        self.timeouts = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.timeouts = self.storage.zeros('timeouts', (self.buffer_size, self.n_envs), dtype=np.float32)
 
-        if psutil is not None:
+        if self.storage.resumed:
+            state = self.storage.load_state()
+            self.pos, self.full = state['pos'], state['full']
+
+        if psutil is not None and not self.storage.on_disk:
             obs_nbytes = 0
             for _, obs in self.observations.items():
                 obs_nbytes += obs.nbytes
@@ -705,6 +765,10 @@ class HerReplayBuffer(sb3.common.buffers.ReplayBuffer):
             self.full = True
             self.pos = 0
 
+    def flush(self) -> None:
+        """Writes the transitions and the buffer position to `storage_path`."""
+        self.storage.flush(pos=self.pos, full=self.full)
+
     def sample(self, batch_size: int, env: Optional[sb3.common.vec_env.VecNormalize] = None) -> RecurrentDictReplayBufferSamples:
         """
         Sample elements from the replay buffer.
@@ -1165,6 +1229,16 @@ class RTD3(sb3.TD3):
             _init_setup_model,
         )
 
+    def save_replay_buffer(self, path: Union[str, os.PathLike]) -> None:
+        """Flushes replay buffers stored on disk, they are resumed with `resume=True`
+        in `replay_buffer_kwargs`. Other buffers are pickled to `path`.
+        """
+        storage = getattr(self.replay_buffer, 'storage', None)
+        if storage is not None and storage.on_disk:
+            self.replay_buffer.flush()
+        else:
+            super(RTD3, self).save_replay_buffer(path)
+
     def _setup_model(self) -> None:
         self._setup_lr_schedule()
         self.set_random_seed(self.seed)
@@ -1566,7 +1640,16 @@ def train_autoencoder(
         learning_rate,
         save_freq,
         eval_freq,
+        dataset=None,
+        num_workers=0,
     ):
+    """Trains the `Autoencoder` on `scale_1`, `scale_2` and `depth` observations.
+
+    Each epoch trains on newly collected episodes, or on one pass over the
+    sharded dataset at `dataset` written by `neurorobotics.data.shards`,
+    streamed by `num_workers` loader processes. `env` is only used for
+    evaluation with a dataset.
+    """
     # Setting Training Device
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
@@ -1588,6 +1671,17 @@ def train_autoencoder(
         device=device,
     )
     
+    loader = None
+    if dataset is not None:
+        from neurorobotics.data.shards import ShardedDataset
+        loader = torch.utils.data.DataLoader(
+            ShardedDataset(dataset, keys=['scale_1', 'scale_2', 'depth'], batch_size=batch_size),
+            batch_size=None,
+            num_workers=num_workers,
+            pin_memory=device == 'cuda',
+            persistent_workers=False
+        )
+
     # Initialise Tensorboard logger
     writer = SummaryWriter(log_dir = logdir)
 
@@ -1700,22 +1794,32 @@ def train_autoencoder(
         # Data Sampling
         total_reward = 0
         count = 0
-        for _ in range(3):
-            last_obs = env.reset()
-            done = False
-            while not done:
-                obs, reward, done, info = env.step(last_obs['sampled_action'])
-                buff.add(
-                    last_obs,
-                    obs,
-                    last_obs['sampled_action'],
-                    reward,
-                    done,
-                    info,
-                )
-                count += 1
-                last_obs = obs
-                total_reward += reward
+        if loader is None:
+            for _ in range(3):
+                last_obs = env.reset()
+                done = False
+                while not done:
+                    obs, reward, done, info = env.step(last_obs['sampled_action'])
+                    buff.add(
+                        last_obs,
+                        obs,
+                        last_obs['sampled_action'],
+                        reward,
+                        done,
+                        info,
+                    )
+                    count += 1
+                    last_obs = obs
+                    total_reward += reward
+            batches = (buff.sample(batch_size).observations for _ in range(count))
+        else:
+            total_reward = np.zeros(1)
+            count = len(loader)
+            loader.dataset.set_epoch(i)
+            batches = (
+                {key: value.to(device, non_blocking=True) for key, value in batch.items()}
+                for batch in loader
+            )
 
         losses = []
         L1 = []
@@ -1725,15 +1829,14 @@ def train_autoencoder(
         SSIM_DEPTH = []
 
         # Model Update
-        for _ in range(count):
-            rollout = buff.sample(batch_size)
-            scale_1 = rollout.observations['scale_1']
-            scale_2 = rollout.observations['scale_2']
+        for observations in batches:
+            scale_1 = observations['scale_1']
+            scale_2 = observations['scale_2']
             gt_image = torch.cat([
                 scale_1, scale_2
             ], 1).float() / 255
 
-            gt_depth = rollout.observations['depth']
+            gt_depth = observations['depth'].float()
 
             # Prediction
             _, [gen_image, depth] = model(gt_image.contiguous())
@@ -0,0 +1,403 @@
+"""N-step and TD(λ) replay.
+
+`NStepReturns` updates the discounted partial returns and the bootstrap
+targets of the last `n_steps` transitions every time a transition is added,
+so sampling a batch only gathers precomputed values. The truncated λ-return
+of transition `j` over `n` steps,
+
+    G = sum_{m < n} (1 - λ) λ^(m - 1) G_m + λ^(n - 1) G_n,
+
+splits into a reward part `sum_k (γ λ)^k r_{j + k}` and `n` bootstrap terms
+`λ^(m - 1) (1 - λ) γ^m Q(s_{j + m})`, whose weights are stored together with
+the indices of the transitions ending in `s_{j + m}`. With `λ = 1` a single
+bootstrap term is kept, giving plain n-step returns. Transitions whose window
+is still open use the returns available so far, bootstrapping from the most
+recent next observation.
+"""
+import numpy as np
+import torch
+import stable_baselines3 as sb3
+from gym import spaces
+from typing import Any, Dict, List, NamedTuple, Optional, Union
+from neurorobotics.utils.buffers import FrameDictReplayBuffer, FrameTD3
+from neurorobotics.utils.torch_utils import polyak_update
+
+TensorDict = Dict[str, torch.Tensor]
+
+
+class NStepReplayBufferSamples(NamedTuple):
+    observations: torch.Tensor
+    actions: torch.Tensor
+    next_observations: torch.Tensor
+    dones: torch.Tensor
+    rewards: torch.Tensor
+    discounts: torch.Tensor
+
+
+class NStepDictReplayBufferSamples(NamedTuple):
+    observations: TensorDict
+    actions: torch.Tensor
+    next_observations: TensorDict
+    dones: torch.Tensor
+    rewards: torch.Tensor
+    discounts: torch.Tensor
+
+
+class NStepReturns:
+    """Incrementally computed n-step or λ-returns of the transitions of a replay buffer.
+
+    `next_observations` of a batch of `b` samples are the `b * n_bootstrap`
+    next observations at `bootstrap_inds`, the TD target of sample `i` is
+    `returns[i] + sum_m bootstrap_weights[i, m] Q(next_observations[i * n_bootstrap + m])`.
+
+    :param buffer_size: max number of transitions in the buffer
+    :type buffer_size: int
+    :param n_steps: number of rewards in the returns
+    :type n_steps: int
+    :param gamma: discount factor
+    :type gamma: float
+    :param lmbda: λ of the TD(λ) returns, 1 gives n-step returns
+    :type lmbda: float
+    """
+    def __init__(self, buffer_size: int, n_steps: int, gamma: float, lmbda: float = 1.0):
+        assert n_steps >= 1 and buffer_size > n_steps
+        assert 0.0 <= lmbda <= 1.0
+        self.buffer_size = buffer_size
+        self.n_steps = n_steps
+        self.gamma = gamma
+        self.lmbda = lmbda
+        self.n_bootstrap = 1 if lmbda == 1.0 else n_steps
+        self.returns = np.zeros((buffer_size,), dtype=np.float32)
+        self.terminals = np.zeros((buffer_size,), dtype=np.float32)
+        self.bootstrap_inds = np.zeros((buffer_size, self.n_bootstrap), dtype=np.int64)
+        self.bootstrap_weights = np.zeros((buffer_size, self.n_bootstrap), dtype=np.float32)
+        steps = np.arange(n_steps)
+        self._reward_discounts = (gamma * lmbda) ** steps
+        self._tail_weights = lmbda ** steps * gamma ** (steps + 1)
+        # Transitions whose window is still open, oldest first.
+        self._pending = np.zeros((0,), dtype=np.int64)
+
+    def add(self, pos: int, reward: float, done: bool, timeout: bool = False) -> None:
+        """Adds the reward of the transition at `pos` to the returns of the open windows."""
+        self.returns[pos] = 0.0
+        self.bootstrap_inds[pos] = pos
+        self.bootstrap_weights[pos] = 0.0
+        pending = np.append(self._pending, pos)
+        # Pending transitions are consecutive, `pos` is the k-th step of their window.
+        k = np.arange(len(pending) - 1, -1, -1)
+        self.returns[pending] += self._reward_discounts[k] * reward
+        terminal = float(done and not timeout)
+        weights = self._tail_weights[k] * (1.0 - terminal)
+        if self.n_bootstrap == 1:
+            self.bootstrap_inds[pending, 0] = pos
+            self.bootstrap_weights[pending, 0] = weights
+        else:
+            # The previous last step now only keeps the weight of its own return.
+            self.bootstrap_weights[pending[:-1], k[:-1] - 1] *= 1.0 - self.lmbda
+            self.bootstrap_inds[pending, k] = pos
+            self.bootstrap_weights[pending, k] = weights
+        self.terminals[pending] = terminal
+        if done:
+            self._pending = self._pending[:0]
+        else:
+            self._pending = pending[k < self.n_steps - 1]
+
+    def truncate(self) -> None:
+        """Closes the open windows, which keep bootstrapping from their last step."""
+        self._pending = self._pending[:0]
+
+
+class NStepReplayBuffer(sb3.common.buffers.ReplayBuffer):
+    """Replay buffer sampling n-step returns, see `NStepReturns`.
+
+    Must be used with `TD3Lambda`, which accounts for the discount of each sample.
+
+    :param n_steps: number of rewards in the returns
+    :type n_steps: int
+    :param gamma: discount factor, set by `TD3Lambda`
+    :type gamma: float
+    :param lmbda: λ of the TD(λ) returns, 1 gives n-step returns
+    :type lmbda: float
+    """
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Space,
+        action_space: spaces.Space,
+        device: Union[torch.device, str] = 'cpu',
+        n_envs: int = 1,
+        optimize_memory_usage: bool = False,
+        handle_timeout_termination: bool = True,
+        n_steps: int = 1,
+        gamma: float = 0.99,
+        lmbda: float = 1.0
+    ):
+        super(NStepReplayBuffer, self).__init__(
+            buffer_size,
+            observation_space,
+            action_space,
+            device,
+            n_envs=n_envs,
+            optimize_memory_usage=optimize_memory_usage,
+            handle_timeout_termination=handle_timeout_termination
+        )
+        self.n_step_returns = NStepReturns(self.buffer_size, n_steps, gamma, lmbda)
+
+    def add(
+        self,
+        obs: np.ndarray,
+        next_obs: np.ndarray,
+        action: np.ndarray,
+        reward: np.ndarray,
+        done: np.ndarray,
+        infos: List[Dict[str, Any]],
+    ) -> None:
+        pos = self.pos
+        super(NStepReplayBuffer, self).add(obs, next_obs, action, reward, done, infos)
+        self.n_step_returns.add(
+            pos,
+            float(np.asarray(reward).reshape(-1)[0]),
+            bool(np.any(done)),
+            self.handle_timeout_termination and bool(infos[0].get('TimeLimit.truncated', False))
+        )
+
+    def truncate(self) -> None:
+        """Ends the current trajectory without a done, e.g. before adding transitions of another actor."""
+        self.n_step_returns.truncate()
+
+    def _get_samples(self, batch_inds: np.ndarray, env: Optional[sb3.common.vec_env.VecNormalize] = None) -> NStepReplayBufferSamples:
+        returns = self.n_step_returns
+        bootstrap_inds = returns.bootstrap_inds[batch_inds].reshape(-1)
+        if self.optimize_memory_usage:
+            next_obs = self.observations[(bootstrap_inds + 1) % self.buffer_size, 0, :]
+        else:
+            next_obs = self.next_observations[bootstrap_inds, 0, :]
+        data = (
+            self._normalize_obs(self.observations[batch_inds, 0, :], env),
+            self.actions[batch_inds, 0, :],
+            self._normalize_obs(next_obs, env),
+            returns.terminals[batch_inds, np.newaxis],
+            self._normalize_reward(returns.returns[batch_inds, np.newaxis], env),
+            returns.bootstrap_weights[batch_inds],
+        )
+        return NStepReplayBufferSamples(*tuple(map(self.to_torch, data)))
+
+
+class NStepLambdaReplayBuffer(NStepReplayBuffer):
+    """`NStepReplayBuffer` sampling truncated λ-returns."""
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Space,
+        action_space: spaces.Space,
+        device: Union[torch.device, str] = 'cpu',
+        n_envs: int = 1,
+        optimize_memory_usage: bool = False,
+        handle_timeout_termination: bool = True,
+        n_steps: int = 10,
+        gamma: float = 0.99,
+        lmbda: float = 0.9
+    ):
+        super(NStepLambdaReplayBuffer, self).__init__(
+            buffer_size,
+            observation_space,
+            action_space,
+            device,
+            n_envs=n_envs,
+            optimize_memory_usage=optimize_memory_usage,
+            handle_timeout_termination=handle_timeout_termination,
+            n_steps=n_steps,
+            gamma=gamma,
+            lmbda=lmbda
+        )
+
+
+class NStepDictReplayBuffer(FrameDictReplayBuffer):
+    """`FrameDictReplayBuffer` sampling n-step returns, see `NStepReturns`.
+
+    Must be used with `TD3Lambda`, which accounts for the discount of each sample.
+
+    :param n_steps: number of rewards in the returns
+    :type n_steps: int
+    :param gamma: discount factor, set by `TD3Lambda`
+    :type gamma: float
+    :param lmbda: λ of the TD(λ) returns, 1 gives n-step returns
+    :type lmbda: float
+    """
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Dict,
+        action_space: spaces.Space,
+        device: Union[torch.device, str] = 'cpu',
+        n_envs: int = 1,
+        optimize_memory_usage: bool = False,
+        handle_timeout_termination: bool = True,
+        compression: Optional[Dict[str, str]] = None,
+        n_steps: int = 1,
+        gamma: float = 0.99,
+        lmbda: float = 1.0
+    ):
+        super(NStepDictReplayBuffer, self).__init__(
+            buffer_size,
+            observation_space,
+            action_space,
+            device,
+            n_envs=n_envs,
+            optimize_memory_usage=optimize_memory_usage,
+            handle_timeout_termination=handle_timeout_termination,
+            compression=compression
+        )
+        self.n_step_returns = NStepReturns(self.buffer_size, n_steps, gamma, lmbda)
+
+    def add(
+        self,
+        obs: Dict[str, np.ndarray],
+        next_obs: Dict[str, np.ndarray],
+        action: np.ndarray,
+        reward: np.ndarray,
+        done: np.ndarray,
+        infos: List[Dict[str, Any]],
+    ) -> None:
+        pos = self.pos
+        super(NStepDictReplayBuffer, self).add(obs, next_obs, action, reward, done, infos)
+        self.n_step_returns.add(
+            pos,
+            float(np.asarray(reward).reshape(-1)[0]),
+            bool(np.any(done)),
+            self.handle_timeout_termination and bool(infos[0].get('TimeLimit.truncated', False))
+        )
+
+    def truncate(self) -> None:
+        super(NStepDictReplayBuffer, self).truncate()
+        self.n_step_returns.truncate()
+
+    def _get_samples(self, batch_inds: np.ndarray, env: Optional[sb3.common.vec_env.VecNormalize] = None) -> NStepDictReplayBufferSamples:
+        returns = self.n_step_returns
+        obs_ = {key: self._decode(key, batch_inds) for key in self.observations.keys()}
+        obs_ = self._normalize_obs(obs_, env)
+        next_obs_ = self._normalize_obs(self._next_observations(returns.bootstrap_inds[batch_inds].reshape(-1)), env)
+        return NStepDictReplayBufferSamples(
+            observations={key: self.to_torch(obs) for key, obs in obs_.items()},
+            actions=self.to_torch(self.actions[batch_inds]),
+            next_observations={key: self.to_torch(obs) for key, obs in next_obs_.items()},
+            dones=self.to_torch(returns.terminals[batch_inds, np.newaxis]),
+            rewards=self.to_torch(self._normalize_reward(returns.returns[batch_inds, np.newaxis], env)),
+            discounts=self.to_torch(returns.bootstrap_weights[batch_inds]),
+        )
+
+
+class NStepLambdaDictReplayBuffer(NStepDictReplayBuffer):
+    """`NStepDictReplayBuffer` sampling truncated λ-returns."""
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Dict,
+        action_space: spaces.Space,
+        device: Union[torch.device, str] = 'cpu',
+        n_envs: int = 1,
+        optimize_memory_usage: bool = False,
+        handle_timeout_termination: bool = True,
+        compression: Optional[Dict[str, str]] = None,
+        n_steps: int = 10,
+        gamma: float = 0.99,
+        lmbda: float = 0.9
+    ):
+        super(NStepLambdaDictReplayBuffer, self).__init__(
+            buffer_size,
+            observation_space,
+            action_space,
+            device,
+            n_envs=n_envs,
+            optimize_memory_usage=optimize_memory_usage,
+            handle_timeout_termination=handle_timeout_termination,
+            compression=compression,
+            n_steps=n_steps,
+            gamma=gamma,
+            lmbda=lmbda
+        )
+
+
+class TD3Lambda(FrameTD3):
+    """TD3 learning from the n-step or λ-returns of the `NStep*ReplayBuffer` classes.
+
+    The discount factor, `n_steps` and `lmbda` are passed on to the replay buffer.
+
+    :param n_steps: number of rewards in the returns
+    :type n_steps: int
+    :param lmbda: λ of the TD(λ) returns, 1 gives n-step returns
+    :type lmbda: float
+    """
+    def __init__(self, *args, n_steps: int = 1, lmbda: float = 1.0, _init_setup_model: bool = True, **kwargs):
+        super(TD3Lambda, self).__init__(*args, _init_setup_model=False, **kwargs)
+        self.n_steps = n_steps
+        self.lmbda = lmbda
+        if self.replay_buffer_class is None:
+            if isinstance(self.observation_space, spaces.Dict):
+                self.replay_buffer_class = NStepDictReplayBuffer
+            else:
+                self.replay_buffer_class = NStepReplayBuffer
+        self.replay_buffer_kwargs = dict(self.replay_buffer_kwargs)
+        self.replay_buffer_kwargs.setdefault('n_steps', n_steps)
+        self.replay_buffer_kwargs.setdefault('lmbda', lmbda)
+        self.replay_buffer_kwargs['gamma'] = self.gamma
+        if _init_setup_model:
+            self._setup_model()
+
+    def train(self, gradient_steps: int, batch_size: int = 100) -> None:
+        # Update learning rate according to lr schedule
+        self._update_learning_rate([self.actor.optimizer, self.critic.optimizer])
+
+        actor_losses, critic_losses = [], []
+
+        for _ in range(gradient_steps):
+
+            self._n_updates += 1
+            # Sample replay buffer
+            replay_data = self.replay_buffer.sample(batch_size, env=self._vec_normalize_env)
+            discounts = replay_data.discounts
+
+            with torch.no_grad():
+                # Select action according to policy and add clipped noise
+                next_actions = self.actor_target(replay_data.next_observations)
+                noise = next_actions.clone().data.normal_(0, self.target_policy_noise)
+                noise = noise.clamp(-self.target_noise_clip, self.target_noise_clip)
+                next_actions = (next_actions + noise).clamp(-1, 1)
+
+                # Compute the next Q-values: min over all critics targets
+                next_q_values = torch.cat(self.critic_target(replay_data.next_observations, next_actions), dim=1)
+                next_q_values, _ = torch.min(next_q_values, dim=1, keepdim=True)
+                # Weighted sum over the bootstrapped next observations of each sample
+                next_q_values = (discounts * next_q_values.view(discounts.shape)).sum(dim=1, keepdim=True)
+                target_q_values = replay_data.rewards + next_q_values
+
+            # Get current Q-values estimates for each critic network
+            current_q_values = self.critic(replay_data.observations, replay_data.actions)
+
+            # Compute critic loss
+            critic_loss = sum([torch.nn.functional.mse_loss(current_q, target_q_values) for current_q in current_q_values])
+            critic_losses.append(critic_loss.item())
+
+            # Optimize the critics
+            self.critic.optimizer.zero_grad()
+            critic_loss.backward()
+            self.critic.optimizer.step()
+
+            # Delayed policy updates
+            if self._n_updates % self.policy_delay == 0:
+                # Compute actor loss
+                actor_loss = -self.critic.q1_forward(replay_data.observations, self.actor(replay_data.observations)).mean()
+                actor_losses.append(actor_loss.item())
+
+                # Optimize the actor
+                self.actor.optimizer.zero_grad()
+                actor_loss.backward()
+                self.actor.optimizer.step()
+
+                polyak_update(self.critic.parameters(), self.critic_target.parameters(), self.tau)
+                polyak_update(self.actor.parameters(), self.actor_target.parameters(), self.tau)
+
+        self.logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        if len(actor_losses) > 0:
+            self.logger.record("train/actor_loss", np.mean(actor_losses))
+        self.logger.record("train/critic_loss", np.mean(critic_losses))
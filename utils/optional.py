@@ -0,0 +1,117 @@
+"""Registry of optional features and lazy imports of their dependencies.
+
+Heavy dependencies that only some code paths need, e.g. plotting or the
+websocket viewer, are imported on first use instead of when the package is
+imported. This keeps the startup of processes that only step environments,
+such as the workers of `SubprocVecEnv`, short. A module is made lazy with::
+
+    plt = lazy_import('matplotlib.pyplot', 'plotting')
+
+which binds a placeholder module that imports `matplotlib.pyplot` on first
+attribute access. If the dependencies of the feature are missing, that access
+raises an `ImportError` naming the feature and the packages to install.
+`available` checks whether a feature can be used without importing anything.
+"""
+import importlib
+import importlib.util
+import sys
+import types
+from typing import Dict, List, NamedTuple, Optional
+
+
+class Feature(NamedTuple):
+    modules: List[str]
+    description: str
+
+
+FEATURES: Dict[str, Feature] = {}
+_AVAILABLE: Dict[str, bool] = {}
+
+
+def register(name: str, modules: List[str], description: str) -> None:
+    """Registers an optional feature.
+
+    :param name: name of the feature
+    :type name: str
+    :param modules: top level modules the feature requires
+    :type modules: List[str]
+    :param description: what the feature is used for, shown when it is missing
+    :type description: str
+    """
+    FEATURES[name] = Feature(list(modules), description)
+    _AVAILABLE.pop(name, None)
+
+
+register('open3d', ['open3d'], 'point cloud processing in `utils.point_cloud`')
+register('plotting', ['matplotlib'], 'plots and figures')
+register('progress', ['tqdm'], 'progress bars')
+register('dataframes', ['pandas'], 'CPG entrainment tables in `utils.cpg_utils`')
+register('images', ['PIL'], 'image conversion in `utils.point_cloud`')
+register('torchvision', ['torchvision'], 'backbones and feature pyramids in `bg.models`')
+register('websocket_viewer', ['fastapi', 'uvicorn', 'PIL'], '`render` of environments with a `websock_port`')
+register('graph_visualisation', ['torchviz', 'hiddenlayer'], 'network graphs in `utils.visualise`')
+
+
+def available(name: str) -> bool:
+    """Whether the modules of feature `name` are installed, they are not imported."""
+    if name not in _AVAILABLE:
+        _AVAILABLE[name] = all(importlib.util.find_spec(module) is not None for module in FEATURES[name].modules)
+    return _AVAILABLE[name]
+
+
+def require(name: str) -> None:
+    """Raises an `ImportError` if feature `name` is not available."""
+    if not available(name):
+        feature = FEATURES[name]
+        missing = [module for module in feature.modules if importlib.util.find_spec(module) is None]
+        raise ImportError('Optional feature `{}`, used for {}, requires {}. Install it with `pip install {}`.'.format(
+            name, feature.description, ', '.join(missing), ' '.join(missing)))
+
+
+def features() -> Dict[str, bool]:
+    """Availability of all registered features."""
+    return {name: available(name) for name in FEATURES}
+
+
+class LazyModule(types.ModuleType):
+    """Placeholder that imports module `name` on first attribute access.
+
+    :param name: module to import
+    :type name: str
+    :param feature: registered feature required by the module
+    :type feature: Optional[str]
+    """
+    def __init__(self, name: str, feature: Optional[str] = None):
+        super(LazyModule, self).__init__(name)
+        self._feature = feature
+        self._module = None
+
+    def _load(self) -> types.ModuleType:
+        if self._module is None:
+            if self._feature is not None:
+                require(self._feature)
+            self._module = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __dir__(self) -> List[str]:
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return '<lazy module {!r}, {}>'.format(self.__name__, state)
+
+
+def lazy_import(name: str, feature: Optional[str] = None) -> types.ModuleType:
+    """Module `name` if it is already imported, otherwise a `LazyModule` importing it on first use."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name, feature)
+
+
+def is_loaded(module: types.ModuleType) -> bool:
+    """Whether a module returned by `lazy_import` has been imported."""
+    return not isinstance(module, LazyModule) or module._module is not None
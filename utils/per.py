@@ -0,0 +1,283 @@
+"""Prioritized experience replay.
+
+`PriorityTree` stores the sum and min trees of the priorities in two flat
+NumPy arrays. Updates of whole index batches walk up the trees one level at a
+time and a batch of stratified samples descends the sum tree together, so the
+cost per batch is `O(log capacity)` vectorised operations.
+"""
+import numpy as np
+import torch
+import stable_baselines3 as sb3
+from gym import spaces
+from typing import Any, Dict, List, NamedTuple, Optional, Union
+from neurorobotics.utils.buffers import FrameDictReplayBuffer, FrameTD3
+from neurorobotics.utils.torch_utils import polyak_update
+
+TensorDict = Dict[str, torch.Tensor]
+
+
+def _unique_sorted(array: np.ndarray) -> np.ndarray:
+    if len(array) < 2:
+        return array
+    return array[np.append(array[1:] != array[:-1], True)]
+
+
+class PriorityTree:
+    """Flat sum and min trees over the priorities of `capacity` transitions.
+
+    Node `i` has children `2i` and `2i + 1`, the root is node 1 and the leaves
+    are nodes `size` to `2 size - 1`, where `size` is `capacity` rounded up to
+    a power of two.
+
+    :param capacity: number of priorities
+    :type capacity: int
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.depth = self.size.bit_length() - 1
+        self._sum = np.zeros((2 * self.size,), dtype=np.float64)
+        self._min = np.full((2 * self.size,), np.inf, dtype=np.float64)
+
+    @property
+    def total(self) -> float:
+        """Sum of all priorities."""
+        return self._sum[1]
+
+    @property
+    def min(self) -> float:
+        """Minimum of the set priorities."""
+        return self._min[1]
+
+    def __getitem__(self, idxes: np.ndarray) -> np.ndarray:
+        return self._sum[self.size + np.asarray(idxes)]
+
+    def _set(self, idxes: np.ndarray, sums: np.ndarray, mins: np.ndarray) -> None:
+        if isinstance(idxes, (int, np.integer)):
+            # Single transitions are added every step, walk up without array overhead.
+            node = int(idxes) + self.size
+            self._sum[node] = sums
+            self._min[node] = mins
+            node //= 2
+            while node > 0:
+                left, right = 2 * node, 2 * node + 1
+                self._sum[node] = self._sum[left] + self._sum[right]
+                self._min[node] = min(self._min[left], self._min[right])
+                node //= 2
+            return
+        idxes = np.atleast_1d(np.asarray(idxes, dtype=np.int64))
+        if len(idxes) == 0:
+            return
+        order = np.argsort(idxes, kind='stable')
+        nodes = idxes[order] + self.size
+        # keep the last value of each repeated index
+        last = np.append(nodes[1:] != nodes[:-1], True)
+        self._sum[nodes[last]] = np.broadcast_to(sums, idxes.shape)[order][last]
+        self._min[nodes[last]] = np.broadcast_to(mins, idxes.shape)[order][last]
+        nodes = nodes[last]
+        for _ in range(self.depth):
+            nodes = _unique_sorted(nodes // 2)
+            self._sum[nodes] = self._sum[2 * nodes] + self._sum[2 * nodes + 1]
+            self._min[nodes] = np.minimum(self._min[2 * nodes], self._min[2 * nodes + 1])
+
+    def update(self, idxes: np.ndarray, priorities: np.ndarray) -> None:
+        """Sets the priorities of `idxes`, the last one wins for repeated indices."""
+        priorities = np.asarray(priorities, dtype=np.float64)
+        self._set(idxes, priorities, priorities)
+
+    def clear(self, idxes: np.ndarray) -> None:
+        """Removes `idxes` from sampling and from the minimum."""
+        self._set(idxes, 0.0, np.inf)
+
+    def find_prefixsum_idx(self, prefixsum: np.ndarray) -> np.ndarray:
+        """Index of the leaf reached by each prefix sum, descending all of them at once."""
+        prefixsum = np.array(prefixsum, dtype=np.float64, ndmin=1)
+        nodes = np.ones(prefixsum.shape, dtype=np.int64)
+        for _ in range(self.depth):
+            nodes *= 2
+            left = self._sum[nodes]
+            right = prefixsum >= left
+            prefixsum -= np.where(right, left, 0.0)
+            nodes += right
+        return nodes - self.size
+
+    def sample(self, batch_size: int, upper: Optional[int] = None) -> np.ndarray:
+        """Stratified sample of `batch_size` indices proportionally to their priorities.
+
+        :param upper: indices at and above `upper` are not returned
+        :type upper: Optional[int]
+        """
+        segment = self.total / batch_size
+        prefixsum = (np.arange(batch_size) + np.random.random(size=batch_size)) * segment
+        idxes = self.find_prefixsum_idx(prefixsum)
+        # rounding can reach empty leaves past the last priority
+        return np.minimum(idxes, (self.capacity if upper is None else upper) - 1)
+
+    def weights(self, idxes: np.ndarray, size: int, beta: float) -> np.ndarray:
+        """Importance sampling weights of `idxes`, normalised by the largest weight."""
+        p_min = self.min / self.total
+        max_weight = (p_min * size) ** (-beta)
+        p_sample = self[idxes] / self.total
+        return (p_sample * size) ** (-beta) / max_weight
+
+
+class PrioritizedDictReplayBufferSamples(NamedTuple):
+    observations: TensorDict
+    actions: torch.Tensor
+    next_observations: TensorDict
+    dones: torch.Tensor
+    rewards: torch.Tensor
+    weights: torch.Tensor
+    indices: np.ndarray
+
+
+class PrioritizedFrameDictReplayBuffer(FrameDictReplayBuffer):
+    """`FrameDictReplayBuffer` sampling transitions proportionally to their priority.
+
+    New transitions get the largest priority seen so far. Samples carry the
+    importance sampling weights and the buffer indices to pass to
+    `update_priorities` with the new TD errors.
+
+    :param alpha: exponent of the priorities, 0 samples uniformly
+    :type alpha: float
+    :param beta: exponent of the importance sampling weights, annealed to 1 by `anneal`
+    :type beta: float
+    :param epsilon: added to the priorities to keep every transition reachable
+    :type epsilon: float
+    """
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Dict,
+        action_space: spaces.Space,
+        device: Union[torch.device, str] = 'cpu',
+        n_envs: int = 1,
+        optimize_memory_usage: bool = False,
+        handle_timeout_termination: bool = True,
+        compression: Optional[Dict[str, str]] = None,
+        alpha: float = 0.6,
+        beta: float = 0.4,
+        epsilon: float = 1e-6
+    ):
+        super(PrioritizedFrameDictReplayBuffer, self).__init__(
+            buffer_size,
+            observation_space,
+            action_space,
+            device,
+            n_envs=n_envs,
+            optimize_memory_usage=optimize_memory_usage,
+            handle_timeout_termination=handle_timeout_termination,
+            compression=compression
+        )
+        assert alpha > 0.0
+        self.alpha = alpha
+        self.initial_beta = beta
+        self.beta = beta
+        self.epsilon = epsilon
+        self.tree = PriorityTree(self.buffer_size)
+        self._max_priority = 1.0
+
+    def anneal(self, progress_remaining: float) -> None:
+        """Linearly anneals `beta` to 1 at the end of training."""
+        self.beta = self.initial_beta + (1.0 - self.initial_beta) * (1.0 - progress_remaining)
+
+    def add(
+        self,
+        obs: Dict[str, np.ndarray],
+        next_obs: Dict[str, np.ndarray],
+        action: np.ndarray,
+        reward: np.ndarray,
+        done: np.ndarray,
+        infos: List[Dict[str, Any]],
+    ) -> None:
+        pos = self.pos
+        super(PrioritizedFrameDictReplayBuffer, self).add(obs, next_obs, action, reward, done, infos)
+        self.tree.update(pos, self._max_priority ** self.alpha)
+        if self.full:
+            # The observation of the oldest transition may have been overwritten.
+            self.tree.clear(self.pos)
+
+    def sample(self, batch_size: int, env: Optional[sb3.common.vec_env.VecNormalize] = None) -> PrioritizedDictReplayBufferSamples:
+        size = self.buffer_size if self.full else self.pos
+        batch_inds = self.tree.sample(batch_size, size)
+        samples = self._get_samples(batch_inds, env=env)
+        weights = self.tree.weights(batch_inds, size, self.beta)
+        return PrioritizedDictReplayBufferSamples(
+            *samples,
+            weights=self.to_torch(weights.astype(np.float32)[:, np.newaxis]),
+            indices=batch_inds
+        )
+
+    def update_priorities(self, indices: np.ndarray, priorities: np.ndarray) -> None:
+        """Sets the priorities of the transitions at `indices`, e.g. to their absolute TD errors."""
+        priorities = np.asarray(priorities, dtype=np.float64).reshape(-1) + self.epsilon
+        self.tree.update(indices, priorities ** self.alpha)
+        self._max_priority = max(self._max_priority, float(np.max(priorities)))
+
+
+class PrioritizedTD3(FrameTD3):
+    """TD3 with an importance weighted critic loss and priorities updated from the TD errors.
+
+    Requires a `PrioritizedFrameDictReplayBuffer` as `replay_buffer_class`.
+    """
+    def train(self, gradient_steps: int, batch_size: int = 100) -> None:
+        # Update learning rate according to lr schedule
+        self._update_learning_rate([self.actor.optimizer, self.critic.optimizer])
+        self.replay_buffer.anneal(self._current_progress_remaining)
+
+        actor_losses, critic_losses = [], []
+
+        for _ in range(gradient_steps):
+
+            self._n_updates += 1
+            # Sample replay buffer
+            replay_data = self.replay_buffer.sample(batch_size, env=self._vec_normalize_env)
+
+            with torch.no_grad():
+                # Select action according to policy and add clipped noise
+                noise = replay_data.actions.clone().data.normal_(0, self.target_policy_noise)
+                noise = noise.clamp(-self.target_noise_clip, self.target_noise_clip)
+                next_actions = (self.actor_target(replay_data.next_observations) + noise).clamp(-1, 1)
+
+                # Compute the next Q-values: min over all critics targets
+                next_q_values = torch.cat(self.critic_target(replay_data.next_observations, next_actions), dim=1)
+                next_q_values, _ = torch.min(next_q_values, dim=1, keepdim=True)
+                target_q_values = replay_data.rewards + (1 - replay_data.dones) * self.gamma * next_q_values
+
+            # Get current Q-values estimates for each critic network
+            current_q_values = self.critic(replay_data.observations, replay_data.actions)
+
+            # Compute importance weighted critic loss
+            td_errors = [current_q - target_q_values for current_q in current_q_values]
+            critic_loss = sum([(replay_data.weights * td_error ** 2).mean() for td_error in td_errors])
+            critic_losses.append(critic_loss.item())
+
+            # Optimize the critics
+            self.critic.optimizer.zero_grad()
+            critic_loss.backward()
+            self.critic.optimizer.step()
+
+            priorities = torch.stack([td_error.detach().abs() for td_error in td_errors], 0).mean(0)
+            self.replay_buffer.update_priorities(replay_data.indices, priorities.cpu().numpy())
+
+            # Delayed policy updates
+            if self._n_updates % self.policy_delay == 0:
+                # Compute actor loss
+                actor_loss = -self.critic.q1_forward(replay_data.observations, self.actor(replay_data.observations)).mean()
+                actor_losses.append(actor_loss.item())
+
+                # Optimize the actor
+                self.actor.optimizer.zero_grad()
+                actor_loss.backward()
+                self.actor.optimizer.step()
+
+                polyak_update(self.critic.parameters(), self.critic_target.parameters(), self.tau)
+                polyak_update(self.actor.parameters(), self.actor_target.parameters(), self.tau)
+
+        self.logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        if len(actor_losses) > 0:
+            self.logger.record("train/actor_loss", np.mean(actor_losses))
+        self.logger.record("train/critic_loss", np.mean(critic_losses))
+        self.logger.record("train/per_beta", self.replay_buffer.beta)
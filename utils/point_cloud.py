@@ -3,12 +3,13 @@
 import math
 import numpy as np
 
-from PIL import Image as PIL_Image
+from neurorobotics.utils.optional import lazy_import
 
-import open3d as o3d
 from neurorobotics.constants import image_height, image_width
 
 import numpy as np
+o3d = lazy_import('open3d', 'open3d')
+PIL_Image = lazy_import('PIL.Image', 'images')
 
 
 """
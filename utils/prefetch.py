@@ -0,0 +1,270 @@
+"""Background batch prefetching between a replay buffer and the learner.
+
+`BatchPrefetcher` samples the next batches of a replay buffer in a worker
+thread while the current gradient step runs. Sampled tensors are copied into a
+ring of reusable tensors, pinned when training on CUDA so the host to device
+copies are asynchronous. Samples of any structure are supported, e.g. dict
+observations, prioritized samples carrying their indices and the sequences of
+the recurrent buffers.
+`PrefetchMixin` makes `train` of an `OffPolicyAlgorithm` draw its batches from
+a `BatchPrefetcher`, see `prefetched`. The worker keeps sampling between the
+calls to `train` and is paused while transitions are added to the buffer.
+"""
+import queue
+import functools
+import threading
+import contextlib
+import torch
+import stable_baselines3 as sb3
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type
+
+
+def _tensors(data: Any) -> List[torch.Tensor]:
+    # Tensors of a sample in a fixed order, other values are left out.
+    if isinstance(data, torch.Tensor):
+        return [data]
+    if isinstance(data, dict):
+        return [tensor for value in data.values() for tensor in _tensors(value)]
+    if isinstance(data, (tuple, list)):
+        return [tensor for value in data for tensor in _tensors(value)]
+    return []
+
+
+def _replace(data: Any, tensors: Any) -> Any:
+    # Copy of the structure of `data` taking its tensors from the iterator `tensors`.
+    if isinstance(data, torch.Tensor):
+        return next(tensors)
+    if isinstance(data, dict):
+        return type(data)((key, _replace(value, tensors)) for key, value in data.items())
+    if isinstance(data, tuple) and hasattr(data, '_fields'):
+        return type(data)(*(_replace(value, tensors) for value in data))
+    if isinstance(data, (tuple, list)):
+        return type(data)(_replace(value, tensors) for value in data)
+    return data
+
+
+class BatchPrefetcher:
+    """Replay buffer proxy sampling batches ahead in a worker thread.
+
+    `sample` starts the worker on its first call, which then samples up to
+    `n_batches` batches ahead with the same arguments until `stop`. The other
+    methods and attributes are those of `replay_buffer`, and calls to them are
+    serialised with the sampling of the worker. Transitions may only be added
+    to the buffer directly inside `paused`. Batches sampled ahead do not
+    include the transitions added after them, and prefetched samples of
+    prioritized buffers do not see the priority updates of the previous
+    `n_batches` gradient steps.
+
+    :param replay_buffer: buffer to sample from
+    :type replay_buffer: sb3.common.buffers.BaseBuffer
+    :param n_batches: number of batches sampled ahead
+    :type n_batches: int
+    :param pin_memory: whether to pin the prefetched tensors, by default when the buffer samples to CUDA
+    :type pin_memory: Optional[bool]
+    """
+    def __init__(
+        self,
+        replay_buffer: sb3.common.buffers.BaseBuffer,
+        n_batches: int = 2,
+        pin_memory: Optional[bool] = None
+    ):
+        assert n_batches > 0
+        self.replay_buffer = replay_buffer
+        self.n_batches = n_batches
+        self.device = torch.device(replay_buffer.device)
+        if pin_memory is None:
+            pin_memory = self.device.type == 'cuda'
+        self.pin_memory = pin_memory
+        self._lock = threading.Lock()
+        # The learner holds one slot while the worker fills the others.
+        self._slots: List[Optional[List[torch.Tensor]]] = [None] * (n_batches + 1)
+        self._events: List[Optional[Any]] = [None] * (n_batches + 1)
+        self._free: queue.Queue = queue.Queue()
+        self._ready: queue.Queue = queue.Queue()
+        self._current: Optional[int] = None
+        self._worker: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._args: Optional[Tuple[Any, ...]] = None
+        for slot in range(n_batches + 1):
+            self._free.put(slot)
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('__') or name == 'replay_buffer':
+            raise AttributeError(name)
+        attr = getattr(self.replay_buffer, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def locked(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return locked
+
+    def _sample(self, batch_size: int, kwargs: Dict[str, Any]) -> Any:
+        # Samples on the host, the learner copies the batch to its device.
+        buffers = [self.replay_buffer]
+        sampler = getattr(self.replay_buffer, 'sampler', None)
+        if sampler is not None:
+            buffers.append(sampler)
+        devices = [buffer.device for buffer in buffers]
+        with self._lock:
+            try:
+                for buffer in buffers:
+                    buffer.device = torch.device('cpu')
+                return self.replay_buffer.sample(batch_size, **kwargs)
+            finally:
+                for buffer, device in zip(buffers, devices):
+                    buffer.device = device
+
+    def _fill(self, slot: int, sample: Any) -> Any:
+        tensors = _tensors(sample)
+        buffers = self._slots[slot]
+        if buffers is None or [buffer.shape for buffer in buffers] != [tensor.shape for tensor in tensors] or \
+                [buffer.dtype for buffer in buffers] != [tensor.dtype for tensor in tensors]:
+            buffers = [
+                torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=self.pin_memory) for tensor in tensors
+            ]
+            self._slots[slot] = buffers
+        elif self._events[slot] is not None:
+            # Wait for the asynchronous copy of the previous batch of the slot.
+            self._events[slot].synchronize()
+        for buffer, tensor in zip(buffers, tensors):
+            buffer.copy_(tensor)
+        return _replace(sample, iter(buffers))
+
+    def _run(self, batch_size: int, kwargs: Dict[str, Any]) -> None:
+        while not self._stop.is_set():
+            try:
+                slot = self._free.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                batch = self._fill(slot, self._sample(batch_size, kwargs))
+            except Exception as error:
+                self._free.put(slot)
+                self._ready.put((None, error))
+                return
+            self._ready.put((slot, batch))
+
+    def start(self, batch_size: int, **kwargs) -> None:
+        """Starts sampling batches of `batch_size` ahead, `kwargs` are passed to `replay_buffer.sample`."""
+        self.stop()
+        self._stop.clear()
+        self._args = (batch_size, sorted(kwargs.items(), key=lambda item: item[0]))
+        self._worker = threading.Thread(target=self._run, args=(batch_size, kwargs), daemon=True)
+        self._worker.start()
+
+    @contextlib.contextmanager
+    def paused(self) -> Iterator[None]:
+        """Context in which the worker does not sample, e.g. to add transitions to `replay_buffer`."""
+        with self._lock:
+            yield
+
+    def stop(self) -> None:
+        """Stops the worker and drops the batches sampled ahead."""
+        if self._worker is not None:
+            self._stop.set()
+            self._worker.join()
+            self._worker = None
+            self._args = None
+        while True:
+            try:
+                slot, _ = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            if slot is not None:
+                self._free.put(slot)
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+
+    def sample(self, batch_size: int, **kwargs) -> Any:
+        """Next prefetched batch, valid until the next call.
+
+        :param batch_size: number of sampled transitions
+        :type batch_size: int
+        :param kwargs: arguments of `replay_buffer.sample`, restarting the worker when changed
+        """
+        if self._args != (batch_size, sorted(kwargs.items(), key=lambda item: item[0])):
+            self.start(batch_size, **kwargs)
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+        slot, batch = self._ready.get()
+        if slot is None:
+            self._worker.join()
+            self._worker = None
+            self._args = None
+            raise batch
+        self._current = slot
+        if self.device.type == 'cpu':
+            return batch
+        batch = _replace(batch, iter([tensor.to(self.device, non_blocking=True) for tensor in _tensors(batch)]))
+        if self.device.type == 'cuda':
+            event = torch.cuda.Event()
+            event.record()
+            self._events[slot] = event
+        return batch
+
+
+class PrefetchMixin:
+    """Mixin of `OffPolicyAlgorithm` sampling the batches of `train` with a `BatchPrefetcher`.
+
+    The prefetcher keeps its batches sampled ahead between the calls to
+    `train`, it is paused while transitions are stored and stopped at the
+    end of `learn`.
+
+    :param prefetch_batches: number of batches sampled ahead
+    :type prefetch_batches: int
+    :param pin_memory: whether to pin the prefetched tensors, by default when training on CUDA
+    :type pin_memory: Optional[bool]
+    """
+    def __init__(self, *args, prefetch_batches: int = 2, pin_memory: Optional[bool] = None, **kwargs):
+        self.prefetch_batches = prefetch_batches
+        self.pin_memory = pin_memory
+        self.prefetcher: Optional[BatchPrefetcher] = None
+        super(PrefetchMixin, self).__init__(*args, **kwargs)
+
+    def _excluded_save_params(self) -> List[str]:
+        return super(PrefetchMixin, self)._excluded_save_params() + ['prefetcher']
+
+    def prefetch_paused(self) -> contextlib.AbstractContextManager:
+        """Context in which transitions can be added to `replay_buffer`, see `BatchPrefetcher.paused`."""
+        if self.prefetcher is None:
+            return contextlib.nullcontext()
+        return self.prefetcher.paused()
+
+    def _store_transition(self, replay_buffer: sb3.common.buffers.ReplayBuffer, *args, **kwargs) -> None:
+        with self.prefetch_paused():
+            super(PrefetchMixin, self)._store_transition(replay_buffer, *args, **kwargs)
+
+    def train(self, gradient_steps: int, batch_size: int = 100) -> None:
+        if self.prefetcher is None or self.prefetcher.replay_buffer is not self.replay_buffer:
+            if self.prefetcher is not None:
+                self.prefetcher.stop()
+            self.prefetcher = BatchPrefetcher(self.replay_buffer, self.prefetch_batches, self.pin_memory)
+        replay_buffer = self.replay_buffer
+        self.replay_buffer = self.prefetcher
+        try:
+            super(PrefetchMixin, self).train(gradient_steps=gradient_steps, batch_size=batch_size)
+        except BaseException:
+            self.prefetcher.stop()
+            raise
+        finally:
+            self.replay_buffer = replay_buffer
+
+    def learn(self, *args, **kwargs):
+        try:
+            return super(PrefetchMixin, self).learn(*args, **kwargs)
+        finally:
+            if self.prefetcher is not None:
+                self.prefetcher.stop()
+
+
+@functools.lru_cache(maxsize=None)
+def prefetched(
+    algorithm_class: Type[sb3.common.off_policy_algorithm.OffPolicyAlgorithm]
+) -> Type[sb3.common.off_policy_algorithm.OffPolicyAlgorithm]:
+    """Subclass of `algorithm_class` with `PrefetchMixin`, e.g. `prefetched(sb3.TD3)(..., prefetch_batches=2)`."""
+    return type('Prefetch' + algorithm_class.__name__, (PrefetchMixin, algorithm_class), {})
@@ -0,0 +1,185 @@
+"""On disk storage for replay buffers larger than RAM.
+
+`ReplayStorage` allocates the arrays of a replay buffer either in memory or as
+memory mapped `.npy` files under a directory, together with a `state.json`
+holding the buffer position so training can resume with its experience.
+`MemmapArray` keeps the most recently written rows in an in-memory hot window
+that is written back in contiguous blocks, and gathers rows in sorted order so
+reads walk the file sequentially through the OS page cache.
+"""
+import os
+import json
+import numpy as np
+from typing import Any, Dict, Optional, Tuple, Union
+
+
+class MemmapArray:
+    """Memory mapped array indexed along its first dimension.
+
+    Supports the indexing used by the replay buffers: writing single rows
+    with an integer index, and reading with an integer, a slice or an index
+    array of any shape optionally followed by indices of the row dimensions.
+
+    :param filename: path of the `.npy` file
+    :type filename: str
+    :param shape: shape of the array
+    :type shape: Tuple[int, ...]
+    :param dtype: data type of the array
+    :type dtype: np.dtype
+    :param hot_window: number of recently written rows kept in memory before being written to the file
+    :type hot_window: int
+    :param mode: `w+` to create the file, `r+` to open an existing one
+    :type mode: str
+    """
+    def __init__(
+        self,
+        filename: str,
+        shape: Tuple[int, ...],
+        dtype: np.dtype,
+        hot_window: int = 0,
+        mode: str = 'w+'
+    ):
+        self.filename = filename
+        if mode == 'w+':
+            self.data = np.lib.format.open_memmap(filename, mode=mode, dtype=dtype, shape=shape)
+        else:
+            self.data = np.load(filename, mmap_mode=mode)
+            assert self.data.shape == tuple(shape) and self.data.dtype == np.dtype(dtype), \
+                'Stored array {} does not match shape {} and dtype {}'.format(filename, shape, dtype)
+        self.hot_window = hot_window
+        if self.hot_window > 0:
+            self.hot = np.zeros((hot_window,) + self.shape[1:], dtype=self.dtype)
+            self._dirty = np.zeros((hot_window,), dtype=bool)
+            self._block = 0
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.data.shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.data.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def _flush_block(self) -> None:
+        rows = np.flatnonzero(self._dirty)
+        if len(rows) > 0:
+            start = self._block * self.hot_window
+            if rows[-1] - rows[0] + 1 == len(rows):
+                self.data[start + rows[0]:start + rows[-1] + 1] = self.hot[rows[0]:rows[-1] + 1]
+            else:
+                self.data[start + rows] = self.hot[rows]
+            self._dirty[:] = False
+
+    def flush(self) -> None:
+        """Writes the hot window and the memory map to the file."""
+        if self.hot_window > 0:
+            self._flush_block()
+        self.data.flush()
+
+    def __setitem__(self, index: int, value: Any) -> None:
+        if self.hot_window > 0 and isinstance(index, (int, np.integer)):
+            block, row = divmod(int(index), self.hot_window)
+            if block != self._block:
+                self._flush_block()
+                self._block = block
+            self.hot[row] = value
+            self._dirty[row] = True
+        else:
+            if self.hot_window > 0:
+                self._flush_block()
+            self.data[index] = value
+
+    def take(self, inds: np.ndarray) -> np.ndarray:
+        """Gathers the rows at `inds`, returning an array of shape `inds.shape + shape[1:]`."""
+        inds = np.asarray(inds)
+        unique, inverse = np.unique(inds.reshape(-1), return_inverse=True)
+        rows = np.asarray(self.data[unique])
+        if self.hot_window > 0:
+            block, row = np.divmod(unique, self.hot_window)
+            hot = (block == self._block) & self._dirty[row]
+            rows[hot] = self.hot[row[hot]]
+        return rows[inverse].reshape(inds.shape + self.shape[1:])
+
+    def __getitem__(self, key: Any) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        first, rest = key[0], key[1:]
+        if isinstance(first, slice):
+            self.flush()
+            return np.asarray(self.data[key])
+        first = np.asarray(first)
+        out = self.take(first)
+        if first.ndim == 0:
+            out = out[()]
+        if rest:
+            out = out[(slice(None),) * first.ndim + rest]
+        return out
+
+    def __array__(self, dtype: Optional[np.dtype] = None) -> np.ndarray:
+        self.flush()
+        return np.asarray(self.data, dtype=dtype)
+
+
+class ReplayStorage:
+    """Allocates the arrays of a replay buffer.
+
+    :param path: directory of the memory mapped arrays, `None` keeps the arrays in memory
+    :type path: Optional[str]
+    :param hot_window: number of recently written rows of each array kept in memory
+    :type hot_window: int
+    :param resume: reopen the arrays and state stored under `path` instead of overwriting them
+    :type resume: bool
+    """
+    def __init__(self, path: Optional[str] = None, hot_window: int = 0, resume: bool = False):
+        self.path = path
+        self.hot_window = hot_window
+        self.arrays: Dict[str, Union[np.ndarray, MemmapArray]] = {}
+        self.resumed = False
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            self.resumed = resume and os.path.exists(self._state_file)
+
+    @property
+    def on_disk(self) -> bool:
+        return self.path is not None
+
+    @property
+    def _state_file(self) -> str:
+        return os.path.join(self.path, 'state.json')
+
+    def zeros(self, name: str, shape: Tuple[int, ...], dtype: np.dtype) -> Union[np.ndarray, MemmapArray]:
+        """Allocates the array `name`, reopening it when resuming."""
+        if self.path is None:
+            array = np.zeros(shape, dtype=dtype)
+        else:
+            array = MemmapArray(
+                os.path.join(self.path, '{}.npy'.format(name)),
+                shape,
+                dtype,
+                self.hot_window,
+                mode='r+' if self.resumed else 'w+'
+            )
+        self.arrays[name] = array
+        return array
+
+    def flush(self, **state) -> None:
+        """Writes every array to disk followed by `state`, e.g. the buffer position."""
+        if self.path is None:
+            return
+        for array in self.arrays.values():
+            array.flush()
+        with open(self._state_file + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self._state_file + '.tmp', self._state_file)
+
+    def load_state(self) -> Dict[str, Any]:
+        """Returns the state written by the last `flush`."""
+        with open(self._state_file, 'r') as f:
+            return json.load(f)
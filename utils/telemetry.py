@@ -0,0 +1,137 @@
+"""Columnar recorder for per step simulation telemetry.
+
+Every tracked key is stored in a single preallocated NumPy column that grows
+geometrically, so recording a step copies each value into place instead of
+appending a new array to a Python list. Columns can optionally be backed by
+memory mapped `.npy` files to keep long simulations out of RAM.
+"""
+import os
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+
+
+class TelemetryRecorder:
+    """Records arrays of fixed shape per key, one row per step.
+
+    Columns are allocated on the first record of a key, using the shape and
+    dtype of the recorded value, and double in size when full. Views returned
+    by `get` or `recorder[key]` do not copy, they are overwritten after a
+    `reset` and stop following the column when it grows.
+
+    :param keys: keys to record, values of other keys are ignored. `None` records all keys.
+    :type keys: Optional[Iterable[str]]
+    :param chunk_size: number of rows first allocated, and the minimum growth of a column
+    :type chunk_size: int
+    :param path: directory to spill the columns to as memory mapped `<key>.npy` files, `None` keeps the columns in memory
+    :type path: Optional[str]
+    """
+    def __init__(
+        self,
+        keys: Optional[Iterable[str]] = None,
+        chunk_size: int = 1024,
+        path: Optional[str] = None
+    ):
+        self._keys = None if keys is None else set(keys)
+        self.chunk_size = chunk_size
+        self.path = path
+        # Column and number of recorded rows of each key
+        self._slots: Dict[str, list] = {}
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+
+    def is_tracked(self, key: str) -> bool:
+        return self._keys is None or key in self._keys
+
+    def keys(self) -> List[str]:
+        """Keys with at least one allocated column."""
+        return list(self._slots.keys())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._slots
+
+    def __len__(self) -> int:
+        return max((size for _, size in self._slots.values()), default=0)
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self.get(key)
+
+    def _allocate(self, key: str, value: np.ndarray, rows: int) -> np.ndarray:
+        shape = (rows,) + value.shape
+        if self.path is None:
+            return np.empty(shape, dtype=value.dtype)
+        return np.lib.format.open_memmap(
+            os.path.join(self.path, '{}.npy'.format(key)),
+            mode='w+',
+            dtype=value.dtype,
+            shape=shape
+        )
+
+    def _resize(self, key: str, rows: int) -> None:
+        slot = self._slots[key]
+        column, size = slot
+        if self.path is None:
+            resized = np.empty((rows,) + column.shape[1:], dtype=column.dtype)
+            resized[:size] = column[:size]
+        else:
+            filename = os.path.join(self.path, '{}.npy'.format(key))
+            resized = np.lib.format.open_memmap(
+                filename + '.tmp',
+                mode='w+',
+                dtype=column.dtype,
+                shape=(rows,) + column.shape[1:]
+            )
+            resized[:size] = column[:size]
+            resized.flush()
+            slot[0] = None
+            del column
+            os.replace(filename + '.tmp', filename)
+        slot[0] = resized
+
+    def record(self, key: str, value) -> None:
+        """Copies `value` into the next row of the column for `key`."""
+        slot = self._slots.get(key)
+        if slot is None:
+            if not self.is_tracked(key):
+                return
+            slot = [self._allocate(key, np.asarray(value), self.chunk_size), 0]
+            self._slots[key] = slot
+        size = slot[1]
+        try:
+            slot[0][size] = value
+        except IndexError:
+            # The column is full, geometric growth keeps the total copying, and the rewrites of memory
+            # mapped files, linear in the number of rows
+            self._resize(key, size + max(size, self.chunk_size))
+            slot[0][size] = value
+        slot[1] = size + 1
+
+    def record_step(self, **items) -> None:
+        """Records one row for every tracked key in `items`."""
+        for key, value in items.items():
+            self.record(key, value)
+
+    def get(self, key: str) -> np.ndarray:
+        """Returns a read only view of the rows recorded for `key`."""
+        column, size = self._slots[key]
+        view = column[:size].view()
+        view.flags.writeable = False
+        return view
+
+    def reset(self) -> None:
+        """Discards all recorded rows, keeping the allocated columns."""
+        for slot in self._slots.values():
+            slot[1] = 0
+
+    def flush(self) -> None:
+        """Truncates the memory mapped columns to the recorded rows and writes them to disk.
+
+        After a flush every `<key>.npy` file under `path` can be read with `np.load`.
+        """
+        if self.path is None:
+            return
+        for key in self.keys():
+            self._resize(key, self._slots[key][1])
+
+    def save(self, path: str) -> None:
+        """Saves the recorded rows of every key to a `.npz` archive."""
+        np.savez(path, **{key: self.get(key) for key in self._slots.keys()})
@@ -23,3 +23,25 @@ def to_tensor(ndarray, volatile=False, requires_grad=False, dtype=FLOAT):
     except Exception as e:
         print(ndarray)
         raise e
+
+
+def polyak_update(params, target_params, tau):
+    """Soft update `target = (1 - tau) * target + tau * param` of all parameters with fused `torch._foreach` kernels.
+
+    Same result as `stable_baselines3.common.utils.polyak_update`, with two
+    kernel launches per device and dtype instead of two per parameter.
+
+    :param params: parameters of the trained network
+    :type params: Iterable[torch.Tensor]
+    :param target_params: parameters of the target network, in the same order
+    :type target_params: Iterable[torch.Tensor]
+    :param tau: soft update coefficient, 1 copies the parameters
+    :type tau: float
+    """
+    params, target_params = list(params), list(target_params)
+    if len(params) != len(target_params):
+        raise ValueError('Expected as many target parameters as parameters, got {} and {}'.format(
+            len(target_params), len(params)))
+    with torch.no_grad():
+        torch._foreach_mul_(target_params, 1 - tau)
+        torch._foreach_add_(target_params, params, alpha=tau)
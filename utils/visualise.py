@@ -1,14 +1,15 @@
 from neurorobotics.bg.models import BasalGanglia, ControlNetwork
-from torchviz import make_dot
-import hiddenlayer as hl
+from neurorobotics.utils.optional import lazy_import
 import torch
+torchviz = lazy_import('torchviz', 'graph_visualisation')
+hl = lazy_import('hiddenlayer', 'graph_visualisation')
 
 def visualise_bg():
     model = BasalGanglia()
     stimulus = torch.rand((1, model.num_ctx))
     deltavf = torch.rand((1,1))
     out = model([stimulus, deltavf])
-    make_dot(out,
+    torchviz.make_dot(out,
             params=dict(list(model.named_parameters()))).render("assets/plots/bg_torchviz_backward", format="png")
     transforms = [
         hl.transforms.FoldDuplicates()
@@ -22,7 +23,7 @@ def visualise_cn():
     img = torch.rand((1, 3, 480, 360))
     vt_1 = torch.rand((1,1))
     out = model([img, vt_1])
-    make_dot(out,
+    torchviz.make_dot(out,
             params=dict(list(model.named_parameters()))).render("assets/plots/cn_torchviz_backward", format="png")
     transforms = [ 
         hl.transforms.FoldDuplicates()